@@ -33,6 +33,32 @@ class Plugin(object):
     """
     _logger = ContextLogger()
     RESTRICT_TO_VENDORS = []
+    # A PluginStats instance, set by the job handler when the plugin's SNMP
+    # and database usage is being recorded
+    instrumentation = None
+    # The shadow classes of the containers this plugin reads and writes.
+    # Plugins that declare them may run concurrently with other plugins of
+    # the same job, as long as neither writes a container class that the
+    # other reads or writes.  Plugins that declare neither are always run
+    # alone.  Containers that only this plugin uses, such as the NetboxInfo
+    # entries of its own TimestampChecker, need not be declared, and neither
+    # need the job's Netbox container, unless the plugin modifies it.
+    READS_CONTAINERS = None
+    WRITES_CONTAINERS = None
+    # (MibRetriever class, scalar object name) pairs of the timestamps that
+    # indicate changes to the data this plugin collects, such as
+    # (EntityMib, 'entLastChangeTime').  The job collects the indicators of
+    # all its plugins in a single request before any plugin runs, and sets
+    # indicators_changed to False if neither they nor sysUpTime appear to
+    # have changed since the last successful run.  Plugins that set
+    # SKIP_WHEN_UNCHANGED aren't run at all in that case, while others may
+    # consult indicators_changed to short-circuit their own work.  The
+    # collected indicators are stored under INDICATOR_VAR_NAME, which
+    # defaults to the lowercased plugin class name.
+    CHANGE_INDICATORS = ()
+    INDICATOR_VAR_NAME = None
+    SKIP_WHEN_UNCHANGED = False
+    indicators_changed = True
 
     def __init__(self, netbox, agent, containers, config=None):
         """
@@ -87,6 +113,29 @@ class Plugin(object):
         else:
             return True
 
+    @classmethod
+    def conflicts_with(cls, other):
+        """Verifies whether this plugin must not run concurrently with another
+        plugin, according to their declared container usage.
+
+        :param other: A Plugin class or instance.
+        :returns: A boolean value.
+        """
+        if not (cls.declares_containers() and other.declares_containers()):
+            return True
+        reads = set(cls.READS_CONTAINERS or ())
+        writes = set(cls.WRITES_CONTAINERS or ())
+        other_reads = set(other.READS_CONTAINERS or ())
+        other_writes = set(other.WRITES_CONTAINERS or ())
+        return bool(writes & (other_reads | other_writes) or
+                    reads & other_writes)
+
+    @classmethod
+    def declares_containers(cls):
+        """Returns True if this plugin declares the containers it uses"""
+        return (cls.READS_CONTAINERS is not None or
+                cls.WRITES_CONTAINERS is not None)
+
     @classmethod
     def on_plugin_load(cls):
         """Called as the plugin class is loaded in the plugin registry.
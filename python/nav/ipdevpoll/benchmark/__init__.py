@@ -0,0 +1,29 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Tools for measuring ipdevpoll throughput without real network equipment.
+
+The agent module implements a farm of simulated SNMP agents, which serve
+recorded walks of real devices on a range of local IP addresses.  The driver
+module runs ipdevpoll jobs against NAV devices that point to these simulated
+agents, and reports on throughput and resource usage.
+
+The replay module runs single plugins offline against SNMP responses recorded
+from real devices (see nav.ipdevpoll.snmp.recording), to catch performance
+regressions in the plugins' own processing.
+
+All of these are run through the tools/ipdevpoll-benchmark.py script.
+
+"""
@@ -0,0 +1,450 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Simulated SNMP agents serving recorded walks.
+
+Walks can be loaded from snmpsim's .snmprec format (as used by NAV's
+integration test fixtures), or from the output of net-snmp's snmpwalk
+program, run with numeric OID output, e.g.::
+
+  snmpwalk $(navsnmp example-sw.example.org) -On -Oe .1 > example-sw.walk
+
+An AgentFarm serves a number of walks from many simulated agents, each
+listening on its own local IP address.  Every agent can be configured to add
+latency to its responses, to drop a share of incoming requests, and to respond
+with tooBig errors to requests for too many varbinds.
+
+"""
+from __future__ import division
+
+import binascii
+import logging
+import random
+import re
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
+
+from IPy import IP
+from twisted.internet import reactor
+from twisted.internet.protocol import DatagramProtocol
+
+from . import ber
+
+_logger = logging.getLogger(__name__)
+
+SNMPREC_TYPES = {
+    '2': ber.INTEGER,
+    '4': ber.OCTET_STRING,
+    '5': ber.NULL,
+    '6': ber.OBJECT_IDENTIFIER,
+    '64': ber.IP_ADDRESS,
+    '65': ber.COUNTER32,
+    '66': ber.GAUGE32,
+    '67': ber.TIMETICKS,
+    '68': ber.OPAQUE,
+    '70': ber.COUNTER64,
+}
+
+SNMPWALK_TYPES = {
+    'STRING': ber.OCTET_STRING,
+    'Hex-STRING': ber.OCTET_STRING,
+    'BITS': ber.OCTET_STRING,
+    'INTEGER': ber.INTEGER,
+    'OID': ber.OBJECT_IDENTIFIER,
+    'IpAddress': ber.IP_ADDRESS,
+    'Network Address': ber.IP_ADDRESS,
+    'Counter32': ber.COUNTER32,
+    'Gauge32': ber.GAUGE32,
+    'Timeticks': ber.TIMETICKS,
+    'Opaque': ber.OPAQUE,
+    'Counter64': ber.COUNTER64,
+}
+HEX_TYPES = ('Hex-STRING', 'BITS', 'Opaque')
+
+SNMPWALK_LINE = re.compile(
+    r'^(?P<oid>\.?\d+(\.\d+)*) = '
+    r'((?P<type>[A-Za-z0-9-]+|Network Address): )?(?P<value>.*)$')
+HEX_OCTET = re.compile(r'^[0-9A-Fa-f]{2}$')
+FIRST_INTEGER = re.compile(r'\((-?\d+)\)|(-?\d+)')
+
+
+class Walk(object):
+    """A recorded SNMP walk of a single device, sorted by OID.
+
+    Varbinds are kept BER encoded, so that responses can be assembled without
+    encoding anything but the message envelope.
+
+    """
+    def __init__(self, varbinds, name=None):
+        """Initializes a walk.
+
+        :param varbinds: An iterable of (oid, tag, value) tuples, where oid
+                         is a tuple of integers, and tag and value are as
+                         expected by nav.ipdevpoll.benchmark.ber.encode_value
+        :param name: A name for the walk, used when logging.
+
+        """
+        self.name = name
+        items = sorted(varbinds, key=itemgetter(0))
+        self.oids = [oid for oid, _, _ in items]
+        self.varbinds = [(ber.encode_oid(oid), ber.encode_value(tag, value))
+                         for oid, tag, value in items]
+
+    def __len__(self):
+        return len(self.oids)
+
+    def __repr__(self):
+        return "<Walk {name!r} ({count} varbinds)>".format(name=self.name,
+                                                          count=len(self))
+
+    def get(self, oid):
+        """Returns the encoded (oid, value) varbind of oid, or None if it
+        doesn't exist.
+        """
+        index = bisect_left(self.oids, oid)
+        if index < len(self.oids) and self.oids[index] == oid:
+            return self.varbinds[index]
+
+    def get_next(self, oid):
+        """Returns an (oid, varbind) tuple of the lexicographically next OID
+        after oid, or None if oid is beyond the end of the walk.
+        """
+        index = bisect_right(self.oids, oid)
+        if index < len(self.oids):
+            return self.oids[index], self.varbinds[index]
+
+
+def load_walk(filename):
+    """Loads a Walk from a file.
+
+    Files whose names end in .snmprec are parsed as snmpsim records, anything
+    else as snmpwalk output.
+
+    """
+    with open(filename, 'rb') as walkfile:
+        lines = walkfile.read().decode('utf-8', 'replace').splitlines()
+    if filename.endswith('.snmprec'):
+        varbinds = parse_snmprec(lines)
+    else:
+        varbinds = parse_snmpwalk(lines)
+    walk = Walk(varbinds, name=filename)
+    _logger.debug("loaded %r", walk)
+    return walk
+
+
+def parse_snmprec(lines):
+    """Parses lines of an snmpsim .snmprec file.
+
+    Records using snmpsim variation modules are skipped.
+
+    :returns: A generator of (oid, tag, value) tuples.
+
+    """
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            oid, tag, value = line.split('|', 2)
+        except ValueError:
+            _logger.debug("skipping malformed snmprec line: %r", line)
+            continue
+        is_hex = tag.endswith('x')
+        tag = SNMPREC_TYPES.get(tag.rstrip('x'))
+        if tag is None:
+            _logger.debug("skipping unsupported snmprec line: %r", line)
+            continue
+        if is_hex:
+            value = binascii.unhexlify(value)
+        yield _parse_oid(oid), tag, _convert_value(tag, value)
+
+
+def _convert_value(tag, value):
+    if tag == ber.INTEGER or tag in ber.UNSIGNED_TYPES:
+        return int(value)
+    if tag == ber.OBJECT_IDENTIFIER:
+        return _parse_oid(value)
+    if tag == ber.IP_ADDRESS:
+        return value
+    if not isinstance(value, bytes):
+        return value.encode('utf-8')
+    return value
+
+
+def parse_snmpwalk(lines):
+    """Parses lines of net-snmp snmpwalk output, as produced using the -On
+    option.
+
+    :returns: A generator of (oid, tag, value) tuples.
+
+    """
+    record = None
+    for line in lines:
+        match = SNMPWALK_LINE.match(line)
+        if match:
+            if record:
+                varbind = _parse_snmpwalk_record(*record)
+                if varbind:
+                    yield varbind
+            record = [match.group('oid'), match.group('type'),
+                      match.group('value')]
+        elif record and _is_continued(record):
+            record[2] += '\n' + line
+    if record:
+        varbind = _parse_snmpwalk_record(*record)
+        if varbind:
+            yield varbind
+
+
+def _is_continued(record):
+    _, kind, value = record
+    if kind in HEX_TYPES:
+        return True
+    return (kind == 'STRING' and value.startswith('"') and
+            (len(value) == 1 or not value.endswith('"')))
+
+
+def _parse_snmpwalk_record(oid, kind, value):
+    if kind is None:
+        if value == '""':
+            return _parse_oid(oid), ber.OCTET_STRING, b''
+        return None
+    tag = SNMPWALK_TYPES.get(kind)
+    if tag is None:
+        _logger.debug("skipping unsupported snmpwalk type %s for %s",
+                      kind, oid)
+        return None
+
+    value = value.strip()
+    if kind in HEX_TYPES:
+        value = binascii.unhexlify(''.join(
+            token for token in value.split() if HEX_OCTET.match(token)))
+    elif tag == ber.OCTET_STRING:
+        if len(value) >= 2 and value.startswith('"') and value.endswith('"'):
+            value = value[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+        value = value.encode('utf-8')
+    elif tag == ber.INTEGER or tag in ber.UNSIGNED_TYPES:
+        match = FIRST_INTEGER.search(value)
+        if not match:
+            return None
+        value = int(match.group(1) or match.group(2))
+    elif tag == ber.OBJECT_IDENTIFIER:
+        if not re.match(r'^\.?\d+(\.\d+)*$', value):
+            _logger.debug("skipping non-numeric OID value for %s", oid)
+            return None
+        value = _parse_oid(value)
+    return _parse_oid(oid), tag, value
+
+
+def _parse_oid(oid):
+    return tuple(int(arc) for arc in oid.strip('.').split('.') if arc)
+
+
+class SimulatedAgent(DatagramProtocol):
+    """A simulated SNMPv1/v2c agent serving a single Walk"""
+    def __init__(self, walk, community=None, latency=0.0, jitter=0.0,
+                 loss=0.0, max_varbinds=None, clock=reactor, rng=None):
+        """Initializes a simulated agent.
+
+        :param walk: The Walk to serve.
+        :param community: The community to accept. If None, any community
+                          is accepted.
+        :param latency: The number of seconds to wait before responding.
+        :param jitter: The maximum number of seconds to randomly add to or
+                       subtract from the latency.
+        :param loss: The fraction of requests to drop without responding.
+        :param max_varbinds: The largest number of varbinds to put in a
+                             response. Larger GET and GETNEXT responses are
+                             replaced by tooBig errors, while GETBULK
+                             responses are truncated.
+
+        """
+        self.walk = walk
+        self.community = community
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.max_varbinds = max_varbinds
+        self.clock = clock
+        self.random = rng or random.Random()
+
+        self.requests = 0
+        self.dropped = 0
+        self.malformed = 0
+
+    def datagramReceived(self, data, address):
+        self.requests += 1
+        if self.loss and self.random.random() < self.loss:
+            self.dropped += 1
+            return
+        try:
+            request = ber.decode_request(data)
+        except ber.BERError as error:
+            self.malformed += 1
+            _logger.debug("malformed request from %s: %s", address, error)
+            return
+        if self.community is not None and request.community != self.community:
+            return
+
+        response = self.respond(request)
+        delay = self.latency
+        if self.jitter:
+            delay += self.random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            self.clock.callLater(delay, self._send, response, address)
+        else:
+            self._send(response, address)
+
+    def _send(self, response, address):
+        if self.transport:
+            self.transport.write(response, address)
+
+    def respond(self, request):
+        """Returns an encoded response message to a decoded request"""
+        if request.pdu_type == ber.GET_REQUEST:
+            varbinds = self._get(request)
+        elif request.pdu_type == ber.GET_NEXT_REQUEST:
+            varbinds = self._get_next(request.oids, request.version)
+        elif request.pdu_type == ber.GET_BULK_REQUEST and request.version > 0:
+            varbinds = self._get_bulk(request)
+        else:
+            return self._error(request, ber.GEN_ERR, 1)
+
+        if isinstance(varbinds, int):
+            return self._error(request, ber.NO_SUCH_NAME, varbinds)
+        if self.max_varbinds and len(varbinds) > self.max_varbinds:
+            if request.pdu_type != ber.GET_BULK_REQUEST:
+                return ber.encode_response(request, [], ber.TOO_BIG)
+            varbinds = varbinds[:self.max_varbinds]
+        return ber.encode_response(request, varbinds)
+
+    def _get(self, request):
+        varbinds = []
+        for index, oid in enumerate(request.oids):
+            varbind = self.walk.get(oid)
+            if varbind is None:
+                if request.version == 0:
+                    return index + 1
+                varbind = (ber.encode_oid(oid),
+                           ber.encode_value(ber.NO_SUCH_INSTANCE, None))
+            varbinds.append(varbind)
+        return varbinds
+
+    def _get_next(self, oids, version=1):
+        varbinds = []
+        for index, oid in enumerate(oids):
+            found = self.walk.get_next(oid)
+            if found is None:
+                if version == 0:
+                    return index + 1
+                varbinds.append(_end_of_mib_view(oid))
+            else:
+                varbinds.append(found[1])
+        return varbinds
+
+    def _get_bulk(self, request):
+        non_repeaters = max(0, request.non_repeaters)
+        varbinds = self._get_next(request.oids[:non_repeaters])
+        repeaters = list(request.oids[non_repeaters:])
+        for _ in range(max(0, request.max_repetitions)):
+            if not repeaters:
+                break
+            exhausted = True
+            for index, oid in enumerate(repeaters):
+                found = self.walk.get_next(oid)
+                if found is None:
+                    varbinds.append(_end_of_mib_view(oid))
+                else:
+                    exhausted = False
+                    repeaters[index] = found[0]
+                    varbinds.append(found[1])
+            if exhausted:
+                break
+        return varbinds
+
+    @staticmethod
+    def _error(request, status, index):
+        varbinds = [(ber.encode_oid(oid), ber.encode_value(ber.NULL, None))
+                    for oid in request.oids]
+        return ber.encode_response(request, varbinds, status, index)
+
+
+def _end_of_mib_view(oid):
+    return ber.encode_oid(oid), ber.encode_value(ber.END_OF_MIB_VIEW, None)
+
+
+def simulated_addresses(network, count):
+    """Returns the list of IP addresses used for count simulated agents in
+    network. The network address itself is never used.
+    """
+    base = IP(network).int()
+    version = IP(network).version()
+    return [IP(base + offset, ipversion=version)
+            for offset in range(1, count + 1)]
+
+
+class AgentFarm(object):
+    """A farm of simulated agents, each listening on its own IP address.
+
+    Walks are assigned to agents in a round-robin fashion.
+
+    """
+    def __init__(self, walks, network, count, port=161, **agent_options):
+        """Initializes an agent farm.
+
+        :param walks: A list of Walk objects to serve.
+        :param network: The network of the first agent's address, e.g.
+                        "127.10.0.0". Agents are assigned consecutive
+                        addresses from this network.
+        :param count: The number of agents to run.
+        :param port: The UDP port to listen to.
+        :param agent_options: Keyword arguments for every SimulatedAgent.
+
+        """
+        if not walks:
+            raise ValueError("no walks to serve")
+        self.walks = walks
+        self.addresses = simulated_addresses(network, count)
+        self.port = port
+        self.agent_options = agent_options
+        self.agents = []
+        self._ports = []
+
+    def start(self):
+        """Starts listening on every agent's address"""
+        for index, address in enumerate(self.addresses):
+            agent = SimulatedAgent(self.walks[index % len(self.walks)],
+                                   **self.agent_options)
+            self._ports.append(reactor.listenUDP(self.port, agent,
+                                                 interface=str(address)))
+            self.agents.append(agent)
+        _logger.info("%d simulated agents serving %d walks on %s-%s port %d",
+                     len(self.agents), len(self.walks), self.addresses[0],
+                     self.addresses[-1], self.port)
+
+    def stop(self):
+        """Stops listening on every agent's address"""
+        for port in self._ports:
+            port.stopListening()
+        self._ports = []
+        self.agents = []
+
+    def log_stats(self, level=logging.INFO):
+        """Logs request statistics of the entire farm"""
+        _logger.log(level,
+                    "simulated agents: %d requests, %d dropped, %d malformed",
+                    sum(agent.requests for agent in self.agents),
+                    sum(agent.dropped for agent in self.agents),
+                    sum(agent.malformed for agent in self.agents))
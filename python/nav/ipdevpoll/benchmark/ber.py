@@ -0,0 +1,237 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""A minimal BER codec for SNMPv1/v2c messages.
+
+Only the parts of BER needed to decode SNMP requests and encode SNMP responses
+are implemented, which is just enough for the simulated agents in
+nav.ipdevpoll.benchmark.agent.
+
+"""
+from collections import namedtuple
+
+from django.utils import six
+
+# Universal types
+INTEGER = 0x02
+OCTET_STRING = 0x04
+NULL = 0x05
+OBJECT_IDENTIFIER = 0x06
+SEQUENCE = 0x30
+
+# SNMP application types
+IP_ADDRESS = 0x40
+COUNTER32 = 0x41
+GAUGE32 = 0x42
+TIMETICKS = 0x43
+OPAQUE = 0x44
+COUNTER64 = 0x46
+
+# SNMPv2 varbind exceptions
+NO_SUCH_OBJECT = 0x80
+NO_SUCH_INSTANCE = 0x81
+END_OF_MIB_VIEW = 0x82
+
+# PDU types
+GET_REQUEST = 0xa0
+GET_NEXT_REQUEST = 0xa1
+RESPONSE = 0xa2
+SET_REQUEST = 0xa3
+GET_BULK_REQUEST = 0xa5
+
+# Error statuses
+NO_ERROR = 0
+TOO_BIG = 1
+NO_SUCH_NAME = 2
+GEN_ERR = 5
+
+UNSIGNED_TYPES = (COUNTER32, GAUGE32, TIMETICKS, COUNTER64)
+
+Request = namedtuple('Request',
+                     'version community pdu_type request_id '
+                     'non_repeaters max_repetitions oids')
+
+
+class BERError(Exception):
+    """Malformed BER data"""
+
+
+def encode_length(length):
+    """Encodes a BER length field"""
+    if length < 0x80:
+        return six.int2byte(length)
+    octets = bytearray()
+    while length:
+        octets.insert(0, length & 0xff)
+        length >>= 8
+    return six.int2byte(0x80 | len(octets)) + bytes(octets)
+
+
+def encode_tlv(tag, value):
+    """Encodes a tag, length and value triplet"""
+    return six.int2byte(tag) + encode_length(len(value)) + value
+
+
+def encode_integer(value, tag=INTEGER):
+    """Encodes an integer in its shortest two's complement form"""
+    octets = bytearray()
+    while True:
+        octets.insert(0, value & 0xff)
+        value >>= 8
+        if (value == 0 and not octets[0] & 0x80) or (
+                value == -1 and octets[0] & 0x80):
+            break
+    return encode_tlv(tag, bytes(octets))
+
+
+def encode_oid(oid):
+    """Encodes an OID given as a tuple of integers"""
+    if len(oid) < 2:
+        oid = tuple(oid) + (0,) * (2 - len(oid))
+    octets = bytearray([oid[0] * 40 + oid[1]])
+    for arc in oid[2:]:
+        chunk = bytearray([arc & 0x7f])
+        arc >>= 7
+        while arc:
+            chunk.insert(0, 0x80 | (arc & 0x7f))
+            arc >>= 7
+        octets.extend(chunk)
+    return encode_tlv(OBJECT_IDENTIFIER, bytes(octets))
+
+
+def encode_value(tag, value):
+    """Encodes a varbind value of the given type.
+
+    :param tag: One of the universal or SNMP application type tags.
+    :param value: An int for integer types, bytes for octet strings and
+                  opaque values, a tuple of ints for OIDs and a dotted quad
+                  string for IP addresses.
+
+    """
+    if tag == INTEGER or tag in UNSIGNED_TYPES:
+        return encode_integer(value, tag)
+    if tag == OBJECT_IDENTIFIER:
+        return encode_oid(value)
+    if tag == IP_ADDRESS:
+        if isinstance(value, six.text_type):
+            value = bytes(bytearray(int(octet) for octet in value.split('.')))
+        return encode_tlv(tag, value)
+    if tag in (NULL, NO_SUCH_OBJECT, NO_SUCH_INSTANCE, END_OF_MIB_VIEW):
+        return encode_tlv(tag, b'')
+    return encode_tlv(tag, value)
+
+
+def encode_response(request, varbinds, error_status=NO_ERROR, error_index=0):
+    """Encodes a response message to a request.
+
+    :param request: The Request being responded to.
+    :param varbinds: A list of (encoded_oid, encoded_value) tuples.
+
+    """
+    varbind_list = b''.join(encode_tlv(SEQUENCE, oid + value)
+                            for oid, value in varbinds)
+    pdu = encode_tlv(RESPONSE,
+                     encode_integer(request.request_id) +
+                     encode_integer(error_status) +
+                     encode_integer(error_index) +
+                     encode_tlv(SEQUENCE, varbind_list))
+    return encode_tlv(SEQUENCE,
+                      encode_integer(request.version) +
+                      encode_tlv(OCTET_STRING, request.community) +
+                      pdu)
+
+
+def decode_tlv(data, offset=0):
+    """Decodes a single tag, length and value triplet.
+
+    :returns: A (tag, value, next_offset) tuple.
+
+    """
+    try:
+        tag = six.indexbytes(data, offset)
+        length = six.indexbytes(data, offset + 1)
+        offset += 2
+        if length & 0x80:
+            count = length & 0x7f
+            length = 0
+            for index in range(count):
+                length = (length << 8) | six.indexbytes(data, offset + index)
+            offset += count
+    except IndexError:
+        raise BERError("truncated data")
+    end = offset + length
+    if end > len(data):
+        raise BERError("truncated data")
+    return tag, data[offset:end], end
+
+
+def decode_integer(value):
+    """Decodes the value octets of a two's complement integer"""
+    result = 0
+    for octet in bytearray(value):
+        result = (result << 8) | octet
+    if value and six.indexbytes(value, 0) & 0x80:
+        result -= 1 << (8 * len(value))
+    return result
+
+
+def decode_oid(value):
+    """Decodes the value octets of an OID into a tuple of integers"""
+    octets = bytearray(value)
+    if not octets:
+        return ()
+    first = octets[0]
+    oid = [first // 40, first % 40] if first < 80 else [2, first - 80]
+    arc = 0
+    for octet in octets[1:]:
+        arc = (arc << 7) | (octet & 0x7f)
+        if not octet & 0x80:
+            oid.append(arc)
+            arc = 0
+    return tuple(oid)
+
+
+def _expect(tag, data, offset):
+    actual, value, offset = decode_tlv(data, offset)
+    if actual != tag:
+        raise BERError("expected tag 0x%02x, got 0x%02x" % (tag, actual))
+    return value, offset
+
+
+def decode_request(data):
+    """Decodes an SNMPv1 or v2c request message into a Request"""
+    message, _ = _expect(SEQUENCE, data, 0)
+    version, offset = _expect(INTEGER, message, 0)
+    community, offset = _expect(OCTET_STRING, message, offset)
+    pdu_type, pdu, _ = decode_tlv(message, offset)
+    if pdu_type not in (GET_REQUEST, GET_NEXT_REQUEST, GET_BULK_REQUEST,
+                        SET_REQUEST):
+        raise BERError("unsupported PDU type 0x%02x" % pdu_type)
+
+    request_id, offset = _expect(INTEGER, pdu, 0)
+    non_repeaters, offset = _expect(INTEGER, pdu, offset)
+    max_repetitions, offset = _expect(INTEGER, pdu, offset)
+    varbind_list, _ = _expect(SEQUENCE, pdu, offset)
+
+    oids = []
+    offset = 0
+    while offset < len(varbind_list):
+        varbind, offset = _expect(SEQUENCE, varbind_list, offset)
+        oid, _ = _expect(OBJECT_IDENTIFIER, varbind, 0)
+        oids.append(decode_oid(oid))
+
+    return Request(decode_integer(version), community, pdu_type,
+                   decode_integer(request_id), decode_integer(non_repeaters),
+                   decode_integer(max_repetitions), oids)
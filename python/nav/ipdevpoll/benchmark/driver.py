@@ -0,0 +1,216 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""A benchmark driver for ipdevpoll jobs.
+
+The driver runs a configured ipdevpoll job against a set of devices, usually
+devices served by a simulated agent farm, using the same JobHandler code as
+the ipdevpoll daemon.  It reports throughput in jobs per second, along with
+the CPU time, database queries and SNMP requests spent per job, and the peak
+memory usage of the process.
+
+The benchmark makes real changes to the NAV database it runs against, and
+should only be run against a scratch installation.
+
+"""
+from __future__ import division
+
+import logging
+import resource
+import time
+from collections import deque
+
+from twisted.internet import defer
+
+from nav.models import manage
+from nav.ipdevpoll.instrumentation import percentile
+from nav.ipdevpoll.jobs import JobHandler
+
+_logger = logging.getLogger(__name__)
+
+
+class BenchmarkJobHandler(JobHandler):
+    """A JobHandler that always records per-plugin statistics, so that the
+    benchmark can sum them up, regardless of whether they are configured to
+    be reported anywhere.
+    """
+    @property
+    def instrumented(self):
+        return True
+
+
+class BenchmarkResult(object):
+    """Accumulates the measurements of a benchmark run"""
+    def __init__(self, job_name, concurrency):
+        self.job_name = job_name
+        self.concurrency = concurrency
+        self.jobs = 0
+        self.failures = 0
+        self.runtimes = []
+        self.db_queries = 0
+        self.snmp_requests = 0
+        self.snmp_timeouts = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.max_rss = 0
+
+    def record(self, handler, runtime, success):
+        """Records the outcome of a single job run"""
+        self.jobs += 1
+        if not success:
+            self.failures += 1
+        self.runtimes.append(runtime)
+        for stats in handler.plugin_stats:
+            self.db_queries += stats.db_queries
+            self.snmp_requests += stats.snmp_requests
+            self.snmp_timeouts += stats.snmp_timeouts
+
+    def as_dict(self):
+        """Returns the results as a dict"""
+        jobs = self.jobs or 1
+        runtimes = sorted(self.runtimes)
+        return {
+            'job': self.job_name,
+            'concurrency': self.concurrency,
+            'jobs': self.jobs,
+            'failures': self.failures,
+            'wall_time': self.wall_time,
+            'jobs_per_second': (self.jobs / self.wall_time
+                                if self.wall_time else None),
+            'cpu_per_job': self.cpu_time / jobs,
+            'db_queries_per_job': self.db_queries / jobs,
+            'snmp_requests_per_job': self.snmp_requests / jobs,
+            'snmp_timeouts': self.snmp_timeouts,
+            'runtime_p50': percentile(runtimes, 50),
+            'runtime_p90': percentile(runtimes, 90),
+            'runtime_max': runtimes[-1] if runtimes else None,
+            'max_rss_mb': self.max_rss / 1024,
+        }
+
+    def report(self):
+        """Returns a human readable report of the results"""
+        result = self.as_dict()
+        lines = [
+            "{job}: {jobs} jobs ({failures} failed) in {wall_time:.1f}s "
+            "with concurrency {concurrency}".format(**result),
+            "  throughput:      {:.2f} jobs/s".format(
+                result['jobs_per_second'] or 0),
+            "  CPU time:        {:.3f}s/job".format(result['cpu_per_job']),
+            "  DB queries:      {:.1f}/job".format(
+                result['db_queries_per_job']),
+            "  SNMP requests:   {:.1f}/job ({} timeouts)".format(
+                result['snmp_requests_per_job'], result['snmp_timeouts']),
+            "  job runtime:     p50={} p90={} max={}".format(
+                _seconds(result['runtime_p50']),
+                _seconds(result['runtime_p90']),
+                _seconds(result['runtime_max'])),
+            "  peak memory:     {:.1f} MiB".format(result['max_rss_mb']),
+        ]
+        return "\n".join(lines)
+
+
+def _seconds(value):
+    return "-" if value is None else "%.2fs" % value
+
+
+def _cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+@defer.inlineCallbacks
+def run_benchmark(job, netbox_ids, concurrency=50, rounds=1):
+    """Runs a job against a list of netboxes, and measures the results.
+
+    :param job: A JobDescriptor of the job to run.
+    :param netbox_ids: The IDs of the netboxes to run the job for.
+    :param concurrency: The maximum number of jobs to run at the same time.
+    :param rounds: How many times to run the job for each netbox.
+    :returns: A Deferred whose result is a BenchmarkResult.
+
+    """
+    result = BenchmarkResult(job.name, concurrency)
+    remaining = deque(list(netbox_ids) * rounds)
+
+    @defer.inlineCallbacks
+    def _run_jobs():
+        while remaining:
+            netbox_id = remaining.popleft()
+            handler = BenchmarkJobHandler(job.name, netbox_id,
+                                          plugins=job.plugins,
+                                          interval=job.interval)
+            start = time.time()
+            try:
+                yield handler.run()
+            except Exception as error:  # pylint: disable=broad-except
+                _logger.debug("%s job failed for netbox %s: %s",
+                              job.name, netbox_id, error)
+                success = False
+            else:
+                success = True
+            result.record(handler, time.time() - start, success)
+
+    _logger.info("running %d %s jobs for %d netboxes, %d at a time",
+                 len(remaining), job.name, len(netbox_ids), concurrency)
+    start_wall, start_cpu = time.time(), _cpu_time()
+    yield defer.DeferredList(
+        [_run_jobs() for _ in range(max(1, concurrency))])
+    result.wall_time = time.time() - start_wall
+    result.cpu_time = _cpu_time() - start_cpu
+    result.max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    defer.returnValue(result)
+
+
+def get_netbox_ids(addresses):
+    """Returns the IDs of the netboxes whose IP addresses are in addresses"""
+    return list(manage.Netbox.objects.filter(
+        ip__in=[str(address) for address in addresses]).values_list(
+            'id', flat=True))
+
+
+def create_netboxes(addresses, room, organization, category, profile):
+    """Creates a netbox for every IP address in addresses that doesn't
+    already have one.
+
+    :param room: The ID of the room to put new netboxes in.
+    :param organization: The ID of the organization owning new netboxes.
+    :param category: The ID of the category of new netboxes.
+    :param profile: The name of the SNMP management profile of new netboxes.
+    :returns: The number of netboxes created.
+
+    """
+    profile = manage.ManagementProfile.objects.get(name=profile)
+    existing = set(manage.Netbox.objects.filter(
+        ip__in=[str(address) for address in addresses]).values_list(
+            'ip', flat=True))
+    created = 0
+    for address in addresses:
+        if str(address) in existing:
+            continue
+        netbox = manage.Netbox.objects.create(
+            ip=str(address),
+            sysname=_simulated_sysname(address),
+            room_id=room,
+            organization_id=organization,
+            category_id=category,
+        )
+        manage.NetboxProfile.objects.create(netbox=netbox, profile=profile)
+        created += 1
+    _logger.info("created %d netboxes", created)
+    return created
+
+
+def _simulated_sysname(address):
+    return "sim-" + str(address).replace('.', '-').replace(':', '-')
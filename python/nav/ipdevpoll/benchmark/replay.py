@@ -0,0 +1,170 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Offline replay of ipdevpoll plugins against recorded SNMP fixtures.
+
+A plugin is run repeatedly against a FixtureAgentProxy, timing its handle()
+method and the preparation of the containers it produced.  Since the fixture
+answers every request immediately, the timings reflect the plugin's own
+processing cost.  Plugins that query the database will of course still need
+one, and the timing of those will include the database round trips.
+
+Timings can be compared to a stored baseline, to catch performance
+regressions in plugins.
+
+"""
+from __future__ import division
+
+import json
+import logging
+import time
+
+from twisted.internet import defer
+
+from nav.ipdevpoll import shadows
+from nav.ipdevpoll.instrumentation import percentile
+from nav.ipdevpoll.storage import ContainerRepository
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_TOLERANCE = 1.5
+
+
+class ReplayTimings(object):
+    """The timings of a number of replays of a plugin against a fixture"""
+    def __init__(self, name):
+        self.name = name
+        self.handle_times = []
+        self.prepare_times = []
+        self.requests = 0
+
+    def __repr__(self):
+        return "<ReplayTimings {name!r} best={best:.4f}s>".format(
+            name=self.name, best=self.best or 0)
+
+    @property
+    def totals(self):
+        """The total time of each replay"""
+        return [handle + prepare for handle, prepare
+                in zip(self.handle_times, self.prepare_times)]
+
+    @property
+    def best(self):
+        """The fastest total replay time, which is the least noisy measure of
+        the plugin's cost
+        """
+        return min(self.totals) if self.totals else None
+
+    def as_dict(self):
+        """Returns the timings as a dict"""
+        totals = sorted(self.totals)
+        return {
+            'runs': len(totals),
+            'best': self.best,
+            'median': percentile(totals, 50),
+            'handle': min(self.handle_times) if self.handle_times else None,
+            'prepare': min(self.prepare_times) if self.prepare_times else None,
+            'requests': self.requests,
+        }
+
+
+def make_netbox(sysname, ip='127.0.0.1', netbox_id=1, **attributes):
+    """Returns a minimal shadow Netbox, for replaying plugins without loading
+    the netbox from the database.
+    """
+    netbox = shadows.Netbox(id=netbox_id, sysname=sysname, ip=ip,
+                            **attributes)
+    netbox.read_only = 'public'
+    netbox.snmp_version = 2
+    netbox.snmp_up = True
+    netbox.last_updated = {}
+    return netbox
+
+
+@defer.inlineCallbacks
+def replay_plugin(plugin_class, fixture, netbox, config=None, repeat=5,
+                  prepare=False, name=None):
+    """Replays a plugin against a fixture a number of times.
+
+    :param plugin_class: The Plugin subclass to replay.
+    :param fixture: An SnmpFixture to answer the plugin's SNMP requests.
+    :param netbox: The shadow Netbox to run the plugin for.
+    :param config: The ipdevpoll config to give the plugin.
+    :param repeat: The number of times to run the plugin.
+    :param prepare: If True, the shadow objects the plugin produces are
+                    prepared for saving, as in a real job. This usually
+                    requires a database.
+    :param name: The name of the replay, used to look it up in baselines.
+                 Defaults to the plugin class name.
+    :returns: A Deferred whose result is a ReplayTimings instance.
+
+    """
+    timings = ReplayTimings(name or plugin_class.__name__)
+    for _ in range(repeat):
+        agent = fixture.make_agent_proxy(ip=str(netbox.ip))
+        containers = ContainerRepository()
+        containers.factory(None, shadows.Netbox, id=netbox.id,
+                           sysname=netbox.sysname)
+        plugin = plugin_class(netbox, agent, containers, config)
+
+        start = time.time()
+        yield plugin.handle()
+        timings.handle_times.append(time.time() - start)
+
+        start = time.time()
+        managers = [shadow_class.manager(shadow_class, containers)
+                    for shadow_class in containers.sortedkeys()]
+        if prepare:
+            for manager in managers:
+                manager.prepare()
+        timings.prepare_times.append(time.time() - start)
+        timings.requests = agent.requests
+
+    _logger.debug("replayed %s: %r", plugin_class.__name__,
+                  timings.as_dict())
+    defer.returnValue(timings)
+
+
+def load_baseline(filename):
+    """Loads a dict of baseline replay times from a JSON file"""
+    with open(filename) as baseline:
+        return json.load(baseline)
+
+
+def save_baseline(filename, timings):
+    """Saves the best times of a list of ReplayTimings as a baseline"""
+    with open(filename, 'w') as baseline:
+        json.dump(dict((timing.name, timing.best) for timing in timings),
+                  baseline, indent=2, sort_keys=True)
+
+
+def find_regressions(timings, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Compares replay timings to a baseline.
+
+    :param timings: A list of ReplayTimings.
+    :param baseline: A dict of {name: seconds}.
+    :param tolerance: How many times slower than its baseline a replay may
+                      be before it is considered a regression.
+    :returns: A list of (name, seconds, baseline_seconds) tuples for each
+              replay that regressed. Replays missing from the baseline are
+              ignored.
+
+    """
+    regressions = []
+    for timing in timings:
+        expected = baseline.get(timing.name)
+        if expected is not None and timing.best > expected * tolerance:
+            regressions.append((timing.name, timing.best, expected))
+    return regressions
@@ -0,0 +1,148 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Listens for netbox change notifications from PostgreSQL.
+
+Database triggers send a notification on the ``netbox_changed`` channel,
+carrying a netbox id, whenever a netbox changes in a way that may affect its
+polling schedules.  A NetboxChangeListener keeps a dedicated database
+connection that LISTENs for these notifications, and is read directly by the
+Twisted reactor, so that no threads are tied up waiting for changes.
+
+Notifications are collected for a short while before being passed on, since
+a single change in the web interface tends to trigger several notifications.
+
+"""
+import logging
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from twisted.internet import reactor
+
+from nav.db import get_connection_string
+
+_logger = logging.getLogger(__name__)
+
+CHANNEL = 'netbox_changed'
+
+
+class NetboxChangeListener(object):
+    """Listens for netbox change notifications, and reports the IDs of changed
+    netboxes to a callback function.
+
+    The listener implements Twisted's IReadDescriptor interface.
+
+    """
+    def __init__(self, callback, delay=1.0, reconnect_delay=30.0):
+        """Initializes a listener.
+
+        :param callback: A function that will be called with a set of changed
+                         netbox IDs. If the listener has lost its database
+                         connection, and may have missed notifications, the
+                         function is called with None as its argument.
+        :param delay: The number of seconds to collect notifications before
+                      reporting them.
+        :param reconnect_delay: The number of seconds to wait before
+                                reconnecting a lost database connection.
+
+        """
+        self.callback = callback
+        self.delay = delay
+        self.reconnect_delay = reconnect_delay
+        self.connection = None
+        self._pending = set()
+        self._report_call = None
+
+    def start(self):
+        """Connects to the database and starts listening for notifications"""
+        try:
+            self.connection = psycopg2.connect(
+                get_connection_string(script_name='ipdevpoll'))
+            self.connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            cursor = self.connection.cursor()
+            cursor.execute('LISTEN %s' % CHANNEL)
+        except psycopg2.Error as error:
+            _logger.error("Cannot listen for netbox changes, will retry in "
+                          "%ds: %s", self.reconnect_delay, error)
+            self._close()
+            reactor.callLater(self.reconnect_delay, self._reconnect)
+            return
+        _logger.debug("listening for netbox change notifications")
+        reactor.addReader(self)
+
+    def stop(self):
+        """Stops listening for notifications"""
+        if self.connection:
+            reactor.removeReader(self)
+        self._close()
+
+    def _close(self):
+        if self.connection:
+            try:
+                self.connection.close()
+            except psycopg2.Error:
+                pass
+        self.connection = None
+
+    def _reconnect(self):
+        self.start()
+        if self.connection:
+            # changes may have been missed while we were disconnected
+            self.callback(None)
+
+    def fileno(self):
+        """Returns the file descriptor of the database connection"""
+        return self.connection.fileno() if self.connection else -1
+
+    def logPrefix(self):
+        """Returns a prefix for Twisted's log messages"""
+        return self.__class__.__name__
+
+    def doRead(self):
+        """Reads and collects pending notifications from the database
+        connection.
+        """
+        try:
+            self.connection.poll()
+        except psycopg2.Error as error:
+            return error
+
+        while self.connection.notifies:
+            notification = self.connection.notifies.pop(0)
+            try:
+                self._pending.add(int(notification.payload))
+            except ValueError:
+                _logger.warning("ignoring invalid notification payload: %r",
+                                notification.payload)
+
+        if self._pending and not self._report_call:
+            self._report_call = reactor.callLater(self.delay, self._report)
+
+    def connectionLost(self, reason):
+        """Called by the reactor when the database connection is lost"""
+        _logger.warning("lost netbox change notification connection, "
+                        "reconnecting in %ds: %s", self.reconnect_delay,
+                        reason)
+        reactor.removeReader(self)
+        self._close()
+        reactor.callLater(self.reconnect_delay, self._reconnect)
+
+    def _report(self):
+        self._report_call = None
+        changed, self._pending = self._pending, set()
+        if changed:
+            _logger.debug("got change notifications for %d netboxes",
+                          len(changed))
+            self.callback(changed)
@@ -33,6 +33,15 @@ class IpdevpollConfig(NAVConfigParser):
 [ipdevpoll]
 logfile = ipdevpolld.log
 max_concurrent_jobs = 500
+stagger_jobs = no
+catchup_window = 5m
+netbox_change_notifications = no
+full_reload_interval = 15m
+bulk_save = no
+plugin_metrics = no
+plugin_stats_in_job_log = no
+overload_policy = queue
+max_concurrent_plugins = 4
 
 [netbox_filters]
 groups_included=
@@ -131,12 +140,14 @@ def get_netbox_filter(section, config=None):
 # pylint: disable=R0913,R0903
 class JobDescriptor(object):
     """A data structure describing a job."""
-    def __init__(self, name, interval, intensity, plugins, description=''):
+    def __init__(self, name, interval, intensity, plugins, description='',
+                 priority=0):
         self.name = str(name)
         self.interval = int(interval)
         self.intensity = int(intensity)
         self.plugins = list(plugins)
         self.description = description
+        self.priority = int(priority)
 
     @classmethod
     def from_config_section(cls, config, section):
@@ -161,7 +172,11 @@ class JobDescriptor(object):
         description = (_parse_description(config.get(section, 'description'))
                        if config.has_option(section, 'description') else '')
 
-        return cls(jobname, interval, intensity, plugins, description)
+        priority = (config.getint(section, 'priority')
+                    if config.has_option(section, 'priority') else 0)
+
+        return cls(jobname, interval, intensity, plugins, description,
+                   priority)
 
 
 def _parse_plugins(value):
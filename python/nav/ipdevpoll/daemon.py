@@ -40,9 +40,13 @@ from nav.util import is_valid_ip
 import nav.daemon
 from nav.daemon import signame
 import nav.logs
+from nav.metrics.carbonclient import (install_carbon_client,
+                                      log_carbon_client_stats)
+from nav.metrics.spool import get_metric_spool, log_metric_spool_stats
 from nav.models import manage
 
 from nav.ipdevpoll import ContextFormatter, schedule, db
+from nav.ipdevpoll.snmp.recording import set_recording_directory
 from . import plugins, pool
 
 
@@ -84,6 +88,12 @@ class IPDevPollProcess(object):
     def run(self):
         """Loads plugins, and initiates polling schedules."""
         reactor.callWhenRunning(self.install_sighandlers)
+        if self.options.record_snmp:
+            set_recording_directory(self.options.record_snmp)
+        if install_carbon_client():
+            self.job_loggers.append(log_carbon_client_stats)
+        if get_metric_spool():
+            self.job_loggers.append(log_metric_spool_stats)
 
         if self.options.netbox:
             self.setup_single_job()
@@ -117,6 +127,11 @@ class IPDevPollProcess(object):
         # every log statement.
         self._logger.info("Starting scheduling in single process")
         from .schedule import JobScheduler
+        from .interfacecache import log_interface_cache_stats
+        from .snmp.cache import log_response_cache_stats
+        from .snmp.packing import log_request_packers
+        from .snmp.pacing import log_pacing_controllers
+        from .snmp.sessionpool import log_session_pool_stats
         plugins.import_plugins()
         self.work_pool = pool.InlinePool()
         reactor.callWhenRunning(JobScheduler.initialize_from_config_and_run,
@@ -126,6 +141,11 @@ class IPDevPollProcess(object):
             JobScheduler.log_active_jobs(logging.INFO)
 
         self.job_loggers.append(log_scheduler_jobs)
+        self.job_loggers.append(log_response_cache_stats)
+        self.job_loggers.append(log_interface_cache_stats)
+        self.job_loggers.append(log_pacing_controllers)
+        self.job_loggers.append(log_request_packers)
+        self.job_loggers.append(log_session_pool_stats)
 
         def reload_netboxes():
             JobScheduler.reload()
@@ -140,11 +160,21 @@ class IPDevPollProcess(object):
         # causes us to have two StreamHandlers on the root logger, duplicating
         # every log statement.
         self._logger.info("Starting worker process")
+        from .interfacecache import log_interface_cache_stats
+        from .snmp.cache import log_response_cache_stats
+        from .snmp.packing import log_request_packers
+        from .snmp.pacing import log_pacing_controllers
+        from .snmp.sessionpool import log_session_pool_stats
         plugins.import_plugins()
 
         def init():
             handler = pool.initialize_worker()
             self.job_loggers.append(handler.log_jobs)
+            self.job_loggers.append(log_response_cache_stats)
+            self.job_loggers.append(log_interface_cache_stats)
+            self.job_loggers.append(log_pacing_controllers)
+            self.job_loggers.append(log_request_packers)
+            self.job_loggers.append(log_session_pool_stats)
 
         reactor.callWhenRunning(init)
 
@@ -262,6 +292,8 @@ class CommandProcessor(object):
             setDebugging(True)
         if options.multiprocess and options.multiprocess < 2:
             parser.error('--multiprocess requires at least 2 workers')
+        if options.multiprocess and options.record_snmp:
+            parser.error('--record-snmp is not supported in multiprocess mode')
 
         return options
 
@@ -304,6 +336,11 @@ class CommandProcessor(object):
             metavar="COUNT", type=int, default=10,
             help="the number of database worker threads, and thus db "
                  "connections, to use in this process")
+        opt("--record-snmp", action="store", dest="record_snmp",
+            metavar="DIRECTORY",
+            help="record all SNMP responses received by each job to a "
+                 "fixture file per device and job in DIRECTORY, for offline "
+                 "replay of plugins. Not supported in multiprocess mode")
         opt("--worker", action="store_true",
             help="Used internally when lauching worker processes")
         return parser
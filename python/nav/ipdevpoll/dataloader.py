@@ -96,13 +96,34 @@ class NetboxLoader(dict):
             changed in the database since the last load operation.
 
         """
+        return self._load_s()
+
+    def load_some_s(self, netbox_ids):
+        """Synchronously reload a subset of netboxes from the database.
+
+        Netboxes that are not already loaded will be added if they match the
+        netbox filters, while loaded netboxes that no longer match (or no
+        longer exist) are removed.
+
+        :param netbox_ids: The IDs of the netboxes to reload.
+        :returns: A three-tuple, (new_ids, lost_ids, changed_ids), just like
+                  load_all_s(), but limited to the netboxes in netbox_ids.
+
+        """
+        return self._load_s(set(netbox_ids))
+
+    def _load_s(self, netbox_ids=None):
         related = ('room__location', 'type__vendor',
                    'category', 'organization')
-        snmp_down = set(event.AlertHistory.objects.unresolved(
-            'snmpAgentState').values_list('netbox__id', flat=True))
+        alerts = event.AlertHistory.objects.unresolved('snmpAgentState')
+        if netbox_ids is not None:
+            alerts = alerts.filter(netbox__id__in=netbox_ids)
+        snmp_down = set(alerts.values_list('netbox__id', flat=True))
         self._logger.debug("These netboxes have active snmpAgentStates: %r",
                            snmp_down)
         queryset = manage.Netbox.objects.filter(deleted_at__isnull=True)
+        if netbox_ids is not None:
+            queryset = queryset.filter(id__in=netbox_ids)
 
         filter_groups_included = get_netbox_filter('groups_included')
         if filter_groups_included:
@@ -118,13 +139,15 @@ class NetboxLoader(dict):
         netbox_list = storage.shadowify_queryset(queryset)
         netbox_dict = dict((netbox.id, netbox) for netbox in netbox_list)
 
-        times = load_last_updated_times()
+        times = load_last_updated_times(netbox_ids)
         for netbox in netbox_list:
             netbox.last_updated = times.get(netbox.id, {})
 
         django_debug_cleanup()
 
         previous_ids = set(self.keys())
+        if netbox_ids is not None:
+            previous_ids.intersection_update(netbox_ids)
         current_ids = set(netbox_dict.keys())
         lost_ids = previous_ids.difference(current_ids)
         new_ids = current_ids.difference(previous_ids)
@@ -146,10 +169,10 @@ class NetboxLoader(dict):
         anything_changed = len(new_ids) or len(lost_ids) or len(changed_ids)
         log = self._logger.info if anything_changed else self._logger.debug
 
-        log("Loaded %d netboxes from database "
+        log("Loaded %d %snetboxes from database "
             "(%d new, %d removed, %d changed, %d peak)",
-            len(netbox_dict), len(new_ids), len(lost_ids), len(changed_ids),
-            self.peak_count
+            len(netbox_dict), "" if netbox_ids is None else "changed ",
+            len(new_ids), len(lost_ids), len(changed_ids), self.peak_count
             )
 
         return (new_ids, lost_ids, changed_ids)
@@ -158,6 +181,10 @@ class NetboxLoader(dict):
         """Asynchronously load netboxes from database."""
         return run_in_thread(self.load_all_s)
 
+    def load_some(self, netbox_ids):
+        """Asynchronously reload a subset of netboxes from database."""
+        return run_in_thread(self.load_some_s, netbox_ids)
+
 
 def is_netbox_changed(netbox1, netbox2):
     """Determine whether a netbox' information has changed enough to
@@ -193,8 +220,12 @@ def is_netbox_changed(netbox1, netbox2):
     return False
 
 
-def load_last_updated_times():
-    """Loads the last-successful timestamps of each job of each netbox"""
+def load_last_updated_times(netbox_ids=None):
+    """Loads the last-successful timestamps of each job of each netbox
+
+    :param netbox_ids: An optional list of netbox IDs to limit the result to.
+
+    """
     sql = """SELECT
                netboxid,
                job_name,
@@ -203,11 +234,42 @@ def load_last_updated_times():
                ipdevpoll_job_log
              WHERE
                success
+               {netbox_filter}
              GROUP BY netboxid, job_name
              """
+    params = []
+    netbox_filter = ""
+    if netbox_ids is not None:
+        netbox_filter = "AND netboxid = ANY(%s)"
+        params.append(list(netbox_ids))
     cursor = django.db.connection.cursor()
-    cursor.execute(sql)
+    cursor.execute(sql.format(netbox_filter=netbox_filter), params)
     times = defaultdict(dict)
     for netboxid, job_name, end_time in cursor.fetchall():
         times[netboxid][job_name] = end_time
     return dict(times)
+
+
+def load_average_job_runtimes(samples=5):
+    """Loads the average runtime of the most recent successful runs of each
+    job for each netbox.
+
+    :param samples: The maximum number of recent job runs to average.
+    :returns: A dict of {(netboxid, job_name): seconds}
+
+    """
+    sql = """WITH ranked AS (
+               SELECT netboxid, job_name, duration,
+                      rank() OVER (PARTITION BY netboxid, job_name
+                                   ORDER BY end_time DESC)
+               FROM ipdevpoll_job_log
+               WHERE success AND duration IS NOT NULL)
+             SELECT netboxid, job_name, AVG(duration)
+             FROM ranked
+             WHERE rank <= %s
+             GROUP BY netboxid, job_name
+             """
+    cursor = django.db.connection.cursor()
+    cursor.execute(sql, [samples])
+    return {(netboxid, job_name): duration
+            for netboxid, job_name, duration in cursor.fetchall()}
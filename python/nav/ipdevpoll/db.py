@@ -17,6 +17,7 @@
 
 import gc
 import logging
+from collections import deque
 from pprint import pformat
 import threading
 from functools import wraps
@@ -85,11 +86,82 @@ def run_in_thread(func, *args, **kwargs):
     """Runs a synchronous function in a thread, with special handling of
     database errors.
 
+    If func is a method of an ipdevpoll plugin that is being instrumented,
+    the Django queries run by func are recorded in the plugin's PluginStats
+    instance.
+
     """
+    owner = getattr(func, '__self__', None)
+    stats = getattr(owner, 'instrumentation', None)
+    if stats is not None:
+        return run_instrumented_in_thread(stats, func, *args, **kwargs)
     return threads.deferToThread(reset_connection_on_interface_error(func),
                                  *args, **kwargs)
 
 
+def run_instrumented_in_thread(stats, func, *args, **kwargs):
+    """Runs a synchronous function in a thread, like run_in_thread, recording
+    the number and total runtime of the Django queries it runs in stats.
+
+    :param stats: A nav.ipdevpoll.instrumentation.PluginStats instance.
+
+    """
+    measured = []
+
+    def _record(result):
+        for count, runtime in measured:
+            stats.record_db_queries(count, runtime)
+        return result
+
+    df = threads.deferToThread(
+        reset_connection_on_interface_error(count_queries(func, measured)),
+        *args, **kwargs)
+    return df.addBoth(_record)
+
+
+class _QueryCounter(deque):
+    """A stand-in for a Django connection's queries_log, which counts the
+    queries appended to it and sums up their runtimes.
+    """
+    def __init__(self, iterable=(), maxlen=None):
+        super(_QueryCounter, self).__init__(iterable, maxlen)
+        self.count = 0
+        self.runtime = 0.0
+
+    def append(self, query):
+        self.count += 1
+        self.runtime += float(query.get('time') or 0)
+        super(_QueryCounter, self).append(query)
+
+
+def count_queries(func, measured):
+    """Decorates func to count the Django queries it runs on the current
+    thread's database connection, even when DJANGO_DEBUG is off.  A
+    (query count, total runtime) tuple is appended to the list `measured`
+    after every call.
+
+    """
+    def _count(*args, **kwargs):
+        connection = django.db.connection
+        original_log = connection.queries_log
+        was_logging = connection.queries_logged
+        forced = connection.force_debug_cursor
+        counter = _QueryCounter(original_log, original_log.maxlen)
+        connection.queries_log = counter
+        connection.force_debug_cursor = True
+        try:
+            return func(*args, **kwargs)
+        finally:
+            connection.force_debug_cursor = forced
+            connection.queries_log = original_log
+            if was_logging:
+                original_log.clear()
+                original_log.extend(counter)
+            measured.append((counter.count, counter.runtime))
+
+    return wraps(func)(_count)
+
+
 def reset_connection_on_interface_error(func):
     """Decorates function to reset the current thread's Django database
     connection on exceptions that appear to come from connection resets.
@@ -0,0 +1,128 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Per-plugin instrumentation of ipdevpoll jobs.
+
+When plugin instrumentation is enabled, a job gives each of its plugins a
+PluginStats instance, which records the SNMP requests the plugin makes
+through the job's AgentProxy, and the Django queries it runs through
+nav.ipdevpoll.db.run_in_thread.  The database work of the job's save stage is
+recorded in a PluginStats instance of its own.
+
+"""
+from django.utils import six
+
+from nav.metrics.names import escape_metric_name
+from nav.metrics.templates import metric_prefix_for_ipdevpoll_job
+
+SAVE_STAGE = 'save'
+
+
+class PluginStats(object):
+    """Request and query statistics for a single plugin run"""
+    def __init__(self, name):
+        self.name = name
+        self.snmp_requests = 0
+        self.snmp_varbinds = 0
+        self.snmp_bytes = 0
+        self.snmp_timeouts = 0
+        self.snmp_latencies = []
+        self.db_queries = 0
+        self.db_time = 0.0
+
+    def __repr__(self):
+        return "<PluginStats {name} {stats!r}>".format(name=self.name,
+                                                       stats=self.as_dict())
+
+    def record_snmp_response(self, latency, varbinds):
+        """Records a response to an SNMP request.
+
+        :param latency: The response time, in seconds.
+        :param varbinds: The list of (oid, value) tuples in the response.
+
+        """
+        self.snmp_requests += 1
+        self.snmp_latencies.append(latency)
+        self.snmp_varbinds += len(varbinds)
+        self.snmp_bytes += sum(estimate_varbind_size(oid, value)
+                               for oid, value in varbinds)
+
+    def record_snmp_timeout(self, latency):
+        """Records a timed out SNMP request"""
+        self.snmp_requests += 1
+        self.snmp_timeouts += 1
+        self.snmp_latencies.append(latency)
+
+    def record_db_queries(self, count, runtime):
+        """Records a number of Django queries and their total runtime"""
+        self.db_queries += count
+        self.db_time += runtime
+
+    def as_dict(self):
+        """Returns the statistics as a dict"""
+        latencies = sorted(self.snmp_latencies)
+        return {
+            'snmp.requests': self.snmp_requests,
+            'snmp.varbinds': self.snmp_varbinds,
+            'snmp.bytes': self.snmp_bytes,
+            'snmp.timeouts': self.snmp_timeouts,
+            'snmp.latency.p50': percentile(latencies, 50),
+            'snmp.latency.p90': percentile(latencies, 90),
+            'snmp.latency.max': latencies[-1] if latencies else None,
+            'db.queries': self.db_queries,
+            'db.time': self.db_time,
+        }
+
+    def to_metrics(self, sysname, job_name, timestamp):
+        """Returns the statistics as a list of metric tuples"""
+        prefix = "{job}.plugins.{plugin}.".format(
+            job=metric_prefix_for_ipdevpoll_job(sysname, job_name),
+            plugin=escape_metric_name(self.name))
+        return [(prefix + key, (timestamp, value))
+                for key, value in sorted(self.as_dict().items())
+                if value is not None]
+
+
+def percentile(values, percent):
+    """Returns the nearest-rank percentile of a sorted list of values, or None
+    if the list is empty.
+    """
+    if not values:
+        return None
+    rank = max(1, int(round(percent / 100.0 * len(values))))
+    return values[rank - 1]
+
+
+def estimate_varbind_size(oid, value):
+    """Returns a rough estimate of the number of bytes a varbind takes up in
+    an SNMP response PDU.
+
+    The estimate assumes one byte per OID sub-identifier, and adds two bytes
+    of type and length encoding each for the OID, the value and the varbind
+    itself.
+    """
+    if isinstance(oid, tuple):
+        oid_size = len(oid)
+    else:
+        oid_size = str(oid).count('.')
+    if isinstance(value, (six.binary_type, six.text_type)):
+        value_size = len(value)
+    elif isinstance(value, tuple):
+        value_size = len(value)
+    elif value is None:
+        value_size = 0
+    else:
+        value_size = 4
+    return oid_size + value_size + 6
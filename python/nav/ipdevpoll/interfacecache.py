@@ -0,0 +1,166 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""A process-wide cache of the interface rows of netboxes.
+
+Every job that collects interface data must match the collected interfaces
+against those already stored in the database, which used to mean reading
+every interface row of the netbox, even for frequent jobs such as linkstate
+and statuscheck.
+
+A database trigger counts the changes to each netbox' interfaces in the
+interface_version table.  The cache keeps the interface rows of recently
+polled netboxes along with the version they were read at, and will only
+read the rows again if the version has changed since.  Checking the version
+is a single primary key lookup.
+
+The cache hands out new Interface model instances on every lookup, since
+jobs modify the instances they are given.
+
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+from django.db import connection
+
+from nav.models import manage
+
+_logger = logging.getLogger(__name__)
+
+CONFIG_SECTION = 'interfacecache'
+
+_interface_cache = None
+
+
+class InterfaceCache(object):
+    """A size-bounded LRU cache of the interface rows of netboxes"""
+    def __init__(self, max_netboxes=1000):
+        """Initializes an interface cache.
+
+        :param max_netboxes: The maximum number of netboxes to keep the
+                             interfaces of.
+
+        """
+        self.max_netboxes = max_netboxes
+        self.fields = [field.attname
+                       for field in manage.Interface._meta.concrete_fields]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_interfaces(self, netbox_id):
+        """Returns a list of Interface model instances for every interface of
+        a netbox, as currently stored in the database.
+        """
+        # The version must be read before the rows: If the interfaces change
+        # in between, the rows are cached with an outdated version, and will
+        # just be read again on the next lookup.
+        version = self.get_version(netbox_id)
+        with self._lock:
+            entry = self._entries.get(netbox_id)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(netbox_id)
+                self.hits += 1
+                rows = entry[1]
+            else:
+                self.misses += 1
+                rows = None
+
+        if rows is None:
+            rows = self.load_rows(netbox_id)
+            self._put(netbox_id, version, rows)
+
+        database = manage.Interface.objects.db
+        return [manage.Interface.from_db(database, self.fields, row)
+                for row in rows]
+
+    def _put(self, netbox_id, version, rows):
+        with self._lock:
+            self._entries[netbox_id] = (version, rows)
+            self._entries.move_to_end(netbox_id)
+            while len(self._entries) > self.max_netboxes:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, netbox_id):
+        """Removes the cached interfaces of a netbox"""
+        with self._lock:
+            if self._entries.pop(netbox_id, None) is not None:
+                self.invalidations += 1
+
+    @staticmethod
+    def get_version(netbox_id):
+        """Returns the current version of a netbox' interfaces"""
+        return get_interface_versions([netbox_id]).get(netbox_id, 0)
+
+    def load_rows(self, netbox_id):
+        """Reads the interface rows of a netbox from the database"""
+        return list(manage.Interface.objects.filter(
+            netbox__id=netbox_id).values_list(*self.fields))
+
+    def get_stats(self):
+        """Returns a dictionary of cache statistics"""
+        return dict(netboxes=len(self._entries), hits=self.hits,
+                    misses=self.misses, evictions=self.evictions,
+                    invalidations=self.invalidations)
+
+    def log_stats(self):
+        """Logs the cache statistics"""
+        _logger.info("interface cache: %(netboxes)d netboxes, %(hits)d hits, "
+                     "%(misses)d misses, %(evictions)d evictions, "
+                     "%(invalidations)d invalidations", self.get_stats())
+
+
+def get_interface_versions(netbox_ids):
+    """Returns the current versions of the interfaces of a number of netboxes.
+
+    :returns: A dict of {netboxid: version}. Netboxes whose interfaces have
+              never changed are omitted, their version is 0.
+
+    """
+    cursor = connection.cursor()
+    cursor.execute("SELECT netboxid, version FROM interface_version "
+                   "WHERE netboxid = ANY(%s)", [list(netbox_ids)])
+    return dict(cursor.fetchall())
+
+
+def get_interface_cache(config=None):
+    """Returns the process-wide InterfaceCache instance, or None if the cache
+    has not been enabled in ipdevpoll.conf.
+    """
+    global _interface_cache
+    if _interface_cache is None:
+        if config is None:
+            from nav.ipdevpoll.config import ipdevpoll_conf as config
+        if not config.getboolean(CONFIG_SECTION, 'enabled', fallback=False):
+            _interface_cache = False
+        else:
+            max_netboxes = config.getint(CONFIG_SECTION, 'max-netboxes',
+                                         fallback=1000)
+            _logger.debug("interface cache enabled, max-netboxes=%d",
+                          max_netboxes)
+            _interface_cache = InterfaceCache(max_netboxes)
+    return _interface_cache if _interface_cache else None
+
+
+def log_interface_cache_stats():
+    """Logs the statistics of the process-wide interface cache, if enabled"""
+    cache = get_interface_cache()
+    if cache:
+        cache.log_stats()
@@ -20,10 +20,12 @@ import pprint
 import logging
 import threading
 import gc
+from collections import Counter
 from itertools import cycle
 
 from twisted.internet import defer, reactor
 from twisted.internet.error import TimeoutError
+from twisted.python.failure import Failure
 
 from nav.ipdevpoll import ContextLogger
 from nav.ipdevpoll.snmp import snmpprotocol, AgentProxy
@@ -35,8 +37,12 @@ from nav.util import splitby
 from nav.ipdevpoll import db
 from .plugins import plugin_registry
 from . import storage, shadows, dataloader
+from .instrumentation import PluginStats, SAVE_STAGE
 from .utils import log_unhandled_failure
 from .snmp.common import snmp_parameter_factory
+from .snmp.recording import get_recorder, save_recording
+from .snmp.sessionpool import get_session_pool
+from .timestamps import ChangeIndicators
 
 _logger = logging.getLogger(__name__)
 ports = cycle([snmpprotocol.port() for i in range(50)])
@@ -91,6 +97,11 @@ class JobHandler(object):
         self._log_context = {}
         self.containers = storage.ContainerRepository()
         self.storage_queue = []
+        self.save_counts = Counter()
+        self.plugin_stats = []
+        self.plugin_metrics = False
+        self.plugin_stats_in_job_log = False
+        self.change_indicators = None
 
         self.agent = None
 
@@ -102,6 +113,23 @@ class JobHandler(object):
             self.agent = None
             return
 
+        session_pool = get_session_pool()
+        if session_pool:
+            try:
+                self.agent = session_pool.borrow(
+                    self.netbox.ip, 161,
+                    community=self.netbox.read_only,
+                    snmpVersion='v%s' % self.netbox.snmp_version,
+                    protocol=next(ports).protocol,
+                    snmp_parameters=snmp_parameter_factory(self.netbox)
+                )
+            except SnmpError as error:
+                self._log_session_error(error)
+                raise AbortedJobError("Cannot open SNMP session", cause=error)
+            self._logger.debug("AgentProxy borrowed for %s: %s",
+                               self.netbox.sysname, self.agent)
+            return
+
         port = next(ports)
         self.agent = AgentProxy(
             self.netbox.ip, 161,
@@ -114,21 +142,49 @@ class JobHandler(object):
             self.agent.open()
         except SnmpError as error:
             self.agent.close()
-            session_count = self.agent.count_open_sessions()
-            job_count = self.get_instance_count()
-            self._logger.error(
-                "%s (%d currently open SNMP sessions, %d job handlers)",
-                error, session_count, job_count)
+            self._log_session_error(error)
             raise AbortedJobError("Cannot open SNMP session", cause=error)
         else:
             self._logger.debug("AgentProxy created for %s: %s",
                                self.netbox.sysname, self.agent)
 
+    def _log_session_error(self, error):
+        session_count = AgentProxy.count_open_sessions()
+        job_count = self.get_instance_count()
+        self._logger.error(
+            "%s (%d currently open SNMP sessions, %d job handlers)",
+            error, session_count, job_count)
+
     def _destroy_agentproxy(self):
         if self.agent:
-            self.agent.close()
+            self.agent.stats = None
+            self._save_recording()
+            session_pool = get_session_pool()
+            if session_pool:
+                session_pool.release(self.agent)
+            else:
+                self.agent.close()
         self.agent = None
 
+    def _start_recording(self):
+        """Starts recording SNMP responses, if recording is enabled"""
+        if self.agent:
+            self.agent.recorder = get_recorder()
+
+    def _save_recording(self):
+        """Saves the SNMP responses recorded during this job, if any"""
+        recorder, self.agent.recorder = self.agent.recorder, None
+        if not recorder:
+            return
+        try:
+            filename = save_recording(recorder, self.netbox.sysname, self.name)
+        except (IOError, OSError) as error:
+            self._logger.error("could not save recorded SNMP responses: %s",
+                               error)
+        else:
+            self._logger.info("saved %d recorded varbinds to %s",
+                              len(recorder), filename)
+
     @defer.inlineCallbacks
     def _find_plugins(self):
         """Populate the internal plugin list with plugin class instances."""
@@ -138,7 +194,9 @@ class JobHandler(object):
                           for name in self._get_valid_plugins()]
         willing_plugins = yield self._get_willing_plugins(plugin_classes)
 
-        plugins = [cls(self.netbox, agent=self.agent,
+        concurrent = self._get_max_concurrent_plugins() > 1
+        plugins = [cls(self.netbox,
+                       agent=self._get_plugin_agent(cls, concurrent),
                        containers=self.containers, config=ipdevpoll_conf)
                    for cls in willing_plugins]
 
@@ -147,6 +205,28 @@ class JobHandler(object):
 
         defer.returnValue(plugins)
 
+    def _get_max_concurrent_plugins(self):
+        """Returns the maximum number of plugins to run concurrently"""
+        from nav.ipdevpoll.config import ipdevpoll_conf
+
+        if self.agent and self.agent.snmp_parameters.throttle_delay:
+            # throttling is done per proxy, and would be circumvented by
+            # concurrent plugins
+            return 1
+        return max(1, ipdevpoll_conf.getint('ipdevpoll',
+                                            'max_concurrent_plugins'))
+
+    def _get_plugin_agent(self, plugin_class, concurrent):
+        """Returns the AgentProxy a plugin should use.
+
+        Plugins that may run concurrently with others get a fork of the job's
+        proxy, so that their SNMP requests can be attributed to them.
+
+        """
+        if self.agent and concurrent and plugin_class.declares_containers():
+            return self.agent.fork()
+        return self.agent
+
     def _get_valid_plugins(self):
         valid_plugins, invalid_plugins = splitby(
             lambda name: name in plugin_registry,
@@ -186,9 +266,54 @@ class JobHandler(object):
 
         defer.returnValue(willing_plugins)
 
+    @defer.inlineCallbacks
+    def _skip_unchanged_plugins(self, plugins):
+        """Collects the change indicators of plugins, and removes the plugins
+        that are to be skipped when their indicators are unchanged.
+
+        :returns: A Deferred whose result is the list of plugins to run.
+
+        """
+        self.change_indicators = ChangeIndicators(self.agent, self.containers,
+                                                  plugins)
+        if not self.change_indicators.plugins:
+            defer.returnValue(plugins)
+
+        yield self.change_indicators.load()
+        yield self.change_indicators.collect()
+        for plugin in self.change_indicators.plugins:
+            plugin.indicators_changed = (
+                self.change_indicators.is_changed(plugin))
+
+        skipped, plugins = splitby(
+            lambda plugin: (plugin.SKIP_WHEN_UNCHANGED and
+                            not plugin.indicators_changed),
+            plugins)
+        skipped, plugins = list(skipped), list(plugins)
+        if skipped:
+            self._logger.debug("skipping plugins with unchanged indicators: "
+                               "%r", [plugin.name() for plugin in skipped])
+        defer.returnValue(plugins)
+
     def _iterate_plugins(self, plugins):
-        """Iterates plugins."""
-        plugins = iter(plugins)
+        """Runs plugins in their configured order.
+
+        A plugin is started as soon as no earlier plugin that conflicts with
+        it is still waiting or running (see Plugin.conflicts_with()), and
+        fewer than max_concurrent_plugins plugins are running.  Plugins that
+        don't declare their container usage are therefore run alone.
+
+        :returns: A Deferred that fires when every plugin is done.  If any
+                  plugin fails, no more plugins are started, and the Deferred
+                  fails with the first failure once the running plugins have
+                  stopped.
+
+        """
+        pending = list(plugins)
+        running = []
+        failures = []
+        max_concurrent = self._get_max_concurrent_plugins()
+        done = defer.Deferred()
 
         def log_plugin_failure(failure, plugin_instance):
             if failure.check(TimeoutError, defer.TimeoutError):
@@ -209,24 +334,53 @@ class JobHandler(object):
                                       plugin_instance)
             return failure
 
-        def next_plugin(result=None):
-            self._raise_if_cancelled()
-            try:
-                plugin_instance = next(plugins)
-            except StopIteration:
-                return result
-
+        def plugin_failed(failure):
+            failures.append(failure)
+
+        def plugin_stopped(_result, plugin_instance):
+            running.remove(plugin_instance)
+            start_plugins()
+
+        def is_blocked(index):
+            plugin_instance = pending[index]
+            return any(plugin_instance.conflicts_with(other)
+                       for other in running + pending[:index])
+
+        def start_plugins():
+            if not failures and pending:
+                try:
+                    self._raise_if_cancelled()
+                except AbortedJobError:
+                    failures.append(Failure())
+
+            index = 0
+            while (not failures and index < len(pending)
+                   and len(running) < max_concurrent):
+                if is_blocked(index):
+                    index += 1
+                else:
+                    start_plugin(pending.pop(index))
+
+            if not running and (failures or not pending) and not done.called:
+                if failures:
+                    done.errback(failures[0])
+                else:
+                    done.callback(None)
+
+        def start_plugin(plugin_instance):
             self._logger.debug("Now calling plugin: %s", plugin_instance)
-            self._start_plugin_timer(plugin_instance)
+            running.append(plugin_instance)
+            timings = self._start_plugin_timer(plugin_instance)
+            self._start_plugin_instrumentation(plugin_instance)
 
             df = defer.maybeDeferred(plugin_instance.handle)
-            df.addErrback(self._stop_plugin_timer)
+            df.addBoth(self._stop_plugin_timer, timings)
             df.addErrback(log_plugin_failure, plugin_instance)
-            df.addCallback(self._stop_plugin_timer)
-            df.addCallback(next_plugin)
-            return df
+            df.addErrback(plugin_failed)
+            df.addCallback(plugin_stopped, plugin_instance)
 
-        return next_plugin()
+        start_plugins()
+        return done
 
     @defer.inlineCallbacks
     def run(self):
@@ -249,12 +403,15 @@ class JobHandler(object):
                                 sysname=self.netbox.sysname)
 
         self._create_agentproxy()
+        self._start_recording()
         plugins = yield self._find_plugins()
         self._reset_timers()
+        self._reset_instrumentation()
         if not plugins:
             self._destroy_agentproxy()
             defer.returnValue(False)
 
+        plugins = yield self._skip_unchanged_plugins(plugins)
         self._logger.debug("Starting job %r for %s",
                            self.name, self.netbox.sysname)
 
@@ -293,6 +450,8 @@ class JobHandler(object):
             if self.cancelled.isSet():
                 return wrap_up_job(result)
 
+            if self.change_indicators:
+                self.change_indicators.save()
             df = self._save_container()
             df.addErrback(save_failure)
             df.addCallback(wrap_up_job)
@@ -342,19 +501,52 @@ class JobHandler(object):
         now = datetime.datetime.now()
         timings = [plugin.__class__.__name__, now, now]
         self._plugin_times.append(timings)
+        return timings
 
-    def _stop_plugin_timer(self, result=None):
-        timings = self._plugin_times[-1]
+    @staticmethod
+    def _stop_plugin_timer(result, timings):
         timings[-1] = datetime.datetime.now()
         return result
 
+    def _reset_instrumentation(self):
+        from nav.ipdevpoll.config import ipdevpoll_conf
+
+        self.plugin_metrics = ipdevpoll_conf.getboolean('ipdevpoll',
+                                                        'plugin_metrics')
+        self.plugin_stats_in_job_log = ipdevpoll_conf.getboolean(
+            'ipdevpoll', 'plugin_stats_in_job_log')
+        self.plugin_stats = []
+
+    @property
+    def instrumented(self):
+        """True if per-plugin statistics should be recorded for this job"""
+        return self.plugin_metrics or self.plugin_stats_in_job_log
+
+    def _start_plugin_instrumentation(self, plugin):
+        """Makes the SNMP requests and database queries of plugin be recorded
+        in a new PluginStats instance, if instrumentation is enabled.
+        """
+        if not self.instrumented:
+            return
+        stats = PluginStats(getattr(plugin, 'alias', plugin.name()))
+        self.plugin_stats.append(stats)
+        plugin.instrumentation = stats
+        if plugin.agent:
+            plugin.agent.stats = stats
+
     def _log_timings(self):
         stop_time = datetime.datetime.now()
         job_total = stop_time-self._start_time
 
         times = [(plugin, stop-start)
                  for (plugin, start, stop) in self._plugin_times]
-        plugin_total = sum((i[1] for i in times), datetime.timedelta(0))
+        # plugins may have run concurrently, so count the time from the first
+        # plugin started until the last one stopped
+        if self._plugin_times:
+            plugin_total = (max(stop for _, _, stop in self._plugin_times) -
+                            min(start for _, start, _ in self._plugin_times))
+        else:
+            plugin_total = datetime.timedelta(0)
 
         times.append(("Plugin total", plugin_total))
         times.append(("Job total", job_total))
@@ -399,6 +591,13 @@ class JobHandler(object):
             # Do cleanup for the known container classes.
             self._cleanup_containers_after_save()
 
+        if self.instrumented:
+            stats = PluginStats(SAVE_STAGE)
+            self.plugin_stats.append(stats)
+            if self.agent:
+                self.agent.stats = None
+            return db.run_instrumented_in_thread(stats, complete_save_cycle)
+
         df = db.run_in_thread(complete_save_cycle)
         return df
 
@@ -440,6 +639,7 @@ class JobHandler(object):
             for manager in self.storage_queue:
                 self._raise_if_cancelled()
                 manager.save()
+            self._log_save_counts()
 
             end_time = time.time()
             total_time = (end_time - start_time) * 1000.0
@@ -459,6 +659,19 @@ class JobHandler(object):
                                    django.db.connection.queries[-1])
             raise
 
+    def _log_save_counts(self):
+        """Sums up and logs the number of changed and unchanged rows"""
+        self.save_counts = Counter()
+        for manager in self.storage_queue:
+            self.save_counts.update(manager.save_counts)
+            if manager.save_counts:
+                self._queue_logger.debug("%s: %r", manager.cls.__name__,
+                                         dict(manager.save_counts))
+        unchanged = self.save_counts[storage.UNCHANGED]
+        changed = sum(self.save_counts.values()) - unchanged
+        self._logger.debug("saved %d changed and %d unchanged rows",
+                           changed, unchanged)
+
     def _log_containers(self, prefix=None):
         log = self._queue_logger
         if not log.isEnabledFor(logging.DEBUG):
@@ -522,6 +735,9 @@ class JobHandler(object):
                 success=success,
                 interval=self.interval
             )
+            if self.plugin_stats_in_job_log:
+                log.plugin_stats = dict((stats.name, stats.as_dict())
+                                        for stats in self.plugin_stats)
             log.save()
 
         def _log_to_graphite():
@@ -529,7 +745,12 @@ class JobHandler(object):
                                                      self.name)
             runtime_path = prefix + ".runtime"
             runtime = (runtime_path, (timestamp, duration_in_seconds))
-            send_metrics([runtime])
+            metrics = [runtime]
+            if self.plugin_metrics:
+                for stats in self.plugin_stats:
+                    metrics.extend(stats.to_metrics(self.netbox.sysname,
+                                                    self.name, timestamp))
+            send_metrics(metrics)
 
         _log_to_graphite()
         try:
@@ -23,33 +23,45 @@ therefore be run in the threadpool instead of the main reactor thread.
 
 """
 import re
+import time
+from collections import OrderedDict, defaultdict, namedtuple
 from datetime import timedelta
 import threading
 
 from IPy import IP
-from django.db.models import Q
 from django.utils import six
 
 from nav.util import cachedfor, synchronized
 from nav.models import manage
 from nav.ipdevpoll.log import ContextLogger
 from nav.ipdevpoll import shadows
+from nav.ipdevpoll.interfacecache import get_interface_versions
 from nav.ipdevpoll.utils import is_invalid_database_string
 
 HSRP_MAC_PREFIXES = ('00:00:0c:07:ac',)
 VRRP_MAC_PREFIXES = ('00:00:5e:00:01', '00:00:5e:00:02')  # RFC5798
 IGNORED_MAC_PREFIXES = HSRP_MAC_PREFIXES + VRRP_MAC_PREFIXES
 
+# How long the netbox identities of the identity index are used before being
+# reloaded from the database
+NETBOX_IDENTITIES_MAX_AGE = timedelta(minutes=5)
+# The maximum number of netboxes to keep interface identities for, and how
+# long these are used before their interface version is verified again
+INTERFACE_IDENTITIES_MAX_NETBOXES = 1000
+INTERFACE_IDENTITIES_VERIFY_INTERVAL = timedelta(seconds=30)
+
+_identity_index = None
+_identity_index_lock = threading.Lock()
+
 
-@synchronized(threading.Lock())
-@cachedfor(timedelta(minutes=5))
 def get_netbox_macs():
     """Returns a dict of (mac, netboxid) mappings of NAV-monitored devices.
 
-    Special MAC address will be ignored, such as those reserved by VRRP.
+    Special MAC address will be ignored, such as those reserved by VRRP.  The
+    dict is shared by the whole process, and must not be modified.
 
     """
-    return _get_netbox_macs()
+    return get_identity_index().get_netbox_macs()
 
 
 def _get_netbox_macs():
@@ -83,6 +95,225 @@ def _get_netbox_catids():
     return catids
 
 
+def get_identity_index():
+    """Returns the process-wide IdentityIndex instance"""
+    global _identity_index
+    if _identity_index is None:
+        with _identity_index_lock:
+            if _identity_index is None:
+                _identity_index = IdentityIndex()
+    return _identity_index
+
+
+InterfaceIdentity = namedtuple('InterfaceIdentity',
+                               'id ifname ifdescr iftype ifalias baseport '
+                               'ifindex ifphysaddress')
+
+
+class IdentityIndex(object):
+    """A process-wide index of the MAC addresses, IP addresses, sysnames and
+    interfaces of NAV-monitored devices, for identifying neighbors without
+    querying the database for each neighbor record.
+
+    Netbox identities are reloaded in full when they are older than
+    NETBOX_IDENTITIES_MAX_AGE.  Interface identities are loaded for a netbox
+    when they are first needed, and are only reloaded when the netbox'
+    interface version (see nav.ipdevpoll.interfacecache) has changed.
+
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded_at = None
+        self._sysnames = {}
+        self._macs = {}
+        self._by_ip = {}
+        self._by_sysname = {}
+        self._by_hostname = {}
+        self._by_gw_ip = {}
+        self._by_info = {}
+        self._interfaces = OrderedDict()
+
+    def refresh(self, force=False):
+        """Reloads the netbox identities if they are too old, or if forced"""
+        with self._lock:
+            max_age = NETBOX_IDENTITIES_MAX_AGE.total_seconds()
+            if (force or self._loaded_at is None
+                    or time.time() - self._loaded_at > max_age):
+                self._load_netbox_identities()
+
+    def _load_netbox_identities(self):
+        sysnames, by_ip = {}, defaultdict(set)
+        by_sysname, by_hostname = defaultdict(set), defaultdict(set)
+        for netbox_id, sysname, ip in self.load_netboxes():
+            sysnames[netbox_id] = sysname
+            by_ip[_normalize_ip(ip)].add(netbox_id)
+            if sysname:
+                by_sysname[sysname.lower()].add(netbox_id)
+                if '.' in sysname:
+                    hostname = sysname.split('.', 1)[0]
+                    by_hostname[hostname.lower()].add(netbox_id)
+
+        by_gw_ip = defaultdict(set)
+        for gw_ip, netbox_id, interface_id in self.load_gateway_addresses():
+            by_gw_ip[_normalize_ip(gw_ip)].add((netbox_id, interface_id))
+
+        self._sysnames = sysnames
+        self._macs = _get_netbox_macs()
+        self._by_ip = dict(by_ip)
+        self._by_sysname = dict(by_sysname)
+        self._by_hostname = dict(by_hostname)
+        self._by_gw_ip = dict(by_gw_ip)
+        self._by_info = {}
+        self._loaded_at = time.time()
+
+    @staticmethod
+    def load_netboxes():
+        """Returns a list of (netboxid, sysname, ip) tuples"""
+        return list(manage.Netbox.objects.values_list('id', 'sysname', 'ip'))
+
+    @staticmethod
+    def load_gateway_addresses():
+        """Returns a list of (gw_ip, netboxid, interfaceid) tuples"""
+        return list(manage.GwPortPrefix.objects.values_list(
+            'gw_ip', 'interface__netbox__id', 'interface__id'))
+
+    @staticmethod
+    def load_info(key, variable):
+        """Returns a list of (value, netboxid) tuples of netbox info entries"""
+        return list(manage.NetboxInfo.objects.filter(
+            key=key, variable=variable).values_list('value', 'netbox__id'))
+
+    @staticmethod
+    def load_interfaces(netbox_ids):
+        """Returns a list of (netboxid, InterfaceIdentity) tuples for the
+        interfaces of a number of netboxes.
+        """
+        fields = ('netbox__id',) + InterfaceIdentity._fields
+        return [(row[0], InterfaceIdentity(*row[1:]))
+                for row in manage.Interface.objects.filter(
+                    netbox__id__in=list(netbox_ids)).values_list(*fields)]
+
+    def get_sysname(self, netbox_id):
+        """Returns the sysname of a netbox"""
+        self.refresh()
+        return self._sysnames.get(netbox_id)
+
+    def get_netbox_macs(self):
+        """Returns a dict of {mac: netboxid} of NAV-monitored devices"""
+        self.refresh()
+        return self._macs
+
+    def netboxes_by_mac(self, mac):
+        """Returns the set of netbox IDs that have a MAC address"""
+        netbox_id = self.get_netbox_macs().get(mac)
+        return {netbox_id} if netbox_id is not None else set()
+
+    def netboxes_by_ip(self, ip):
+        """Returns the set of netbox IDs whose management IP is ip"""
+        self.refresh()
+        return self._by_ip.get(_normalize_ip(ip), set())
+
+    def netboxes_by_gateway_address(self, ip):
+        """Returns the set of netbox IDs that have an interface address ip"""
+        self.refresh()
+        return set(netbox_id for netbox_id, _interface_id
+                   in self._by_gw_ip.get(_normalize_ip(ip), ()))
+
+    def netboxes_by_sysname(self, sysname):
+        """Returns the set of netbox IDs whose sysname is sysname, ignoring
+        case.  If sysname is not a fully qualified domain name, netboxes
+        whose sysname is sysname qualified by any domain name are included.
+        """
+        self.refresh()
+        sysname = sysname.lower()
+        result = set(self._by_sysname.get(sysname, ()))
+        if '.' not in sysname:
+            result.update(self._by_hostname.get(sysname, ()))
+        return result
+
+    def netboxes_by_info(self, key, variable, value):
+        """Returns the set of netbox IDs that have a netbox info entry with
+        the given key, variable and value.
+        """
+        self.refresh()
+        with self._lock:
+            if (key, variable) not in self._by_info:
+                by_value = defaultdict(set)
+                for info_value, netbox_id in self.load_info(key, variable):
+                    by_value[info_value].add(netbox_id)
+                self._by_info[(key, variable)] = dict(by_value)
+            return self._by_info[(key, variable)].get(value, set())
+
+    def interfaces_by_gateway_address(self, netbox_id, ip):
+        """Returns the interfaces of a netbox that have the address ip"""
+        self.refresh()
+        interface_ids = set(
+            interface_id for gw_netbox_id, interface_id
+            in self._by_gw_ip.get(_normalize_ip(ip), ())
+            if gw_netbox_id == netbox_id)
+        return [ifc for ifc in self.get_interfaces(netbox_id)
+                if ifc.id in interface_ids]
+
+    def get_interfaces(self, netbox_id):
+        """Returns a list of InterfaceIdentity tuples for every interface of
+        a netbox.
+        """
+        self.prefetch_interfaces([netbox_id])
+        with self._lock:
+            entry = self._interfaces.get(netbox_id)
+            if entry is None:
+                return []
+            self._interfaces.move_to_end(netbox_id)
+            return entry[2]
+
+    def prefetch_interfaces(self, netbox_ids):
+        """Ensures that the interface identities of a number of netboxes are
+        loaded and current, using as few database queries as possible.
+        """
+        now = time.time()
+        verify_interval = INTERFACE_IDENTITIES_VERIFY_INTERVAL.total_seconds()
+        with self._lock:
+            wanted = set(
+                netbox_id for netbox_id in netbox_ids
+                if netbox_id not in self._interfaces
+                or now - self._interfaces[netbox_id][1] > verify_interval)
+        if not wanted:
+            return
+
+        # versions must be read before the interfaces, see InterfaceCache
+        versions = get_interface_versions(wanted)
+        with self._lock:
+            stale = set()
+            for netbox_id in wanted:
+                version = versions.get(netbox_id, 0)
+                entry = self._interfaces.get(netbox_id)
+                if entry and entry[0] == version:
+                    self._interfaces[netbox_id] = (version, now, entry[2])
+                else:
+                    stale.add(netbox_id)
+        if not stale:
+            return
+
+        interfaces = defaultdict(list)
+        for netbox_id, ifc in self.load_interfaces(stale):
+            interfaces[netbox_id].append(ifc)
+        with self._lock:
+            for netbox_id in stale:
+                self._interfaces[netbox_id] = (
+                    versions.get(netbox_id, 0), now,
+                    sorted(interfaces[netbox_id]))
+                self._interfaces.move_to_end(netbox_id)
+            while len(self._interfaces) > INTERFACE_IDENTITIES_MAX_NETBOXES:
+                self._interfaces.popitem(last=False)
+
+
+def _normalize_ip(ip):
+    try:
+        return six.text_type(IP(ip))
+    except ValueError:
+        return six.text_type(ip)
+
+
 INVALID_IPS = ('None', '0.0.0.0',)
 
 
@@ -91,7 +322,7 @@ class Neighbor(object):
     "Abstract base class for neigbor identification"
     _logger = ContextLogger()
 
-    def __init__(self, record, local_address=None):
+    def __init__(self, record, local_address=None, identify=True):
         """Given a supported neighbor record, tries to identify the remote
         device and port among the ones registered in NAV's database.
 
@@ -104,6 +335,8 @@ class Neighbor(object):
         :param local_address: The management IP address used by the local
                               system. If supplied, will be used to identify
                               and ignore possible self-loops.
+        :param identify: If False, the neighbor is not identified until
+                         identify() is called.
 
         """
         self.record = record
@@ -113,11 +346,37 @@ class Neighbor(object):
 
         self.netbox = self.interfaces = None
         self.identified = False
+        self.index = get_identity_index()
 
-        self.identify()
+        if identify:
+            self.identify()
+
+    @classmethod
+    def identify_records(cls, records, local_address=None):
+        """Identifies a list of neighbor records.
+
+        This is equivalent to instantiating this class for each record, but
+        the interfaces of all the identified netboxes are looked up at once.
+
+        :returns: A list of instances of this class.
+
+        """
+        neighbors = [cls(record, local_address, identify=False)
+                     for record in records]
+        for neighbor in neighbors:
+            neighbor.netbox = neighbor._identify_netbox()
+        get_identity_index().prefetch_interfaces(
+            set(neighbor.netbox.id for neighbor in neighbors
+                if neighbor.netbox))
+        for neighbor in neighbors:
+            neighbor._identify_remote_interfaces()
+        return neighbors
 
     def identify(self):
         self.netbox = self._identify_netbox()
+        self._identify_remote_interfaces()
+
+    def _identify_remote_interfaces(self):
         self.interfaces = self._identify_interfaces()
         self.identified = bool(self.netbox or self.interfaces)
         if self.interfaces and len(self.interfaces) > 1:
@@ -130,9 +389,7 @@ class Neighbor(object):
         raise NotImplementedError
 
     def _netbox_from_mac(self, mac):
-        mac_map = get_netbox_macs()
-        if mac in mac_map:
-            return self._netbox_query(Q(id=mac_map[mac]))
+        return self._netbox_from_ids(self.index.netboxes_by_mac(mac), mac)
 
     def _netbox_from_ip(self, ip):
         """Tries to find a Netbox from NAV's database based on an IP address.
@@ -151,8 +408,9 @@ class Neighbor(object):
         assert ip
         if ip in self._invalid_neighbor_ips:
             return
-        return (self._netbox_query(Q(ip=ip)) or
-                self._netbox_query(Q(interface__gwportprefix__gw_ip=ip)))
+        return (self._netbox_from_ids(self.index.netboxes_by_ip(ip), ip) or
+                self._netbox_from_ids(
+                    self.index.netboxes_by_gateway_address(ip), ip))
 
     ID_PATTERN = re.compile(r'(.*\()?(?P<sysname>[^\)]+)\)?')
 
@@ -171,32 +429,26 @@ class Neighbor(object):
         match = self.ID_PATTERN.search(sysname)
         sysname = match.group('sysname')
         assert sysname
-        query = Q(sysname__iexact=sysname)
-
-        is_fqdn = '.' in sysname
-        if not is_fqdn:
-            query = query | Q(sysname__istartswith=sysname + '.')
-
-        return self._netbox_query(query)
+        return self._netbox_from_ids(self.index.netboxes_by_sysname(sysname),
+                                     sysname)
 
-    def _netbox_query(self, query):
-        """Runs a Django get()-query on the Netbox model, based on query.
+    def _netbox_from_ids(self, netbox_ids, description):
+        """Returns the netbox identified by a lookup in the identity index.
 
-        :param query: A Q object usable in a Netbox query.
-        :returns: A shadows.Netbox object if a db object was found, otherwise
-                  None.
+        :param netbox_ids: The set of netbox IDs that matched the lookup.
+        :param description: What was looked up, for logging purposes.
+        :returns: A shadows.Netbox object if exactly one netbox matched,
+                  otherwise None.
 
         """
-        assert query
-        try:
-            netbox = manage.Netbox.objects.values('id', 'sysname').get(query)
-        except manage.Netbox.DoesNotExist:
-            return None
-        except manage.Netbox.MultipleObjectsReturned:
+        if len(netbox_ids) > 1:
             self._logger.info("found multiple matching neighbors on remote, "
-                              "cannot decide: %s", query)
+                              "cannot decide: %s", description)
             return None
-        return shadows.Netbox(**netbox)
+        for netbox_id in netbox_ids:
+            sysname = self.index.get_sysname(netbox_id)
+            if sysname is not None:
+                return shadows.Netbox(id=netbox_id, sysname=sysname)
 
     def _interfaces_from_name(self, name):
         """Tries to find an Interface in NAV's database for the already
@@ -217,23 +469,35 @@ class Neighbor(object):
                                  "neighboring port name %r", name)
             return
 
-        queries = [Q(ifdescr=name), Q(ifname=name), Q(ifalias=name)]
+        matchers = [lambda ifc: ifc.ifdescr == name,
+                    lambda ifc: ifc.ifname == name,
+                    lambda ifc: ifc.ifalias == name]
         if name.isdigit():
-            queries.append(Q(baseport=int(name)))
+            matchers.append(lambda ifc: ifc.baseport == int(name))
 
-        for query in queries:
-            ifc = self._interface_query(query)
+        for matcher in matchers:
+            ifc = self._interfaces_matching(matcher)
             if ifc:
                 return ifc
 
-    def _interface_query(self, query):
-        assert query
-        netbox = Q(netbox__id=self.netbox.id)
-        result = []
-        for ifc in manage.Interface.objects.values(
-                'id', 'ifname', 'ifdescr', 'iftype').filter(netbox & query):
+    def _interfaces_matching(self, matcher):
+        """Returns the interfaces of the already identified netbox for which
+        matcher returns True.
+
+        :param matcher: A function that takes an InterfaceIdentity tuple.
+        :returns: A list of shadows.Interface objects.
 
-            ifc = shadows.Interface(**ifc)
+        """
+        return self._make_interfaces(
+            ifc for ifc in self.index.get_interfaces(self.netbox.id)
+            if matcher(ifc))
+
+    def _make_interfaces(self, identities):
+        result = []
+        for identity in identities:
+            ifc = shadows.Interface(id=identity.id, ifname=identity.ifname,
+                                    ifdescr=identity.ifdescr,
+                                    iftype=identity.iftype)
             ifc.netbox = self.netbox
             result.append(ifc)
         return result
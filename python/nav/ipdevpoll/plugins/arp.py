@@ -35,7 +35,6 @@ the name for historical reasons.
 
 """
 
-import operator
 from datetime import datetime, timedelta
 
 from IPy import IP
@@ -48,13 +47,14 @@ from nav.mibs.cisco_ietf_ip_mib import CiscoIetfIpMib
 from nav.models import manage
 from nav.ipdevpoll import Plugin, db
 from nav.ipdevpoll import storage, shadows
+from nav.ipdevpoll.prefixindex import PrefixIndex
 
 INCOMPLETE_MAC = '00:00:00:00:00:00'
 
 
 class Arp(Plugin):
     """Collects ARP records for IPv4 devices and NDP cache for IPv6 devices."""
-    prefix_cache = []  # prefix cache, should be sorted by descending mask length
+    prefix_cache = PrefixIndex()  # shared by all jobs in this process
     prefix_cache_update_time = datetime.min
     prefix_cache_max_age = timedelta(minutes=5)
 
@@ -158,18 +158,14 @@ class Arp(Plugin):
 
     @classmethod
     def _load_prefixes_synchronously(cls):
-        return list(manage.Prefix.objects.all().values('id', 'net_address'))
+        prefixes = manage.Prefix.objects.all().values_list('net_address', 'id')
+        return PrefixIndex(prefixes)
 
     @classmethod
-    def _update_prefix_cache_with_result(cls, prefixes):
+    def _update_prefix_cache_with_result(cls, prefix_index):
         cls._logger.debug(
-            "Populating prefix cache with %d prefixes", len(prefixes))
-
-        prefixes = [(IP(p['net_address']), p['id']) for p in prefixes]
-        prefixes.sort(key=operator.itemgetter(1), reverse=True)
-
-        del cls.prefix_cache[:]
-        cls.prefix_cache.extend(prefixes)
+            "Populating prefix cache with %d prefixes", len(prefix_index))
+        cls.prefix_cache = prefix_index
 
     def _make_new_mappings(self, mappings):
         """Convert a sequence of (ip, mac) tuples into a Arp shadow containers.
@@ -217,9 +213,7 @@ class Arp(Plugin):
 
           An integer prefix ID, or None if no matches were found.
         """
-        for prefix_addr, prefix_id in self.prefix_cache:
-            if ip in prefix_addr:
-                return prefix_id
+        return self.prefix_cache.lookup(ip)
 
 
 def ipv6_address_in_mappings(mappings):
@@ -33,6 +33,8 @@ INFO_VAR_BASE_ADDRESS = 'base_address'
 
 class Bridge(Plugin):
     "Finds interfaces in L2/switchport mode"
+    READS_CONTAINERS = ()
+    WRITES_CONTAINERS = (shadows.Interface,)
 
     @defer.inlineCallbacks
     def handle(self):
@@ -25,9 +25,7 @@ from nav.ipdevpoll import Plugin, shadows
 from nav.mibs.cisco_cdp_mib import CiscoCDPMib
 from nav.ipdevpoll.neighbor import Neighbor
 from nav.ipdevpoll.db import run_in_thread
-from nav.ipdevpoll.timestamps import TimestampChecker
 
-INFO_VAR_NAME = "cdp"
 INFO_KEY_NAME = "cdp"
 INFO_VAR_NEIGHBORS_CACHE = "neighbors_cache"
 SOURCE = "cdp"
@@ -42,6 +40,8 @@ class CDP(Plugin):
     device.
 
     """
+    CHANGE_INDICATORS = ((CiscoCDPMib, 'cdpGlobalLastChange'),)
+    INDICATOR_VAR_NAME = 'cdp'
     neighbors = None
 
     @classmethod
@@ -59,12 +59,9 @@ class CDP(Plugin):
     @defer.inlineCallbacks
     def handle(self):
         cdp = CiscoCDPMib(self.agent)
+        need_to_collect = self.indicators_changed
 
-        stampcheck = yield self._get_stampcheck(cdp)
-        remote_table_has_changed = yield stampcheck.is_changed()
-        need_to_collect = remote_table_has_changed
-
-        if not remote_table_has_changed:
+        if not self.indicators_changed:
             cache = yield self._get_cached_neighbors()
             if cache is not None:
                 self._logger.debug("Using cached CDP neighbors")
@@ -89,15 +86,6 @@ class CDP(Plugin):
         # Store sentinels to signal that CDP neighbors have been processed
         shadows.AdjacencyCandidate.sentinel(self.containers, SOURCE)
         shadows.UnrecognizedNeighbor.sentinel(self.containers, SOURCE)
-        stampcheck.save()
-
-    @defer.inlineCallbacks
-    def _get_stampcheck(self, mib):
-        stampcheck = TimestampChecker(self.agent, self.containers, INFO_VAR_NAME)
-        yield stampcheck.load()
-        yield stampcheck.collect([mib.get_neighbors_last_change()])
-
-        defer.returnValue(stampcheck)
 
     @defer.inlineCallbacks
     def _get_cached_neighbors(self):
@@ -125,7 +113,8 @@ class CDP(Plugin):
         """
         Tries to synchronously identify CDP cache entries in NAV's database
         """
-        neighbors = [CDPNeighbor(cdp, self.netbox.ip) for cdp in self.neighbors]
+        neighbors = CDPNeighbor.identify_records(self.neighbors,
+                                                  self.netbox.ip)
 
         self._process_identified(
             [n for n in neighbors if n.identified])
@@ -35,6 +35,9 @@ from nav.enterprise.ids import VENDOR_ID_CISCOSYSTEMS
 
 class CiscoVlan(Plugin):
     """Collect 802.1q info from CISCO-VTP-MIB and CISCO-VLAN-MEMBERSHIP-MIB."""
+    READS_CONTAINERS = ()
+    WRITES_CONTAINERS = (shadows.Interface, shadows.Vlan,
+                         shadows.SwPortAllowedVlan)
     _valid_ifindexes = ()
 
     @classmethod
@@ -39,6 +39,9 @@ from nav.ipdevpoll import shadows
 
 class Dot1q(Plugin):
     """Collect 802.1q info from BRIDGE and Q-BRIDGE MIBs."""
+    READS_CONTAINERS = ()
+    WRITES_CONTAINERS = (shadows.Interface, shadows.Vlan,
+                         shadows.SwPortAllowedVlan)
     baseports = {}
     pvids = {}
 
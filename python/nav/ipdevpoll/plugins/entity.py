@@ -25,42 +25,26 @@ from nav.ipdevpoll.shadows.entity import NetboxEntity
 
 from nav.mibs.entity_mib import EntityMib, EntityTable
 from nav.ipdevpoll import Plugin, shadows
-from nav.ipdevpoll.timestamps import TimestampChecker
 from nav.models import manage
 from nav.oids import OID
 
-INFO_VAR_NAME = 'entityphysical'
-
 
 class Entity(Plugin):
     """Plugin to collect physical entity data from devices"""
+    READS_CONTAINERS = ()
+    WRITES_CONTAINERS = (NetboxEntity, shadows.Device)
 
     def __init__(self, *args, **kwargs):
         super(Entity, self).__init__(*args, **kwargs)
         self.alias_mapping = {}
         self.entitymib = EntityMib(self.agent)
-        self.stampcheck = TimestampChecker(self.agent, self.containers,
-                                           INFO_VAR_NAME)
 
     @defer.inlineCallbacks
     def handle(self):
         self._logger.debug("Collecting physical entity data")
-        need_to_collect = yield self._need_to_collect()
-        # if need_to_collect:
-        if True:
-            physical_table = (
-                yield self.entitymib.get_entity_physical_table())
-            self._logger.debug("found %d entities", len(physical_table))
-            self._process_entities(physical_table)
-        self.stampcheck.save()
-
-    @defer.inlineCallbacks
-    def _need_to_collect(self):
-        yield self.stampcheck.load()
-        yield self.stampcheck.collect([self.entitymib.get_last_change_time()])
-
-        result = yield self.stampcheck.is_changed()
-        defer.returnValue(result)
+        physical_table = yield self.entitymib.get_entity_physical_table()
+        self._logger.debug("found %d entities", len(physical_table))
+        self._process_entities(physical_table)
 
     def _process_entities(self, result):
         """Process the list of collected entities."""
@@ -33,6 +33,8 @@ from .dot1q import vlan_list_to_hex
 
 class ExtremeVlan(Plugin):
     """Collects 802.1q info from EXTREME-VLAN-MIB and BRIDGE-MIB"""
+    READS_CONTAINERS = ()
+    WRITES_CONTAINERS = (shadows.Interface, shadows.SwPortAllowedVlan)
 
     def __init__(self, *args, **kwargs):
         super(ExtremeVlan, self).__init__(*args, **kwargs)
@@ -41,6 +41,8 @@ DUPLEX_MAP = {
 
 class Interfaces(Plugin):
     "Collects comprehensive information about device's network interfaces"
+    READS_CONTAINERS = ()
+    WRITES_CONTAINERS = (shadows.Interface, shadows.InterfaceStack)
     def __init__(self, *args, **kwargs):
         super(Interfaces, self).__init__(*args, **kwargs)
         self.ifmib = IfMib(self.agent)
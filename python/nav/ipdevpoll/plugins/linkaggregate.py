@@ -25,6 +25,8 @@ from nav.mibs.if_mib import IfMib
 
 class LinkAggregate(Plugin):
     """Collects information about link aggregation"""
+    READS_CONTAINERS = ()
+    WRITES_CONTAINERS = (shadows.Interface, shadows.InterfaceAggregate)
     def __init__(self, *args, **kwargs):
         super(LinkAggregate, self).__init__(*args, **kwargs)
         self.ifmib = IfMib(self.agent)
@@ -16,18 +16,16 @@
 """ipdevpoll plugin to collect LLDP neighbors"""
 from pprint import pformat
 
-from django.db.models import Q
 from django.utils import six
 from twisted.internet import defer
 
+from nav.macaddress import MacAddress
 from nav.models import manage
 from nav.mibs import lldp_mib
 from nav.ipdevpoll import Plugin, shadows
 from nav.ipdevpoll.neighbor import Neighbor
 from nav.ipdevpoll.db import run_in_thread
-from nav.ipdevpoll.timestamps import TimestampChecker
 
-INFO_VAR_NAME = 'lldp'
 SOURCE = 'lldp'
 INFO_KEY_LLDP_INFO = "lldp"
 INFO_VAR_CHASSIS_ID = "chassis_id"
@@ -44,6 +42,9 @@ class LLDP(Plugin):
     device.
 
     """
+    CHANGE_INDICATORS = ((lldp_mib.LLDPMib,
+                          'lldpStatsRemTablesLastChangeTime'),)
+    INDICATOR_VAR_NAME = 'lldp'
     remote = None
     neighbors = None
 
@@ -62,12 +63,9 @@ class LLDP(Plugin):
     @defer.inlineCallbacks
     def handle(self):
         mib = lldp_mib.LLDPMib(self.agent)
+        need_to_collect = self.indicators_changed
 
-        stampcheck = yield self._get_stampcheck(mib)
-        remote_table_has_changed = yield stampcheck.is_changed()
-        need_to_collect = remote_table_has_changed
-
-        if not remote_table_has_changed:
+        if not self.indicators_changed:
             cache = yield self._get_cached_remote_table()
             if cache is not None:
                 self._logger.debug("Using cached LLDP remote table")
@@ -91,7 +89,6 @@ class LLDP(Plugin):
         # Store sentinels to signal that LLDP neighbors have been processed
         shadows.AdjacencyCandidate.sentinel(self.containers, SOURCE)
         shadows.UnrecognizedNeighbor.sentinel(self.containers, SOURCE)
-        stampcheck.save()
 
     @defer.inlineCallbacks
     def _get_cached_remote_table(self):
@@ -139,20 +136,9 @@ class LLDP(Plugin):
             info.key = INFO_KEY_LLDP_INFO
             info.variable = INFO_VAR_CHASSIS_MAC
 
-    @defer.inlineCallbacks
-    def _get_stampcheck(self, mib):
-        """Retrieves the last change timestamp of the LLDP remote table, returning a
-        TimestampChecker instance reflecting it.
-        """
-        stampcheck = TimestampChecker(self.agent, self.containers, INFO_VAR_NAME)
-        yield stampcheck.load()
-        yield stampcheck.collect([mib.get_remote_last_change()])
-
-        defer.returnValue(stampcheck)
-
     def _process_remote(self):
         """Tries to synchronously identify LLDP entries in NAV's database"""
-        neighbors = [LLDPNeighbor(lldp) for lldp in self.remote]
+        neighbors = LLDPNeighbor.identify_records(self.remote)
 
         self._process_identified(
             [n for n in neighbors if n.identified])
@@ -232,11 +218,10 @@ class LLDPNeighbor(Neighbor):
         return netbox
 
     def _netbox_from_local(self, chassid):
-        netbox = self._netbox_query(Q(
-            info_set__key=INFO_KEY_LLDP_INFO,
-            info_set__variable=INFO_VAR_CHASSIS_ID,
-            info_set__value=str(chassid),
-        ))
+        netbox = self._netbox_from_ids(
+            self.index.netboxes_by_info(INFO_KEY_LLDP_INFO,
+                                        INFO_VAR_CHASSIS_ID, str(chassid)),
+            chassid)
         if netbox:
             self._logger.debug("Found netbox through local type lookup")
             return netbox
@@ -276,19 +261,32 @@ class LLDPNeighbor(Neighbor):
         """
         portdesc = self.record.port_desc
         if portdesc and portid.isdigit():
-            query = Q(ifindex=int(portid)) & Q(ifalias=portdesc)
-            ifc = self._interface_query(query)
+            ifc = self._interfaces_matching(
+                lambda ifc: (ifc.ifindex == int(portid)
+                             and ifc.ifalias == portdesc))
             if ifc:
                 return ifc
         return self._interfaces_from_name(portid)
 
     def _interfaces_from_mac(self, mac):
         assert mac
-        return self._interface_query(Q(ifphysaddress=mac))
+        mac = _normalize_mac(mac)
+        return self._interfaces_matching(
+            lambda ifc: _normalize_mac(ifc.ifphysaddress) == mac)
 
     def _interfaces_from_ip(self, ip):
         ip = six.text_type(ip)
         assert ip
         if ip in self._invalid_neighbor_ips:
             return
-        return self._interface_query(Q(gwportprefix__gw_ip=ip))
+        return self._make_interfaces(
+            self.index.interfaces_by_gateway_address(self.netbox.id, ip))
+
+
+def _normalize_mac(mac):
+    if not mac:
+        return None
+    try:
+        return str(MacAddress(mac))
+    except ValueError:
+        return mac
@@ -29,40 +29,28 @@ from twisted.internet import defer
 
 from nav.mibs.entity_mib import EntityMib, EntityTable
 from nav.ipdevpoll import Plugin, shadows
-from nav.ipdevpoll.timestamps import TimestampChecker
-
-INFO_VAR_NAME = 'modules'
 
 
 class Modules(Plugin):
     """Plugin to collect module data from devices"""
+    READS_CONTAINERS = ()
+    WRITES_CONTAINERS = (shadows.Device, shadows.Module, shadows.Interface)
+    CHANGE_INDICATORS = ((EntityMib, 'entLastChangeTime'),)
+    INDICATOR_VAR_NAME = 'modules'
+    SKIP_WHEN_UNCHANGED = True
 
     def __init__(self, *args, **kwargs):
         super(Modules, self).__init__(*args, **kwargs)
         self.alias_mapping = {}
         self.entitymib = EntityMib(self.agent)
-        self.stampcheck = TimestampChecker(self.agent, self.containers,
-                                           INFO_VAR_NAME)
 
     @defer.inlineCallbacks
     def handle(self):
         self._logger.debug("Collecting ENTITY-MIB module data")
-        need_to_collect = yield self._need_to_collect()
-        if need_to_collect:
-            physical_table = (
-                yield self.entitymib.get_entity_physical_table())
-
-            self.alias_mapping = yield self.entitymib.get_alias_mapping()
-            self._process_entities(physical_table)
-        self.stampcheck.save()
-
-    @defer.inlineCallbacks
-    def _need_to_collect(self):
-        yield self.stampcheck.load()
-        yield self.stampcheck.collect([self.entitymib.get_last_change_time()])
+        physical_table = yield self.entitymib.get_entity_physical_table()
 
-        result = yield self.stampcheck.is_changed()
-        defer.returnValue(result)
+        self.alias_mapping = yield self.entitymib.get_alias_mapping()
+        self._process_entities(physical_table)
 
     def _device_from_entity(self, ent):
         serial_column = 'entPhysicalSerialNum'
@@ -57,6 +57,9 @@ class Prefix(Plugin):
     ipdevpoll-plugin for collecting prefix information from monitored
     equipment.
     """
+    READS_CONTAINERS = ()
+    WRITES_CONTAINERS = (shadows.Interface, shadows.Vlan, shadows.GwPortPrefix,
+                         shadows.Prefix)
     @classmethod
     def on_plugin_load(cls):
         from nav.ipdevpoll.config import ipdevpoll_conf
@@ -38,6 +38,8 @@ VENDOR_MIBS = {
 
 class ProprietarySerial(Plugin):
     """retrieves chassis serial numbers from various proprietary MIBs"""
+    READS_CONTAINERS = (NetboxEntity,)
+    WRITES_CONTAINERS = (NetboxEntity, Device)
     RESTRICT_TO_VENDORS = VENDOR_MIBS.keys()
 
     @defer.inlineCallbacks
@@ -62,6 +62,8 @@ FALLBACK_MIBS = [EntityMib]
 
 class PowerSupplyUnit(Plugin):
     """Plugin that collect PSUs and FANs,- and their status from netboxes."""
+    READS_CONTAINERS = ()
+    WRITES_CONTAINERS = (shadows.PowerSupplyOrFan, shadows.Device)
 
     def __init__(self, *args, **kwargs):
         super(PowerSupplyUnit, self).__init__(*args, **kwargs)
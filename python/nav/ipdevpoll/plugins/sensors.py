@@ -45,6 +45,8 @@ _logger = logging.getLogger(__name__)
 
 class Sensors(Plugin):
     """Plugin to detect environmental sensors in netboxes"""
+    READS_CONTAINERS = ()
+    WRITES_CONTAINERS = (shadows.Sensor, shadows.Interface)
     @classmethod
     def on_plugin_load(cls):
         from nav.ipdevpoll.config import ipdevpoll_conf
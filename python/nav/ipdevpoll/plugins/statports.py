@@ -22,7 +22,8 @@ from twisted.internet import defer
 from nav.ipdevpoll import Plugin
 from nav.ipdevpoll import db
 from nav.metrics.carbon import send_metrics
-from nav.metrics.templates import metric_path_for_interface
+from nav.metrics.names import escape_metric_name
+from nav.metrics.templates import metric_prefix_for_interface
 from nav.mibs import reduce_index
 from nav.mibs.if_mib import IfMib
 from nav.mibs.ip_mib import IpMib
@@ -66,6 +67,8 @@ IP_COUNTERS = (
 
 USED_COUNTERS = NON_HC_COUNTERS + HC_COUNTERS + OTHER_COUNTERS
 LOGGED_COUNTERS = USED_COUNTERS + IP_COUNTERS
+ESCAPED_COUNTERS = dict((key, escape_metric_name(key))
+                        for key in LOGGED_COUNTERS)
 
 
 class StatPorts(Plugin):
@@ -112,16 +115,20 @@ class StatPorts(Plugin):
 
         for row in itervalues(stats):
             hc_counters = use_hc_counters(row) or hc_counters
+            # the escaped interface path prefixes are the same for every
+            # counter, so only the final join is made per counter
+            ifname = row['ifName'] or row['ifDescr']
+            prefixes = [metric_prefix_for_interface(netbox, ifname)
+                        for netbox in netboxes]
             for key in LOGGED_COUNTERS:
                 if key not in row:
                     continue
                 value = row[key]
                 if value is not None:
-                    for netbox in netboxes:
+                    counter = ESCAPED_COUNTERS[key]
+                    for prefix in prefixes:
                         # duplicate metrics for all involved netboxes
-                        path = metric_path_for_interface(
-                            netbox, row['ifName'] or row['ifDescr'], key)
-                        yield (path, (timestamp, value))
+                        yield (prefix + "." + counter, (timestamp, value))
 
         if stats:
             if hc_counters:
@@ -24,12 +24,17 @@ from nav.Snmp import safestring
 from nav.ipdevpoll import Plugin
 from nav.ipdevpoll import db
 from nav.ipdevpoll.db import run_in_thread
+from nav.ipdevpoll.snmp.packing import get_packed, get_request_packer
 from nav.metrics.carbon import send_metrics
-from nav.metrics.templates import metric_path_for_sensor
+from nav.metrics.names import escape_metric_name
+from nav.metrics.templates import metric_prefix_for_sensors
 from nav.models.manage import Sensor
 
-# Ask for no more than this number of values in a single SNMP GET operation
+# Ask for this number of values in a single SNMP GET operation to devices we
+# have not polled before. The number is adjusted to what each device can take.
 MAX_SENSORS_PER_REQUEST = 5
+# The number of concurrent SNMP GET operations to use when polling a device
+MAX_CONCURRENT_REQUESTS = 2
 
 
 class StatSensors(Plugin):
@@ -37,6 +42,19 @@ class StatSensors(Plugin):
     Graphite.
 
     """
+    initial_request_size = MAX_SENSORS_PER_REQUEST
+    max_concurrent_requests = MAX_CONCURRENT_REQUESTS
+
+    @classmethod
+    def on_plugin_load(cls):
+        from nav.ipdevpoll.config import ipdevpoll_conf
+        cls.initial_request_size = ipdevpoll_conf.getint(
+            'statsensors', 'sensors-per-request',
+            fallback=MAX_SENSORS_PER_REQUEST)
+        cls.max_concurrent_requests = ipdevpoll_conf.getint(
+            'statsensors', 'max-concurrent-requests',
+            fallback=MAX_CONCURRENT_REQUESTS)
+
     @classmethod
     @defer.inlineCallbacks
     def can_handle(cls, netbox):
@@ -58,13 +76,12 @@ class StatSensors(Plugin):
         netboxes = yield db.run_in_thread(self._get_netbox_list)
         sensors = yield run_in_thread(self._get_sensors)
         self._logger.debug("retrieving data from %d sensors", len(sensors))
-        oids = list(sensors.keys())
-        requests = [oids[x:x+MAX_SENSORS_PER_REQUEST]
-                    for x in range(0, len(oids), MAX_SENSORS_PER_REQUEST)]
-        for req in requests:
-            data = yield self.agent.get(req).addCallback(
-                self._response_to_metrics, sensors, netboxes)
-            self._logger.debug("got data from sensors: %r", data)
+        packer = get_request_packer(self.agent.get_agent_identity(),
+                                    self.initial_request_size)
+        result = yield get_packed(self.agent, list(sensors.keys()), packer,
+                                  self.max_concurrent_requests)
+        data = self._response_to_metrics(result, sensors, netboxes)
+        self._logger.debug("got data from sensors: %r", data)
 
     def _get_sensors(self):
         sensors = Sensor.objects.filter(netbox=self.netbox.id).values()
@@ -73,6 +90,8 @@ class StatSensors(Plugin):
     def _response_to_metrics(self, result, sensors, netboxes):
         metrics = []
         timestamp = time.time()
+        prefixes = [metric_prefix_for_sensors(netbox) + "."
+                    for netbox in netboxes]
         data = ((sensors[oid], value) for oid, value in six.iteritems(result)
                 if oid in sensors)
         for sensor, value in data:
@@ -86,10 +105,9 @@ class StatSensors(Plugin):
                     pass
 
             value = convert_to_precision(value, sensor)
-            for netbox in netboxes:
-                path = metric_path_for_sensor(netbox,
-                                              sensor['internal_name'])
-                metrics.append((path, (timestamp, value)))
+            name = escape_metric_name(sensor['internal_name'])
+            for prefix in prefixes:
+                metrics.append((prefix + name, (timestamp, value)))
         send_metrics(metrics)
         return metrics
 
@@ -34,6 +34,8 @@ PATTERNS = [
 
 class System(Plugin):
     """Collects sysDescr and parses a software version from it"""
+    READS_CONTAINERS = (shadows.NetboxEntity,)
+    WRITES_CONTAINERS = (shadows.NetboxEntity, shadows.Device)
 
     @inlineCallbacks
     def handle(self):
@@ -29,12 +29,7 @@ from nav.models import manage
 from nav.enterprise import ids
 
 UNKNOWN_VENDOR_ID = UNKNOWN_TYPE_ID = "unknown"
-CONSTANT_PREFIX = "VENDOR_ID_"
-_enterprise_map = {
-    value: constant
-    for constant, value in vars(ids).items()
-    if constant.startswith(CONSTANT_PREFIX)
-}
+CONSTANT_PREFIX = ids.CONSTANT_PREFIX
 
 
 class InvalidResponseError(Exception):
@@ -146,8 +141,8 @@ class TypeOid(Plugin):
     def _make_new_vendor(cls, sysobjectid):
         """Makes up a new Vendor based on a sysObjectID"""
         enterprise_id = get_enterprise_id(sysobjectid)
-        if enterprise_id in _enterprise_map:
-            name = _enterprise_map[enterprise_id]
+        name = ids.get_vendor_constant(enterprise_id)
+        if name:
             name = name.replace(CONSTANT_PREFIX, "").replace("_", "").lower()[:15]
         else:
             name = UNKNOWN_VENDOR_ID
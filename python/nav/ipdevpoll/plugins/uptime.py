@@ -28,6 +28,8 @@ COLDBOOT_MAX_DELTA = 60*60  # seconds
 
 class Uptime(Plugin):
     """Collects uptime ticks and discovers discontinuities in uptime data"""
+    READS_CONTAINERS = ()
+    WRITES_CONTAINERS = (shadows.Netbox,)
 
     @inlineCallbacks
     def handle(self):
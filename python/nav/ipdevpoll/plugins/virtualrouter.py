@@ -37,6 +37,8 @@ class VirtualRouter(Plugin):
     on the router.
 
     """
+    READS_CONTAINERS = (GwPortPrefix,)
+    WRITES_CONTAINERS = (GwPortPrefix,)
 
     @classmethod
     def can_handle(cls, netbox):
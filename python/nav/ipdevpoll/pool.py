@@ -21,6 +21,7 @@ import os
 import signal
 import sys
 import logging
+import time
 
 from twisted.protocols import amp
 from twisted.internet import reactor, protocol
@@ -31,7 +32,12 @@ import twisted.internet.endpoints
 from django.utils import six
 
 from nav.ipdevpoll.config import ipdevpoll_conf
+from nav.ipdevpoll import db
 from . import control, jobs
+from .dataloader import load_average_job_runtimes
+
+# Runtime estimate for jobs we know nothing about, in seconds
+DEFAULT_RUNTIME_ESTIMATE = 10.0
 
 
 def initialize_worker():
@@ -199,6 +205,56 @@ class InlinePool(object):
             self.active_jobs[deferred].cancel()
 
 
+class RuntimeEstimator(object):
+    """Keeps exponentially weighted moving averages of job runtimes, for
+    every job of every netbox.
+
+    Jobs that haven't been seen for a netbox are estimated using a moving
+    average of that job's runtime across all netboxes.
+
+    """
+    def __init__(self, alpha=0.3, default=DEFAULT_RUNTIME_ESTIMATE):
+        self.alpha = alpha
+        self.default = default
+        self._estimates = {}
+        self._job_estimates = {}
+
+    def __len__(self):
+        return len(self._estimates)
+
+    def seed(self, runtimes):
+        """Seeds the estimator with known runtimes.
+
+        :param runtimes: A dict of {(netboxid, job_name): seconds}
+
+        """
+        for (netbox, job), runtime in runtimes.items():
+            self._estimates[(job, netbox)] = runtime
+            self._job_estimates[job] = self._average(
+                self._job_estimates.get(job), runtime)
+
+    def estimate(self, job, netbox):
+        """Returns the expected runtime of job for netbox, in seconds"""
+        runtime = self._estimates.get((job, netbox))
+        if runtime is None:
+            runtime = self._job_estimates.get(job, self.default)
+        return runtime
+
+    def update(self, job, netbox, runtime):
+        """Updates the runtime estimate of job for netbox with a newly observed
+        runtime.
+        """
+        key = (job, netbox)
+        self._estimates[key] = self._average(self._estimates.get(key), runtime)
+        self._job_estimates[job] = self._average(
+            self._job_estimates.get(job), runtime)
+
+    def _average(self, average, value):
+        if average is None:
+            return value
+        return self.alpha * value + (1 - self.alpha) * average
+
+
 class Worker(object):
     """This class holds information about one worker process as seen from
     the worker pool"""
@@ -215,6 +271,7 @@ class Worker(object):
         self.threadpoolsize = threadpoolsize
         self.max_jobs = max_jobs
         self.started_at = None
+        self.expected_runtimes = {}
         self._ping_loop = twisted.internet.task.LoopingCall(
             self._euthanize_unresponsive_worker,
             timeout=ipdevpoll_conf.getint("multiprocess", "ping_timeout", fallback=10),
@@ -223,16 +280,26 @@ class Worker(object):
     def __repr__(self):
         return (
             "<Worker pid={pid} ready={ready} active={active} max={max} "
-            "total={total} started_at={started_at}>"
+            "total={total} backlog={backlog:.1f}s started_at={started_at}>"
         ).format(
             pid=self.pid,
             ready=not self.done(),
             active=self.active_jobs,
             max=self.max_concurrent_jobs,
             total=self.total_jobs,
+            backlog=self.get_estimated_backlog(),
             started_at=self.started_at,
         )
 
+    def get_estimated_backlog(self):
+        """Returns the estimated number of seconds of work remaining for the
+        jobs currently running on this worker.
+        """
+        now = time.time()
+        return sum(max(0, expected - (now - started_at))
+                   for _key, started_at, expected
+                   in self.expected_runtimes.values())
+
     @inlineCallbacks
     def start(self):
         """Starts a new child worker process"""
@@ -374,6 +441,19 @@ class WorkerPool(object):
             self._spawn_worker()
         self.serial = 0
         self.jobs = dict()
+        self.estimator = RuntimeEstimator()
+        reactor.callWhenRunning(self._load_runtime_estimates)
+
+    @inlineCallbacks
+    def _load_runtime_estimates(self):
+        try:
+            runtimes = yield db.run_in_thread(load_average_job_runtimes)
+        except Exception:  # pylint: disable=broad-except
+            self._logger.exception("Could not load job runtime estimates")
+        else:
+            self.estimator.seed(runtimes)
+            self._logger.debug("Loaded %d job runtime estimates",
+                               len(runtimes))
 
     def worker_died(self, worker):
         """Called to signal the death of a worker process"""
@@ -387,18 +467,29 @@ class WorkerPool(object):
         self.workers.add(worker)
 
     def _cleanup(self, result, deferred):
-        _serial, worker = self.jobs[deferred]
+        serial, worker = self.jobs[deferred]
         del self.jobs[deferred]
         worker.active_jobs -= 1
+        if serial in worker.expected_runtimes:
+            (job, netbox), started_at, _expected = worker.expected_runtimes.pop(
+                serial)
+            self.estimator.update(job, netbox, time.time() - started_at)
         return result
 
     def _execute(self, command, **kwargs):
         ready_workers = [w for w in self.workers if not w.done()]
         if not ready_workers:
             raise RuntimeError("No ready workers")
-        worker = min(ready_workers, key=lambda x: x.active_jobs)  # type: Worker
+        # Pick the worker that is expected to finish its current work first
+        worker = min(ready_workers,
+                     key=lambda x: (x.get_estimated_backlog(),
+                                    x.active_jobs))  # type: Worker
         self.serial += 1
         deferred = worker.execute(self.serial, command, **kwargs)
+        if command is Job:
+            key = (kwargs['job'], kwargs['netbox'])
+            worker.expected_runtimes[self.serial] = (
+                key, time.time(), self.estimator.estimate(*key))
         if worker.done():
             self._spawn_worker()
         self.jobs[deferred] = (self.serial, worker)
@@ -431,7 +522,12 @@ class WorkerPool(object):
     def log_summary(self):
         """Logs a summary of currently running workers"""
         self._logger.info(
-            "%s out of %s workers running", len(self.workers), self.target_count
+            "%s out of %s workers running, %d active jobs, estimated backlog "
+            "%.1fs",
+            len(self.workers),
+            self.target_count,
+            sum(worker.active_jobs for worker in self.workers),
+            sum(worker.get_estimated_backlog() for worker in self.workers),
         )
         for worker in self.workers:
             self._logger.info(" - %r", worker)
@@ -0,0 +1,160 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""A longest-prefix-match index of IPv4 and IPv6 prefixes.
+
+The index is a path-compressed binary trie (a PATRICIA trie) per address
+family, so looking up the most specific prefix containing an address takes
+time proportional to the address length, regardless of the number of indexed
+prefixes.
+
+"""
+from IPy import IP
+
+_NO_VALUE = object()
+
+
+class _Node(object):
+    """A trie node, representing the first `length` bits of `prefix`"""
+    __slots__ = ('prefix', 'length', 'value', 'children')
+
+    def __init__(self, prefix, length, value=_NO_VALUE):
+        self.prefix = prefix
+        self.length = length
+        self.value = value
+        self.children = [None, None]
+
+
+class _PrefixTrie(object):
+    """A PATRICIA trie of integer prefixes of a fixed bit width"""
+    def __init__(self, bits):
+        self.bits = bits
+        self.root = _Node(0, 0)
+        self.size = 0
+
+    def _bit(self, key, position):
+        """Returns the bit of key at position, counted from the left"""
+        return (key >> (self.bits - position - 1)) & 1
+
+    def _mask(self, key, length):
+        return key >> (self.bits - length) << (self.bits - length)
+
+    def insert(self, key, length, value):
+        """Inserts the prefix key/length, replacing any existing value"""
+        key = self._mask(key, length)
+        node = self.root
+        while True:
+            if node.length == length:
+                if node.value is _NO_VALUE:
+                    self.size += 1
+                node.value = value
+                return
+
+            bit = self._bit(key, node.length)
+            child = node.children[bit]
+            if child is None:
+                node.children[bit] = _Node(key, length, value)
+                self.size += 1
+                return
+
+            common = self._common_length(key, child.prefix,
+                                         min(length, child.length))
+            if common == child.length:
+                node = child
+                continue
+
+            # split the edge to child at the point where key diverges
+            middle = _Node(self._mask(key, common), common)
+            node.children[bit] = middle
+            middle.children[self._bit(child.prefix, common)] = child
+            if common == length:
+                middle.value = value
+            else:
+                middle.children[self._bit(key, common)] = _Node(
+                    key, length, value)
+            self.size += 1
+            return
+
+    def _common_length(self, key1, key2, max_length):
+        diff = key1 ^ key2
+        if not diff:
+            return max_length
+        return min(max_length, self.bits - diff.bit_length())
+
+    def lookup(self, key):
+        """Returns the value of the longest prefix containing key, or
+        _NO_VALUE if there is no such prefix.
+        """
+        bits = self.bits
+        best = _NO_VALUE
+        node = self.root
+        while node is not None:
+            if node.length and (key ^ node.prefix) >> (bits - node.length):
+                break
+            if node.value is not _NO_VALUE:
+                best = node.value
+            if node.length == bits:
+                break
+            node = node.children[(key >> (bits - node.length - 1)) & 1]
+        return best
+
+
+class PrefixIndex(object):
+    """An index of IPv4 and IPv6 prefixes, for finding the most specific
+    prefix an IP address belongs to.
+
+    Example:
+
+    >>> index = PrefixIndex([('10.0.0.0/8', 1), ('10.0.1.0/24', 2)])
+    >>> index.lookup('10.0.1.42')
+    2
+    >>> index.lookup('10.1.0.1')
+    1
+    >>> index.lookup('192.168.0.1') is None
+    True
+
+    """
+    def __init__(self, prefixes=()):
+        """Initializes a prefix index.
+
+        :param prefixes: An iterable of (prefix, value) tuples, where each
+                         prefix is an IPy.IP object or a string.
+
+        """
+        self._tries = {4: _PrefixTrie(32), 6: _PrefixTrie(128)}
+        for prefix, value in prefixes:
+            self.add(prefix, value)
+
+    def __len__(self):
+        return sum(trie.size for trie in self._tries.values())
+
+    def add(self, prefix, value):
+        """Adds a prefix to the index, associating it with value"""
+        if not isinstance(prefix, IP):
+            prefix = IP(prefix)
+        self._tries[prefix.version()].insert(prefix.int(), prefix.prefixlen(),
+                                             value)
+
+    def lookup(self, address):
+        """Returns the value associated with the most specific prefix that
+        contains address, or None if no indexed prefix contains it.
+
+        :param address: An IPy.IP object or a string.
+
+        """
+        if not isinstance(address, IP):
+            address = IP(address)
+        value = self._tries[address.version()].lookup(address.int())
+        return None if value is _NO_VALUE else value
@@ -18,6 +18,7 @@
 import logging
 import datetime
 import time
+import zlib
 from operator import itemgetter
 from collections import defaultdict
 from random import randint
@@ -33,6 +34,7 @@ from django.utils.six import iteritems
 
 from nav import ipdevpoll
 from nav.ipdevpoll import db
+from nav.util import parse_interval
 from nav.ipdevpoll.snmp import SnmpError, AgentProxy
 from nav.metrics.carbon import send_metrics
 from nav.metrics.templates import metric_prefix_for_ipdevpoll_job
@@ -41,11 +43,27 @@ from nav.tableformat import SimpleTableFormatter
 from nav.ipdevpoll.utils import log_unhandled_failure
 
 from . import shadows, config, signals
+from .changelistener import NetboxChangeListener
 from .dataloader import NetboxLoader
 from .jobs import JobHandler, AbortedJobError, SuggestedReschedule
+from .pool import RuntimeEstimator
 
 _logger = logging.getLogger(__name__)
 
+# Jobs whose runtime is predicted to take up more than this fraction of their
+# interval are at risk of overrunning their schedule
+OVERRUN_RATIO = 0.9
+# Jobs that start more than this fraction of their interval after they were
+# due are counted as late
+LATE_START_RATIO = 0.1
+# The longest time a job is postponed when stretched in favor of higher
+# priority jobs
+MAX_STRETCH_DELAY = 5*60
+# The minimum number of seconds between repeated overload warnings
+OVERLOAD_WARNING_INTERVAL = 60
+
+OVERLOAD_POLICIES = ('queue', 'stretch', 'shed')
+
 
 class NetboxJobScheduler(object):
     """Netbox job schedule handler.
@@ -59,6 +77,10 @@ class NetboxJobScheduler(object):
     global_job_queue = []
     global_intensity = config.ipdevpoll_conf.getint('ipdevpoll',
                                                     'max_concurrent_jobs')
+    overload_policy = config.ipdevpoll_conf.get('ipdevpoll',
+                                                'overload_policy')
+    runtime_estimator = RuntimeEstimator()
+    _last_overload_warning = 0
     _logger = ipdevpoll.ContextLogger()
 
     def __init__(self, job, netbox, pool):
@@ -72,6 +94,8 @@ class NetboxJobScheduler(object):
         self._deferred = Deferred()
         self._next_call = None
         self._last_job_started_at = 0
+        self._due_at = None
+        self._at_risk = False
         self.running = False
         self._start_time = None
         self._current_job = None
@@ -81,11 +105,54 @@ class NetboxJobScheduler(object):
         """Returns time elapsed since the start of the job as a timedelta."""
         return datetime.datetime.now() - self._start_time
 
-    def start(self):
-        """Start polling schedule."""
-        self._next_call = self.callLater(0, self.run_job)
+    def start(self, delay=0):
+        """Start polling schedule.
+
+        :param delay: Number of seconds to wait before the first job run.
+
+        """
+        if self._due_at is None:
+            self._due_at = time.time() + delay
+        self._next_call = self.callLater(delay, self.run_job)
         return self._deferred
 
+    def get_phase(self):
+        """Returns a deterministic fraction in the range [0, 1), derived from
+        the job name and netbox id, which is used to spread job runs across
+        the job interval.
+        """
+        key = "%s:%s" % (self.job.name, self.netbox.id)
+        return (zlib.crc32(key.encode('utf-8')) & 0xffffffff) / 2.0**32
+
+    def get_staggered_start_delay(self, catchup_window, now=None):
+        """Returns the number of seconds to wait before the first run of this
+        job, so that the first runs of many jobs are spread out in time,
+        rather than all starting at once.
+
+        Overdue jobs (and jobs that have never run) are spread across the
+        catch-up window. Other jobs are run at their own phase offset within
+        the job interval, or when they are due, whichever comes first.
+
+        :param catchup_window: The maximum number of seconds to delay overdue
+                               jobs.
+        :param now: The current time as a UNIX timestamp.
+
+        """
+        if now is None:
+            now = time.time()
+        interval = self.job.interval
+        phase = self.get_phase()
+
+        last_updated = self.netbox.last_updated.get(self.job.name)
+        if last_updated:
+            due = time.mktime(last_updated.timetuple()) + interval - now
+        else:
+            due = 0
+
+        if due <= 0:
+            return phase * min(interval, catchup_window)
+        return min(due, (phase * interval - now) % interval)
+
     def cancel(self):
         """Cancel scheduling of this job for this box.
 
@@ -129,12 +196,16 @@ class NetboxJobScheduler(object):
             return
 
         if self.is_global_limit_reached():
+            self._warn_about_overload()
+            if self._yield_to_higher_priority_jobs():
+                return
             self._logger.debug("global intensity limit reached - waiting to "
                                "run for %s", self.netbox.sysname)
             self.queue_myself(self.global_job_queue)
             return
 
         # We're ok to start a polling run.
+        self._check_start_time()
         try:
             self._start_time = datetime.datetime.now()
             deferred = self.pool.execute_job(self.job.name, self.netbox.id,
@@ -159,6 +230,101 @@ class NetboxJobScheduler(object):
     def is_running(self):
         return self.running
 
+    def is_outranked(self):
+        """Returns True if a job of higher priority than this one is waiting
+        for the global intensity limit.
+        """
+        return any(handler.job.priority > self.job.priority
+                   for handler in self.global_job_queue)
+
+    def _yield_to_higher_priority_jobs(self):
+        """Applies the configured overload policy when this job cannot run
+        because the global intensity limit has been reached.
+
+        Unless the policy is to simply queue all jobs, a job that is outranked
+        by waiting higher priority jobs is either postponed for a while
+        (stretched), or skipped until its next regular run (shed).
+
+        :returns: True if this job run was postponed or skipped, False if it
+                  should be queued as normal.
+
+        """
+        if self.overload_policy not in ('stretch', 'shed'):
+            return False
+        if not self.is_outranked():
+            return False
+
+        if self.overload_policy == 'shed':
+            delay = self.job.interval
+            self._logger.info("skipping this %r run for %s in favor of "
+                              "higher priority jobs",
+                              self.job.name, self.netbox.sysname)
+        else:
+            delay = min(self.job.interval, MAX_STRETCH_DELAY)
+            self._logger.info("postponing %r job for %s by %ds in favor of "
+                              "higher priority jobs",
+                              self.job.name, self.netbox.sysname, delay)
+        self._increment_counter(self.overload_policy + "-count")
+        self.reschedule(delay)
+        return True
+
+    @classmethod
+    def _warn_about_overload(cls, now=None):
+        """Logs a rate-limited warning about jobs having to wait for the
+        global intensity limit.
+        """
+        if now is None:
+            now = time.time()
+        if now - cls._last_overload_warning < OVERLOAD_WARNING_INTERVAL:
+            return
+        cls._last_overload_warning = now
+        cls._logger.warning(
+            "ipdevpoll is overloaded: %d jobs are running and %d jobs are "
+            "waiting to run (max_concurrent_jobs=%d, overload_policy=%s)",
+            cls.get_global_job_count(), len(cls.global_job_queue),
+            cls.global_intensity, cls.overload_policy)
+
+    def _check_start_time(self, now=None):
+        """Counts this job run as late if it is starting well after it was
+        due, which is a sign that ipdevpoll has more work than it can handle.
+        """
+        if now is None:
+            now = time.time()
+        due, self._due_at = self._due_at, None
+        if due is None:
+            return
+        lateness = now - due
+        if lateness > self.job.interval * LATE_START_RATIO:
+            self._logger.info("%r job for %s is starting %ds late",
+                              self.job.name, self.netbox.sysname, lateness)
+            self._increment_counter("late-count")
+
+    def get_predicted_runtime(self):
+        """Returns the predicted runtime of this job, in seconds"""
+        return self.runtime_estimator.estimate(self.job.name, self.netbox.id)
+
+    def _update_runtime_prediction(self, runtime):
+        """Updates the runtime prediction of this job, and counts and logs
+        the job if its predicted runtime is getting too close to its interval.
+        """
+        self.runtime_estimator.update(self.job.name, self.netbox.id, runtime)
+        predicted = self.get_predicted_runtime()
+        at_risk = predicted >= self.job.interval * OVERRUN_RATIO
+        if at_risk:
+            self._increment_counter("overrun-count")
+            if not self._at_risk:
+                self._logger.warning(
+                    "%r job for %s is predicted to take %s, which leaves "
+                    "little or no room within its %s interval",
+                    self.job.name, self.netbox.sysname,
+                    datetime.timedelta(seconds=int(predicted)),
+                    datetime.timedelta(seconds=self.job.interval))
+        elif self._at_risk:
+            self._logger.info("%r job for %s is no longer predicted to "
+                              "overrun its interval",
+                              self.job.name, self.netbox.sysname)
+        self._at_risk = at_risk
+
     @classmethod
     def _adjust_intensity_on_snmperror(cls, failure):
         if (failure.check(AbortedJobError) and
@@ -173,16 +339,20 @@ class NetboxJobScheduler(object):
         return failure
 
     def _update_counters(self, success):
+        self._increment_counter(
+            "success-count" if success else "failure-count")
+
+    def _increment_counter(self, name):
         prefix = metric_prefix_for_ipdevpoll_job(self.netbox.sysname,
                                                  self.job.name)
-        counter_path = (
-            prefix + (".success-count" if success else ".failure-count"))
-        _COUNTERS.increment(counter_path)
+        _COUNTERS.increment(prefix + "." + name)
         _COUNTERS.start()
 
     def _reschedule_on_success(self, result):
         """Reschedules the next normal run of this job."""
-        delay = max(0, self.job.interval - self.get_runtime())
+        runtime = self.get_runtime()
+        self._update_runtime_prediction(runtime)
+        delay = max(0, self.job.interval - runtime)
         self.reschedule(delay)
         if result:
             self._log_finished_job(True)
@@ -234,6 +404,7 @@ class NetboxJobScheduler(object):
             self._logger.debug("ignoring request to reschedule cancelled job")
             return
 
+        self._due_at = time.time() + delay
         next_time = datetime.datetime.now() + datetime.timedelta(seconds=delay)
 
         self._logger.debug("Next %r job for %s will be in %d seconds (%s)",
@@ -303,12 +474,22 @@ class NetboxJobScheduler(object):
 
     @classmethod
     def unqueue_next_global_job(cls):
-        "Unqueues the next job waiting because of the global intensity setting"
+        """Unqueues the next job waiting because of the global intensity
+        setting.
+
+        The waiting job with the highest priority is picked first. Jobs of
+        equal priority are unqueued in the order they were queued.
+
+        """
         if not cls.is_global_limit_reached():
-            for index, handler in enumerate(cls.global_job_queue):
-                if not handler.is_job_limit_reached():
-                    del cls.global_job_queue[index]
-                    return handler.start()
+            candidates = [(index, handler)
+                          for index, handler in enumerate(cls.global_job_queue)
+                          if not handler.is_job_limit_reached()]
+            if candidates:
+                index, handler = max(candidates,
+                                     key=lambda item: item[1].job.priority)
+                del cls.global_job_queue[index]
+                return handler.start()
 
     def get_job_queue(self):
         if self.job.name not in self.job_queues:
@@ -321,6 +502,11 @@ class JobScheduler(object):
     job_logging_loop = None
     netbox_reload_interval = 2*60.0  # seconds
     netbox_reload_loop = None
+    netbox_change_listener = None
+    stagger_jobs = config.ipdevpoll_conf.getboolean('ipdevpoll',
+                                                    'stagger_jobs')
+    catchup_window = parse_interval(
+        config.ipdevpoll_conf.get('ipdevpoll', 'catchup_window'))
     _logger = ipdevpoll.ContextLogger()
 
     def __init__(self, job, pool):
@@ -335,12 +521,42 @@ class JobScheduler(object):
 
     @classmethod
     def initialize_from_config_and_run(cls, pool, onlyjob=None):
+        if NetboxJobScheduler.overload_policy not in OVERLOAD_POLICIES:
+            cls._logger.warning("unknown overload_policy %r, falling back to "
+                                "queue", NetboxJobScheduler.overload_policy)
+            NetboxJobScheduler.overload_policy = 'queue'
         descriptors = config.get_jobs()
         schedulers = [JobScheduler(d, pool) for d in descriptors
                       if not onlyjob or (d.name == onlyjob)]
+        if config.ipdevpoll_conf.getboolean('ipdevpoll',
+                                            'netbox_change_notifications'):
+            cls.netbox_reload_interval = parse_interval(
+                config.ipdevpoll_conf.get('ipdevpoll', 'full_reload_interval'))
+            cls._start_netbox_change_listener()
         for scheduler in schedulers:
             scheduler.run()
 
+    @classmethod
+    def _start_netbox_change_listener(cls):
+        if not cls.netbox_change_listener:
+            cls.netbox_change_listener = NetboxChangeListener(
+                cls.on_netboxes_changed)
+            cls.netbox_change_listener.start()
+
+    @classmethod
+    def on_netboxes_changed(cls, netbox_ids):
+        """Reloads changed netboxes for all jobs.
+
+        :param netbox_ids: A set of netbox IDs to reload. If None, all
+                           netboxes are reloaded.
+
+        """
+        if netbox_ids is None:
+            cls.reload()
+            return
+        for scheduler in cls.active_schedulers:
+            scheduler._reload_some_netboxes(netbox_ids)
+
     def run(self):
         """Initiate scheduling of this job."""
         signals.netbox_type_changed.connect(self.on_netbox_type_changed)
@@ -395,6 +611,13 @@ class JobScheduler(object):
         db.django_debug_cleanup()
         return deferred
 
+    def _reload_some_netboxes(self, netbox_ids):
+        """Reload a subset of netboxes and update their schedules."""
+        deferred = self.netboxes.load_some(netbox_ids)
+        deferred.addCallbacks(self._process_reloaded_netboxes,
+                              self._handle_reload_failures)
+        return deferred
+
     def _process_reloaded_netboxes(self, result):
         """Process the result of a netbox reload and update schedules."""
         (new_ids, removed_ids, changed_ids) = result
@@ -410,18 +633,31 @@ class JobScheduler(object):
         new_and_changed = sorted(new_ids.union(changed_ids),
                                  key=_lastupdated)
         for netbox_id in new_and_changed:
-            self.add_netbox_scheduler(netbox_id)
+            self.add_netbox_scheduler(netbox_id,
+                                      stagger=netbox_id not in changed_ids)
 
     def _handle_reload_failures(self, failure):
         failure.trap(db.ResetDBConnectionError)
         self._logger.error("Reloading the IP device list failed because the "
                            "database connection was reset")
 
-    def add_netbox_scheduler(self, netbox_id):
+    def add_netbox_scheduler(self, netbox_id, stagger=False):
+        """Adds and starts a job scheduler for a netbox.
+
+        :param stagger: If True, and job staggering is enabled, the first run
+                        of the job is delayed according to the netbox' phase
+                        offset within the job interval.
+
+        """
         netbox = self.netboxes[netbox_id]
         scheduler = NetboxJobScheduler(self.job, netbox, self.pool)
         self.active_netboxes[netbox_id] = scheduler
-        return scheduler.start()
+        delay = 0
+        if stagger and self.stagger_jobs:
+            delay = scheduler.get_staggered_start_delay(self.catchup_window)
+            self._logger.debug("staggering first %r job for %s by %.1fs",
+                               self.job.name, netbox.sysname, delay)
+        return scheduler.start(delay)
 
     def cancel_netbox_scheduler(self, netbox_id):
         if netbox_id not in self.active_netboxes:
@@ -293,7 +293,7 @@ class Vlan(Shadow):
         self._ignore_unknown_organizations()
         self._ignore_unknown_usages()
 
-        super(Vlan, self).save(containers)
+        return super(Vlan, self).save(containers)
 
     def get_existing_model(self, containers=None):
         """Finds pre-existing Vlan object using custom logic.
@@ -199,7 +199,7 @@ class NetboxEntity(Shadow):
 
     def save(self, containers):
         self._check_for_resolved_chassis_outage()
-        super(NetboxEntity, self).save(containers)
+        return super(NetboxEntity, self).save(containers)
 
     def _check_for_resolved_chassis_outage(self):
         if self.physical_class != manage.NetboxEntity.CLASS_CHASSIS:
@@ -27,7 +27,8 @@ from nav.models.event import EventQueue as Event, EventQueueVar as EventVar
 from nav.models.event import AlertHistory
 from nav import natsort
 
-from nav.ipdevpoll.storage import Shadow, DefaultManager
+from nav.ipdevpoll.interfacecache import get_interface_cache
+from nav.ipdevpoll.storage import Shadow, DefaultManager, UNCHANGED
 
 from .netbox import Netbox
 
@@ -49,6 +50,7 @@ class InterfaceManager(DefaultManager):
         super(InterfaceManager, self).__init__(*args, **kwargs)
         self.netbox = self.containers.get(None, Netbox)
         self.handle_missing = False
+        self._changed_rows = False
 
     def prepare(self):
         if self.sentinel in self.containers[Interface]:
@@ -77,8 +79,12 @@ class InterfaceManager(DefaultManager):
                 ifc.baseport = None
 
     def _load_existing_objects(self):
-        db_ifcs = manage.Interface.objects.filter(
-            netbox__id=self.netbox.id).select_related('module')
+        cache = get_interface_cache()
+        if cache:
+            db_ifcs = cache.get_interfaces(self.netbox.id)
+        else:
+            db_ifcs = manage.Interface.objects.filter(
+                netbox__id=self.netbox.id).select_related('module')
         self._make_maps(db_ifcs)
 
     def _make_maps(self, db_ifcs):
@@ -143,9 +149,11 @@ class InterfaceManager(DefaultManager):
         self._logger.debug("%s changed ifindex mappings (new/old): %r",
                            self.netbox.sysname, changed_ifindexes)
 
-        changed_interfaces = self._db_ifcs.filter(
+        changed_interfaces = manage.Interface.objects.filter(
+            netbox__id=self.netbox.id,
             ifindex__in=[new for new, old in changed_ifindexes])
         changed_interfaces.update(ifindex=None)
+        self._changed_rows = True
 
     def _resolve_linkstate_alerts(self):
         alerts = self._get_unresolved_linkstate_alerts()
@@ -175,6 +183,16 @@ class InterfaceManager(DefaultManager):
             self._mark_missing_interfaces()
             self._delete_missing_interfaces()
         self._generate_linkstate_events()
+        self._invalidate_cached_interfaces()
+
+    def _invalidate_cached_interfaces(self):
+        """Drops this netbox' interfaces from the interface cache if this job
+        changed any of them, as they will need to be read again anyway.
+        """
+        cache = get_interface_cache()
+        if cache and (self._changed_rows or any(
+                outcome != UNCHANGED for outcome in self.save_counts)):
+            cache.invalidate(self.netbox.id)
 
     @transaction.atomic()
     def _mark_missing_interfaces(self):
@@ -190,6 +208,7 @@ class InterfaceManager(DefaultManager):
             missing = manage.Interface.objects.filter(
                 id__in=self._missing_ifcs.keys())
             missing.update(gone_since=datetime.datetime.now())
+            self._changed_rows = True
 
     @transaction.atomic()
     def _delete_missing_interfaces(self):
@@ -203,6 +222,7 @@ class InterfaceManager(DefaultManager):
                               len(deleteable), ifnames(deleteable))
             pks = [ifc.id for ifc in deleteable]
             manage.Interface.objects.filter(pk__in=pks).delete()
+            self._changed_rows = True
 
     def _get_indexless_ifcs(self):
         return [ifc for ifc in self._db_ifcs
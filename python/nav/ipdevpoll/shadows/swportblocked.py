@@ -87,4 +87,4 @@ class SwPortBlocked(Shadow):
             self._logger.debug(
                 "missing vlan value for STP block, ignoring: %r", self)
         else:
-            super(SwPortBlocked, self).save(containers)
+            return super(SwPortBlocked, self).save(containers)
@@ -0,0 +1,154 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""A process-wide cache of SNMP table responses.
+
+AgentProxy instances only live for the duration of a single job, and so does
+their session cache.  This module provides an opt-in cache that outlives
+individual jobs, so that jobs running minutes apart against the same device
+can share the results of walking slow-changing tables (like ifTable or the
+ENTITY-MIB tables).
+
+Only responses for OID subtrees that have been explicitly assigned a
+time-to-live value in the ``[snmpcache:ttl]`` section of ``ipdevpoll.conf``
+are ever cached.
+
+"""
+import logging
+import time
+from collections import OrderedDict
+
+from nav.oids import OID
+from nav.util import parse_interval
+
+_logger = logging.getLogger(__name__)
+
+CONFIG_SECTION = 'snmpcache'
+TTL_SECTION = 'snmpcache:ttl'
+
+_response_cache = None
+
+
+class ResponseCache(object):
+    """A size-bounded LRU cache of SNMP responses, with configurable
+    time-to-live values for individual OID subtrees.
+    """
+    def __init__(self, ttls, max_entries=1000):
+        """Initializes a response cache.
+
+        :param ttls: A dictionary of {subtree: seconds} entries, where
+                     subtree is an OID (or OID string).
+        :param max_entries: The maximum number of responses to keep.
+
+        """
+        self.ttls = sorted(((OID(subtree), ttl)
+                            for subtree, ttl in ttls.items()),
+                           key=lambda x: len(x[0]), reverse=True)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_ttl(self, oids):
+        """Returns the number of seconds a response to a request for `oids`
+        may be cached, or None if it should not be cached at all.
+
+        The TTL of a multi-OID request is the shortest TTL of any of its
+        OIDs.
+
+        """
+        ttls = [self._get_subtree_ttl(OID(oid)) for oid in oids]
+        if not ttls or None in ttls:
+            return None
+        return min(ttls)
+
+    def _get_subtree_ttl(self, oid):
+        for subtree, ttl in self.ttls:
+            if subtree == oid or subtree.is_a_prefix_of(oid):
+                return ttl
+        return None
+
+    def get(self, key):
+        """Returns the unexpired response stored under key, or None if there
+        is no such response.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, value, ttl):
+        """Stores a response under key for ttl seconds"""
+        self._entries[key] = (time.time() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_stats(self):
+        """Returns a dictionary of cache statistics"""
+        return dict(entries=len(self._entries), hits=self.hits,
+                    misses=self.misses, evictions=self.evictions)
+
+    def log_stats(self):
+        """Logs the cache statistics"""
+        _logger.info("SNMP response cache: %(entries)d entries, "
+                     "%(hits)d hits, %(misses)d misses, "
+                     "%(evictions)d evictions", self.get_stats())
+
+
+def get_response_cache(config=None):
+    """Returns the process-wide ResponseCache instance, or None if the cache
+    has not been enabled in ipdevpoll.conf.
+    """
+    global _response_cache
+    if _response_cache is None:
+        if config is None:
+            from nav.ipdevpoll.config import ipdevpoll_conf as config
+        if not config.getboolean(CONFIG_SECTION, 'enabled', fallback=False):
+            _response_cache = False
+        else:
+            _response_cache = make_response_cache(config)
+    return _response_cache if _response_cache else None
+
+
+def make_response_cache(config):
+    """Makes a ResponseCache instance from an ipdevpoll config object"""
+    max_entries = config.getint(CONFIG_SECTION, 'max-entries', fallback=1000)
+    ttls = {}
+    if config.has_section(TTL_SECTION):
+        for subtree, interval in config.items(TTL_SECTION):
+            try:
+                ttls[OID(subtree)] = parse_interval(interval)
+            except ValueError:
+                _logger.error("ignoring invalid %s entry: %s = %s",
+                              TTL_SECTION, subtree, interval)
+    _logger.debug("SNMP response cache enabled, max-entries=%d, TTLs=%r",
+                  max_entries, ttls)
+    return ResponseCache(ttls, max_entries)
+
+
+def log_response_cache_stats():
+    """Logs the statistics of the process-wide response cache, if enabled"""
+    cache = get_response_cache()
+    if cache:
+        cache.log_stats()
@@ -14,22 +14,34 @@
 # License along with NAV. If not, see <http://www.gnu.org/licenses/>.
 #
 "common AgentProxy mixin"
+import copy
 import time
 import logging
 from functools import wraps
 from collections import namedtuple
 
 from twisted.internet import reactor
-from twisted.internet.defer import succeed
+from twisted.internet.defer import succeed, maybeDeferred
+from twisted.internet.error import TimeoutError
 from twisted.internet.task import deferLater
 
+from .cache import get_response_cache
+from .pacing import get_pacing_controller
+from .tableretriever import MultiColumnTableRetriever
+
 _logger = logging.getLogger(__name__)
 
 
 def cache_for_session(func):
-    """Decorator for AgentProxyMixIn.getTable to cache responses"""
+    """Decorator for AgentProxyMixIn.getTable to cache responses.
+
+    The cache is bypassed while responses are being recorded, since cached
+    responses never reach the recorder.
+    """
     def _wrapper(*args, **kwargs):
         self, oids = args[0], args[1]
+        if getattr(self, 'recorder', None) is not None:
+            return func(*args, **kwargs)
         cache = getattr(self, '_result_cache')
         key = tuple(oids)
         if key not in cache:
@@ -48,12 +60,47 @@ def _cache_result(result, cache, key):
     return result
 
 
+def cache_for_worker(func):
+    """Decorator for AgentProxyMixIn.getTable to cache responses in the
+    process-wide response cache, if enabled.
+
+    Like the session cache, this cache is bypassed while responses are being
+    recorded.
+    """
+    def _wrapper(*args, **kwargs):
+        self, oids = args[0], args[1]
+        if getattr(self, 'recorder', None) is not None:
+            return func(*args, **kwargs)
+        cache = get_response_cache()
+        ttl = cache.get_ttl(oids) if cache else None
+        if not ttl:
+            return func(*args, **kwargs)
+
+        key = (self.get_cache_identity(), tuple(oids))
+        result = cache.get(key)
+        if result is not None:
+            _logger.debug("response cache hit for %r: %r", self, oids)
+            return succeed(result)
+
+        df = func(*args, **kwargs)
+        if df:
+            df.addCallback(_cache_result_for_worker, cache, key, ttl)
+        return df
+
+    return wraps(func)(_wrapper)
+
+
+def _cache_result_for_worker(result, cache, key, ttl):
+    cache.put(key, result, ttl)
+    return result
+
+
 def throttled(func):
     """Decorator for AgentProxyMixIn.getTable to throttle requests"""
     def _wrapper(*args, **kwargs):
         self = args[0]
         last_request = getattr(self, '_last_request')
-        delay = (last_request + self.throttle_delay) - time.time()
+        delay = (last_request + self.get_throttle_delay()) - time.time()
         setattr(self, '_last_request', time.time())
 
         if delay > 0:
@@ -65,6 +112,98 @@ def throttled(func):
     return wraps(func)(_wrapper)
 
 
+def paced(func):
+    """Decorator for AgentProxyMixIn request methods to limit the number of
+    concurrent requests to an agent, and to feed the outcome of each request
+    to the agent's pacing controller, if adaptive pacing is enabled.
+    """
+    def _wrapper(*args, **kwargs):
+        self = args[0]
+        pacing = self.pacing
+        if not pacing:
+            return func(*args, **kwargs)
+
+        def _send(_):
+            start = time.time()
+            df = maybeDeferred(func, *args, **kwargs)
+            df.addCallbacks(_on_response, _on_failure, callbackArgs=(start,))
+            return df
+
+        def _on_response(result, start):
+            if result:
+                pacing.on_response(time.time() - start)
+            else:
+                # pynetsnmp reports error responses, such as tooBig, as
+                # empty results
+                pacing.on_too_big()
+            return result
+
+        def _on_failure(failure):
+            if failure.check(TimeoutError):
+                pacing.on_timeout()
+            return failure
+
+        def _release(result):
+            pacing.release()
+            return result
+
+        df = pacing.acquire()
+        df.addCallback(_send)
+        df.addBoth(_release)
+        return df
+
+    return wraps(func)(_wrapper)
+
+
+def instrumented(func):
+    """Decorator for AgentProxyMixIn request methods to record the outcome of
+    each request in the agent's current PluginStats instance, if any.
+    """
+    def _wrapper(*args, **kwargs):
+        self = args[0]
+        stats = self.stats
+        if stats is None:
+            return func(*args, **kwargs)
+
+        start = time.time()
+
+        def _on_response(result):
+            stats.record_snmp_response(time.time() - start, result or [])
+            return result
+
+        def _on_failure(failure):
+            if failure.check(TimeoutError):
+                stats.record_snmp_timeout(time.time() - start)
+            return failure
+
+        df = maybeDeferred(func, *args, **kwargs)
+        df.addCallbacks(_on_response, _on_failure)
+        return df
+
+    return wraps(func)(_wrapper)
+
+
+def recorded(func):
+    """Decorator for AgentProxyMixIn request methods to record every varbind
+    received from the agent in the agent's ResponseRecorder, if any.
+    """
+    def _wrapper(*args, **kwargs):
+        self = args[0]
+        recorder = self.recorder
+        if recorder is None:
+            return func(*args, **kwargs)
+
+        def _record(result):
+            recorder.record(getattr(self, 'community', None), result)
+            return result
+
+        df = maybeDeferred(func, *args, **kwargs)
+        df.addCallback(_record)
+        return df
+
+    return wraps(func)(_wrapper)
+
+
 # pylint: disable=R0903
 class AgentProxyMixIn(object):
     """Common AgentProxy mix-in class.
@@ -90,12 +229,19 @@ class AgentProxyMixIn(object):
         self._result_cache = {}
         self._last_request = 0
         self.throttle_delay = self.snmp_parameters.throttle_delay
+        self.stats = None
+        self.recorder = None
 
         super(AgentProxyMixIn, self).__init__(*args, **kwargs)
         # If we're mixed in with a pure twistedsnmp AgentProxy, the timeout
         # parameter will have no effect, since it is an argument to individual
         # method calls.
         self.timeout = self.snmp_parameters.timeout
+        if self.snmp_parameters.adaptive_pacing:
+            self.pacing = get_pacing_controller(self.get_agent_identity(),
+                                                self.snmp_parameters)
+        else:
+            self.pacing = None
 
     def __repr__(self):
         return "<{module}.{klass}({ip}, ...) at {ident}>".format(
@@ -104,38 +250,118 @@ class AgentProxyMixIn(object):
             ip=repr(self.ip),
             ident=id(self))
 
+    def get_cache_identity(self):
+        """Returns a tuple that identifies the agent and MIB instance this
+        proxy talks to, for use as part of cache keys.
+        """
+        return (self.ip, self.port, getattr(self, 'community', None))
+
+    def get_agent_identity(self):
+        """Returns a tuple that identifies the agent this proxy talks to,
+        regardless of which MIB instance it queries.
+
+        Unlike the cache identity, this never includes the community string,
+        and is safe to log.
+
+        """
+        return (self.ip, self.port)
+
+    def reset(self):
+        """Resets the per-job state of this proxy, so that it can be reused
+        by another job.
+        """
+        self._result_cache = {}
+        self.throttle_delay = self.snmp_parameters.throttle_delay
+        self.stats = None
+        self.recorder = None
+
+    def fork(self):
+        """Returns a proxy that shares this proxy's SNMP session, response
+        cache, pacing controller and recorder, but records its requests in a
+        PluginStats instance of its own.
+
+        This lets several plugins of a job use the same agent concurrently,
+        while still attributing each request to the right plugin.  Forks must
+        not be opened or closed; the life cycle of the session belongs to the
+        original proxy.
+
+        """
+        proxy = copy.copy(self)
+        proxy.stats = None
+        return proxy
+
+    def get_throttle_delay(self):
+        """Returns the current minimum delay between requests, in seconds"""
+        if self.pacing:
+            return max(self.throttle_delay, self.pacing.delay)
+        return self.throttle_delay
+
+    def get_max_repetitions(self):
+        """Returns the max-repetitions value to use in GETBULK requests"""
+        if self.pacing:
+            return self.pacing.max_repetitions
+        return self.snmp_parameters.max_repetitions
+
     # hey, we're mimicking someone else's API here, never mind the bollocks:
     # pylint: disable=C0111,C0103
     @cache_for_session
-    def getTable(self, *args, **kwargs):
-        kwargs['maxRepetitions'] = self.snmp_parameters.max_repetitions
-        return super(AgentProxyMixIn, self).getTable(*args, **kwargs)
+    @cache_for_worker
+    def getTable(self, oids, **kwargs):
+        kwargs['maxRepetitions'] = self.get_max_repetitions()
+        if len(oids) > 1 and self._can_walk_columns_in_parallel():
+            retriever = MultiColumnTableRetriever(
+                self, oids,
+                max_repetitions=self.get_max_repetitions(),
+                max_columns=self.snmp_parameters.max_columns)
+            return retriever()
+        return super(AgentProxyMixIn, self).getTable(oids, **kwargs)
+
+    def _can_walk_columns_in_parallel(self):
+        """Returns True if this agent can walk several table columns using
+        single GETBULK requests.
+        """
+        version = str(getattr(self, 'snmpVersion', '1'))
+        return self.snmp_parameters.max_columns > 1 and '1' not in version
 
     # hey, we're mimicking someone else's API here, never mind the bollocks:
     # pylint: disable=C0111,C0103
+    @paced
     @throttled
+    @instrumented
+    @recorded
     def _get(self, *args, **kwargs):
         return super(AgentProxyMixIn, self)._get(*args, **kwargs)
 
     # hey, we're mimicking someone else's API here, never mind the bollocks:
     # pylint: disable=C0111,C0103
+    @paced
     @throttled
+    @instrumented
+    @recorded
     def _walk(self, *args, **kwargs):
         return super(AgentProxyMixIn, self)._walk(*args, **kwargs)
 
     # hey, we're mimicking someone else's API here, never mind the bollocks:
     # pylint: disable=C0111,C0103
+    @paced
     @throttled
+    @instrumented
+    @recorded
     def _getbulk(self, *args, **kwargs):
         return super(AgentProxyMixIn, self)._getbulk(*args, **kwargs)
 
 
 # pylint: disable=C0103
 SNMPParameters = namedtuple('SNMPParameters',
-                            'timeout max_repetitions throttle_delay')
+                            'timeout max_repetitions throttle_delay '
+                            'max_columns adaptive_pacing max_in_flight '
+                            'max_concurrent_instances')
+SNMPParameters.__new__.__defaults__ = (10, False, 4, 4)
 
 SNMP_DEFAULTS = SNMPParameters(timeout=1.5, max_repetitions=50,
-                               throttle_delay=0)
+                               throttle_delay=0, max_columns=10,
+                               adaptive_pacing=False, max_in_flight=4,
+                               max_concurrent_instances=4)
 
 
 # pylint: disable=W0212
@@ -155,6 +381,10 @@ def snmp_parameter_factory(host=None):
             ('max-repetitions', config.getint),
             ('timeout', config.getfloat),
             ('throttle-delay', config.getfloat),
+            ('max-columns', config.getint),
+            ('adaptive-pacing', config.getboolean),
+            ('max-in-flight', config.getint),
+            ('max-concurrent-instances', config.getint),
     ]:
         if config.has_option(section, var):
             key = var.replace('-', '_')
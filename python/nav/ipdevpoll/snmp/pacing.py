@@ -0,0 +1,192 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Adaptive pacing of SNMP requests to individual agents.
+
+A PacingController keeps track of how a single SNMP agent copes with the
+requests we send it, and tunes three parameters using an AIMD (additive
+increase, multiplicative decrease) strategy:
+
+* the delay between consecutive requests,
+* the max-repetitions value used in GETBULK requests and
+* the number of requests that may be in flight at the same time.
+
+Timeouts and tooBig errors cause multiplicative backoff, while successful,
+speedy responses slowly increase the request intensity again, up to the
+limits set in ipdevpoll.conf.  Controllers are kept in memory for the
+lifetime of the ipdevpoll process, so what is learned about an agent in one
+job carries over to the next.
+
+"""
+import logging
+
+from twisted.internet import defer
+
+_logger = logging.getLogger(__name__)
+
+# Responses slower than this fraction of the SNMP timeout value are
+# considered a sign of an overloaded agent
+SLOW_RESPONSE_RATIO = 0.5
+# The maximum inter-request delay the controller will impose, in seconds
+MAX_DELAY = 2.0
+# The amount of seconds by which to increase delays on signs of overload
+DELAY_STEP = 0.05
+# The additive increase of max-repetitions for every speedy response
+REPETITIONS_STEP = 2
+
+_controllers = {}
+
+
+class PacingController(object):
+    """AIMD controller of the request intensity towards a single agent"""
+    def __init__(self, identity, min_delay=0.0, max_repetitions=10,
+                 max_in_flight=4, timeout=1.5):
+        self.identity = identity
+        self.min_delay = min_delay
+        self.max_repetitions_ceiling = max_repetitions
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+
+        self.delay = min_delay
+        self.max_repetitions = max_repetitions
+        self._window = 1.0
+        self.in_flight = 0
+        self._waiting = []
+
+        self.responses = 0
+        self.timeouts = 0
+        self.too_big = 0
+        self.slow_responses = 0
+
+    def __repr__(self):
+        return ("<PacingController {identity!r} delay={delay:.3f} "
+                "max_repetitions={max_repetitions} in_flight={in_flight}/"
+                "{limit} responses={responses} timeouts={timeouts} "
+                "too_big={too_big} slow={slow}>").format(
+                    identity=self.identity, delay=self.delay,
+                    max_repetitions=self.max_repetitions,
+                    in_flight=self.in_flight, limit=self.in_flight_limit,
+                    responses=self.responses, timeouts=self.timeouts,
+                    too_big=self.too_big, slow=self.slow_responses)
+
+    def update_limits(self, min_delay, max_repetitions, max_in_flight,
+                      timeout):
+        """Updates the configured limits of this controller, clamping the
+        current state to the new limits.
+        """
+        self.min_delay = min_delay
+        self.max_repetitions_ceiling = max_repetitions
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+
+        self.delay = max(self.delay, min_delay)
+        self.max_repetitions = min(self.max_repetitions, max_repetitions)
+        self._window = min(self._window, max_in_flight)
+
+    @property
+    def in_flight_limit(self):
+        """The current maximum number of concurrent requests to the agent"""
+        return max(1, int(self._window))
+
+    def acquire(self):
+        """Returns a Deferred that fires when a new request may be sent"""
+        if self.in_flight < self.in_flight_limit:
+            self.in_flight += 1
+            return defer.succeed(None)
+        deferred = defer.Deferred()
+        self._waiting.append(deferred)
+        return deferred
+
+    def release(self):
+        """Signals that a request has completed"""
+        self.in_flight -= 1
+        while self._waiting and self.in_flight < self.in_flight_limit:
+            self.in_flight += 1
+            self._waiting.pop(0).callback(None)
+
+    def on_response(self, latency):
+        """Updates the controller state after a successful response"""
+        self.responses += 1
+        before = self._get_state()
+        if latency > self.timeout * SLOW_RESPONSE_RATIO:
+            self.slow_responses += 1
+            self.delay = min(MAX_DELAY, self.delay + DELAY_STEP)
+        else:
+            self.max_repetitions = min(self.max_repetitions_ceiling,
+                                       self.max_repetitions + REPETITIONS_STEP)
+            self._window = min(self.max_in_flight,
+                               self._window + 1.0 / self._window)
+            self.delay = max(self.min_delay, self.delay / 2)
+            if self.delay < DELAY_STEP / 10:
+                self.delay = self.min_delay
+        self._log_state_change(before, "response in %.3fs" % latency)
+
+    def on_timeout(self):
+        """Updates the controller state after a request timeout"""
+        self.timeouts += 1
+        before = self._get_state()
+        self.max_repetitions = max(1, self.max_repetitions // 2)
+        self._window = max(1.0, self._window / 2)
+        self.delay = min(MAX_DELAY, max(self.delay * 2, DELAY_STEP))
+        self._log_state_change(before, "timeout")
+
+    def on_too_big(self):
+        """Updates the controller state after a tooBig response"""
+        self.too_big += 1
+        before = self._get_state()
+        self.max_repetitions = max(1, self.max_repetitions // 2)
+        self._log_state_change(before, "tooBig")
+
+    def _get_state(self):
+        return self.delay, self.max_repetitions, self.in_flight_limit
+
+    def _log_state_change(self, before, reason):
+        if _logger.isEnabledFor(logging.DEBUG) and before != self._get_state():
+            _logger.debug("%s: %r", reason, self)
+
+
+def get_pacing_controller(identity, snmp_parameters):
+    """Returns the process-wide PacingController for the agent identified by
+    identity, creating it if necessary.
+
+    :param identity: A hashable object identifying an SNMP agent, such as
+                     the (ip, port) tuple returned by an AgentProxy's
+                     get_agent_identity().  It is logged as part of the
+                     controller state, and must not contain secrets such as
+                     community strings.
+    :param snmp_parameters: An SNMPParameters namedtuple, which supplies the
+                            limits the controller must work within.
+
+    """
+    limits = dict(min_delay=snmp_parameters.throttle_delay,
+                  max_repetitions=snmp_parameters.max_repetitions,
+                  max_in_flight=snmp_parameters.max_in_flight,
+                  timeout=snmp_parameters.timeout)
+    controller = _controllers.get(identity)
+    if controller is None:
+        controller = PacingController(identity, **limits)
+        _controllers[identity] = controller
+    else:
+        controller.update_limits(**limits)
+    return controller
+
+
+def log_pacing_controllers(level=logging.INFO):
+    """Dumps the state of all known pacing controllers to the log"""
+    if not _controllers:
+        return
+    _logger.log(level, "SNMP pacing state for %d agents:", len(_controllers))
+    for controller in _controllers.values():
+        _logger.log(level, " - %r", controller)
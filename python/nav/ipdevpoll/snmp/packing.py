@@ -0,0 +1,260 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Adaptive packing of many OIDs into SNMP GET requests.
+
+Agents differ wildly in how many varbinds they will answer in a single GET
+request. A RequestPacker learns the largest request size an individual agent
+accepts: The size is doubled after every successful request, while empty
+responses and timeouts cause the failed request to be split in two and
+retried.  Only the timeout of a request that has not already been split
+shrinks the packer, so that an agent that stops responding altogether does
+not leave its packer at the smallest size for later jobs.
+
+pynetsnmp reports every error response as an empty result, so an empty
+response may be a tooBig error just as well as a noSuchName error or genErr
+caused by a single bad OID.  The response is only taken to be a tooBig error,
+which puts a permanent ceiling on the request size for the agent, once every
+OID of the failed request has been retrieved by smaller requests.
+
+Packers are kept in memory for the lifetime of the ipdevpoll process, so what
+is learned about an agent in one job carries over to the next.
+
+"""
+import logging
+from collections import deque
+
+from twisted.internet import defer
+from twisted.internet.error import TimeoutError
+
+_logger = logging.getLogger(__name__)
+
+# The largest number of varbinds we will ever ask for in a single request
+MAX_REQUEST_SIZE = 100
+# The number of single-OID requests that may time out in a row before an
+# agent is considered unresponsive
+MAX_SINGLE_TIMEOUTS = 3
+
+_packers = {}
+
+
+class RequestPacker(object):
+    """Keeps track of the request size to use for GET requests to a single
+    agent.
+    """
+    def __init__(self, identity, initial_size=5, max_size=MAX_REQUEST_SIZE):
+        self.identity = identity
+        self.size = min(initial_size, max_size)
+        self.ceiling = max_size
+
+        self.requests = 0
+        self.empty = 0
+        self.too_big = 0
+        self.timeouts = 0
+
+    def __repr__(self):
+        return ("<RequestPacker {identity!r} size={size} ceiling={ceiling} "
+                "requests={requests} empty={empty} too_big={too_big} "
+                "timeouts={timeouts}>").format(
+                    identity=self.identity, size=self.size,
+                    ceiling=self.ceiling, requests=self.requests,
+                    empty=self.empty, too_big=self.too_big,
+                    timeouts=self.timeouts)
+
+    def on_success(self, count):
+        """Grows the request size after a successful request of count
+        varbinds
+        """
+        self.requests += 1
+        if count >= self.size and self.size < self.ceiling:
+            self.size = min(self.ceiling, self.size * 2)
+            _logger.debug("growing request size: %r", self)
+
+    def on_empty(self, count):
+        """Shrinks the request size after an empty response to a request of
+        count varbinds
+        """
+        self.requests += 1
+        self.empty += 1
+        self.size = max(1, min(self.size, count // 2))
+        _logger.debug("empty response to %d varbinds: %r", count, self)
+
+    def on_too_big(self, count):
+        """Puts a ceiling on the request size after a request of count
+        varbinds has been found to cause a tooBig error
+        """
+        self.too_big += 1
+        self.ceiling = max(1, min(self.ceiling, count - 1))
+        self.size = max(1, min(self.size, self.ceiling))
+        _logger.debug("tooBig response to %d varbinds: %r", count, self)
+
+    def on_timeout(self, count):
+        """Shrinks the request size after a timed out request of count
+        varbinds
+        """
+        self.requests += 1
+        self.timeouts += 1
+        self.size = max(1, min(self.size, count // 2))
+        _logger.debug("timeout on %d varbinds: %r", count, self)
+
+
+class _Request(object):
+    """A GET request, which may have been split from a larger request that
+    failed
+    """
+    def __init__(self, oids, parent=None):
+        self.oids = oids
+        self.parent = parent
+        self.got_empty_response = False
+        self.pending = 0
+        self.answered = True
+
+    def split(self, got_empty_response):
+        """Splits this failed request into two halves"""
+        self.got_empty_response = got_empty_response
+        middle = len(self.oids) // 2
+        self.pending = 2
+        return [_Request(self.oids[:middle], self),
+                _Request(self.oids[middle:], self)]
+
+    def finish(self, packer, answered):
+        """Finishes this request.
+
+        :param answered: True if every OID of this request was retrieved,
+                         either by this request or the requests split from
+                         it.
+
+        """
+        if answered and self.got_empty_response:
+            packer.on_too_big(len(self.oids))
+        if self.parent:
+            self.parent._finish_part(packer, answered)
+
+    def _finish_part(self, packer, answered):
+        self.pending -= 1
+        self.answered = self.answered and answered
+        if not self.pending:
+            self.finish(packer, self.answered)
+
+
+@defer.inlineCallbacks
+def get_packed(agent, oids, packer, max_concurrent=1):
+    """Retrieves the values of a list of OIDs using GET requests, packing as
+    many OIDs into each request as the agent's packer allows.
+
+    Requests that get an empty response or time out are split and retried.
+    OIDs that cannot be retrieved even on their own are left out of the
+    result.  If several single-OID requests time out in a row, the agent is
+    considered unresponsive, and the values retrieved so far are returned.
+    If no values were retrieved at all, the result is a TimeoutError failure.
+
+    :param agent: An AgentProxy instance.
+    :param oids: A list of OIDs to retrieve.
+    :param packer: The RequestPacker for the agent.
+    :param max_concurrent: The maximum number of requests to have
+                           outstanding at the same time.
+    :returns: A deferred whose result is a dict of {oid: value}.
+
+    """
+    remaining = deque(oids)
+    retries = deque()
+    result = {}
+    single_timeouts = 0
+
+    def _next_request():
+        if retries:
+            return retries.popleft()
+        count = min(packer.size, len(remaining))
+        return _Request([remaining.popleft() for _ in range(count)])
+
+    @defer.inlineCallbacks
+    def _send_requests():
+        nonlocal single_timeouts
+        while ((retries or remaining)
+               and single_timeouts < MAX_SINGLE_TIMEOUTS):
+            request = _next_request()
+            count = len(request.oids)
+            try:
+                response = yield agent.get(request.oids)
+            except TimeoutError:
+                if request.parent is None:
+                    packer.on_timeout(count)
+                if count > 1:
+                    retries.extendleft(reversed(request.split(False)))
+                else:
+                    single_timeouts += 1
+                    _logger.debug("%r: timeout on %s", agent, request.oids)
+                    request.finish(packer, False)
+                continue
+
+            single_timeouts = 0
+            if response:
+                packer.on_success(count)
+                result.update(response)
+                request.finish(packer, True)
+            elif count > 1:
+                packer.on_empty(count)
+                retries.extendleft(reversed(request.split(True)))
+            else:
+                _logger.debug("%r: got no response for %s", agent,
+                              request.oids)
+                request.finish(packer, False)
+
+    senders = [_send_requests() for _ in range(max(1, max_concurrent))]
+    yield defer.gatherResults(senders, consumeErrors=True).addErrback(
+        _unwrap_first_error)
+    if single_timeouts >= MAX_SINGLE_TIMEOUTS:
+        if not result:
+            raise TimeoutError("%r: giving up after %d timeouts, no values "
+                               "retrieved" % (agent, single_timeouts))
+        _logger.warning("%r: giving up after %d timeouts, got %d of %d "
+                        "values", agent, single_timeouts, len(result),
+                        len(oids))
+    defer.returnValue(result)
+
+
+def _unwrap_first_error(failure):
+    failure.trap(defer.FirstError)
+    return failure.value.subFailure
+
+
+def get_request_packer(identity, initial_size):
+    """Returns the process-wide RequestPacker for the agent identified by
+    identity, creating it if necessary.
+
+    :param identity: A hashable object identifying an SNMP agent, such as
+                     the (ip, port) tuple returned by an AgentProxy's
+                     get_agent_identity().  It is logged as part of the
+                     packer state, and must not contain secrets such as
+                     community strings.
+    :param initial_size: The request size to start out with for agents that
+                         have not been seen before.
+
+    """
+    packer = _packers.get(identity)
+    if packer is None:
+        packer = RequestPacker(identity, initial_size)
+        _packers[identity] = packer
+    return packer
+
+
+def log_request_packers(level=logging.INFO):
+    """Dumps the state of all known request packers to the log"""
+    if not _packers:
+        return
+    _logger.log(level, "SNMP request packing state for %d agents:",
+                len(_packers))
+    for packer in _packers.values():
+        _logger.log(level, " - %r", packer)
@@ -0,0 +1,338 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Recording and offline replay of SNMP responses.
+
+When recording is enabled (using ipdevpolld's --record-snmp option), every
+varbind received by a job's AgentProxy is recorded, and saved to a compressed
+fixture file per netbox and job when the job is done.  Responses to queries
+of community indexed MIB instances are recorded separately for each instance.
+The community strings themselves are never saved, only their instance
+suffixes.
+
+A FixtureAgentProxy answers requests from such a fixture, in the same format
+as a real AgentProxy would, which lets plugins be run offline against data
+recorded from real devices.
+
+"""
+import base64
+import gzip
+import io
+import json
+import logging
+import os
+import time
+from bisect import bisect_left, bisect_right
+
+from django.utils import six
+from twisted.internet import defer
+
+from nav.metrics.names import escape_metric_name
+
+_logger = logging.getLogger(__name__)
+
+FIXTURE_SUFFIX = '.snmp.json.gz'
+
+_recording_directory = None
+
+
+class ResponseRecorder(object):
+    """Collects the varbinds received by one or more AgentProxy instances"""
+    def __init__(self):
+        self.instances = {}
+
+    def __len__(self):
+        return sum(len(varbinds) for varbinds in self.instances.values())
+
+    def record(self, community, varbinds):
+        """Records a list of (oid, value) varbinds received from an agent
+        using the given community.
+        """
+        instance = self.instances.setdefault(_instance_of(community), {})
+        for oid, value in varbinds or ():
+            instance[tuple(oid)] = value
+
+    def save(self, filename, **metadata):
+        """Saves the recorded varbinds to a fixture file.
+
+        :param metadata: Any additional JSON serializable data to store in the
+                         fixture, e.g. the sysname and job name.
+
+        """
+        data = dict(metadata)
+        data['recorded'] = time.time()
+        data['instances'] = dict(
+            (instance, [_encode_varbind(oid, value)
+                        for oid, value in sorted(varbinds.items())])
+            for instance, varbinds in self.instances.items())
+        with gzip.open(filename, 'wb') as fixture:
+            fixture.write(json.dumps(data, sort_keys=True).encode('utf-8'))
+        _logger.debug("saved %d recorded varbinds to %s", len(self), filename)
+
+
+def _instance_of(community):
+    """Returns the MIB instance part of a community string, e.g. '10' for the
+    community 'public@10', or '' for the base instance.
+    """
+    if isinstance(community, six.binary_type):
+        community = community.decode('utf-8', 'replace')
+    return (community or '').partition('@')[2]
+
+
+def _encode_varbind(oid, value):
+    oid = _oid_to_str(oid)
+    if value is None:
+        return [oid, 'n', None]
+    if isinstance(value, bool):
+        return [oid, 'i', int(value)]
+    if isinstance(value, six.integer_types):
+        return [oid, 'i', value]
+    if isinstance(value, float):
+        return [oid, 'f', value]
+    if isinstance(value, tuple):
+        return [oid, 'o', _oid_to_str(value)]
+    if isinstance(value, six.binary_type):
+        return [oid, 'b', base64.b64encode(value).decode('ascii')]
+    return [oid, 's', six.text_type(value)]
+
+
+def _decode_varbind(oid, kind, value):
+    oid = _str_to_oid(oid)
+    if kind == 'b':
+        return oid, base64.b64decode(value)
+    if kind == 'o':
+        return oid, _str_to_oid(value)
+    return oid, value
+
+
+def _oid_to_str(oid):
+    return '.' + '.'.join(str(arc) for arc in oid)
+
+
+def _str_to_oid(oid):
+    if isinstance(oid, tuple):
+        return oid
+    return tuple(int(arc) for arc in str(oid).strip('.').split('.') if arc)
+
+
+class SnmpFixture(object):
+    """Recorded varbinds of one device, for every recorded MIB instance"""
+    def __init__(self, instances, **metadata):
+        """Initializes a fixture.
+
+        :param instances: A dict of {instance: [(oid, value), ...]}, where
+                          instance is the MIB instance suffix of a community
+                          string ('' for the base instance), and oid is a tuple
+                          of integers.
+
+        """
+        self.metadata = metadata
+        self.instances = {}
+        for instance, varbinds in instances.items():
+            varbinds = sorted(varbinds)
+            self.instances[instance] = ([oid for oid, _ in varbinds],
+                                        [value for _, value in varbinds])
+
+    def __repr__(self):
+        return "<SnmpFixture {metadata!r} ({count} instances)>".format(
+            metadata=self.metadata, count=len(self.instances))
+
+    @classmethod
+    def load(cls, filename):
+        """Loads a fixture from a file saved by a ResponseRecorder"""
+        with gzip.open(filename, 'rb') as fixture:
+            data = json.loads(fixture.read().decode('utf-8'))
+        instances = dict(
+            (instance, [_decode_varbind(*varbind) for varbind in varbinds])
+            for instance, varbinds in data.pop('instances').items())
+        return cls(instances, **data)
+
+    def get(self, community, oid):
+        """Returns the value of oid in community's MIB instance, or None"""
+        oids, values = self.instances.get(_instance_of(community), ([], []))
+        index = bisect_left(oids, oid)
+        if index < len(oids) and oids[index] == oid:
+            return values[index]
+
+    def get_next(self, community, oid, count=1):
+        """Returns a list of up to count (oid, value) varbinds following oid
+        in community's MIB instance.
+        """
+        oids, values = self.instances.get(_instance_of(community), ([], []))
+        start = bisect_right(oids, oid)
+        end = start + count
+        return list(zip(oids[start:end], values[start:end]))
+
+    def subtree(self, community, oid):
+        """Returns a list of all (oid, value) varbinds below oid in
+        community's MIB instance.
+        """
+        oids, values = self.instances.get(_instance_of(community), ([], []))
+        start = bisect_right(oids, oid)
+        end = start
+        while end < len(oids) and oids[end][:len(oid)] == oid:
+            end += 1
+        return list(zip(oids[start:end], values[start:end]))
+
+    def make_agent_proxy(self, ip='127.0.0.1', community='public',
+                         snmp_version='v2c'):
+        """Returns a FixtureAgentProxy answering requests from this fixture"""
+        proxy_class = type('FixtureAgentProxy', (FixtureAgentProxy,),
+                           {'fixture': self})
+        return proxy_class(ip, 161, community=community,
+                           snmpVersion=snmp_version)
+
+
+class FixtureAgentProxy(object):
+    """A stand-in for AgentProxy, answering requests from an SnmpFixture.
+
+    Every request returns an already fired Deferred, so plugins run against a
+    FixtureAgentProxy spend their time in their own code, rather than waiting
+    for the network.  Use SnmpFixture.make_agent_proxy() to create instances.
+
+    """
+    fixture = None
+
+    # we're mimicking AgentProxy's API here:
+    # pylint: disable=C0103,W0613
+    def __init__(self, ip, port, community=None, snmpVersion='v2c',
+                 snmp_parameters=None, **kwargs):
+        from nav.ipdevpoll.snmp.common import SNMP_DEFAULTS
+        self.ip = ip
+        self.port = port
+        self.community = community
+        self.snmpVersion = snmpVersion
+        self.snmp_parameters = snmp_parameters or SNMP_DEFAULTS
+        self.stats = None
+        self.recorder = None
+        self.requests = 0
+
+    def __repr__(self):
+        return "<FixtureAgentProxy({ip!r}, ...) at {ident}>".format(
+            ip=self.ip, ident=id(self))
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def reset(self):
+        self.stats = None
+
+    def get_cache_identity(self):
+        return (self.ip, self.port, self.community)
+
+    def get_agent_identity(self):
+        return (self.ip, self.port)
+
+    def _get(self, oids, *args, **kwargs):
+        self.requests += 1
+        return defer.succeed(
+            [(oid, self.fixture.get(self.community, oid))
+             for oid in (_str_to_oid(oid) for oid in oids)])
+
+    def _walk(self, oid, *args, **kwargs):
+        self.requests += 1
+        return defer.succeed(
+            self.fixture.get_next(self.community, _str_to_oid(oid)))
+
+    def _getbulk(self, nonrepeaters, maxrepetitions, oids):
+        self.requests += 1
+        result = []
+        for oid in oids:
+            result.extend(self.fixture.get_next(self.community,
+                                                _str_to_oid(oid),
+                                                max(1, maxrepetitions)))
+        return defer.succeed(result)
+
+    def get(self, oids, *args, **kwargs):
+        return self._get(oids).addCallback(_as_dict)
+
+    def walk(self, oid, *args, **kwargs):
+        return self._walk(oid).addCallback(_as_dict)
+
+    def getbulk(self, nonrepeaters, maxrepetitions, oids):
+        return self._getbulk(nonrepeaters, maxrepetitions,
+                             oids).addCallback(_as_dict)
+
+    def getTable(self, oids, **kwargs):
+        self.requests += 1
+        return defer.succeed(dict(
+            (oid, _as_dict(self.fixture.subtree(self.community,
+                                                _str_to_oid(oid))))
+            for oid in oids))
+
+
+def _as_dict(varbinds):
+    return dict((_oid_to_str(oid), value) for oid, value in varbinds)
+
+
+def set_recording_directory(directory):
+    """Enables recording of SNMP responses to fixture files in directory, or
+    disables recording if directory is None.
+    """
+    global _recording_directory
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    _recording_directory = directory
+
+
+def get_recorder():
+    """Returns a new ResponseRecorder if recording is enabled, else None"""
+    if _recording_directory:
+        return ResponseRecorder()
+
+
+def save_recording(recorder, sysname, job_name):
+    """Saves the responses recorded by recorder to a fixture file named after
+    the sysname and job in the recording directory.
+
+    :returns: The name of the fixture file.
+
+    """
+    filename = os.path.join(_recording_directory,
+                            get_fixture_name(sysname, job_name))
+    recorder.save(filename, sysname=sysname, job=job_name)
+    return filename
+
+
+def get_fixture_name(sysname, job_name):
+    """Returns the file name of the fixture of a netbox and job"""
+    return "{sysname}.{job}{suffix}".format(
+        sysname=escape_metric_name(sysname), job=job_name,
+        suffix=FIXTURE_SUFFIX)
+
+
+def load_snmprec_fixture(filename):
+    """Loads an SnmpFixture from an snmpsim .snmprec file.
+
+    This allows existing snmpsim fixtures to be used for replays. The whole
+    file is loaded as the base MIB instance.
+
+    """
+    from nav.ipdevpoll.benchmark import ber
+    from nav.ipdevpoll.benchmark.agent import parse_snmprec
+
+    with io.open(filename, 'r', encoding='utf-8', errors='replace') as rec:
+        records = list(parse_snmprec(rec.read().splitlines()))
+    varbinds = []
+    for oid, tag, value in records:
+        if tag == ber.IP_ADDRESS and isinstance(value, six.text_type):
+            value = bytes(bytearray(int(octet) for octet in value.split('.')))
+        elif tag == ber.NULL:
+            value = None
+        varbinds.append((oid, value))
+    return SnmpFixture({'': varbinds}, source=filename)
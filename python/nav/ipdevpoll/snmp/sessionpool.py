@@ -0,0 +1,214 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""A process-wide pool of open SNMP sessions.
+
+Opening an SNMP session means allocating a socket and, for SNMPv3, engine ID
+discovery and time synchronization round trips.  Rather than opening and
+closing a session for every job, jobs can borrow open AgentProxy instances
+from a SessionPool, and return them when they are done.
+
+"""
+import logging
+import time
+
+from twisted.internet import task
+
+from nav.util import parse_interval
+
+_logger = logging.getLogger(__name__)
+
+CONFIG_SECTION = 'sessionpool'
+
+_session_pool = None
+
+
+class SessionPool(object):
+    """A pool of open AgentProxy instances, keyed by agent address and SNMP
+    credentials.
+
+    A borrowed session is used exclusively by the borrower until it is
+    released back to the pool.  Idle sessions are closed after a configurable
+    amount of time.
+
+    """
+    def __init__(self, factory, max_sessions=100, idle_timeout=300):
+        """Initializes a session pool.
+
+        :param factory: A callable that creates a new, unopened AgentProxy
+                        instance. It will be called with the same arguments
+                        as given to borrow().
+        :param max_sessions: The maximum number of open sessions to keep in
+                             the pool, busy or idle.
+        :param idle_timeout: The number of seconds an idle session is kept
+                             open.
+
+        """
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._idle = {}  # key -> [(released_at, agent), ...]
+        self._busy = set()
+        self._expiry_loop = None
+
+        self.created = 0
+        self.reused = 0
+        self.expired = 0
+
+    def __repr__(self):
+        return ("<SessionPool busy={busy} idle={idle} max={max} "
+                "created={created} reused={reused} expired={expired}>").format(
+                    busy=len(self._busy), idle=self.idle_count,
+                    max=self.max_sessions, created=self.created,
+                    reused=self.reused, expired=self.expired)
+
+    @property
+    def idle_count(self):
+        """The number of idle sessions in the pool"""
+        return sum(len(sessions) for sessions in self._idle.values())
+
+    @staticmethod
+    def make_key(ip, port, community, snmpVersion):
+        """Returns the pool key of a set of session parameters"""
+        return (str(ip), port, community, snmpVersion)
+
+    def borrow(self, ip, port, community, snmpVersion, **kwargs):
+        """Borrows an open session from the pool, opening a new one if there
+        are no idle sessions to the same agent with the same credentials.
+
+        Sessions must be returned to the pool using release().
+
+        """
+        self._start_expiry_loop()
+        key = self.make_key(ip, port, community, snmpVersion)
+        sessions = self._idle.get(key)
+        if sessions:
+            _released_at, agent = sessions.pop()
+            if not sessions:
+                del self._idle[key]
+            self._busy.add(agent)
+            agent.reset()
+            self.reused += 1
+            return agent
+
+        if len(self._busy) + self.idle_count >= self.max_sessions:
+            self._close_oldest_idle_session()
+
+        agent = self.factory(ip, port, community=community,
+                             snmpVersion=snmpVersion, **kwargs)
+        try:
+            agent.open()
+        except Exception:
+            agent.close()
+            raise
+        self.created += 1
+        if len(self._busy) + self.idle_count < self.max_sessions:
+            agent.pool_key = key
+            self._busy.add(agent)
+        else:
+            _logger.debug("session pool is full, %r will not be pooled",
+                          agent)
+            agent.pool_key = None
+        return agent
+
+    def release(self, agent):
+        """Returns a borrowed session to the pool.  Sessions that cannot be
+        pooled are closed.
+        """
+        key = getattr(agent, 'pool_key', None)
+        if agent not in self._busy or key is None:
+            agent.close()
+            return
+        self._busy.discard(agent)
+        self._idle.setdefault(key, []).append((time.time(), agent))
+
+    def expire_idle_sessions(self):
+        """Closes all sessions that have been idle longer than the idle
+        timeout.
+        """
+        threshold = time.time() - self.idle_timeout
+        for key in list(self._idle):
+            sessions = self._idle[key]
+            keep = [(released_at, agent) for released_at, agent in sessions
+                    if released_at > threshold]
+            for released_at, agent in sessions:
+                if released_at <= threshold:
+                    agent.close()
+                    self.expired += 1
+            if keep:
+                self._idle[key] = keep
+            else:
+                del self._idle[key]
+
+    def _close_oldest_idle_session(self):
+        oldest = None
+        for key, sessions in self._idle.items():
+            for released_at, _agent in sessions:
+                if oldest is None or released_at < oldest[0]:
+                    oldest = (released_at, key)
+        if oldest:
+            _released_at, key = oldest
+            sessions = self._idle[key]
+            sessions.sort(key=lambda entry: entry[0])
+            _released_at, agent = sessions.pop(0)
+            if not sessions:
+                del self._idle[key]
+            agent.close()
+            self.expired += 1
+
+    def _start_expiry_loop(self):
+        if self._expiry_loop is None:
+            self._expiry_loop = task.LoopingCall(self.expire_idle_sessions)
+            self._expiry_loop.start(
+                interval=max(1, self.idle_timeout / 2.0), now=False)
+
+    def log_stats(self):
+        """Logs the pool statistics"""
+        _logger.info("SNMP session pool: %r", self)
+
+
+def get_session_pool(config=None):
+    """Returns the process-wide SessionPool instance, or None if session
+    pooling has not been enabled in ipdevpoll.conf.
+    """
+    global _session_pool
+    if _session_pool is None:
+        if config is None:
+            from nav.ipdevpoll.config import ipdevpoll_conf as config
+        if not config.getboolean(CONFIG_SECTION, 'enabled', fallback=False):
+            _session_pool = False
+        else:
+            _session_pool = make_session_pool(config)
+    return _session_pool if _session_pool else None
+
+
+def make_session_pool(config):
+    """Makes a SessionPool instance from an ipdevpoll config object"""
+    from nav.ipdevpoll.snmp import AgentProxy
+
+    max_sessions = config.getint(CONFIG_SECTION, 'max-sessions',
+                                 fallback=100)
+    idle_timeout = parse_interval(
+        config.get(CONFIG_SECTION, 'idle-timeout', fallback='5m'))
+    _logger.debug("SNMP session pool enabled, max-sessions=%d, "
+                  "idle-timeout=%ds", max_sessions, idle_timeout)
+    return SessionPool(AgentProxy, max_sessions, idle_timeout)
+
+
+def log_session_pool_stats():
+    """Logs the statistics of the process-wide session pool, if enabled"""
+    pool = get_session_pool()
+    if pool:
+        pool.log_stats()
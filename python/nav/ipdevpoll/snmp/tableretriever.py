@@ -0,0 +1,152 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Multi-column table retrieval using GETBULK.
+
+The table retriever in pynetsnmp walks each requested OID in turn, which
+means that retrieving N columns of a table costs N separate walks.  Like
+NET-SNMP's snmptable program, the retriever in this module walks several
+columns in lockstep by putting one varbind per column into each GETBULK
+request.
+
+"""
+import logging
+
+from twisted.internet import defer
+
+from nav.oids import OID
+
+_logger = logging.getLogger(__name__)
+
+
+class _ColumnStatus(object):
+    """Keeps track of the walk of a single column"""
+    def __init__(self, start_oid_str):
+        self.start_oid_str = start_oid_str
+        self.start_oid = OID(start_oid_str)
+        self.result = []
+        self.finished = False
+
+    @property
+    def last_oid(self):
+        """Returns the last OID retrieved for this column, or the column's
+        start OID if nothing has been retrieved yet.
+        """
+        return self.result[-1][0] if self.result else self.start_oid
+
+    def __repr__(self):
+        return "<_ColumnStatus %s (%d rows%s)>" % (
+            self.start_oid_str, len(self.result),
+            ", finished" if self.finished else "")
+
+
+class MultiColumnTableRetriever(object):
+    """Retrieves multiple table columns in parallel, using a single GETBULK
+    varbind list for up to `max_columns` columns at a time.
+
+    The result format is identical to that of pynetsnmp's getTable(), i.e. a
+    dictionary that maps each requested OID string to a dictionary of
+    {oid_string: value} pairs.
+
+    """
+    def __init__(self, proxy, oids, max_repetitions=10, max_columns=10):
+        """Initializes a retriever.
+
+        :param proxy: An AgentProxy instance that provides a `_getbulk()`
+                      method.
+        :param oids: A list of OID strings of the columns to retrieve.
+        :param max_repetitions: The max-repetitions value to use in each
+                                GETBULK request.
+        :param max_columns: The maximum number of columns to walk in a single
+                            GETBULK request.
+
+        """
+        self.proxy = proxy
+        self.columns = [_ColumnStatus(oid) for oid in oids]
+        self.max_repetitions = max(1, max_repetitions)
+        self.max_columns = max(1, max_columns)
+        self.requests = 0
+        self.deferred = None
+
+    def __call__(self):
+        self.deferred = defer.Deferred()
+        self._fetch_some_more()
+        return self.deferred
+
+    def _fetch_some_more(self):
+        active = [col for col in self.columns
+                  if not col.finished][:self.max_columns]
+        if not active:
+            _logger.debug("retrieved %d columns in %d requests",
+                          len(self.columns), self.requests)
+            self.deferred.callback(self._make_result())
+            return
+
+        self.requests += 1
+        oids = [tuple(col.last_oid) for col in active]
+        deferred = self.proxy._getbulk(0, self.max_repetitions, oids)
+        deferred.addCallback(self._save_results, active)
+        deferred.addCallback(lambda _: self._fetch_some_more())
+        deferred.addErrback(self._error)
+
+    def _save_results(self, varbinds, active):
+        if not varbinds:
+            self._shrink_request(active)
+            return
+
+        # An agent may truncate its response to fit it into a single PDU,
+        # in which case the last columns may get no varbinds at all.  Those
+        # columns are simply left for the next request.
+        for position, (oid, value) in enumerate(varbinds):
+            col = active[position % len(active)]
+            if col.finished:
+                continue
+            oid = OID(oid)
+            if col.start_oid.is_a_prefix_of(oid) and oid > col.last_oid:
+                col.result.append((oid, value))
+            else:
+                # walked past the column, reached endOfMibView, or the agent
+                # went backwards
+                col.finished = True
+
+    def _shrink_request(self, active):
+        """Reduces the size of the next request after an empty response.
+
+        Agents that cannot fit a response into a single PDU will respond with
+        a tooBig error, which is reported to us as an empty response.  We
+        first reduce the repetition count, then the number of columns per
+        request, before finally giving up on the columns in question.
+
+        """
+        if self.max_repetitions > 1:
+            self.max_repetitions //= 2
+        elif self.max_columns > 1 and len(active) > 1:
+            self.max_columns = len(active) // 2
+        else:
+            for col in active:
+                col.finished = True
+            return
+        _logger.debug("empty GETBULK response from %r, retrying with "
+                      "max_repetitions=%d, max_columns=%d",
+                      self.proxy, self.max_repetitions, self.max_columns)
+
+    def _error(self, failure):
+        self.deferred.errback(failure)
+
+    def _make_result(self):
+        return {
+            col.start_oid_str: {str(oid): value for oid, value in col.result}
+            for col in self.columns
+        }
@@ -14,13 +14,33 @@
 # License along with NAV. If not, see <http://www.gnu.org/licenses/>.
 #
 """Storage layer for ipdevpoll"""
+import datetime
+import decimal
+import json
+import operator
+from collections import defaultdict, Counter
+from functools import reduce
 
 import django.db.models
+from django.core.exceptions import FieldDoesNotExist, ValidationError
 from django.db import transaction
 from django.utils import six
 
 from nav import toposort
 from nav import ipdevpoll
+from nav.ipdevpoll.config import ipdevpoll_conf
+
+# The maximum number of rows to insert or update in a single statement
+BULK_BATCH_SIZE = 500
+# Returned by DefaultManager._get_lookup_key() for lookups that cannot be
+# resolved in bulk
+_UNRESOLVABLE = object()
+
+# Outcomes of saving a single shadow object
+INSERTED = 'inserted'
+UPDATED = 'updated'
+UNCHANGED = 'unchanged'
+DELETED = 'deleted'
 
 
 class MetaShadow(type):
@@ -66,6 +86,7 @@ class DefaultManager(object):
 
     """
     _logger = ipdevpoll.ContextLogger()
+    bulk_save = ipdevpoll_conf.getboolean('ipdevpoll', 'bulk_save')
 
     def __init__(self, cls, containers):
         """Creates a storage manager.
@@ -76,6 +97,7 @@ class DefaultManager(object):
         """
         self.cls = cls
         self.containers = containers
+        self.save_counts = Counter()
 
     def prepare(self):
         """Prepares managed shadows in containers"""
@@ -83,8 +105,262 @@ class DefaultManager(object):
 
     def save(self):
         """Saves managed shadows in containers"""
-        for obj in self.get_managed():
-            obj.save(self.containers)
+        managed = list(self.get_managed())
+        if self.bulk_save and len(managed) > 1 and self.can_bulk_save():
+            self.save_in_bulk(managed)
+        else:
+            for obj in managed:
+                self._count(obj.save(self.containers))
+
+    def _count(self, outcome, count=1):
+        """Counts the outcome of saving objects. Outcomes of None are not
+        counted, as these come from shadow classes that don't report what
+        they did.
+        """
+        if outcome:
+            self.save_counts[outcome] += count
+
+    def can_bulk_save(self):
+        """Returns True if the managed shadow class can be saved using bulk
+        operations.
+
+        Classes that override the Shadow save logic, or whose Django models
+        override save(), must be saved one object at a time to retain their
+        semantics.
+
+        """
+        model = self.cls.__shadowclass__
+        return (self.cls.save == Shadow.save and
+                self.cls.update == Shadow.update and
+                model.save == django.db.models.Model.save and
+                not model._meta.parents)
+
+    def save_in_bulk(self, objects):
+        """Saves a list of shadow objects of the managed class using as few
+        database statements as possible.
+
+        Existing rows are looked up using one query per primary key or
+        natural key lookup of the class, deletions are done using a single
+        delete query, while inserts and updates are batched into multi-row
+        statements.
+
+        """
+        self._prefetch_existing_models(objects)
+        missing = self._prefetch_existing_models_by_lookups(objects)
+        deletes, updates, inserts, deferred = [], defaultdict(list), [], []
+        for obj in objects:
+            if self._refers_to_own_class(obj):
+                # may refer to an object that hasn't been inserted yet
+                deferred.append(obj)
+                continue
+            if id(obj) in missing:
+                existing = None
+            else:
+                existing = obj.get_existing_model(self.containers)
+            if obj.delete:
+                if existing:
+                    deletes.append(existing.pk)
+            elif existing:
+                diff = obj.get_diff_attrs(existing)
+                if diff:
+                    updates[frozenset(diff)].append(obj)
+                else:
+                    self._count(UNCHANGED)
+            else:
+                obj._cached_missing_model = id(obj) in missing
+                model = obj.convert_to_model(self.containers)
+                obj._cached_missing_model = False
+                if model:
+                    inserts.append((obj, model))
+
+        if deletes:
+            self.cls.__shadowclass__.objects.filter(pk__in=deletes).delete()
+            self._count(DELETED, len(deletes))
+        for diff, objs in updates.items():
+            self._bulk_update(objs, diff)
+        if inserts:
+            self._bulk_insert(inserts)
+        for obj in deferred:
+            self._count(obj.save(self.containers))
+        self._logger.debug("bulk saved %s: %r", self.cls.__name__,
+                           dict(self.save_counts))
+
+    def _refers_to_own_class(self, obj):
+        return any(isinstance(getattr(obj, attr), self.cls)
+                   for attr in obj.get_touched())
+
+    def _prefetch_existing_models(self, objects):
+        """Looks up the existing models of objects with known primary keys
+        using a single query.
+        """
+        if self.cls.get_existing_model != Shadow.get_existing_model:
+            return
+        wanted = {}
+        for obj in objects:
+            pkey = obj.get_primary_key()
+            if (pkey and not isinstance(pkey, Shadow)
+                    and not obj._cached_existing_model):
+                wanted[pkey] = obj
+        if wanted:
+            found = self.cls.__shadowclass__.objects.in_bulk(list(wanted))
+            for pkey, model in found.items():
+                wanted[pkey].set_existing_model(model)
+
+    def _prefetch_existing_models_by_lookups(self, objects):
+        """Looks up the existing models of objects without known primary keys
+        by their natural keys, using a single query per lookup of the class.
+
+        Objects whose lookups cannot all be resolved in bulk, or that match
+        multiple rows, are left for get_existing_model() to look up one at a
+        time.
+
+        :returns: The set of ids of the objects that are known not to exist
+                  in the database.
+
+        """
+        if self.cls.get_existing_model != Shadow.get_existing_model:
+            return set()
+        unresolved = [obj for obj in objects
+                      if obj.get_primary_key() is None
+                      and not obj._cached_existing_model]
+        exhaustive = {id(obj) for obj in unresolved}
+        for lookup in self.cls.__lookups__:
+            fields = lookup if isinstance(lookup, tuple) else (lookup,)
+            keyed = defaultdict(list)
+            for obj in unresolved:
+                key = self._get_lookup_key(obj, fields,
+                                           isinstance(lookup, tuple))
+                if key is _UNRESOLVABLE:
+                    exhaustive.discard(id(obj))
+                elif key is not None:
+                    keyed[key].append(obj)
+            if not keyed:
+                continue
+
+            for key, models in self._find_by_lookup(fields, list(keyed)):
+                for obj in keyed.get(key, ()):
+                    if len(models) > 1:
+                        exhaustive.discard(id(obj))
+                    else:
+                        obj.set_existing_model(models[0])
+            unresolved = [obj for obj in unresolved
+                          if id(obj) in exhaustive
+                          and not obj._cached_existing_model]
+        return {id(obj) for obj in unresolved if id(obj) in exhaustive}
+
+    def _get_lookup_key(self, obj, fields, is_tuple):
+        """Returns the normalized values of obj's lookup fields.
+
+        :returns: A tuple of values, None if the lookup isn't applicable to
+                  obj, or _UNRESOLVABLE if the lookup must be done by
+                  get_existing_model().
+
+        """
+        meta = self.cls.__shadowclass__._meta
+        key = []
+        for name in fields:
+            value = getattr(obj, name)
+            if isinstance(value, Shadow):
+                value = value.get_primary_key()
+                if value is None or isinstance(value, Shadow):
+                    return _UNRESOLVABLE
+            elif isinstance(value, django.db.models.Model):
+                value = value.pk
+            if value is None:
+                # tuple lookups match NULL values, which is left to the
+                # database
+                return _UNRESOLVABLE if is_tuple else None
+            try:
+                key.append(_normalize_lookup_value(meta.get_field(name),
+                                                   value))
+            except ValidationError:
+                return _UNRESOLVABLE
+        return tuple(key)
+
+    def _find_by_lookup(self, fields, keys):
+        """Finds the rows matching a list of lookup keys.
+
+        :returns: A list of (key, [model, ...]) tuples.
+
+        """
+        model_class = self.cls.__shadowclass__
+        meta = model_class._meta
+        model_fields = [meta.get_field(name) for name in fields]
+        attnames = [field.attname for field in model_fields]
+        found = defaultdict(list)
+        for index in range(0, len(keys), BULK_BATCH_SIZE):
+            batch = keys[index:index + BULK_BATCH_SIZE]
+            if len(attnames) == 1:
+                query = django.db.models.Q(**{
+                    attnames[0] + '__in': [key[0] for key in batch]})
+            else:
+                query = reduce(operator.or_, (
+                    django.db.models.Q(**dict(zip(attnames, key)))
+                    for key in batch))
+            for model in model_class.objects.filter(query):
+                key = tuple(_normalize_lookup_value(field,
+                                                   getattr(model, attname))
+                            for field, attname in zip(model_fields,
+                                                      attnames))
+                found[key].append(model)
+        return list(found.items())
+
+    def _bulk_insert(self, inserts):
+        model_class = self.cls.__shadowclass__
+        models = [model for _obj, model in inserts]
+        model_class.objects.bulk_create(models, batch_size=BULK_BATCH_SIZE)
+        for obj, model in inserts:
+            # bulk_create sets the primary keys of the inserted models on
+            # PostgreSQL, these are passed on to the shadows just as
+            # Shadow.save() would do.
+            if not obj.get_primary_key():
+                obj.set_primary_key(model.pk)
+            obj._touched.clear()
+        self._count(INSERTED, len(inserts))
+
+    def _bulk_update(self, objs, diff):
+        """Updates the diff attributes of objs using UPDATE ... FROM
+        statements, with the new row values given as a JSON document.
+
+        Using json_populate_recordset() ensures the new values are converted
+        to the actual column types of the table.
+
+        """
+        meta = self.cls.__shadowclass__._meta
+        fields = [meta.get_field(attr) for attr in sorted(diff)]
+        rows = []
+        for obj in objs:
+            model = obj.convert_to_model(self.containers)
+            row = {meta.pk.column: _json_value(meta.pk.get_prep_value(
+                getattr(model, meta.pk.attname)))}
+            for field in fields:
+                value = field.get_prep_value(getattr(model, field.attname))
+                if isinstance(value, (dict, list, tuple, set)):
+                    # not representable as a single column value in JSON
+                    self._count(UPDATED if obj.update(self.containers)
+                                else UNCHANGED)
+                    break
+                row[field.column] = _json_value(value)
+            else:
+                rows.append(row)
+                obj._touched.clear()
+        if not rows:
+            return
+
+        quote = django.db.connection.ops.quote_name
+        sql = "UPDATE {table} AS t SET {assignments} " \
+              "FROM json_populate_recordset(NULL::{table}, %s) AS v " \
+              "WHERE t.{pkey} = v.{pkey}".format(
+                  table=quote(meta.db_table),
+                  assignments=", ".join(
+                      "{0} = v.{0}".format(quote(field.column))
+                      for field in fields),
+                  pkey=quote(meta.pk.column))
+        cursor = django.db.connection.cursor()
+        for index in range(0, len(rows), BULK_BATCH_SIZE):
+            cursor.execute(sql, [json.dumps(
+                rows[index:index + BULK_BATCH_SIZE])])
+        self._count(UPDATED, len(rows))
 
     def cleanup(self):
         """Runs any necessary cleanup hooks after save is done"""
@@ -159,6 +435,7 @@ class Shadow(object):
         self.update_only = False
         self._cached_converted_model = None
         self._cached_existing_model = None
+        self._cached_missing_model = False
 
     def __eq__(self, other):
         if not isinstance(other, self.__class__):
@@ -340,6 +617,8 @@ class Shadow(object):
         if hasattr(self, '_cached_existing_model') and \
                 self._cached_existing_model:
             return self._cached_existing_model
+        if getattr(self, '_cached_missing_model', False):
+            return None
         if containers is None:
             containers = {}
 
@@ -470,12 +749,18 @@ class Shadow(object):
                 delattr(self, attr)
 
     def save(self, containers):
-        """Saves this container to the database synchronously"""
+        """Saves this container to the database synchronously.
+
+        :returns: One of the INSERTED, UPDATED, UNCHANGED or DELETED
+                  constants, or None if nothing was saved.
+
+        """
         existing = self.get_existing_model(containers)
         if self.delete and existing:
             existing.delete()
+            return DELETED
         elif existing:
-            self.update(containers)
+            return UPDATED if self.update(containers) else UNCHANGED
         else:
             obj = self.convert_to_model(containers)
             if obj:
@@ -487,6 +772,7 @@ class Shadow(object):
                 if not self.get_primary_key():
                     self.set_primary_key(obj.pk)
                 self._touched.clear()
+                return INSERTED
 
     def update(self, containers):
         """Updates the existing object in the database (synchronously) with
@@ -495,6 +781,8 @@ class Shadow(object):
         If none of the touched attributes of this instance are different from
         the existing object, no update is executed.
 
+        :returns: True if the existing object was updated.
+
         """
         existing = self.get_existing_model(containers)
         diff = self.get_diff_attrs(existing)
@@ -507,23 +795,82 @@ class Shadow(object):
             myself = self.__shadowclass__.objects.filter(**filtr)
             myself.update(**update)
             self._touched.clear()
+            return True
+        return False
 
     def get_diff_attrs(self, other):
         """Returns a list of the names of the touched attributes on self whose
         values are are different from the corresponding attributes on other.
 
+        Values are normalized by their model fields before comparison, so
+        that e.g. an IP object and its string representation are considered
+        equal. Foreign keys are compared by their primary key values, to
+        avoid loading related objects from the database.
+
         """
         def _is_different(attr):
             myvalue = getattr(self, attr)
-            if isinstance(myvalue, Shadow):
-                attr = "%s_id" % attr
-                myvalue = myvalue.id
-            return hasattr(other, attr) and myvalue != getattr(other, attr)
+            try:
+                field = self._meta.get_field(attr)
+            except FieldDoesNotExist:
+                return hasattr(other, attr) and myvalue != getattr(other, attr)
+
+            if field.is_relation:
+                while isinstance(myvalue, Shadow):
+                    myvalue = myvalue.get_primary_key()
+                if isinstance(myvalue, django.db.models.Model):
+                    myvalue = myvalue.pk
+                return myvalue != getattr(other, field.attname, myvalue)
+
+            if not hasattr(other, attr):
+                return False
+            othervalue = getattr(other, attr)
+            if myvalue == othervalue:
+                return False
+            return _normalize(field, myvalue) != _normalize(field, othervalue)
 
         return [a for a in self.get_touched()
                 if _is_different(a)]
 
 
+def _normalize(field, value):
+    """Normalizes value to the Python type of a model field, if possible"""
+    try:
+        return field.to_python(value)
+    except Exception:  # pylint: disable=broad-except
+        return value
+
+
+def _normalize_lookup_value(field, value):
+    """Converts a lookup value to the Python type of a model field, so that
+    values set by plugins can be compared to those loaded from the database.
+    Foreign key values are given as primary keys of the related model.
+    """
+    if field.is_relation:
+        field = field.target_field
+    return field.to_python(value)
+
+
+def _json_value(value):
+    """Converts a database field value into something that can be serialized
+    as JSON, in a form PostgreSQL will parse into the correct column type.
+    """
+    if isinstance(value, datetime.datetime):
+        if value == datetime.datetime.max:
+            return 'infinity'
+        if value == datetime.datetime.min:
+            return '-infinity'
+        return value.isoformat()
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if value is None or isinstance(value, (bool, float) + six.integer_types +
+                                   six.string_types):
+        return value
+    return six.text_type(value)
+
+
 def shadowify(model):
     """Return a properly shadowed version of a Django model object.
 
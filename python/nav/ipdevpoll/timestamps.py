@@ -15,6 +15,7 @@
 #
 """SNMP timestamps and sysUpTime comparisons"""
 import json
+import time
 
 from twisted.internet import defer
 
@@ -132,36 +133,187 @@ class TimestampChecker(object):
                   reboot) is detected.
 
         """
-        if not self.loaded_times:
-            self._logger.debug("%r: no previous collection times found",
-                               self.var_name)
-            return True
+        return _is_changed(self._logger, self.var_name, self.loaded_times,
+                           self.collected_times, max_deviation)
 
-        old_uptime, old_times = (self.loaded_times[0],
-                                 self.loaded_times[1:])
-        new_uptime, new_times = (self.collected_times[0],
-                                 self.collected_times[1:])
-        uptime_deviation = self.snmpv2mib.get_uptime_deviation(
-            old_uptime, new_uptime)
 
-        if None in new_times:
-            self._logger.debug("%r: None in timestamp list: %r",
-                               self.var_name, new_times)
-            return True
-        if uptime_deviation is None:
-            self._logger.debug("%r: unable to calculate uptime deviation for "
-                               "old/new: %r/%r",
-                               self.var_name, old_times, new_times)
-            return True
-        if list(old_times) != list(new_times):
-            self._logger.debug("%r: timestamps have changed: %r / %r",
-                               self.var_name, old_times, new_times)
-            return True
-        elif abs(uptime_deviation) > max_deviation:
-            self._logger.debug("%r: sysUpTime deviation detected, possible "
-                               "reboot", self.var_name)
+class ChangeIndicators(object):
+    """Collects and compares the change indicators declared by the plugins of
+    a job.
+
+    This is the declarative counterpart of TimestampChecker: Plugins list the
+    scalar timestamps that indicate changes to the data they collect in their
+    CHANGE_INDICATORS attribute.  The indicators of every plugin of a job are
+    collected along with sysUpTime in a single SNMP GET request, and the
+    values stored by the previous successful job run are loaded from the
+    database in a single query.
+
+    The values of each plugin are stored as a NetboxInfo entry named after
+    the plugin, in the same format as that of a TimestampChecker using the
+    same variable name.
+
+    """
+    _logger = ContextLogger()
+
+    def __init__(self, agent, containers, plugins):
+        """Initializes a change indicator check.
+
+        :param agent: The AgentProxy of the job.
+        :param containers: The ContainerRepository of the job.
+        :param plugins: The plugin instances of the job.  Plugins that
+                        declare no change indicators are ignored.
+
+        """
+        # pylint: disable=W0104
+        self._logger
+        self.agent = agent
+        self.containers = containers
+        self.plugins = [plugin for plugin in plugins
+                        if plugin.CHANGE_INDICATORS]
+        self.collected_times = {}
+        self.loaded_times = {}
+
+    @staticmethod
+    def get_var_name(plugin):
+        """Returns the NetboxInfo variable name of a plugin's indicators"""
+        return plugin.INDICATOR_VAR_NAME or plugin.name().lower()
+
+    @staticmethod
+    def get_oid(indicator):
+        """Returns the OID of a (MibRetriever class, scalar name) indicator"""
+        mib, name = indicator
+        return mib.nodes[name].oid + (0,)
+
+    def get_oids(self):
+        """Returns the list of OIDs to collect, starting with sysUpTime"""
+        oids = [self.get_oid((Snmpv2Mib, 'sysUpTime'))]
+        for plugin in self.plugins:
+            for indicator in plugin.CHANGE_INDICATORS:
+                oid = self.get_oid(indicator)
+                if oid not in oids:
+                    oids.append(oid)
+        return oids
+
+    # A failed request only means the plugins will have to run in full, so
+    # any error is acceptable
+    # pylint: disable=W0703
+    @defer.inlineCallbacks
+    def collect(self):
+        """Collects the current values of all change indicators"""
+        if not self.plugins:
+            defer.returnValue(self.collected_times)
+
+        oids = self.get_oids()
+        try:
+            result = yield self.agent.get([str(oid) for oid in oids])
+        except Exception as error:
+            self._logger.debug("unable to collect change indicators: %s",
+                               error)
+            defer.returnValue(self.collected_times)
+        timestamp = time.mktime(time.localtime())
+
+        def _value(oid):
+            return result.get(oid, result.get(str(oid), None))
+
+        sysuptime = _value(oids[0])
+        if sysuptime is None:
+            self._logger.debug("sysUpTime missing from change indicators: %r",
+                               result)
+            defer.returnValue(self.collected_times)
+
+        for plugin in self.plugins:
+            self.collected_times[self.get_var_name(plugin)] = (
+                (timestamp, sysuptime),) + tuple(
+                    _value(self.get_oid(indicator))
+                    for indicator in plugin.CHANGE_INDICATORS)
+        defer.returnValue(self.collected_times)
+
+    # We must ignore deserialization failures by catching the Exception base
+    # class
+    # pylint: disable=W0703
+    @defer.inlineCallbacks
+    def load(self):
+        """Loads the indicator values stored by the previous job run"""
+        var_names = [self.get_var_name(plugin) for plugin in self.plugins]
+
+        def _deserialize():
+            infos = manage.NetboxInfo.objects.filter(
+                netbox__id=self._get_netbox().id,
+                key=INFO_KEY_NAME,
+                variable__in=var_names,
+            ).values_list('variable', 'value')
+            loaded = {}
+            for variable, value in infos:
+                try:
+                    loaded[variable] = json.loads(value)
+                except Exception:
+                    pass
+            return loaded
+
+        if var_names:
+            self.loaded_times = yield db.run_in_thread(_deserialize)
+        defer.returnValue(self.loaded_times)
+
+    def is_changed(self, plugin, max_deviation=60):
+        """Verifies whether any of a plugin's change indicators have changed.
+
+        :returns: True if the indicators could not be collected, if any of
+                  them differ from the loaded ones, or if a discontinuity in
+                  sysUpTime is detected.  See TimestampChecker.is_changed().
+
+        """
+        var_name = self.get_var_name(plugin)
+        collected_times = self.collected_times.get(var_name)
+        if not collected_times:
             return True
-        else:
-            self._logger.debug("%r: timestamps appear unchanged since last run",
-                               self.var_name)
-            return False
+        return _is_changed(self._logger, var_name,
+                           self.loaded_times.get(var_name), collected_times,
+                           max_deviation)
+
+    def save(self):
+        """Saves the collected indicator values to the ContainerRepository"""
+        netbox = self._get_netbox()
+        for var_name, times in self.collected_times.items():
+            info = self.containers.factory((INFO_KEY_NAME, var_name),
+                                           shadows.NetboxInfo)
+            info.netbox = netbox
+            info.key = INFO_KEY_NAME
+            info.variable = var_name
+            info.value = json.dumps(times)
+
+    def _get_netbox(self):
+        return self.containers.factory(None, shadows.Netbox)
+
+
+def _is_changed(logger, var_name, loaded_times, collected_times,
+                max_deviation):
+    """Compares loaded and collected timestamp tuples, as described in
+    TimestampChecker.is_changed()
+    """
+    if not loaded_times:
+        logger.debug("%r: no previous collection times found", var_name)
+        return True
+
+    old_uptime, old_times = loaded_times[0], loaded_times[1:]
+    new_uptime, new_times = collected_times[0], collected_times[1:]
+    uptime_deviation = Snmpv2Mib.get_uptime_deviation(old_uptime, new_uptime)
+
+    if None in new_times:
+        logger.debug("%r: None in timestamp list: %r", var_name, new_times)
+        return True
+    if uptime_deviation is None:
+        logger.debug("%r: unable to calculate uptime deviation for "
+                     "old/new: %r/%r", var_name, old_times, new_times)
+        return True
+    if list(old_times) != list(new_times):
+        logger.debug("%r: timestamps have changed: %r / %r",
+                     var_name, old_times, new_times)
+        return True
+    elif abs(uptime_deviation) > max_deviation:
+        logger.debug("%r: sysUpTime deviation detected, possible reboot",
+                     var_name)
+        return True
+    else:
+        logger.debug("%r: timestamps appear unchanged since last run",
+                     var_name)
+        return False
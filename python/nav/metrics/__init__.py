@@ -26,6 +26,14 @@ class GraphiteConfigParser(NAVConfigParser):
 [carbon]
 host = 127.0.0.1
 port = 2003
+protocol = udp
+batch_size = 500
+flush_interval = 1.0
+max_queue_size = 100000
+spool = no
+spool_dir =
+spool_max_mb = 100
+spool_replay_rate = 1000
 
 [graphiteweb]
 base=http://localhost:8000/
@@ -15,19 +15,24 @@
 #
 """
 This module implements various common API to send metrics to a
-Graphite/Carbon backend. It currently only supports the UDP line protocol,
-as it's the easiest to implement, and will also work without vodoo in
-asynchronous programs (i .e. such as ipdevpoll, which is implemented using
-Twisted).
+Graphite/Carbon backend. It uses the UDP line protocol by default, as it's the
+easiest to implement, and will also work without vodoo in asynchronous
+programs (i .e. such as ipdevpoll, which is implemented using Twisted).
+
+Twisted programs may install a non-blocking sender that uses Carbon's TCP
+line or pickle protocols instead; see nav.metrics.carbonclient.
 """
 import logging
 import socket
 import time
 import warnings
 from nav.metrics import CONFIG
+from nav.metrics.spool import get_metric_spool
 
 _logger = logging.getLogger(__name__)
 _error_timestamp = 0
+_replay_timestamp = 0
+_metrics_sender = None
 
 # Maximum payload to allow for a UDP packet containing metrics destined for
 # Graphite. A value of 1472 should be ok to stay within the standard ethernet
@@ -64,11 +69,47 @@ def send_metrics_to(metric_tuples, host, port=2003):
 
     _logger.debug("sending carbon metrics to [%s]:%s: %r",
                   host, port, metric_tuples)
+    if _send_packets(carbon, metric_tuples, host, port):
+        _replay_spooled_metrics(carbon, host, port)
+
+
+def _send_packets(sock, metric_tuples, host, port):
+    """Sends metric tuples on a UDP socket, spooling them if the socket
+    reports an error.
+
+    :returns: True if the metrics were sent.
+
+    """
     try:
         for packet in metrics_to_packets(metric_tuples):
-            carbon.send(packet)
+            sock.send(packet)
     except socket.error as error:
         _handle_error(error, host, port)
+        spool = get_metric_spool()
+        if spool:
+            spool.write(metric_tuples)
+        return False
+    return True
+
+
+def _replay_spooled_metrics(sock, host, port):
+    """Sends spooled metrics, if any, but no more than the spool's replay rate
+    allows for the time passed since the last replay.
+    """
+    # pylint: disable=W0601
+    global _replay_timestamp
+    spool = get_metric_spool()
+    if not spool:
+        return
+    now = time.time()
+    count = int(min(1.0, now - _replay_timestamp) * spool.replay_rate)
+    if count < 1:
+        return
+    _replay_timestamp = now
+    metrics = spool.read(count)
+    if metrics:
+        _logger.debug("replaying %d spooled metrics", len(metrics))
+        _send_packets(sock, metrics, host, port)
 
 
 def _handle_error(error, host, port):
@@ -116,18 +157,33 @@ def send_metrics(metric_tuples):
                           [(path, (timestamp, value)), ...]
 
     """
+    if _metrics_sender is not None:
+        return _metrics_sender.send(metric_tuples)
     host = CONFIG.get("carbon", "host")
     port = CONFIG.getint("carbon", "port")
     return send_metrics_to(metric_tuples, host, port)
 
 
+def set_metrics_sender(sender):
+    """Makes send_metrics pass all metrics to sender, instead of sending them
+    to the pre-configured carbon backend using UDP.
+
+    :param sender: An object with a send(metric_tuples) method, or None to
+                   restore the default behavior.
+
+    """
+    global _metrics_sender
+    _metrics_sender = sender
+
+
 def _socktype_from_addr(addr):
     info = socket.getaddrinfo(addr, 0)
     socktype = info[0][0]
     return socktype
 
 
-def _metric_to_line(metric_tuple):
+def metric_to_line(metric_tuple):
+    """Converts a metric tuple to a Carbon plaintext protocol line"""
     path, (timestamp, value) = metric_tuple
     line = "%s %s %s\n" % (path, value, int(timestamp))
     return line.encode('utf-8')
@@ -147,7 +203,7 @@ def metrics_to_packets(metric_tuples):
     """
     output = bytearray()
     for metric in metric_tuples:
-        line = _metric_to_line(metric)
+        line = metric_to_line(metric)
         if len(output) + len(line) > MAX_UDP_PAYLOAD:
             packet = bytes(output)
             yield packet
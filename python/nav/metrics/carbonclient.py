@@ -0,0 +1,396 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""A non-blocking, batching Carbon client for Twisted programs.
+
+A CarbonClient keeps a persistent TCP connection to a Carbon backend, using
+either the plaintext line protocol or the pickle protocol.  Metrics passed to
+it are queued in memory, and written to the connection in batches, either
+when a full batch has been queued or at regular intervals.
+
+The client never blocks the reactor: While the connection is down, or while
+Twisted reports that the connection's write buffer is full, metrics are kept
+in the queue.  When the queue is full, new metrics are dropped and counted,
+or written to a MetricSpool, if one is configured.  Spooled metrics are read
+back into the queue at the spool's replay rate once the queue has room.
+
+Programs that run a Twisted reactor can route all calls to
+nav.metrics.carbon.send_metrics through a CarbonClient by calling
+install_carbon_client().
+
+"""
+import logging
+import pickle
+import struct
+import time
+from collections import deque
+
+from twisted.internet import defer, reactor, task
+from twisted.internet.interfaces import IPushProducer
+from twisted.internet.protocol import Protocol, ReconnectingClientFactory
+from zope.interface import implementer
+
+from nav.metrics import carbon
+from nav.metrics.spool import get_metric_spool
+
+_logger = logging.getLogger(__name__)
+
+PLAINTEXT = 'tcp'
+PICKLE = 'pickle'
+PROTOCOLS = (PLAINTEXT, PICKLE)
+
+# The maximum number of seconds to wait for queued metrics to be written on
+# shutdown
+STOP_TIMEOUT = 5
+
+_carbon_client = None
+
+
+class CarbonClient(object):
+    """A batching Carbon client that queues metrics while the backend cannot
+    keep up or is unavailable.
+    """
+    def __init__(self, host, port, protocol=PLAINTEXT, batch_size=500,
+                 flush_interval=1.0, max_queue_size=100000, spool=None):
+        """Initializes a Carbon client.
+
+        :param host: The host name or IP address of the Carbon backend.
+        :param port: The TCP port of the Carbon backend's line or pickle
+                     receiver.
+        :param protocol: Either PLAINTEXT or PICKLE.
+        :param batch_size: The maximum number of metrics to write in a single
+                           batch (or pickle).
+        :param flush_interval: The maximum number of seconds to keep metrics
+                               queued before writing them.
+        :param max_queue_size: The maximum number of metrics to keep queued.
+        :param spool: An optional MetricSpool to write metrics to when the
+                      queue is full, and to replay metrics from when it is
+                      not.
+
+        """
+        if protocol not in PROTOCOLS:
+            raise ValueError("unknown carbon protocol: %r" % protocol)
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.spool = spool
+
+        self._queue = deque()
+        self._factory = _CarbonClientFactory(self)
+        self._connection = None
+        self._paused = False
+        self._flush_loop = None
+        self._disconnected = None
+        self._error_timestamp = 0
+
+        self.sent = 0
+        self.dropped = 0
+
+    def __repr__(self):
+        return ("<CarbonClient {host}:{port} protocol={protocol} "
+                "connected={connected} sent={sent} dropped={dropped} "
+                "queued={queued}>").format(
+                    host=self.host, port=self.port, protocol=self.protocol,
+                    connected=self.connected, sent=self.sent,
+                    dropped=self.dropped, queued=self.queued)
+
+    @property
+    def queued(self):
+        """The number of metrics currently waiting to be written"""
+        return len(self._queue)
+
+    @property
+    def connected(self):
+        """True if the client is currently connected to the backend"""
+        return self._connection is not None
+
+    def start(self):
+        """Connects to the Carbon backend and starts the flush timer"""
+        reactor.connectTCP(self.host, self.port, self._factory)
+        self._flush_loop = task.LoopingCall(self._replay_and_flush)
+        self._flush_loop.start(self.flush_interval, now=False)
+
+    def stop(self):
+        """Writes as many queued metrics as possible and disconnects.
+
+        :returns: A Deferred that fires when the connection has been closed,
+                  or after STOP_TIMEOUT seconds, whichever comes first.
+
+        """
+        if self._flush_loop and self._flush_loop.running:
+            self._flush_loop.stop()
+        self._factory.stopTrying()
+        self._paused = False
+        self.flush()
+        if self._queue:
+            unsent = list(self._queue)
+            self._queue.clear()
+            if self.spool:
+                _logger.info("spooling %d unsent metrics on shutdown",
+                             len(unsent))
+                self._overflow(unsent)
+                self.spool.seal()
+            else:
+                _logger.warning("discarding %d unsent metrics on shutdown",
+                                len(unsent))
+                self.dropped += len(unsent)
+        if not self._connection:
+            return defer.succeed(None)
+
+        self._disconnected = defer.Deferred()
+        timeout = reactor.callLater(STOP_TIMEOUT, self._disconnected.callback,
+                                    None)
+        self._disconnected.addBoth(_cancel_delayed_call, timeout)
+        self._connection.transport.loseConnection()
+        return self._disconnected
+
+    def send(self, metric_tuples):
+        """Queues a list of metric tuples for sending.
+
+        :param metric_tuples: A list of metric tuples in the form
+                              [(path, (timestamp, value)), ...]
+
+        """
+        metric_tuples = list(metric_tuples)
+        room = max(0, self.max_queue_size - len(self._queue))
+        if len(metric_tuples) > room:
+            self._overflow(metric_tuples[room:])
+            metric_tuples = metric_tuples[:room]
+        self._queue.extend(metric_tuples)
+        if len(self._queue) >= self.batch_size:
+            self.flush()
+
+    def _overflow(self, metric_tuples):
+        """Handles metrics that do not fit in the queue"""
+        spooled = self.spool.write(metric_tuples) if self.spool else 0
+        dropped = len(metric_tuples) - spooled
+        if dropped:
+            self.dropped += dropped
+            self._log_error("carbon client queue is full, dropped %d metrics"
+                            % dropped)
+
+    def _replay_and_flush(self):
+        self.replay()
+        self.flush()
+
+    def replay(self):
+        """Moves spooled metrics to the queue, if the backend is connected and
+        the queue is not backed up. No more metrics are moved per call than
+        the spool's replay rate allows per flush interval.
+        """
+        if (not self.spool or not self._connection or self._paused
+                or len(self._queue) >= self.batch_size):
+            return
+        count = max(1, int(self.spool.replay_rate * self.flush_interval))
+        metrics = self.spool.read(count)
+        if metrics:
+            _logger.debug("replaying %d spooled metrics", len(metrics))
+            self._queue.extend(metrics)
+
+    def flush(self):
+        """Writes queued metrics to the connection, in batches, until the
+        queue is empty or the connection cannot take any more data.
+        """
+        while self._queue and self._can_write():
+            count = min(self.batch_size, len(self._queue))
+            batch = [self._queue.popleft() for _ in range(count)]
+            data, count = self._encode(batch)
+            if not data:
+                continue
+            try:
+                self._connection.transport.write(data)
+            except Exception as error:  # pylint: disable=broad-except
+                self.dropped += count
+                self._log_error("failed to write %d metrics to carbon: %s"
+                                % (count, error))
+                break
+            self.sent += count
+
+    def _can_write(self):
+        """Returns True if the connection will accept more data"""
+        return bool(self._connection and not self._paused
+                    and not self._connection.transport.disconnecting)
+
+    def _encode(self, batch):
+        """Encodes a batch of metric tuples for the wire.
+
+        :returns: A (data, count) tuple, where count is the number of metrics
+                  encoded in data.
+
+        """
+        if self.protocol == PICKLE:
+            metrics = []
+            for path, (timestamp, value) in batch:
+                try:
+                    metrics.append((path, (int(timestamp), float(value))))
+                except (TypeError, ValueError):
+                    self.dropped += 1
+            if not metrics:
+                return b'', 0
+            payload = pickle.dumps(metrics, protocol=2)
+            return struct.pack("!L", len(payload)) + payload, len(metrics)
+
+        return (b''.join(carbon.metric_to_line(metric) for metric in batch),
+                len(batch))
+
+    def _log_error(self, msg):
+        """Logs an error, but never more frequently than
+        SOCKET_ERROR_MESSAGE_INTERVAL seconds.
+        """
+        if self._error_timestamp < (time.time() -
+                                    carbon.SOCKET_ERROR_MESSAGE_INTERVAL):
+            self._error_timestamp = time.time()
+            _logger.error(msg)
+
+    #
+    # Callbacks from the protocol and factory
+    #
+
+    def connection_made(self, connection):
+        """Called when a connection to the backend has been established"""
+        _logger.debug("connected to carbon backend [%s]:%s",
+                      self.host, self.port)
+        self._connection = connection
+        self._paused = False
+        self.flush()
+
+    def connection_lost(self, reason):
+        """Called when a connection to the backend has been lost"""
+        self._connection = None
+        self._paused = False
+        if self._disconnected:
+            disconnected, self._disconnected = self._disconnected, None
+            disconnected.callback(None)
+        else:
+            self._log_error("lost connection to carbon ([%s]:%s): %s"
+                            % (self.host, self.port, reason.getErrorMessage()))
+
+    def connection_failed(self, reason):
+        """Called when a connection attempt has failed"""
+        self._log_error("unable to send metrics to carbon ([%s]:%s): %s"
+                        % (self.host, self.port, reason.getErrorMessage()))
+
+    def pause(self):
+        """Stops writing to the connection until resume() is called"""
+        self._paused = True
+
+    def resume(self):
+        """Resumes writing to the connection"""
+        self._paused = False
+        self.flush()
+
+    def log_stats(self):
+        """Logs the client statistics"""
+        _logger.info("Carbon client: %r", self)
+
+
+@implementer(IPushProducer)
+class _CarbonProtocol(Protocol):
+    """Carbon client protocol. Registers itself as a streaming producer, so
+    that the transport will tell the client when its write buffer is full.
+    """
+    def connectionMade(self):
+        self.factory.resetDelay()
+        self.transport.registerProducer(self, True)
+        self.factory.client.connection_made(self)
+
+    def connectionLost(self, reason=None):
+        self.factory.client.connection_lost(reason)
+
+    def pauseProducing(self):
+        self.factory.client.pause()
+
+    def resumeProducing(self):
+        self.factory.client.resume()
+
+    def stopProducing(self):
+        pass
+
+
+class _CarbonClientFactory(ReconnectingClientFactory):
+    protocol = _CarbonProtocol
+    maxDelay = 60
+
+    def __init__(self, client):
+        self.client = client
+
+    def clientConnectionFailed(self, connector, reason):
+        self.client.connection_failed(reason)
+        ReconnectingClientFactory.clientConnectionFailed(
+            self, connector, reason)
+
+
+def _cancel_delayed_call(result, delayed_call):
+    if delayed_call.active():
+        delayed_call.cancel()
+    return result
+
+
+def get_carbon_client(config=None):
+    """Returns the process-wide CarbonClient instance, or None if graphite.conf
+    configures the UDP protocol.
+    """
+    global _carbon_client
+    if _carbon_client is None:
+        if config is None:
+            from nav.metrics import CONFIG as config
+        protocol = config.get('carbon', 'protocol')
+        if protocol == 'udp':
+            _carbon_client = False
+        else:
+            _carbon_client = make_carbon_client(config)
+    return _carbon_client if _carbon_client else None
+
+
+def make_carbon_client(config):
+    """Makes a CarbonClient instance from a graphite config object"""
+    client = CarbonClient(
+        host=config.get('carbon', 'host'),
+        port=config.getint('carbon', 'port'),
+        protocol=config.get('carbon', 'protocol'),
+        batch_size=config.getint('carbon', 'batch_size'),
+        flush_interval=config.getfloat('carbon', 'flush_interval'),
+        max_queue_size=config.getint('carbon', 'max_queue_size'),
+        spool=get_metric_spool(config))
+    _logger.debug("using carbon client: %r", client)
+    return client
+
+
+def install_carbon_client(config=None):
+    """Routes all metrics sent using nav.metrics.carbon.send_metrics through
+    the process-wide CarbonClient, if one is configured.
+
+    The client is started when the reactor starts, and stopped when it shuts
+    down.
+
+    :returns: The installed CarbonClient, or None.
+
+    """
+    client = get_carbon_client(config)
+    if client:
+        carbon.set_metrics_sender(client)
+        reactor.callWhenRunning(client.start)
+        reactor.addSystemEventTrigger('before', 'shutdown', client.stop)
+    return client
+
+
+def log_carbon_client_stats():
+    """Logs the statistics of the process-wide carbon client, if enabled"""
+    client = get_carbon_client()
+    if client:
+        client.log_stats()
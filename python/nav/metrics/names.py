@@ -22,9 +22,12 @@ from django.utils.six.moves.urllib.parse import urlencode, urljoin
 from django.utils.six.moves.urllib.request import Request, urlopen
 from django.utils.six.moves.urllib.error import URLError
 from nav.metrics import CONFIG, errors
+import re
 import string
 
 LEGAL_METRIC_CHARACTERS = string.ascii_letters + string.digits + "-_"
+_ILLEGAL_METRIC_CHARACTER = re.compile(
+    "[^%s]" % re.escape(LEGAL_METRIC_CHARACTERS))
 
 
 def escape_metric_name(name):
@@ -35,9 +38,7 @@ def escape_metric_name(name):
     if name is None:
         return name
     name = name.replace('\x00', '')  # some devices have crazy responses!
-    name = ''.join([c if c in LEGAL_METRIC_CHARACTERS else "_"
-                    for c in name])
-    return name
+    return _ILLEGAL_METRIC_CHARACTER.sub("_", name)
 
 
 def join_series(names):
@@ -0,0 +1,297 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""An on-disk spool of metrics that could not be sent to Carbon.
+
+Spooled metrics are appended to segment files in a spool directory, using
+Carbon's plaintext line format, so that they keep their original timestamps.
+Once the backend is available again, segments are read back and replayed, and
+deleted when fully read.
+
+Several processes may share the same spool directory.  Each process writes to
+its own segment files, and segments are claimed for replay by renaming them,
+which is atomic.  A segment file name tells which state it is in:
+
+* ``<created>-<pid>-<seq>.part`` is being written to by process `pid`,
+* ``<created>-<pid>-<seq>.spool`` is complete and waiting to be replayed,
+* ``<created>-<pid>-<seq>.spool.<claimer>`` is being replayed by process
+  `claimer`.
+
+Segments left behind by processes that are no longer running are returned to
+the waiting state.  A segment that was only partially replayed when its
+process died will be replayed again from the start; since Carbon keeps only
+the last value received for a given timestamp, this is harmless.
+
+"""
+import errno
+import logging
+import os
+import time
+
+_logger = logging.getLogger(__name__)
+
+PART = '.part'
+WAITING = '.spool'
+
+_metric_spool = None
+
+
+class MetricSpool(object):
+    """An append-only on-disk spool of metric tuples"""
+    def __init__(self, directory, max_size=100 * 1024 * 1024,
+                 replay_rate=1000, segment_size=1024 * 1024):
+        """Initializes a spool.
+
+        :param directory: The spool directory. It is created if it does not
+                          exist.
+        :param max_size: The maximum combined size of all segment files in
+                         the directory, in bytes. Metrics are discarded when
+                         the spool is full.
+        :param replay_rate: The maximum number of spooled metrics per second
+                            that senders should replay once the backend is
+                            available.
+        :param segment_size: The size at which a new segment file is started,
+                             in bytes.
+
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.replay_rate = replay_rate
+        self.segment_size = segment_size
+        self.pid = os.getpid()
+
+        self._writer = None
+        self._writer_name = None
+        self._sequence = 0
+        self._reader = None
+        self._reader_name = None
+
+        self.spooled = 0
+        self.replayed = 0
+        self.discarded = 0
+
+    def __repr__(self):
+        return ("<MetricSpool {directory} spooled={spooled} "
+                "replayed={replayed} discarded={discarded}>").format(
+                    directory=self.directory, spooled=self.spooled,
+                    replayed=self.replayed, discarded=self.discarded)
+
+    def write(self, metric_tuples):
+        """Appends metric tuples to the spool.
+
+        :param metric_tuples: A list of metric tuples in the form
+                              [(path, (timestamp, value)), ...]
+        :returns: The number of spooled metrics, which is less than the
+                  number of given metrics if the spool is full.
+
+        """
+        # carbon imports this module, so its line format is imported late
+        from nav.metrics.carbon import metric_to_line
+
+        metric_tuples = list(metric_tuples)
+        if not metric_tuples:
+            return 0
+        if not self._writer and not self._open_segment():
+            self.discarded += len(metric_tuples)
+            return 0
+
+        self._writer.write(b''.join(metric_to_line(metric)
+                                    for metric in metric_tuples))
+        self._writer.flush()
+        self.spooled += len(metric_tuples)
+        if self._writer.tell() >= self.segment_size:
+            self.seal()
+        return len(metric_tuples)
+
+    def _open_segment(self):
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            if self.get_size() >= self.max_size:
+                _logger.error("metric spool %s is full (%d bytes)",
+                              self.directory, self.max_size)
+                return False
+            self._sequence += 1
+            self._writer_name = os.path.join(
+                self.directory, "%.6f-%d-%d%s" % (time.time(), self.pid,
+                                                  self._sequence, PART))
+            self._writer = open(self._writer_name, 'ab')
+        except (IOError, OSError) as error:
+            _logger.error("cannot write to metric spool %s: %s",
+                          self.directory, error)
+            return False
+        return True
+
+    def seal(self):
+        """Closes the current segment, making it available for replay"""
+        if not self._writer:
+            return
+        self._writer.close()
+        self._writer = None
+        name, self._writer_name = self._writer_name, None
+        os.rename(name, name[:-len(PART)] + WAITING)
+
+    def get_size(self):
+        """Returns the combined size of all segments in the spool, in bytes"""
+        size = 0
+        for name in self._list():
+            try:
+                size += os.path.getsize(os.path.join(self.directory, name))
+            except OSError:
+                pass  # claimed and deleted by someone else
+        return size
+
+    def read(self, max_count):
+        """Reads and removes up to max_count metric tuples from the spool,
+        oldest first.
+
+        The current segment being written to by this process is sealed
+        first, so that everything spooled so far is eventually read.
+
+        """
+        self.seal()
+        metrics = []
+        while len(metrics) < max_count:
+            if not self._reader and not self._claim_segment():
+                break
+            line = self._reader.readline()
+            if not line:
+                self._finish_segment()
+                continue
+            metric = _line_to_metric(line)
+            if metric:
+                metrics.append(metric)
+        self.replayed += len(metrics)
+        return metrics
+
+    def _claim_segment(self):
+        self._reclaim_abandoned_segments()
+        for name in sorted(self._list()):
+            if not name.endswith(WAITING):
+                continue
+            source = os.path.join(self.directory, name)
+            claimed = "%s.%d" % (source, self.pid)
+            try:
+                os.rename(source, claimed)
+                self._reader = open(claimed, 'rb')
+            except (IOError, OSError):
+                continue  # claimed by someone else
+            self._reader_name = claimed
+            return True
+        return False
+
+    def _finish_segment(self):
+        self._reader.close()
+        self._reader = None
+        try:
+            os.remove(self._reader_name)
+        except OSError as error:
+            _logger.warning("cannot remove replayed spool segment %s: %s",
+                            self._reader_name, error)
+        self._reader_name = None
+
+    def _reclaim_abandoned_segments(self):
+        for name in self._list():
+            owner = _get_owner(name)
+            if owner is None or owner == self.pid or _is_running(owner):
+                continue
+            path = os.path.join(self.directory, name)
+            if name.endswith(PART):
+                waiting = path[:-len(PART)] + WAITING
+            else:
+                waiting = path[:path.rindex(WAITING) + len(WAITING)]
+            try:
+                os.rename(path, waiting)
+            except OSError:
+                pass
+
+    def has_data(self):
+        """Returns True if there are spooled metrics waiting to be read"""
+        return bool(self._writer or self._reader or self._list())
+
+    def _list(self):
+        try:
+            return [name for name in os.listdir(self.directory)
+                    if PART in name or WAITING in name]
+        except OSError:
+            return []
+
+    def log_stats(self):
+        """Logs the spool statistics"""
+        _logger.info("Metric spool: %r", self)
+
+
+def _line_to_metric(line):
+    try:
+        path, value, timestamp = line.decode('utf-8').split()
+        return path, (int(timestamp), float(value))
+    except ValueError:
+        _logger.warning("ignoring invalid line in metric spool: %r", line)
+        return None
+
+
+def _get_owner(name):
+    """Returns the pid of the process that is writing or replaying a segment,
+    or None if the segment is waiting.
+    """
+    if name.endswith(PART):
+        return int(name.split('-')[1])
+    if not name.endswith(WAITING):
+        return int(name.rsplit('.', 1)[1])
+    return None
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as error:
+        return error.errno == errno.EPERM
+    return True
+
+
+def get_metric_spool(config=None):
+    """Returns the process-wide MetricSpool instance, or None if spooling has
+    not been enabled in graphite.conf.
+    """
+    global _metric_spool
+    if _metric_spool is None or (_metric_spool and
+                                 _metric_spool.pid != os.getpid()):
+        if config is None:
+            from nav.metrics import CONFIG as config
+        if not config.getboolean('carbon', 'spool'):
+            _metric_spool = False
+        else:
+            _metric_spool = make_metric_spool(config)
+    return _metric_spool if _metric_spool else None
+
+
+def make_metric_spool(config):
+    """Makes a MetricSpool instance from a graphite config object"""
+    from nav.buildconf import localstatedir
+
+    directory = (config.get('carbon', 'spool_dir') or
+                 os.path.join(localstatedir, 'spool', 'carbon'))
+    max_size = config.getint('carbon', 'spool_max_mb') * 1024 * 1024
+    replay_rate = config.getint('carbon', 'spool_replay_rate')
+    _logger.debug("metric spool enabled in %s, max %d bytes, replay rate "
+                  "%d/s", directory, max_size, replay_rate)
+    return MetricSpool(directory, max_size=max_size, replay_rate=replay_rate)
+
+
+def log_metric_spool_stats():
+    """Logs the statistics of the process-wide metric spool, if enabled"""
+    spool = get_metric_spool()
+    if spool:
+        spool.log_stats()
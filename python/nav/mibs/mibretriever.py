@@ -30,20 +30,22 @@ this to allow asynchronous data retrieval.
 
 """
 
+import copy
 import logging
+import types
+from collections.abc import Mapping
 
 from django.utils import six
 
-from twisted.internet import defer, reactor
+from twisted.internet import defer
 from twisted.internet.defer import returnValue
 from twisted.internet.error import TimeoutError
 
 from nav.Snmp import safestring
 from nav.ipdevpoll import ContextLogger
-from nav.ipdevpoll.utils import fire_eventually
 from nav.errors import GeneralException
 from nav.oids import OID
-from nav.smidumps import get_mib
+from nav.smidumps import get_mib, get_outline
 
 _logger = logging.getLogger(__name__)
 TEXT_TYPES = ("DisplayString", "SnmpAdminString")
@@ -164,30 +166,34 @@ class MibTableDescriptor(object):
                                    self.columns)
 
     @classmethod
-    def build(cls, mib, table_name):
+    def build(cls, mib, table_name, outline=None):
         """Build and return a MibTableDescriptor for a MIB table.
 
         mib -- a MibRetriever instance.
         table_name -- the name of the table from the mib.
+        outline -- the node outline of the mib, as returned by
+                   nav.smidumps.get_outline(). Looked up if omitted.
 
         """
-        if (table_name not in mib.nodes or
-                mib.nodes[table_name].raw_mib_data['nodetype'] != 'table'):
+        if outline is None:
+            outline = get_outline(mib.mib)
+        if (table_name not in outline or
+                outline[table_name].nodetype != 'table'):
             raise MibRetrieverError("%s is not a table" % table_name)
 
         table_object = mib.nodes[table_name]
-        for node in mib.nodes.values():
+        for name, node in outline.items():
             if table_object.oid.is_a_prefix_of(node.oid) and \
-                    node.raw_mib_data['nodetype'] == 'row':
-                row_object = mib.nodes[node.name]
+                    node.nodetype == 'row':
+                row_object = mib.nodes[name]
                 # Only one row node type per table
                 break
 
         columns = {}
-        for node in mib.nodes.values():
+        for name, node in outline.items():
             if row_object.oid.is_a_prefix_of(node.oid) and \
-                    node.raw_mib_data['nodetype'] == 'column':
-                columns[node.name] = mib.nodes[node.name]
+                    node.nodetype == 'column':
+                columns[name] = mib.nodes[name]
 
         return cls(table_object, row_object, columns)
 
@@ -196,12 +202,10 @@ class MibTableDescriptor(object):
         """Build table descriptors for all tables in a mib.
 
         mib -- MibRetriever instance"""
-        table_descriptors = []
-        for node in mib.nodes.values():
-            if node.raw_mib_data['nodetype'] == 'table':
-                table_descriptors.append(
-                    MibTableDescriptor.build(mib, node.name))
-        return table_descriptors
+        outline = get_outline(mib.mib)
+        return [MibTableDescriptor.build(mib, name, outline)
+                for name, node in outline.items()
+                if node.nodetype == 'table']
 
 
 class MibTableResultRow(dict):
@@ -226,6 +230,35 @@ class MibTableResultRow(dict):
         self[0] = index
 
 
+class LazyMapping(Mapping):
+    """A read-only mapping of a known set of keys, whose values are created
+    by a factory function when they are first looked up.
+    """
+    def __init__(self, keys, factory):
+        self._keys = list(keys)
+        self._keyset = frozenset(self._keys)
+        self._factory = factory
+        self._values = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            if key not in self._keyset:
+                raise
+        value = self._values[key] = self._factory(key)
+        return value
+
+    def __contains__(self, key):
+        return key in self._keyset
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+
 class MibRetrieverMaker(type):
     """Metaclass to create new functional MIB retriever classes.
 
@@ -256,13 +289,17 @@ class MibRetrieverMaker(type):
             # This may be the MibRetriever base class or a MixIn of some sort
             return
 
-        MibRetrieverMaker.__make_node_objects(cls)
-        cls.tables = dict((t.table.name, t)
-                          for t in MibTableDescriptor.build_all(cls))
+        # Node objects and table descriptors are only created when they are
+        # first used, as large MIBs have thousands of nodes, of which a
+        # retriever typically uses a handful. The node outline provides
+        # enough information to build the class without them.
+        outline = get_outline(mib)
+        MibRetrieverMaker.__make_node_objects(cls, outline)
+        MibRetrieverMaker.__make_table_descriptors(cls, outline)
 
-        MibRetrieverMaker.__make_scalar_getters(cls)
+        MibRetrieverMaker.__make_scalar_getters(cls, outline)
         MibRetrieverMaker.__make_table_getters(cls)
-        MibRetrieverMaker.__prepopulate_text_columns(cls)
+        MibRetrieverMaker.__prepopulate_text_columns(cls, outline)
 
         MibRetrieverMaker.modules[mib['moduleName']] = cls
 
@@ -270,15 +307,15 @@ class MibRetrieverMaker(type):
     # MIB-aware retriever class that is being created.
 
     @staticmethod
-    def __make_scalar_getters(cls):
+    def __make_scalar_getters(cls, outline):
         """Make a get_* method for every scalar MIB node."""
-        for node in cls.nodes.values():
-            if node.raw_mib_data['nodetype'] == 'scalar':
-                method_name = 'get_%s' % node.name
+        for name, node in outline.items():
+            if node.nodetype == 'scalar':
+                method_name = 'get_%s' % name
                 # Only create method if a custom one was not present
                 if not hasattr(cls, method_name):
                     setattr(cls, method_name,
-                            MibRetrieverMaker.__scalar_getter(node.name))
+                            MibRetrieverMaker.__scalar_getter(name))
 
     @staticmethod
     def __scalar_getter(node_name):
@@ -327,12 +364,21 @@ class MibRetrieverMaker(type):
         return getter
 
     @staticmethod
-    def __make_node_objects(cls):
-        cls.nodes = dict((node_name, MIBObject(cls.mib, node_name))
-                         for node_name in cls.mib['nodes'].keys())
+    def __make_node_objects(cls, outline):
+        mib = cls.mib
+        cls.nodes = LazyMapping(outline,
+                                lambda node_name: MIBObject(mib, node_name))
 
     @staticmethod
-    def __prepopulate_text_columns(cls):
+    def __make_table_descriptors(cls, outline):
+        table_names = [name for name, node in outline.items()
+                       if node.nodetype == 'table']
+        cls.tables = LazyMapping(
+            table_names,
+            lambda name: MibTableDescriptor.build(cls, name, outline))
+
+    @staticmethod
+    def __prepopulate_text_columns(cls, outline):
         """Prepopulates the new MibRetriever class' text_columns attribute
         with a set of names of contained MIB objects that can be considered as
         text types.
@@ -340,8 +386,9 @@ class MibRetrieverMaker(type):
         """
         nodes = {
             node_name
-            for node_name in cls.mib['nodes']
-            if is_text_object(cls.mib, node_name)
+            for node_name, node in outline.items()
+            if (node.type_name in TEXT_TYPES or
+                node.parent_type_name in TEXT_TYPES)
         }
         cls.text_columns = nodes
 
@@ -390,26 +437,6 @@ class MibRetriever(object):
         if node.raw_mib_data['nodetype'] != 'column':
             self._logger.debug("%s is not a table column", column_name)
 
-        def _result_formatter(result):
-            formatted_result = {}
-            # result keys may be OID objects/tuples or strings, depending on
-            # snmp library used
-            if node.oid not in result and str(node.oid) not in result:
-                self._logger.debug("%s (%s) seems to be unsupported, result "
-                                   "keys were: %r",
-                                   column_name, node.oid, result.keys())
-                return {}
-            varlist = result.get(node.oid, result.get(str(node.oid), None))
-
-            for oid, value in varlist.items():
-                # Extract index information from oid
-                row_index = OID(oid).strip_prefix(node.oid)
-                if column_name in self.text_columns:
-                    value = safestring(value)
-                formatted_result[row_index] = value
-
-            return formatted_result
-
         def _valueerror_handler(failure):
             failure.trap(ValueError)
             self._logger.warning("got a possibly strange response from device "
@@ -419,14 +446,44 @@ class MibRetriever(object):
             return {}  # alternative is to retry or raise a Timeout exception
 
         deferred = self.agent_proxy.getTable([str(node.oid)])
-        deferred.addCallbacks(_result_formatter, _valueerror_handler)
+        deferred.addCallbacks(self._format_column_result,
+                              _valueerror_handler,
+                              callbackArgs=(column_name,))
         return deferred
 
+    def _format_column_result(self, result, column_name):
+        """Formats a single column from a getTable() result as a dictionary:
+
+          { row_index: column_value }
+
+        """
+        node = self.nodes[column_name]
+        formatted_result = {}
+        # result keys may be OID objects/tuples or strings, depending on
+        # snmp library used
+        if node.oid not in result and str(node.oid) not in result:
+            self._logger.debug("%s (%s) seems to be unsupported, result "
+                               "keys were: %r",
+                               column_name, node.oid, result.keys())
+            return {}
+        varlist = result.get(node.oid, result.get(str(node.oid), None))
+
+        for oid, value in varlist.items():
+            # Extract index information from oid
+            row_index = OID(oid).strip_prefix(node.oid)
+            if column_name in self.text_columns:
+                value = safestring(value)
+            formatted_result[row_index] = value
+
+        return formatted_result
+
     def retrieve_columns(self, column_names):
         """Retrieve a set of table columns.
 
         The table columns may come from different tables, as long as
-        the table rows are indexed the same way.
+        the table rows are indexed the same way.  All the columns are
+        requested from the AgentProxy in a single getTable() call, which
+        allows the AgentProxy to walk them in parallel.
 
         Returns a deferred whose result is a dictionary:
 
@@ -435,33 +492,52 @@ class MibRetriever(object):
         """
         def _sortkey(col):
             return self.nodes[col].oid
-        columns = iter(sorted(column_names, key=_sortkey))
+        columns = sorted(column_names, key=_sortkey)
+
+        def _format_all(result):
+            return {column: self._format_column_result(result, column)
+                    for column in columns}
+
+        def _result_aggregate(results):
+            final_result = {}
+            for column in columns:
+                for row_index, value in results[column].items():
+                    if row_index not in final_result:
+                        final_result[row_index] = \
+                            MibTableResultRow(row_index, column_names)
+                    final_result[row_index][column] = value
+            return final_result
 
-        final_result = {}
-        my_deferred = defer.Deferred()
+        def _valueerror_handler(failure):
+            failure.trap(ValueError)
+            self._logger.debug("got a possibly strange response from device "
+                               "when asking for %s::%s, retrying one column "
+                               "at a time: %s",
+                               self.mib.get('moduleName', ''), columns,
+                               failure.getErrorMessage())
+            return self._retrieve_columns_one_by_one(columns)
+
+        if not columns:
+            return defer.succeed({})
+        deferred = self.agent_proxy.getTable(
+            [str(self.nodes[column].oid) for column in columns])
+        deferred.addCallbacks(_format_all, _valueerror_handler)
+        deferred.addCallback(_result_aggregate)
+        return deferred
 
-        def _result_aggregate(result, column):
-            for row_index, value in result.items():
-                if row_index not in final_result:
-                    final_result[row_index] = \
-                        MibTableResultRow(row_index, column_names)
-                final_result[row_index][column] = value
-            return True
+    @defer.inlineCallbacks
+    def _retrieve_columns_one_by_one(self, columns):
+        """Retrieves each column in turn.
 
-        # schedule the next iteration (i.e. collect next column)
-        def _schedule_next(_result=None):
-            try:
-                column = next(columns)
-            except StopIteration:
-                my_deferred.callback(final_result)
-                return
-            deferred = self.retrieve_column(column)
-            deferred.addCallback(_result_aggregate, column)
-            deferred.addCallback(_schedule_next)
-            deferred.addErrback(my_deferred.errback)
+        :returns: A deferred whose result is a dictionary:
 
-        reactor.callLater(0, _schedule_next)
-        return my_deferred
+          { column_name: { row_index: column_value } }
+
+        """
+        results = {}
+        for column in columns:
+            results[column] = yield self.retrieve_column(column)
+        defer.returnValue(results)
 
     def retrieve_table(self, table_name):
         """Table retriever and formatter.
@@ -589,14 +665,19 @@ class MultiMibMixIn(MibRetriever):
     def _multiquery(self, method, *args, **kwargs):
         """Runs method once for each known MIB instance.
 
-        The internal AgentProxy will be temporarily replaced with one
-        representing the current MIB instance for each iteration.
+        Up to get_max_concurrent_instances() instances are queried in
+        parallel, each through a copy of this retriever whose internal
+        AgentProxy represents that MIB instance.
+
+        :param method: A bound method of this retriever.
 
         :param integrator: A function that can take a list of (description,
                            result) tuples. description is the object
                            associated with an instance, as supplied to the
                            class constructor; result is the actual result
-                           value of the call to method.
+                           value of the call to method. The list is in the
+                           same order as the instances, regardless of the
+                           order in which the instances responded.
 
                            If omitted, the default integrator function is
                            self._dictintegrator().
@@ -605,31 +686,64 @@ class MultiMibMixIn(MibRetriever):
                   integrator.
 
         """
-        agents = self._make_agents()
-        if 'integrator' in kwargs:
-            integrator = kwargs['integrator']
-            del kwargs['integrator']
-        else:
-            integrator = self._dictintegrator
-        results = []
+        integrator = kwargs.pop('integrator', self._dictintegrator)
+        agents = enumerate(self._make_agents())
+        results = {}
+        failures = []
+
+        def _stop_querying(failure):
+            failures.append(failure)
+            return failure
+
+        @defer.inlineCallbacks
+        def _query_instances():
+            for index, (agent, descr) in agents:
+                if failures:
+                    break
+                one_result = yield self._query_instance(
+                    agent, descr, method, *args, **kwargs).addErrback(
+                        _stop_querying)
+                results[index] = (descr, one_result)
+
+        workers = [_query_instances()
+                   for _ in range(self.get_max_concurrent_instances())]
+        yield defer.gatherResults(workers, consumeErrors=True).addErrback(
+            lambda failure: failure.value.subFailure)
+        defer.returnValue(integrator([results[index]
+                                      for index in sorted(results)]))
 
-        for agent, descr in agents:
-            self._logger.debug("now querying %r", descr)
+    @defer.inlineCallbacks
+    def _query_instance(self, agent, descr, method, *args, **kwargs):
+        """Runs method against a single MIB instance"""
+        self._logger.debug("now querying %r", descr)
+        if agent is self._base_agent:
+            retriever = self
+        else:
+            agent.open()
+            retriever = copy.copy(self)
+            retriever.agent_proxy = agent
+        try:
+            result = yield types.MethodType(method.__func__, retriever)(
+                *args, **kwargs).addErrback(self.__timeout_handler, agent,
+                                            descr)
+        finally:
             if agent is not self._base_agent:
-                agent.open()
-            self.agent_proxy = agent
-            try:
-                one_result = yield method(
-                    *args, **kwargs).addErrback(self.__timeout_handler, descr)
-            finally:
-                if agent is not self._base_agent:
-                    agent.close()
-                self.agent_proxy = self._base_agent
-            results.append((descr, one_result))
-            yield lambda thing: fire_eventually(thing)
-        defer.returnValue(integrator(results))
-
-    def __timeout_handler(self, failure, descr):
+                agent.close()
+        defer.returnValue(result)
+
+    def get_max_concurrent_instances(self):
+        """Returns the maximum number of MIB instances to query in parallel.
+
+        Instances are queried one at a time if the base AgentProxy has a
+        throttle delay, as throttling is done per AgentProxy.
+
+        """
+        params = getattr(self._base_agent, 'snmp_parameters', None)
+        if params is None or params.throttle_delay:
+            return 1
+        return max(1, params.max_concurrent_instances)
+
+    def __timeout_handler(self, failure, agent, descr):
         """Handles timeouts while processing alternate MIB instances.
 
         Under the premise that we may have an incorrect community string for a
@@ -638,7 +752,7 @@ class MultiMibMixIn(MibRetriever):
         (base) instance.
 
         """
-        if self.agent_proxy is not self._base_agent:
+        if agent is not self._base_agent:
             failure.trap(TimeoutError, defer.TimeoutError)
             self._logger.debug("ignoring timeout from %r", descr)
             return None
@@ -703,6 +817,12 @@ class MultiMibMixIn(MibRetriever):
             snmp_parameters=agent.snmp_parameters)
         if hasattr(agent, 'protocol'):
             alt_agent.protocol = agent.protocol
+        alt_agent.recorder = getattr(agent, 'recorder', None)
+        alt_agent.stats = getattr(agent, 'stats', None)
+        if getattr(agent, 'pacing', None):
+            # every instance lives in the same device, so they must share
+            # its request pacing
+            alt_agent.pacing = agent.pacing
 
         return alt_agent
 
@@ -2598,6 +2598,7 @@ class IpdevpollJobLog(models.Model):
     duration = models.FloatField(null=True)
     success = models.NullBooleanField(default=False, null=True)
     interval = models.IntegerField(null=True)
+    plugin_stats = JSONField(null=True)
 
     class Meta(object):
         db_table = 'ipdevpoll_job_log'
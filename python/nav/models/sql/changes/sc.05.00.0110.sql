@@ -0,0 +1,94 @@
+-- Notify listeners (i.e. ipdevpoll) of changes to netboxes that may warrant
+-- a reload of their polling schedules. The payload of each notification on the
+-- netbox_changed channel is the id of a changed netbox.
+
+CREATE OR REPLACE FUNCTION notify_netbox_changed() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM pg_notify('netbox_changed', OLD.netboxid::TEXT);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM pg_notify('netbox_changed', NEW.netboxid::TEXT);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER netbox_notify_insert_delete
+    AFTER INSERT OR DELETE ON netbox
+    FOR EACH ROW EXECUTE PROCEDURE notify_netbox_changed();
+
+-- ipdevpoll updates netbox rows all the time, only notify of changes to the
+-- columns that affect polling
+CREATE TRIGGER netbox_notify_update
+    AFTER UPDATE ON netbox
+    FOR EACH ROW
+    WHEN (OLD.ip IS DISTINCT FROM NEW.ip
+          OR OLD.typeid IS DISTINCT FROM NEW.typeid
+          OR OLD.sysname IS DISTINCT FROM NEW.sysname
+          OR OLD.catid IS DISTINCT FROM NEW.catid
+          OR OLD.roomid IS DISTINCT FROM NEW.roomid
+          OR OLD.orgid IS DISTINCT FROM NEW.orgid
+          OR OLD.up IS DISTINCT FROM NEW.up
+          OR OLD.deleted_at IS DISTINCT FROM NEW.deleted_at
+          OR OLD.masterid IS DISTINCT FROM NEW.masterid
+          OR (OLD.uptodate AND NOT NEW.uptodate))
+    EXECUTE PROCEDURE notify_netbox_changed();
+
+CREATE TRIGGER netbox_profile_notify
+    AFTER INSERT OR UPDATE OR DELETE ON netbox_profile
+    FOR EACH ROW EXECUTE PROCEDURE notify_netbox_changed();
+
+CREATE TRIGGER netboxcategory_notify
+    AFTER INSERT OR UPDATE OR DELETE ON netboxcategory
+    FOR EACH ROW EXECUTE PROCEDURE notify_netbox_changed();
+
+CREATE TRIGGER alerthist_snmpagentstate_notify_insert
+    AFTER INSERT ON alerthist
+    FOR EACH ROW
+    WHEN (NEW.eventtypeid = 'snmpAgentState' AND NEW.netboxid IS NOT NULL)
+    EXECUTE PROCEDURE notify_netbox_changed();
+
+CREATE TRIGGER alerthist_snmpagentstate_notify_update
+    AFTER UPDATE ON alerthist
+    FOR EACH ROW
+    WHEN (NEW.eventtypeid = 'snmpAgentState' AND NEW.netboxid IS NOT NULL
+          AND OLD.end_time IS DISTINCT FROM NEW.end_time)
+    EXECUTE PROCEDURE notify_netbox_changed();
+
+
+-- Changes to management profiles and types affect all the netboxes that use
+-- them
+CREATE OR REPLACE FUNCTION notify_profile_netboxes_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('netbox_changed', netboxid::TEXT)
+    FROM netbox_profile
+    WHERE profileid = OLD.management_profileid;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER management_profile_notify
+    AFTER UPDATE ON management_profile
+    FOR EACH ROW
+    WHEN (OLD.protocol IS DISTINCT FROM NEW.protocol
+          OR OLD.configuration IS DISTINCT FROM NEW.configuration)
+    EXECUTE PROCEDURE notify_profile_netboxes_changed();
+
+CREATE OR REPLACE FUNCTION notify_type_netboxes_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('netbox_changed', netboxid::TEXT)
+    FROM netbox
+    WHERE typeid = OLD.typeid;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER type_notify
+    AFTER UPDATE ON type
+    FOR EACH ROW
+    WHEN (OLD.sysobjectid IS DISTINCT FROM NEW.sysobjectid
+          OR OLD.vendorid IS DISTINCT FROM NEW.vendorid)
+    EXECUTE PROCEDURE notify_type_netboxes_changed();
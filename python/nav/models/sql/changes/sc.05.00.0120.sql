@@ -0,0 +1,2 @@
+-- per-plugin SNMP and database statistics of ipdevpoll job runs
+ALTER TABLE ipdevpoll_job_log ADD COLUMN plugin_stats JSONB;
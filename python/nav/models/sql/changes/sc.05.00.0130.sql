@@ -0,0 +1,76 @@
+-- Counts changes to the interfaces of each netbox, so that ipdevpoll can
+-- cheaply verify whether its cached copies of a netbox' interface rows are
+-- still current.  There is deliberately no foreign key to netbox, as the
+-- counter is bumped while a deleted netbox's interfaces are being removed.
+--
+-- The counters are bumped by statement-level triggers, once per netbox per
+-- statement, and only for rows that actually changed.  Bumping a counter
+-- locks its row until the end of the transaction, so concurrent transactions
+-- that change interfaces of the same netbox will wait for each other.  The
+-- counter rows are locked in netboxid order, to avoid deadlocks between
+-- statements that change interfaces of several netboxes.
+
+CREATE TABLE interface_version (
+    netboxid INTEGER PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION bump_interface_versions(changed_netboxids INTEGER[])
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO interface_version (netboxid, version)
+    SELECT DISTINCT netboxid, 1
+    FROM unnest(changed_netboxids) AS netboxid
+    WHERE netboxid IS NOT NULL
+    ORDER BY netboxid
+    ON CONFLICT (netboxid)
+    DO UPDATE SET version = interface_version.version + 1;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION interfaces_inserted() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM bump_interface_versions(ARRAY(
+        SELECT netboxid FROM new_interfaces));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION interfaces_updated() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM bump_interface_versions(ARRAY(
+        SELECT old.netboxid
+        FROM old_interfaces AS old
+        JOIN new_interfaces AS new USING (interfaceid)
+        WHERE old IS DISTINCT FROM new
+        UNION
+        SELECT new.netboxid
+        FROM old_interfaces AS old
+        JOIN new_interfaces AS new USING (interfaceid)
+        WHERE old.netboxid IS DISTINCT FROM new.netboxid));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION interfaces_deleted() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM bump_interface_versions(ARRAY(
+        SELECT netboxid FROM old_interfaces));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER interface_version_insert
+    AFTER INSERT ON interface
+    REFERENCING NEW TABLE AS new_interfaces
+    FOR EACH STATEMENT EXECUTE PROCEDURE interfaces_inserted();
+
+CREATE TRIGGER interface_version_update
+    AFTER UPDATE ON interface
+    REFERENCING OLD TABLE AS old_interfaces NEW TABLE AS new_interfaces
+    FOR EACH STATEMENT EXECUTE PROCEDURE interfaces_updated();
+
+CREATE TRIGGER interface_version_delete
+    AFTER DELETE ON interface
+    REFERENCING OLD TABLE AS old_interfaces
+    FOR EACH STATEMENT EXECUTE PROCEDURE interfaces_deleted();
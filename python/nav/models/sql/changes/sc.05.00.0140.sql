@@ -0,0 +1,2 @@
+-- The entity plugin no longer records ENTITY-MIB change timestamps
+DELETE FROM netboxinfo WHERE key='poll_times' AND var='entityphysical';
@@ -2,11 +2,15 @@
 
 As dumped by smidump dump using the python format option.
 
+Modules that have a precompiled index (see nav.smidumps.index) are loaded
+lazily from their index, rather than imported.
+
 """
 from __future__ import absolute_import
 
 from itertools import chain
 import importlib
+import os
 
 from django.utils import six
 
@@ -20,12 +24,19 @@ def get_mib(mib_module):
     """Returns the smidumped MIB definition of a named MIB module, if it exists
     in NAV.
 
+    The definition is loaded from the module's precompiled index, if it has
+    an up to date one.
+
     """
     if not mib_module:
         return None
 
     if mib_module not in _mib_map:
         for path in get_search_path():
+            mib = _load_indexed_mib(mib_module, path)
+            if mib is not None:
+                _mib_map[mib_module] = mib
+                break
             try:
                 name = '.' + mib_module if path else mib_module  # support top namespace
                 module = importlib.import_module(name, path)
@@ -33,12 +44,45 @@ def get_mib(mib_module):
                 continue
             else:
                 convert_oids(module.MIB)
-                _mib_map[mib_module] = module
+                _mib_map[mib_module] = module.MIB
                 break
         else:
             return None
 
-    return _mib_map[mib_module].MIB
+    return _mib_map[mib_module]
+
+
+def _load_indexed_mib(mib_module, path):
+    """Returns a MibIndex for mib_module, if it has an up to date index in
+    the package path.
+    """
+    from nav.smidumps.index import load_index
+
+    if not path:
+        return None
+    try:
+        package = importlib.import_module(path)
+    except ImportError:
+        return None
+    for directory in getattr(package, '__path__', ()):
+        source = os.path.join(directory, mib_module + '.py')
+        if os.path.exists(source):
+            return load_index(source, oid_factory=OID)
+
+
+def get_outline(mib):
+    """Returns a dict of NodeOutline tuples, describing the type and OID of
+    every node of a MIB definition.
+
+    The outline of an indexed MIB is read from its index, without loading
+    the node definitions themselves.
+
+    """
+    from nav.smidumps.index import MibIndex, make_outline
+
+    if isinstance(mib, MibIndex):
+        return mib.outline
+    return make_outline(mib, oid_factory=OID)
 
 
 def get_search_path():
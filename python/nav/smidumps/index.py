@@ -0,0 +1,291 @@
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.  You should have received a copy of the GNU General Public
+# License along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""Precompiled, lazily loaded indexes of smidumped MIB modules.
+
+Importing a large smidump module, such as PowerNet-MIB, takes seconds of CPU
+time and tens of megabytes of memory in every process that uses it, even
+though a process typically only needs a handful of its objects.
+
+An index file stores each node, typedef and notification of a MIB module as
+a separately marshalled blob, along with a small outline of every node.  A
+MibIndex memory maps the index file, and only unmarshals the definitions that
+are actually looked up.  Since the file is mapped read-only, all the
+processes that use an index share the same pages.
+
+Indexes are compiled next to their smidump modules when NAV is built, or by
+running this module::
+
+  python -m nav.smidumps.index [DIRECTORY ...]
+
+This module deliberately only depends on the standard library, so it can be
+used at build time.
+
+"""
+from __future__ import print_function
+
+import glob
+import logging
+import marshal
+import mmap
+import os
+import runpy
+import struct
+import sys
+from collections import namedtuple
+try:
+    from collections.abc import Mapping
+except ImportError:  # Python 2
+    from collections import Mapping
+
+_logger = logging.getLogger(__name__)
+
+INDEX_SUFFIX = '.idx'
+MAGIC = b'NAVMIBX1'
+HEADER_LENGTH = struct.Struct('<I')
+# top-level MIB sections whose entries are stored as separate blobs
+LAZY_SECTIONS = ('nodes', 'typedefs', 'notifications', 'groups',
+                 'compliances')
+# sections whose entries have an 'oid' member
+OID_SECTIONS = ('nodes', 'notifications')
+
+NodeOutline = namedtuple('NodeOutline',
+                         'nodetype oid type_name parent_type_name')
+
+
+def make_outline(mib, oid_factory=None):
+    """Returns a dict of NodeOutline tuples for every node of a MIB
+    definition dict.
+    """
+    return dict((name, _outline_node(node, oid_factory))
+                for name, node in mib.get('nodes', {}).items())
+
+
+def _outline_node(node, oid_factory=None):
+    syntax_type = node.get('syntax', {}).get('type', {})
+    oid = node['oid']
+    if oid_factory:
+        oid = oid_factory(oid)
+    return NodeOutline(
+        node.get('nodetype'), oid, syntax_type.get('name', ''),
+        syntax_type.get('parent module', {}).get('type', ''))
+
+
+class MibIndex(Mapping):
+    """A read-only MIB definition dict, backed by a compiled index file.
+
+    Top-level members are looked up just like in the MIB dict of a smidump
+    module, but the entries of the nodes, typedefs, notifications, groups and
+    compliances sections are only unmarshalled when they are first accessed.
+
+    """
+    def __init__(self, filename, oid_factory=None):
+        """Opens an index file.
+
+        :param oid_factory: An optional callable to convert the OID strings
+                            of nodes, notifications and outlines with.
+
+        """
+        self.filename = filename
+        self._oid_factory = oid_factory
+        with open(filename, 'rb') as index:
+            self._buffer = mmap.mmap(index.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+        if self._buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError("%s is not a MIB index" % filename)
+        start = len(MAGIC) + HEADER_LENGTH.size
+        (length,) = HEADER_LENGTH.unpack(self._buffer[len(MAGIC):start])
+        header = marshal.loads(self._buffer[start:start + length])
+        data_start = start + length
+
+        self.source_size = header['source_size']
+        self._inline = header['inline']
+        self._raw_outline = header['outline']
+        self._outline = None
+        self._sections = dict(
+            (name, _IndexSection(self._buffer, data_start, offsets,
+                                 oid_factory if name in OID_SECTIONS
+                                 else None))
+            for name, offsets in header['sections'].items())
+
+    def __repr__(self):
+        return "<MibIndex {!r}>".format(self._inline.get('moduleName'))
+
+    def __getitem__(self, key):
+        if key in self._sections:
+            return self._sections[key]
+        return self._inline[key]
+
+    def __iter__(self):
+        for key in self._inline:
+            yield key
+        for key in self._sections:
+            yield key
+
+    def __len__(self):
+        return len(self._inline) + len(self._sections)
+
+    @property
+    def outline(self):
+        """A dict of NodeOutline tuples for every node of this MIB"""
+        if self._outline is None:
+            factory = self._oid_factory
+            self._outline = dict(
+                (name, NodeOutline(nodetype, factory(oid) if factory else oid,
+                                   type_name, parent_type_name))
+                for name, (nodetype, oid, type_name, parent_type_name)
+                in self._raw_outline.items())
+        return self._outline
+
+
+class _IndexSection(Mapping):
+    """A lazily unmarshalled section of a MibIndex"""
+    def __init__(self, buffer, data_start, offsets, oid_factory=None):
+        self._buffer = buffer
+        self._data_start = data_start
+        self._offsets = offsets
+        self._oid_factory = oid_factory
+        self._cache = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        offset, length = self._offsets[key]
+        offset += self._data_start
+        entry = marshal.loads(self._buffer[offset:offset + length])
+        if self._oid_factory and 'oid' in entry:
+            entry['oid'] = self._oid_factory(entry['oid'])
+        self._cache[key] = entry
+        return entry
+
+    def __contains__(self, key):
+        return key in self._offsets
+
+    def __iter__(self):
+        return iter(self._offsets)
+
+    def __len__(self):
+        return len(self._offsets)
+
+
+def get_index_filename(source):
+    """Returns the name of the index file of a smidump module file"""
+    return os.path.splitext(source)[0] + INDEX_SUFFIX
+
+
+def load_index(source, oid_factory=None):
+    """Returns a MibIndex for a smidump module file, or None if the module
+    has no index, or the index is out of date.
+    """
+    filename = get_index_filename(source)
+    try:
+        index = MibIndex(filename, oid_factory)
+    except (IOError, OSError, ValueError, EOFError):
+        return None
+    try:
+        source_size = os.path.getsize(source)
+    except OSError:
+        source_size = None
+    if source_size is not None and source_size != index.source_size:
+        _logger.warning("ignoring out of date MIB index %s", filename)
+        return None
+    return index
+
+
+def compile_index(source, filename=None):
+    """Compiles the MIB definition of a smidump module file into an index.
+
+    :param source: The file name of the smidump module.
+    :param filename: The file name of the index. Defaults to the name of the
+                     module, with an .idx suffix.
+    :returns: The file name of the index, or None if source contains no MIB
+              definition.
+
+    """
+    mib = runpy.run_path(source).get('MIB')
+    if not isinstance(mib, dict):
+        return None
+    filename = filename or get_index_filename(source)
+
+    blobs = []
+    offset = 0
+    sections = {}
+    for name in LAZY_SECTIONS:
+        if name not in mib:
+            continue
+        offsets = sections[name] = {}
+        for key, entry in mib[name].items():
+            blob = marshal.dumps(entry)
+            offsets[key] = (offset, len(blob))
+            offset += len(blob)
+            blobs.append(blob)
+
+    header = marshal.dumps({
+        'source_size': os.path.getsize(source),
+        'inline': dict((key, value) for key, value in mib.items()
+                       if key not in sections),
+        'sections': sections,
+        'outline': dict((name, tuple(outline)) for name, outline
+                        in make_outline(mib).items()),
+    })
+
+    # Write to a temporary file and rename it, as other processes may have
+    # the old index mapped
+    temporary = filename + '.tmp'
+    with open(temporary, 'wb') as index:
+        index.write(MAGIC)
+        index.write(HEADER_LENGTH.pack(len(header)))
+        index.write(header)
+        for blob in blobs:
+            index.write(blob)
+    os.rename(temporary, filename)
+    return filename
+
+
+def compile_directory(directory):
+    """Compiles indexes for every smidump module in a directory.
+
+    :returns: A list of the file names of the compiled indexes.
+
+    """
+    compiled = []
+    for source in sorted(glob.glob(os.path.join(directory, '*.py'))):
+        if os.path.basename(source).startswith('_') or (
+                os.path.abspath(source) == _this_module_source()):
+            continue
+        filename = compile_index(source)
+        if filename:
+            compiled.append(filename)
+    return compiled
+
+
+def _this_module_source():
+    return os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+
+
+def main(args=None):
+    """Compiles MIB indexes for the smidump modules in the directories given
+    on the command line, or in the directory of this module.
+    """
+    directories = args or [os.path.dirname(os.path.abspath(__file__))]
+    for directory in directories:
+        for filename in compile_directory(directory):
+            print(filename)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
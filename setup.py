@@ -1,6 +1,8 @@
 import os
+import runpy
 from glob import glob
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py
 from distutils.command.build import build
 
 TOP_SRCDIR = os.path.abspath(os.path.dirname(__file__))
@@ -22,6 +24,20 @@ def find_scripts():
                 yield candidate
 
 
+class BuildPyWithMibIndexes(build_py):
+    """Compiles indexes of the built smidump modules, so that NAV can load
+    large MIB modules lazily (see nav.smidumps.index)
+    """
+    def run(self):
+        build_py.run(self)
+        if self.dry_run:
+            return
+        index = runpy.run_path(
+            os.path.join(TOP_SRCDIR, 'python', 'nav', 'smidumps', 'index.py'))
+        index['compile_directory'](
+            os.path.join(self.build_lib, 'nav', 'smidumps'))
+
+
 # Ensure CSS files are built every time build is invoked
 build.sub_commands = [('build_sass', None)] + build.sub_commands
 
@@ -63,5 +79,7 @@ setup(
         },
     },
 
+    cmdclass={'build_py': BuildPyWithMibIndexes},
+
     zip_safe=False,
 )
@@ -0,0 +1,45 @@
+"""Tests for the lazily loaded IANA enterprise number table"""
+import pytest
+
+from nav.enterprise import ids
+from nav.enterprise.ids import EnterpriseTable
+
+
+def test_vendor_constants_should_be_importable():
+    from nav.enterprise.ids import VENDOR_ID_CISCOSYSTEMS
+    assert VENDOR_ID_CISCOSYSTEMS == 9
+
+
+def test_unknown_vendor_constant_should_raise_attribute_error():
+    assert not hasattr(ids, 'VENDOR_ID_NONEXISTENT_VENDOR_42')
+    with pytest.raises(AttributeError):
+        ids.NOT_A_VENDOR_ID
+
+
+def test_should_find_vendor_constant_of_enterprise_number():
+    assert ids.get_vendor_constant(11) == 'VENDOR_ID_HEWLETT_PACKARD'
+    assert ids.get_vendor_constant(None) is None
+
+
+def test_vendor_ids_should_contain_all_constants():
+    vendor_ids = ids.get_vendor_ids()
+    assert vendor_ids['VENDOR_ID_IBM'] == 2
+    assert len(vendor_ids) == len(ids.get_table())
+
+
+class TestEnterpriseTable(object):
+    @pytest.fixture
+    def table(self):
+        return EnterpriseTable(["# comment", "2 IBM", "9 CISCOSYSTEMS",
+                                "11 HEWLETT_PACKARD", "6860"])
+
+    def test_should_look_up_number_by_name(self, table):
+        assert table.get_number('CISCOSYSTEMS') == 9
+        assert table.get_number('IBM') == 2
+        assert table.get_number('') == 6860
+        assert table.get_number('ACME') is None
+
+    def test_should_look_up_name_by_number(self, table):
+        assert table.get_name(11) == 'HEWLETT_PACKARD'
+        assert table.get_name(10) is None
+        assert table.get_name(12) is None
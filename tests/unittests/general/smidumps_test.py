@@ -0,0 +1,95 @@
+"""Tests for the precompiled smidumps MIB indexes"""
+import os
+import shutil
+
+import pytest
+
+import nav.smidumps
+from nav.mibs.mibretriever import MibRetriever, MibRetrieverMaker
+from nav.oids import OID
+from nav.smidumps import convert_oids, get_outline
+from nav.smidumps.index import (MibIndex, compile_directory, compile_index,
+                                load_index)
+
+SMIDUMPS = os.path.dirname(nav.smidumps.__file__)
+
+
+@pytest.fixture
+def bridge_mib_source(tmpdir):
+    source = str(tmpdir.join('BRIDGE-MIB.py'))
+    shutil.copy(os.path.join(SMIDUMPS, 'BRIDGE-MIB.py'), source)
+    return source
+
+
+@pytest.fixture
+def bridge_mib_index(bridge_mib_source):
+    return MibIndex(compile_index(bridge_mib_source), oid_factory=OID)
+
+
+def _load_source(source):
+    namespace = {}
+    with open(source) as module:
+        exec(module.read(), namespace)
+    return namespace['MIB']
+
+
+class TestMibIndex(object):
+    def test_should_contain_same_nodes_as_module(self, bridge_mib_source,
+                                                 bridge_mib_index):
+        mib = _load_source(bridge_mib_source)
+        assert set(bridge_mib_index['nodes']) == set(mib['nodes'])
+        assert bridge_mib_index['moduleName'] == 'BRIDGE-MIB'
+
+    def test_should_load_node_with_oid(self, bridge_mib_index):
+        node = bridge_mib_index['nodes']['dot1dBasePortIfIndex']
+        assert node['nodetype'] == 'column'
+        assert node['oid'] == OID('.1.3.6.1.2.1.17.1.4.1.2')
+
+    def test_should_not_unmarshal_nodes_before_they_are_used(
+            self, bridge_mib_index):
+        nodes = bridge_mib_index['nodes']
+        assert 'dot1dBaseBridgeAddress' in nodes
+        assert not nodes._cache
+
+    def test_outline_should_match_module_outline(self, bridge_mib_source,
+                                                 bridge_mib_index):
+        mib = _load_source(bridge_mib_source)
+        assert get_outline(bridge_mib_index) == get_outline(mib)
+
+    def test_changed_module_should_invalidate_index(self, bridge_mib_source):
+        compile_index(bridge_mib_source)
+        with open(bridge_mib_source, 'a') as source:
+            source.write('\n# changed\n')
+        assert load_index(bridge_mib_source) is None
+
+    def test_missing_index_should_not_load(self, bridge_mib_source):
+        assert load_index(bridge_mib_source) is None
+
+    def test_compile_directory_should_skip_non_mib_modules(
+            self, tmpdir, bridge_mib_source):
+        tmpdir.join('__init__.py').write('')
+        tmpdir.join('other.py').write('X = 1\n')
+        assert compile_directory(str(tmpdir)) == [
+            str(tmpdir.join('BRIDGE-MIB.idx'))]
+
+
+def test_retriever_from_index_should_equal_retriever_from_module(
+        bridge_mib_source, bridge_mib_index, monkeypatch):
+    # keep the test classes out of the real MIB retriever registry
+    monkeypatch.setattr(MibRetrieverMaker, 'modules',
+                        dict(MibRetrieverMaker.modules))
+    module_mib = _load_source(bridge_mib_source)
+    convert_oids(module_mib)
+
+    class FromModule(MibRetriever):
+        mib = module_mib
+
+    class FromIndex(MibRetriever):
+        mib = bridge_mib_index
+
+    assert set(FromIndex.tables) == set(FromModule.tables)
+    table = FromIndex.tables['dot1dBasePortTable']
+    assert table.column_index == (
+        FromModule.tables['dot1dBasePortTable'].column_index)
+    assert FromIndex.text_columns == FromModule.text_columns
+    assert hasattr(FromIndex, 'get_dot1dBaseBridgeAddress')
@@ -0,0 +1,230 @@
+"""Tests for ipdevpoll's simulated SNMP agents and benchmark results"""
+from mock import Mock
+from twisted.internet import task
+import pytest
+
+from nav.ipdevpoll.benchmark import ber
+from nav.ipdevpoll.benchmark.agent import (SimulatedAgent, Walk,
+                                           parse_snmprec, parse_snmpwalk,
+                                           simulated_addresses)
+from nav.ipdevpoll.benchmark.driver import BenchmarkResult
+from nav.ipdevpoll.instrumentation import PluginStats
+
+SYSDESCR = (1, 3, 6, 1, 2, 1, 1, 1, 0)
+SYSOBJECTID = (1, 3, 6, 1, 2, 1, 1, 2, 0)
+SYSUPTIME = (1, 3, 6, 1, 2, 1, 1, 3, 0)
+IFDESCR = (1, 3, 6, 1, 2, 1, 2, 2, 1, 2)
+
+
+@pytest.fixture
+def walk():
+    return Walk([
+        (SYSUPTIME, ber.TIMETICKS, 4242),
+        (SYSDESCR, ber.OCTET_STRING, b'Simulated switch'),
+        (SYSOBJECTID, ber.OBJECT_IDENTIFIER, (1, 3, 6, 1, 4, 1, 9, 1, 1)),
+        (IFDESCR + (1,), ber.OCTET_STRING, b'Gi1/1'),
+        (IFDESCR + (2,), ber.OCTET_STRING, b'Gi1/2'),
+    ])
+
+
+def _request(pdu_type, oids, version=1, non_repeaters=0, max_repetitions=0):
+    varbinds = b''.join(
+        ber.encode_tlv(ber.SEQUENCE, ber.encode_oid(oid) +
+                       ber.encode_value(ber.NULL, None))
+        for oid in oids)
+    pdu = ber.encode_tlv(pdu_type,
+                         ber.encode_integer(1234) +
+                         ber.encode_integer(non_repeaters) +
+                         ber.encode_integer(max_repetitions) +
+                         ber.encode_tlv(ber.SEQUENCE, varbinds))
+    return ber.encode_tlv(ber.SEQUENCE,
+                          ber.encode_integer(version) +
+                          ber.encode_tlv(ber.OCTET_STRING, b'public') + pdu)
+
+
+def _decode_response(data):
+    """Decodes a response into (error_status, [(oid, tag, raw value)])"""
+    message, _ = ber._expect(ber.SEQUENCE, data, 0)
+    _, offset = ber._expect(ber.INTEGER, message, 0)
+    _, offset = ber._expect(ber.OCTET_STRING, message, offset)
+    pdu, _ = ber._expect(ber.RESPONSE, message, offset)
+    _, offset = ber._expect(ber.INTEGER, pdu, 0)
+    status, offset = ber._expect(ber.INTEGER, pdu, offset)
+    _, offset = ber._expect(ber.INTEGER, pdu, offset)
+    varbind_list, _ = ber._expect(ber.SEQUENCE, pdu, offset)
+    varbinds = []
+    offset = 0
+    while offset < len(varbind_list):
+        varbind, offset = ber._expect(ber.SEQUENCE, varbind_list, offset)
+        oid, value_offset = ber._expect(ber.OBJECT_IDENTIFIER, varbind, 0)
+        tag, value, _ = ber.decode_tlv(varbind, value_offset)
+        varbinds.append((ber.decode_oid(oid), tag, value))
+    return ber.decode_integer(status), varbinds
+
+
+class TestBER(object):
+    @pytest.mark.parametrize("value", [0, 1, 127, 128, 255, 256, -1, -128,
+                                       -129, 2**31, 2**64 - 1])
+    def test_integers_should_survive_roundtrip(self, value):
+        tag, encoded, _ = ber.decode_tlv(ber.encode_integer(value))
+        assert tag == ber.INTEGER
+        assert ber.decode_integer(encoded) == value
+
+    @pytest.mark.parametrize("oid", [
+        (1, 3, 6, 1, 2, 1, 1, 1, 0),
+        (1, 3, 6, 1, 4, 1, 318, 1, 1, 12, 2, 3, 1, 1, 2, 1),
+        (1, 3, 6, 1, 4, 1, 2**32 - 1),
+    ])
+    def test_oids_should_survive_roundtrip(self, oid):
+        _, encoded, _ = ber.decode_tlv(ber.encode_oid(oid))
+        assert ber.decode_oid(encoded) == oid
+
+    def test_should_encode_long_lengths(self):
+        tag, value, _ = ber.decode_tlv(ber.encode_tlv(ber.OCTET_STRING,
+                                                      b'x' * 300))
+        assert value == b'x' * 300
+
+    def test_should_decode_request(self):
+        request = ber.decode_request(
+            _request(ber.GET_BULK_REQUEST, [SYSDESCR], max_repetitions=10))
+        assert request.pdu_type == ber.GET_BULK_REQUEST
+        assert request.community == b'public'
+        assert request.request_id == 1234
+        assert request.max_repetitions == 10
+        assert request.oids == [SYSDESCR]
+
+    def test_should_raise_on_truncated_request(self):
+        with pytest.raises(ber.BERError):
+            ber.decode_request(_request(ber.GET_REQUEST, [SYSDESCR])[:-3])
+
+
+class TestWalkParsing(object):
+    def test_should_parse_snmprec(self):
+        lines = ["1.3.6.1.2.1.1.1.0|4x|537769746368",
+                 "1.3.6.1.2.1.1.3.0|67|4242",
+                 "1.3.6.1.2.1.4.20.1.1.10.0.0.1|64|10.0.0.1",
+                 "1.3.6.1.2.1.1.9.0|4:numeric|foo"]
+        assert list(parse_snmprec(lines)) == [
+            (SYSDESCR, ber.OCTET_STRING, b'Switch'),
+            (SYSUPTIME, ber.TIMETICKS, 4242),
+            ((1, 3, 6, 1, 2, 1, 4, 20, 1, 1, 10, 0, 0, 1), ber.IP_ADDRESS,
+             '10.0.0.1'),
+        ]
+
+    def test_should_parse_snmpwalk_output(self):
+        lines = [
+            '.1.3.6.1.2.1.1.1.0 = STRING: "Multi',
+            'line"',
+            '.1.3.6.1.2.1.1.2.0 = OID: .1.3.6.1.4.1.9.1.1',
+            '.1.3.6.1.2.1.1.3.0 = Timeticks: (4242) 0:00:42.42',
+            '.1.3.6.1.2.1.2.2.1.6.1 = Hex-STRING: 00 1A 2B 3C',
+            '4D 5E ',
+            '.1.3.6.1.2.1.2.2.1.7.1 = INTEGER: up(1)',
+            '.1.3.6.1.2.1.2.2.1.8.1 = ""',
+        ]
+        assert list(parse_snmpwalk(lines)) == [
+            (SYSDESCR, ber.OCTET_STRING, b'Multi\nline'),
+            (SYSOBJECTID, ber.OBJECT_IDENTIFIER, (1, 3, 6, 1, 4, 1, 9, 1, 1)),
+            (SYSUPTIME, ber.TIMETICKS, 4242),
+            ((1, 3, 6, 1, 2, 1, 2, 2, 1, 6, 1), ber.OCTET_STRING,
+             b'\x00\x1a\x2b\x3c\x4d\x5e'),
+            ((1, 3, 6, 1, 2, 1, 2, 2, 1, 7, 1), ber.INTEGER, 1),
+            ((1, 3, 6, 1, 2, 1, 2, 2, 1, 8, 1), ber.OCTET_STRING, b''),
+        ]
+
+
+class TestSimulatedAgent(object):
+    def test_get_should_return_values(self, walk):
+        agent = SimulatedAgent(walk)
+        status, varbinds = _decode_response(agent.respond(ber.decode_request(
+            _request(ber.GET_REQUEST, [SYSDESCR, SYSUPTIME]))))
+        assert status == ber.NO_ERROR
+        assert varbinds == [(SYSDESCR, ber.OCTET_STRING, b'Simulated switch'),
+                            (SYSUPTIME, ber.TIMETICKS, b'\x10\x92')]
+
+    def test_get_of_missing_oid_should_return_exception(self, walk):
+        agent = SimulatedAgent(walk)
+        _, varbinds = _decode_response(agent.respond(ber.decode_request(
+            _request(ber.GET_REQUEST, [(1, 3, 6, 1, 9)]))))
+        assert varbinds[0][1] == ber.NO_SUCH_INSTANCE
+
+    def test_v1_get_of_missing_oid_should_return_error(self, walk):
+        agent = SimulatedAgent(walk)
+        status, _ = _decode_response(agent.respond(ber.decode_request(
+            _request(ber.GET_REQUEST, [(1, 3, 6, 1, 9)], version=0))))
+        assert status == ber.NO_SUCH_NAME
+
+    def test_getnext_should_walk_to_end_of_mib(self, walk):
+        agent = SimulatedAgent(walk)
+        _, varbinds = _decode_response(agent.respond(ber.decode_request(
+            _request(ber.GET_NEXT_REQUEST, [IFDESCR, IFDESCR + (2,)]))))
+        assert varbinds[0][0] == IFDESCR + (1,)
+        assert varbinds[1][1] == ber.END_OF_MIB_VIEW
+
+    def test_getbulk_should_repeat_until_end_of_mib(self, walk):
+        agent = SimulatedAgent(walk)
+        _, varbinds = _decode_response(agent.respond(ber.decode_request(
+            _request(ber.GET_BULK_REQUEST, [SYSUPTIME], max_repetitions=10))))
+        assert [oid for oid, _, _ in varbinds] == [
+            IFDESCR + (1,), IFDESCR + (2,), IFDESCR + (2,)]
+        assert varbinds[-1][1] == ber.END_OF_MIB_VIEW
+
+    def test_large_get_should_be_too_big(self, walk):
+        agent = SimulatedAgent(walk, max_varbinds=1)
+        status, varbinds = _decode_response(agent.respond(ber.decode_request(
+            _request(ber.GET_REQUEST, [SYSDESCR, SYSUPTIME]))))
+        assert status == ber.TOO_BIG
+        assert varbinds == []
+
+    def test_large_getbulk_should_be_truncated(self, walk):
+        agent = SimulatedAgent(walk, max_varbinds=2)
+        status, varbinds = _decode_response(agent.respond(ber.decode_request(
+            _request(ber.GET_BULK_REQUEST, [SYSDESCR], max_repetitions=10))))
+        assert status == ber.NO_ERROR
+        assert len(varbinds) == 2
+
+    def test_should_delay_responses(self, walk):
+        clock = task.Clock()
+        agent = SimulatedAgent(walk, latency=0.5, clock=clock)
+        agent.transport = Mock()
+        agent.datagramReceived(_request(ber.GET_REQUEST, [SYSDESCR]),
+                               ('127.0.0.1', 12345))
+        assert not agent.transport.write.called
+        clock.advance(0.5)
+        assert agent.transport.write.called
+
+    def test_should_drop_requests(self, walk):
+        agent = SimulatedAgent(walk, loss=1.0)
+        agent.transport = Mock()
+        agent.datagramReceived(_request(ber.GET_REQUEST, [SYSDESCR]),
+                               ('127.0.0.1', 12345))
+        assert agent.dropped == 1
+        assert not agent.transport.write.called
+
+    def test_should_ignore_wrong_community(self, walk):
+        agent = SimulatedAgent(walk, community=b'secret')
+        agent.transport = Mock()
+        agent.datagramReceived(_request(ber.GET_REQUEST, [SYSDESCR]),
+                               ('127.0.0.1', 12345))
+        assert not agent.transport.write.called
+
+
+def test_simulated_addresses_should_skip_network_address():
+    addresses = simulated_addresses('127.10.0.0', 300)
+    assert str(addresses[0]) == '127.10.0.1'
+    assert str(addresses[-1]) == '127.10.1.44'
+
+
+def test_benchmark_result_should_sum_plugin_stats():
+    stats = PluginStats('typeoid')
+    stats.record_snmp_response(0.1, [])
+    stats.record_db_queries(3, 0.1)
+    result = BenchmarkResult('inventory', 10)
+    result.record(Mock(plugin_stats=[stats]), 1.0, True)
+    result.record(Mock(plugin_stats=[stats]), 3.0, False)
+    result.wall_time = 2.0
+    summary = result.as_dict()
+    assert summary['jobs_per_second'] == 1.0
+    assert summary['db_queries_per_job'] == 3
+    assert summary['failures'] == 1
+    assert 'inventory' in result.report()
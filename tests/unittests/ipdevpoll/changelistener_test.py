@@ -0,0 +1,53 @@
+"""Tests for ipdevpoll's netbox change notification listener"""
+from collections import namedtuple
+
+from mock import Mock, patch
+from twisted.internet import task
+import pytest
+
+from nav.ipdevpoll.changelistener import NetboxChangeListener
+
+Notify = namedtuple('Notify', 'pid channel payload')
+
+
+@pytest.fixture
+def clock():
+    clock = task.Clock()
+    with patch('nav.ipdevpoll.changelistener.reactor') as reactor:
+        reactor.callLater = clock.callLater
+        yield clock
+
+
+@pytest.fixture
+def listener(clock):
+    listener = NetboxChangeListener(Mock(), delay=1.0)
+    listener.connection = Mock()
+    listener.connection.notifies = []
+    return listener
+
+
+def _notify(listener, *payloads):
+    listener.connection.notifies.extend(
+        Notify(1, 'netbox_changed', payload) for payload in payloads)
+    listener.doRead()
+
+
+def test_should_report_changed_netboxes_after_delay(listener, clock):
+    _notify(listener, '1', '2')
+    assert not listener.callback.called
+    clock.advance(1)
+    listener.callback.assert_called_once_with({1, 2})
+
+
+def test_should_coalesce_notifications(listener, clock):
+    _notify(listener, '1')
+    clock.advance(0.5)
+    _notify(listener, '2', '1')
+    clock.advance(0.5)
+    listener.callback.assert_called_once_with({1, 2})
+
+
+def test_should_ignore_invalid_payloads(listener, clock):
+    _notify(listener, 'foo', '3')
+    clock.advance(1)
+    listener.callback.assert_called_once_with({3})
@@ -0,0 +1,125 @@
+"""Tests for ipdevpoll's per-plugin instrumentation"""
+import django.db
+from mock import Mock, patch
+from twisted.internet import defer
+from twisted.internet.error import TimeoutError
+import pytest
+
+from nav.ipdevpoll import db, Plugin
+from nav.ipdevpoll.instrumentation import PluginStats, percentile
+from nav.ipdevpoll.snmp.common import instrumented
+
+
+@pytest.fixture
+def stats():
+    return PluginStats('sensors')
+
+
+class TestPluginStats(object):
+    def test_should_count_responses_and_varbinds(self, stats):
+        stats.record_snmp_response(0.1, [((1, 3, 6, 1), b'foo'),
+                                         ((1, 3, 6, 2), 42)])
+        stats.record_snmp_timeout(1.5)
+        result = stats.as_dict()
+        assert result['snmp.requests'] == 2
+        assert result['snmp.varbinds'] == 2
+        assert result['snmp.timeouts'] == 1
+        assert result['snmp.bytes'] > 0
+        assert result['snmp.latency.max'] == 1.5
+
+    def test_should_sum_db_queries(self, stats):
+        stats.record_db_queries(2, 0.5)
+        stats.record_db_queries(1, 0.25)
+        assert stats.as_dict()['db.queries'] == 3
+        assert stats.as_dict()['db.time'] == 0.75
+
+    def test_metrics_should_be_below_job_prefix(self, stats):
+        stats.record_snmp_response(0.1, [])
+        metrics = stats.to_metrics('example-sw.example.org', 'inventory', 42)
+        paths = [path for path, _ in metrics]
+        assert ('nav.devices.example-sw_example_org.ipdevpoll.inventory.'
+                'plugins.sensors.snmp.requests') in paths
+
+    def test_metrics_should_not_include_empty_latencies(self, stats):
+        metrics = stats.to_metrics('example-sw', 'inventory', 42)
+        assert not any('latency' in path for path, _ in metrics)
+
+
+@pytest.mark.parametrize("percent,expected", [
+    (50, 5),
+    (90, 9),
+    (100, 10),
+    (1, 1),
+])
+def test_percentile(percent, expected):
+    assert percentile(list(range(1, 11)), percent) == expected
+
+
+def test_percentile_of_empty_list_should_be_none():
+    assert percentile([], 50) is None
+
+
+class FakeAgent(object):
+    stats = None
+
+    def __init__(self, response):
+        self.response = response
+
+    @instrumented
+    def _get(self, oids):
+        return self.response
+
+
+class TestInstrumentedDecorator(object):
+    def test_should_do_nothing_without_stats(self):
+        agent = FakeAgent(defer.succeed([]))
+        assert agent._get([]).result == []
+
+    def test_should_record_response(self, stats):
+        agent = FakeAgent(defer.succeed([((1, 3, 6), 1)]))
+        agent.stats = stats
+        agent._get([])
+        assert stats.snmp_requests == 1
+        assert stats.snmp_varbinds == 1
+
+    def test_should_record_timeout(self, stats):
+        agent = FakeAgent(defer.fail(TimeoutError()))
+        agent.stats = stats
+        agent._get([]).addErrback(lambda failure: None)
+        assert stats.snmp_timeouts == 1
+
+
+def _run_queries(count):
+    for _ in range(count):
+        django.db.connection.queries_log.append({'sql': 'SELECT 1',
+                                                 'time': '0.010'})
+    return count
+
+
+class TestQueryCounting(object):
+    def test_should_count_queries(self):
+        measured = []
+        db.count_queries(_run_queries, measured)(3)
+        assert measured[0][0] == 3
+        assert measured[0][1] == pytest.approx(0.03)
+
+    def test_should_restore_connection_state(self):
+        connection = django.db.connection
+        forced = connection.force_debug_cursor
+        log = connection.queries_log
+        db.count_queries(_run_queries, [])(1)
+        assert connection.force_debug_cursor == forced
+        assert connection.queries_log is log
+
+    def test_run_in_thread_should_attribute_queries_to_plugin(self, stats):
+        class MyPlugin(Plugin):
+            def load(self):
+                return _run_queries(2)
+
+        plugin = MyPlugin(Mock(), None, None)
+        plugin.instrumentation = stats
+        with patch('nav.ipdevpoll.db.threads.deferToThread',
+                   side_effect=defer.execute):
+            result = db.run_in_thread(plugin.load)
+        assert result.result == 2
+        assert stats.db_queries == 2
@@ -0,0 +1,77 @@
+"""Tests for ipdevpoll's process-wide interface cache"""
+from mock import patch
+
+import pytest
+
+from nav.ipdevpoll.interfacecache import InterfaceCache
+from nav.models.manage import Interface
+
+
+def _make_rows(cache, netbox_id, *ifnames):
+    rows = []
+    for index, ifname in enumerate(ifnames, start=1):
+        ifc = Interface(id=netbox_id * 100 + index, netbox_id=netbox_id,
+                        ifindex=index, ifname=ifname)
+        rows.append(tuple(getattr(ifc, field) for field in cache.fields))
+    return rows
+
+
+@pytest.fixture
+def cache():
+    cache = InterfaceCache(max_netboxes=2)
+    versions = {}
+    rows = {1: _make_rows(cache, 1, 'Gi0/1', 'Gi0/2'),
+            2: _make_rows(cache, 2, 'ge-0/0/0'),
+            3: _make_rows(cache, 3, 'eth0')}
+    with patch.object(cache, 'get_version',
+                      side_effect=lambda netbox_id: versions.get(netbox_id,
+                                                                 0)), \
+            patch.object(cache, 'load_rows',
+                         side_effect=lambda netbox_id: rows[netbox_id]):
+        cache.versions = versions
+        yield cache
+
+
+class TestInterfaceCache(object):
+    def test_should_return_interface_models(self, cache):
+        interfaces = cache.get_interfaces(1)
+        assert [ifc.ifname for ifc in interfaces] == ['Gi0/1', 'Gi0/2']
+        assert interfaces[0].netbox_id == 1
+        assert not interfaces[0]._state.adding
+
+    def test_should_not_reload_unchanged_interfaces(self, cache):
+        cache.get_interfaces(1)
+        cache.get_interfaces(1)
+        assert cache.load_rows.call_count == 1
+        assert cache.get_stats()['hits'] == 1
+
+    def test_should_reload_when_version_changes(self, cache):
+        cache.get_interfaces(1)
+        cache.versions[1] = 1
+        cache.get_interfaces(1)
+        assert cache.load_rows.call_count == 2
+
+    def test_should_reload_invalidated_interfaces(self, cache):
+        cache.get_interfaces(1)
+        cache.invalidate(1)
+        cache.get_interfaces(1)
+        assert cache.load_rows.call_count == 2
+        assert cache.get_stats()['invalidations'] == 1
+
+    def test_should_return_new_instances_on_every_lookup(self, cache):
+        first = cache.get_interfaces(1)
+        first[0].ifname = 'changed'
+        second = cache.get_interfaces(1)
+        assert second[0] is not first[0]
+        assert second[0].ifname == 'Gi0/1'
+
+    def test_should_evict_least_recently_used_netboxes(self, cache):
+        cache.get_interfaces(1)
+        cache.get_interfaces(2)
+        cache.get_interfaces(1)
+        cache.get_interfaces(3)
+        assert cache.get_stats()['evictions'] == 1
+        cache.get_interfaces(1)
+        assert cache.get_stats()['hits'] == 2
+        cache.get_interfaces(2)
+        assert cache.load_rows.call_count == 4
@@ -0,0 +1,178 @@
+from mock import Mock, patch
+
+import pytest
+from twisted.internet import defer
+
+from nav.ipdevpoll import Plugin, shadows
+from nav.ipdevpoll.jobs import JobHandler
+
+
+class Undeclared(Plugin):
+    pass
+
+
+class WritesInterfaces(Plugin):
+    READS_CONTAINERS = ()
+    WRITES_CONTAINERS = (shadows.Interface,)
+
+
+class WritesVlans(Plugin):
+    READS_CONTAINERS = ()
+    WRITES_CONTAINERS = (shadows.Interface, shadows.Vlan)
+
+
+class WritesPrefixes(Plugin):
+    READS_CONTAINERS = ()
+    WRITES_CONTAINERS = (shadows.GwPortPrefix,)
+
+
+class ReadsPrefixes(Plugin):
+    READS_CONTAINERS = (shadows.GwPortPrefix,)
+    WRITES_CONTAINERS = ()
+
+
+class WritesSensors(Plugin):
+    READS_CONTAINERS = ()
+    WRITES_CONTAINERS = (shadows.Sensor,)
+
+
+class TestConflicts(object):
+    def test_undeclared_plugin_should_conflict_with_everything(self):
+        assert Undeclared.conflicts_with(WritesInterfaces)
+        assert WritesInterfaces.conflicts_with(Undeclared)
+
+    def test_writers_of_same_container_should_conflict(self):
+        assert WritesInterfaces.conflicts_with(WritesVlans)
+        assert WritesVlans.conflicts_with(WritesInterfaces)
+
+    def test_reader_should_conflict_with_writer(self):
+        assert ReadsPrefixes.conflicts_with(WritesPrefixes)
+        assert WritesPrefixes.conflicts_with(ReadsPrefixes)
+
+    def test_readers_should_not_conflict(self):
+        assert not ReadsPrefixes.conflicts_with(ReadsPrefixes)
+
+    def test_unrelated_writers_should_not_conflict(self):
+        assert not WritesInterfaces.conflicts_with(WritesPrefixes)
+
+
+def _make_plugins(*classes):
+    """Instantiates plugins whose handle() results are controlled by the
+    test, through the Deferred in each plugin's `deferred` attribute.
+    """
+    netbox = Mock(sysname='example-sw')
+    plugins = []
+    for cls in classes:
+        plugin = cls(netbox, None, None)
+        plugin.deferred = defer.Deferred()
+        plugin.handle = Mock(return_value=plugin.deferred)
+        plugins.append(plugin)
+    return plugins
+
+
+@pytest.fixture
+def job_handler():
+    handler = JobHandler('myjob', 1)
+    handler.netbox = Mock(sysname='example-sw')
+    handler._plugin_times = []
+    with patch.object(handler, '_get_max_concurrent_plugins',
+                      return_value=4), \
+            patch.object(handler, '_start_plugin_instrumentation'):
+        yield handler
+
+
+def _started(plugins):
+    return [plugin.handle.called for plugin in plugins]
+
+
+class TestIteratePlugins(object):
+    def test_should_start_unrelated_plugins_concurrently(self, job_handler):
+        plugins = _make_plugins(WritesInterfaces, WritesPrefixes,
+                                WritesSensors)
+        done = job_handler._iterate_plugins(plugins)
+        assert _started(plugins) == [True, True, True]
+        for plugin in plugins:
+            plugin.deferred.callback(None)
+        assert done.called
+
+    def test_should_serialize_conflicting_plugins(self, job_handler):
+        plugins = _make_plugins(WritesPrefixes, WritesSensors, ReadsPrefixes)
+        done = job_handler._iterate_plugins(plugins)
+        assert _started(plugins) == [True, True, False]
+        plugins[0].deferred.callback(None)
+        assert _started(plugins) == [True, True, True]
+        plugins[1].deferred.callback(None)
+        plugins[2].deferred.callback(None)
+        assert done.called
+
+    def test_should_not_start_more_than_max_concurrent(self, job_handler):
+        job_handler._get_max_concurrent_plugins.return_value = 2
+        plugins = _make_plugins(WritesInterfaces, WritesPrefixes,
+                                WritesSensors)
+        job_handler._iterate_plugins(plugins)
+        assert _started(plugins) == [True, True, False]
+        plugins[1].deferred.callback(None)
+        assert _started(plugins) == [True, True, True]
+
+    def test_undeclared_plugin_should_run_alone(self, job_handler):
+        plugins = _make_plugins(WritesInterfaces, Undeclared, WritesSensors)
+        job_handler._iterate_plugins(plugins)
+        assert _started(plugins) == [True, False, False]
+        plugins[0].deferred.callback(None)
+        assert _started(plugins) == [True, True, False]
+        plugins[1].deferred.callback(None)
+        assert _started(plugins) == [True, True, True]
+
+    def test_should_fail_with_first_failure_when_running_plugins_stop(
+            self, job_handler):
+        plugins = _make_plugins(WritesInterfaces, WritesPrefixes,
+                                ReadsPrefixes)
+        done = job_handler._iterate_plugins(plugins)
+        plugins[0].deferred.errback(ValueError("boom"))
+        assert not done.called
+        plugins[1].deferred.callback(None)
+        assert not plugins[2].handle.called
+        failures = []
+        done.addErrback(failures.append)
+        assert failures[0].check(ValueError)
+
+    def test_should_record_a_timing_for_each_plugin(self, job_handler):
+        plugins = _make_plugins(WritesInterfaces, WritesPrefixes)
+        job_handler._iterate_plugins(plugins)
+        for plugin in plugins:
+            plugin.deferred.callback(None)
+        names = [name for name, _start, _stop in job_handler._plugin_times]
+        assert names == ['WritesInterfaces', 'WritesPrefixes']
+
+
+class SkipsWhenUnchanged(Plugin):
+    CHANGE_INDICATORS = ((Mock(), 'someLastChange'),)
+    SKIP_WHEN_UNCHANGED = True
+
+
+class RunsWhenUnchanged(Plugin):
+    CHANGE_INDICATORS = ((Mock(), 'someLastChange'),)
+
+
+class TestSkipUnchangedPlugins(object):
+    def _skip(self, job_handler, plugins, changed):
+        with patch('nav.ipdevpoll.jobs.ChangeIndicators') as indicators:
+            indicators.return_value.plugins = [
+                plugin for plugin in plugins if plugin.CHANGE_INDICATORS]
+            indicators.return_value.is_changed.return_value = changed
+            df = job_handler._skip_unchanged_plugins(plugins)
+        return df.result
+
+    def test_should_skip_plugins_with_unchanged_indicators(self, job_handler):
+        plugins = _make_plugins(SkipsWhenUnchanged, RunsWhenUnchanged,
+                                WritesSensors)
+        result = self._skip(job_handler, plugins, changed=False)
+        assert result == plugins[1:]
+        assert not plugins[1].indicators_changed
+
+    def test_should_run_plugins_with_changed_indicators(self, job_handler):
+        plugins = _make_plugins(SkipsWhenUnchanged, RunsWhenUnchanged,
+                                WritesSensors)
+        result = self._skip(job_handler, plugins, changed=True)
+        assert result == plugins
+        assert plugins[0].indicators_changed
@@ -1,6 +1,9 @@
 from unittest import TestCase
-from nav.ipdevpoll.neighbor import _get_netbox_macs
+import pytest
+from nav.ipdevpoll.neighbor import (_get_netbox_macs, IdentityIndex,
+                                    InterfaceIdentity)
 from nav.ipdevpoll.plugins.cdp import CDPNeighbor
+from nav.mibs.cisco_cdp_mib import CDPNeighbor as CDPRecord
 from mock import patch, Mock
 
 
@@ -34,3 +37,113 @@ class IgnoreCDPSelfLoopsTest(TestCase):
         test_ip = '10.0.1.41'
         neighbor = _MockedCDPNeighbor(None, test_ip)
         self.assertTrue(neighbor._netbox_from_ip(test_ip) is None)
+
+
+NETBOXES = [(1, 'core-gw.example.org', '10.0.0.1'),
+            (2, 'access-sw.example.org', '10.0.0.2'),
+            (3, 'access-sw.example.com', '10.0.0.3')]
+GATEWAY_ADDRESSES = [('10.1.0.1', 1, 11), ('10.2.0.1', 1, 12)]
+INTERFACES = {
+    1: [InterfaceIdentity(11, 'Gi0/1', 'GigabitEthernet0/1', 6, 'uplink',
+                          1, 1, '00:12:34:56:78:01'),
+        InterfaceIdentity(12, 'Gi0/2', 'GigabitEthernet0/2', 6, None,
+                          2, 2, '00:12:34:56:78:02')],
+    2: [InterfaceIdentity(21, 'ge-0/0/0', 'ge-0/0/0', 6, None, None, 501,
+                          None)],
+}
+
+
+@pytest.fixture
+def index():
+    index = IdentityIndex()
+    versions = {}
+
+    def _load_interfaces(netbox_ids):
+        return [(netbox_id, ifc) for netbox_id in netbox_ids
+                for ifc in INTERFACES.get(netbox_id, [])]
+
+    with patch.object(index, 'load_netboxes', return_value=NETBOXES), \
+            patch.object(index, 'load_gateway_addresses',
+                         return_value=GATEWAY_ADDRESSES), \
+            patch.object(index, 'load_interfaces',
+                         side_effect=_load_interfaces), \
+            patch('nav.ipdevpoll.neighbor._get_netbox_macs',
+                  return_value={'00:12:34:56:78:00': 1}), \
+            patch('nav.ipdevpoll.neighbor.get_interface_versions',
+                  side_effect=lambda ids: dict(
+                      (i, versions[i]) for i in ids if i in versions)), \
+            patch('nav.ipdevpoll.neighbor.get_identity_index',
+                  return_value=index):
+        index.versions = versions
+        yield index
+
+
+class TestIdentityIndex(object):
+    def test_should_find_netbox_by_ip(self, index):
+        assert index.netboxes_by_ip('10.0.0.2') == {2}
+
+    def test_should_find_netbox_by_gateway_address(self, index):
+        assert index.netboxes_by_gateway_address('10.2.0.1') == {1}
+
+    def test_should_find_netbox_by_sysname_regardless_of_case(self, index):
+        assert index.netboxes_by_sysname('CORE-GW.example.org') == {1}
+
+    def test_should_find_all_netboxes_by_unqualified_sysname(self, index):
+        assert index.netboxes_by_sysname('access-sw') == {2, 3}
+
+    def test_should_not_load_netboxes_more_than_once(self, index):
+        index.netboxes_by_ip('10.0.0.1')
+        index.netboxes_by_sysname('core-gw')
+        assert index.load_netboxes.call_count == 1
+
+    def test_should_reload_old_netbox_identities(self, index):
+        index.netboxes_by_ip('10.0.0.1')
+        with patch('time.time', return_value=2**40):
+            index.netboxes_by_ip('10.0.0.1')
+        assert index.load_netboxes.call_count == 2
+
+    def test_should_prefetch_interfaces_in_one_query(self, index):
+        index.prefetch_interfaces([1, 2])
+        assert len(index.get_interfaces(1)) == 2
+        assert len(index.get_interfaces(2)) == 1
+        assert index.load_interfaces.call_count == 1
+
+    def test_should_reload_interfaces_when_version_changes(self, index):
+        index.get_interfaces(1)
+        index.versions[1] = 1
+        with patch('time.time', return_value=2**40):
+            index.get_interfaces(1)
+        assert index.load_interfaces.call_count == 2
+
+    def test_should_not_reload_unchanged_interfaces(self, index):
+        index.get_interfaces(1)
+        with patch('time.time', return_value=2**40):
+            index.get_interfaces(1)
+        assert index.load_interfaces.call_count == 1
+
+
+class TestNeighborIdentification(object):
+    def test_should_identify_cdp_neighbor_by_ip_and_port_name(self, index):
+        record = CDPRecord(1, '10.1.0.1', 'core-gw', 'GigabitEthernet0/2')
+        neighbor, = CDPNeighbor.identify_records([record], '10.0.0.2')
+        assert neighbor.identified
+        assert neighbor.netbox.id == 1
+        assert neighbor.netbox.sysname == 'core-gw.example.org'
+        assert [ifc.id for ifc in neighbor.interfaces] == [12]
+
+    def test_should_identify_cdp_neighbor_by_sysname(self, index):
+        record = CDPRecord(1, None, 'SERIAL(access-sw.example.org)',
+                           'ge-0/0/0')
+        neighbor = CDPNeighbor(record)
+        assert neighbor.netbox.id == 2
+        assert [ifc.id for ifc in neighbor.interfaces] == [21]
+
+    def test_should_not_identify_ambiguous_sysname(self, index):
+        record = CDPRecord(1, None, 'access-sw', 'ge-0/0/0')
+        neighbor = CDPNeighbor(record)
+        assert not neighbor.identified
+
+    def test_should_identify_interface_by_baseport(self, index):
+        record = CDPRecord(1, '10.0.0.1', 'core-gw', '1')
+        neighbor = CDPNeighbor(record)
+        assert [ifc.id for ifc in neighbor.interfaces] == [11]
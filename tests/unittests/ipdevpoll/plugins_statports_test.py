@@ -0,0 +1,81 @@
+"""Tests and benchmark for metric path generation in the statports plugin"""
+import os
+import timeit
+
+from mock import Mock
+import pytest
+
+from nav.ipdevpoll.plugins.statports import StatPorts, LOGGED_COUNTERS
+from nav.ipdevpoll.plugins.statsensors import StatSensors
+from nav.metrics.templates import (metric_path_for_interface,
+                                   metric_path_for_sensor)
+
+
+def _make_stats(count):
+    return dict(
+        (ifindex, dict([('ifName', 'Gi1/0/%d' % ifindex), ('ifDescr', None)]
+                       + [(key, ifindex) for key in LOGGED_COUNTERS]))
+        for ifindex in range(1, count + 1))
+
+
+def _make_metrics_the_slow_way(stats, netboxes, timestamp):
+    for row in stats.values():
+        for key in LOGGED_COUNTERS:
+            if row.get(key) is not None:
+                for netbox in netboxes:
+                    path = metric_path_for_interface(
+                        netbox, row['ifName'] or row['ifDescr'], key)
+                    yield (path, (timestamp, row[key]))
+
+
+@pytest.fixture
+def plugin():
+    return StatPorts(Mock(), None, None)
+
+
+def test_make_metrics_should_produce_same_paths_as_templates(plugin):
+    stats = _make_stats(3)
+    stats[2]['ifName'] = None
+    stats[2]['ifDescr'] = 'GigabitEthernet 1/0/2 (uplink)'
+    netboxes = ['example-sw.example.org', 'example-sw-vdc']
+
+    # _make_metrics replaces non-HC counter values in place
+    result = list(plugin._make_metrics(stats, netboxes, timestamp=42))
+    expected = list(_make_metrics_the_slow_way(stats, netboxes, 42))
+    assert result == expected
+
+
+def test_response_to_metrics_should_produce_same_paths_as_templates(
+        monkeypatch):
+    monkeypatch.setattr('nav.ipdevpoll.plugins.statsensors.send_metrics',
+                        Mock())
+    plugin = StatSensors(Mock(), None, None)
+    sensors = {'.1.2.3': {'internal_name': 'temp 1 (inlet)'},
+               '.1.2.4': {'internal_name': 'fan.2'}}
+    netboxes = ['example-sw.example.org', 'example-sw-vdc']
+
+    result = plugin._response_to_metrics({'.1.2.3': 20, '.1.2.4': 3000},
+                                         sensors, netboxes)
+    paths = set(path for path, _value in result)
+    assert paths == set(metric_path_for_sensor(netbox, sensor['internal_name'])
+                        for netbox in netboxes
+                        for sensor in sensors.values())
+
+
+@pytest.mark.skipif(not os.environ.get('NAV_BENCHMARKS'),
+                    reason="timing benchmarks are only run when "
+                           "NAV_BENCHMARKS is set")
+def test_make_metrics_benchmark(plugin):
+    """A micro-benchmark of precomputed interface path prefixes versus
+    building each metric path from scratch
+    """
+    stats = _make_stats(500)
+    netboxes = ['example-sw.example.org']
+
+    slow = timeit.timeit(
+        lambda: list(_make_metrics_the_slow_way(stats, netboxes, 42)),
+        number=3)
+    fast = timeit.timeit(
+        lambda: list(plugin._make_metrics(stats, netboxes, timestamp=42)),
+        number=3)
+    assert fast * 2 < slow
@@ -0,0 +1,86 @@
+"""Tests for cost-aware job dispatch in ipdevpoll's worker pool"""
+import time
+
+from mock import Mock, patch
+from twisted.internet import defer
+import pytest
+
+from nav.ipdevpoll import pool
+
+
+def test_estimator_should_return_default_for_unknown_job():
+    estimator = pool.RuntimeEstimator(default=42)
+    assert estimator.estimate('inventory', 1) == 42
+
+
+def test_estimator_should_use_seeded_runtimes():
+    estimator = pool.RuntimeEstimator()
+    estimator.seed({(1, 'inventory'): 120.0})
+    assert estimator.estimate('inventory', 1) == 120.0
+
+
+def test_estimator_should_fall_back_to_job_average_for_unknown_netbox():
+    estimator = pool.RuntimeEstimator()
+    estimator.seed({(1, 'inventory'): 120.0})
+    assert estimator.estimate('inventory', 2) == 120.0
+
+
+def test_estimator_should_move_towards_observed_runtimes():
+    estimator = pool.RuntimeEstimator(alpha=0.5)
+    estimator.update('inventory', 1, 100.0)
+    estimator.update('inventory', 1, 50.0)
+    assert estimator.estimate('inventory', 1) == 75.0
+
+
+def test_worker_backlog_should_subtract_elapsed_time():
+    worker = pool.Worker(Mock(), None, None)
+    now = time.time()
+    worker.expected_runtimes = {
+        1: (('inventory', 1), now - 10, 60),
+        2: (('1minstats', 1), now - 10, 5),
+    }
+    assert 49 < worker.get_estimated_backlog() <= 50
+
+
+class TestWorkerPoolDispatch(object):
+    @pytest.fixture
+    def workerpool(self):
+        with patch.object(pool.WorkerPool, '_spawn_worker'):
+            workerpool = pool.WorkerPool(workers=2, max_jobs=0)
+        workers = []
+        for _ in range(2):
+            worker = pool.Worker(workerpool, None, 0)
+            worker.execute = Mock(side_effect=self._execute(worker))
+            workers.append(worker)
+        workerpool.workers = set(workers)
+        return workerpool
+
+    @staticmethod
+    def _execute(worker):
+        def _execute(serial, command, **kwargs):
+            worker.active_jobs += 1
+            return defer.Deferred()
+        return _execute
+
+    def test_should_dispatch_to_worker_with_least_estimated_backlog(
+            self, workerpool):
+        workerpool.estimator.seed({(1, 'inventory'): 300.0,
+                                   (2, '1minstats'): 1.0})
+        workerpool.execute_job('inventory', 1, plugins=[], interval=3600)
+        # three short jobs should all go to the worker not busy with inventory
+        for _ in range(3):
+            workerpool.execute_job('1minstats', 2, plugins=[], interval=60)
+
+        active = sorted(worker.active_jobs for worker in workerpool.workers)
+        assert active == [1, 3]
+
+    def test_should_update_estimate_when_job_finishes(self, workerpool):
+        deferred = workerpool.execute_job('inventory', 1, plugins=[],
+                                          interval=3600)
+        results = []
+        deferred.addCallbacks(results.append, results.append)
+        deferred.callback({'result': True, 'reschedule': 0})
+        assert results == [True]
+        assert workerpool.estimator.estimate('inventory', 1) < 1
+        assert all(not worker.expected_runtimes
+                   for worker in workerpool.workers)
@@ -0,0 +1,112 @@
+"""Tests and benchmark for ipdevpoll's longest-prefix-match index"""
+import os
+import random
+import timeit
+
+from IPy import IP
+import pytest
+
+from nav.models.manage import Prefix
+from nav.ipdevpoll.prefixindex import PrefixIndex
+from nav.ipdevpoll.utils import find_prefix
+
+
+@pytest.fixture
+def index():
+    return PrefixIndex([
+        ('10.0.0.0/8', 'ten'),
+        ('10.0.1.0/24', 'ten-one'),
+        ('10.0.1.128/25', 'ten-one-upper'),
+        ('10.0.2.0/24', 'ten-two'),
+        ('0.0.0.0/0', 'default'),
+        ('2001:db8::/32', 'doc'),
+        ('2001:db8:1234::/48', 'doc-1234'),
+    ])
+
+
+@pytest.mark.parametrize("address,expected", [
+    ('10.0.1.1', 'ten-one'),
+    ('10.0.1.200', 'ten-one-upper'),
+    ('10.0.2.1', 'ten-two'),
+    ('10.1.0.1', 'ten'),
+    ('192.168.0.1', 'default'),
+    ('2001:db8:1234::1', 'doc-1234'),
+    ('2001:db8:4321::1', 'doc'),
+])
+def test_lookup_should_find_most_specific_prefix(index, address, expected):
+    assert index.lookup(IP(address)) == expected
+
+
+def test_lookup_should_return_none_when_nothing_matches(index):
+    assert index.lookup('2001:db9::1') is None
+
+
+def test_lookup_should_not_be_sensitive_to_insertion_order():
+    prefixes = [('10.0.1.128/25', 3), ('10.0.1.0/24', 2), ('10.0.0.0/8', 1)]
+    for _ in range(10):
+        random.shuffle(prefixes)
+        index = PrefixIndex(prefixes)
+        assert index.lookup('10.0.1.129') == 3
+        assert index.lookup('10.0.1.1') == 2
+        assert index.lookup('10.0.3.1') == 1
+
+
+def test_adding_existing_prefix_should_replace_value(index):
+    size = len(index)
+    index.add('10.0.1.0/24', 'replaced')
+    assert index.lookup('10.0.1.1') == 'replaced'
+    assert len(index) == size
+
+
+def test_host_prefixes_should_be_indexed():
+    index = PrefixIndex([('10.0.0.1/32', 1), ('2001:db8::1/128', 2)])
+    assert index.lookup('10.0.0.1') == 1
+    assert index.lookup('10.0.0.2') is None
+    assert index.lookup('2001:db8::1') == 2
+
+
+def _make_random_prefixes(count):
+    rand = random.Random(42)
+    prefixes = set()
+    while len(prefixes) < count:
+        length = rand.randint(16, 30)
+        address = rand.getrandbits(32) >> (32 - length) << (32 - length)
+        prefixes.add('%s/%d' % (IP(address), length))
+    return sorted(prefixes)
+
+
+def test_index_should_agree_with_find_prefix():
+    prefixes = [Prefix(id=i, net_address=p)
+                for i, p in enumerate(_make_random_prefixes(500))]
+    index = PrefixIndex((p.net_address, p) for p in prefixes)
+    rand = random.Random(4242)
+    for prefix in rand.sample(prefixes, 100):
+        address = IP(IP(prefix.net_address).int() + 1)
+        assert index.lookup(address) is find_prefix(address, prefixes)
+
+
+def test_index_should_agree_with_find_prefix_on_large_table():
+    prefixes = [Prefix(id=i, net_address=p)
+                for i, p in enumerate(_make_random_prefixes(1000))]
+    index = PrefixIndex((p.net_address, p) for p in prefixes)
+    addresses = [IP(IP(p.net_address).int() + 1) for p in prefixes[:20]]
+
+    assert ([index.lookup(a) for a in addresses] ==
+            [find_prefix(a, prefixes) for a in addresses])
+
+
+@pytest.mark.skipif(not os.environ.get('NAV_BENCHMARKS'),
+                    reason="timing benchmarks are only run when "
+                           "NAV_BENCHMARKS is set")
+def test_index_should_outperform_find_prefix():
+    """A micro-benchmark of PrefixIndex versus a linear prefix scan"""
+    prefixes = [Prefix(id=i, net_address=p)
+                for i, p in enumerate(_make_random_prefixes(1000))]
+    index = PrefixIndex((p.net_address, p) for p in prefixes)
+    addresses = [IP(IP(p.net_address).int() + 1) for p in prefixes[:20]]
+
+    linear = timeit.timeit(
+        lambda: [find_prefix(a, prefixes) for a in addresses], number=1)
+    indexed = timeit.timeit(
+        lambda: [index.lookup(a) for a in addresses], number=1)
+    assert indexed * 10 < linear
@@ -1,4 +1,6 @@
-from mock import Mock
+import datetime
+
+from mock import Mock, patch
 
 import pytest
 from twisted.internet import defer, task
@@ -13,6 +15,7 @@ def netbox_job_scheduler():
     job.interval = 10
     job.plugins = []
     job.intensity = 0
+    job.priority = 0
     netbox = Mock()
     netbox.id = 1
     pool = Mock()
@@ -32,3 +35,142 @@ def test_netbox_job_scheduler_reschedule_on_success(netbox_job_scheduler):
     assert pool.execute_job.call_count == 2
     pool.execute_job.assert_called_with('myjob', 1, plugins=[],
                                         interval=10)
+
+
+def test_netbox_job_scheduler_start_should_honor_delay(netbox_job_scheduler):
+    pool = netbox_job_scheduler.pool
+    pool.execute_job.return_value = defer.Deferred()
+    clock = task.Clock()
+    netbox_job_scheduler.callLater = clock.callLater
+    netbox_job_scheduler.start(5)
+    clock.advance(4)
+    assert not pool.execute_job.called
+    clock.advance(1)
+    assert pool.execute_job.called
+
+
+class TestStaggeredStart(object):
+    def test_phase_should_be_deterministic(self, netbox_job_scheduler):
+        phase = netbox_job_scheduler.get_phase()
+        assert 0 <= phase < 1
+        assert netbox_job_scheduler.get_phase() == phase
+
+    def test_phase_should_differ_between_netboxes(self):
+        job = Mock()
+        job.name = 'myjob'
+        phases = set()
+        for netboxid in range(100):
+            netbox = Mock()
+            netbox.id = netboxid
+            scheduler = schedule.NetboxJobScheduler(job, netbox, Mock())
+            phases.add(scheduler.get_phase())
+        assert len(phases) == 100
+
+    def test_never_run_job_should_start_within_catchup_window(
+            self, netbox_job_scheduler):
+        netbox_job_scheduler.job.interval = 3600
+        netbox_job_scheduler.netbox.last_updated = {}
+        delay = netbox_job_scheduler.get_staggered_start_delay(60)
+        assert 0 <= delay < 60
+
+    def test_overdue_job_should_start_within_catchup_window(
+            self, netbox_job_scheduler):
+        netbox_job_scheduler.job.interval = 3600
+        netbox_job_scheduler.netbox.last_updated = {
+            'myjob': datetime.datetime.now() - datetime.timedelta(hours=2)}
+        delay = netbox_job_scheduler.get_staggered_start_delay(60)
+        assert 0 <= delay < 60
+
+    def test_pending_job_should_start_no_later_than_when_due(
+            self, netbox_job_scheduler):
+        netbox_job_scheduler.job.interval = 3600
+        netbox_job_scheduler.netbox.last_updated = {
+            'myjob': datetime.datetime.now() - datetime.timedelta(minutes=50)}
+        delay = netbox_job_scheduler.get_staggered_start_delay(60)
+        assert 0 <= delay <= 601
+
+
+def _make_scheduler(name, priority, netbox_id=1):
+    job = Mock()
+    job.name = name
+    job.interval = 60
+    job.intensity = 0
+    job.priority = priority
+    netbox = Mock()
+    netbox.id = netbox_id
+    netbox.sysname = 'example-sw'
+    scheduler = schedule.NetboxJobScheduler(job, netbox, Mock())
+    scheduler.callLater = task.Clock().callLater
+    scheduler.start = Mock()
+    scheduler._next_call = Mock(active=Mock(return_value=False))
+    return scheduler
+
+
+@pytest.fixture
+def global_queue():
+    cls = schedule.NetboxJobScheduler
+    with patch.object(cls, 'global_job_queue', []), \
+            patch.object(cls, 'job_counters', {}), \
+            patch.object(cls, 'global_intensity', 1), \
+            patch.object(schedule, '_COUNTERS') as counters:
+        yield counters
+
+
+class TestJobPriorities(object):
+    def test_should_unqueue_highest_priority_job_first(self, global_queue):
+        queue = schedule.NetboxJobScheduler.global_job_queue
+        inventory = _make_scheduler('inventory', 0)
+        first = _make_scheduler('1minstats', 10)
+        second = _make_scheduler('statuscheck', 10)
+        queue.extend([inventory, first, second])
+
+        schedule.NetboxJobScheduler.unqueue_next_global_job()
+        assert first.start.called
+        assert queue == [inventory, second]
+
+    def test_shed_policy_should_skip_outranked_job(self, global_queue):
+        schedule.NetboxJobScheduler.job_counters['other'] = 1
+        queue = schedule.NetboxJobScheduler.global_job_queue
+        queue.append(_make_scheduler('1minstats', 10))
+        inventory = _make_scheduler('inventory', 0)
+        inventory.overload_policy = 'shed'
+
+        inventory.run_job()
+        assert inventory not in queue
+        assert inventory._next_call.getTime() == 60
+        global_queue.increment.assert_called_with(
+            'nav.devices.example-sw.ipdevpoll.inventory.shed-count')
+
+    def test_queue_policy_should_queue_outranked_job(self, global_queue):
+        schedule.NetboxJobScheduler.job_counters['other'] = 1
+        queue = schedule.NetboxJobScheduler.global_job_queue
+        queue.append(_make_scheduler('1minstats', 10))
+        inventory = _make_scheduler('inventory', 0)
+        inventory.overload_policy = 'queue'
+
+        inventory.run_job()
+        assert inventory in queue
+
+
+class TestOverloadDetection(object):
+    def test_should_count_late_start(self, global_queue):
+        scheduler = _make_scheduler('1minstats', 10)
+        scheduler._due_at = 1000
+        scheduler._check_start_time(now=1030)
+        global_queue.increment.assert_called_with(
+            'nav.devices.example-sw.ipdevpoll.1minstats.late-count')
+
+    def test_should_not_count_timely_start(self, global_queue):
+        scheduler = _make_scheduler('1minstats', 10)
+        scheduler._due_at = 1000
+        scheduler._check_start_time(now=1001)
+        assert not global_queue.increment.called
+
+    def test_should_count_predicted_overrun(self, global_queue):
+        scheduler = _make_scheduler('1minstats', 10, netbox_id=42)
+        with patch.object(scheduler, 'runtime_estimator',
+                          schedule.RuntimeEstimator()):
+            scheduler._update_runtime_prediction(58)
+            assert scheduler.get_predicted_runtime() == 58
+        global_queue.increment.assert_called_with(
+            'nav.devices.example-sw.ipdevpoll.1minstats.overrun-count')
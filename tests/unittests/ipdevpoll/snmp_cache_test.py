@@ -0,0 +1,111 @@
+"""Tests for ipdevpoll's process-wide SNMP response cache"""
+from mock import patch
+
+from twisted.internet import defer
+
+from nav.ipdevpoll.snmp.cache import ResponseCache
+from nav.ipdevpoll.snmp.common import AgentProxyMixIn, SNMPParameters
+from nav.ipdevpoll.snmp.recording import ResponseRecorder
+
+IFTABLE = '.1.3.6.1.2.1.2.2'
+IFDESCR = '.1.3.6.1.2.1.2.2.1.2'
+IFHCINOCTETS = '.1.3.6.1.2.1.31.1.1.1.6'
+
+
+class TestResponseCache(object):
+    def test_should_only_cache_configured_subtrees(self):
+        cache = ResponseCache({IFTABLE: 300})
+        assert cache.get_ttl([IFDESCR]) == 300
+        assert cache.get_ttl([IFHCINOCTETS]) is None
+
+    def test_multi_oid_request_should_get_shortest_ttl(self):
+        cache = ResponseCache({IFTABLE: 300, IFDESCR: 60})
+        assert cache.get_ttl([IFTABLE + '.1.3', IFDESCR]) == 60
+
+    def test_multi_oid_request_with_uncached_oid_should_not_be_cached(self):
+        cache = ResponseCache({IFTABLE: 300})
+        assert cache.get_ttl([IFDESCR, IFHCINOCTETS]) is None
+
+    def test_should_expire_entries(self):
+        cache = ResponseCache({IFTABLE: 300})
+        cache.put('key', 'value', ttl=300)
+        assert cache.get('key') == 'value'
+        with patch('time.time', return_value=2**40):
+            assert cache.get('key') is None
+        assert cache.get_stats()['hits'] == 1
+        assert cache.get_stats()['misses'] == 1
+
+    def test_should_evict_least_recently_used_entries(self):
+        cache = ResponseCache({}, max_entries=2)
+        cache.put('a', 1, ttl=300)
+        cache.put('b', 2, ttl=300)
+        cache.get('a')
+        cache.put('c', 3, ttl=300)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+        assert cache.get_stats()['evictions'] == 1
+
+
+class MockAgent(object):
+    def __init__(self, ip):
+        self.ip = ip
+        self.port = 161
+        self.community = 'public'
+        self.requests = []
+
+    def getTable(self, oids, **_kwargs):
+        self.requests.append(oids)
+        return defer.succeed({'result': 1})
+
+
+class MockAgentProxy(AgentProxyMixIn, MockAgent):
+    pass
+
+
+def _make_agent():
+    return MockAgentProxy(
+        '192.0.2.1',
+        snmp_parameters=SNMPParameters(timeout=1, max_repetitions=10,
+                                       throttle_delay=0, max_columns=1))
+
+
+def test_getTable_should_share_cached_responses_between_agents():
+    cache = ResponseCache({IFTABLE: 300})
+    with patch('nav.ipdevpoll.snmp.common.get_response_cache',
+               return_value=cache):
+        first, second = _make_agent(), _make_agent()
+        assert first.getTable([IFDESCR]).result == {'result': 1}
+        assert second.getTable([IFDESCR]).result == {'result': 1}
+
+    assert len(first.requests) == 1
+    assert len(second.requests) == 0
+    assert cache.get_stats()['hits'] == 1
+    assert cache.get_stats()['misses'] == 1
+
+
+def test_getTable_should_not_cache_unconfigured_subtrees():
+    cache = ResponseCache({IFTABLE: 300})
+    with patch('nav.ipdevpoll.snmp.common.get_response_cache',
+               return_value=cache):
+        first, second = _make_agent(), _make_agent()
+        first.getTable([IFHCINOCTETS])
+        second.getTable([IFHCINOCTETS])
+
+    assert len(second.requests) == 1
+    assert cache.get_stats()['hits'] == 0
+    assert cache.get_stats()['misses'] == 0
+
+
+def test_getTable_should_bypass_caches_while_recording():
+    cache = ResponseCache({IFTABLE: 300})
+    with patch('nav.ipdevpoll.snmp.common.get_response_cache',
+               return_value=cache):
+        first, second = _make_agent(), _make_agent()
+        first.getTable([IFDESCR])
+        second.recorder = ResponseRecorder()
+        second.getTable([IFDESCR])
+        second.getTable([IFDESCR])
+
+    assert len(second.requests) == 2
+    assert cache.get_stats()['hits'] == 0
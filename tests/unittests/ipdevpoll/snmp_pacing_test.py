@@ -0,0 +1,125 @@
+"""Tests for ipdevpoll's adaptive SNMP pacing controller"""
+from mock import patch
+
+from twisted.internet import defer
+from twisted.internet.error import TimeoutError
+import pytest
+
+from nav.ipdevpoll.snmp.common import AgentProxyMixIn, SNMPParameters
+from nav.ipdevpoll.snmp.pacing import PacingController, MAX_DELAY
+
+
+@pytest.fixture
+def controller():
+    return PacingController('agent', min_delay=0.0, max_repetitions=40,
+                            max_in_flight=4, timeout=1.0)
+
+
+class TestPacingController(object):
+    def test_timeout_should_back_off(self, controller):
+        controller.on_timeout()
+        assert controller.max_repetitions == 20
+        assert controller.delay > 0
+
+    def test_repeated_timeouts_should_not_exceed_limits(self, controller):
+        for _ in range(20):
+            controller.on_timeout()
+        assert controller.max_repetitions == 1
+        assert controller.delay == MAX_DELAY
+        assert controller.in_flight_limit == 1
+
+    def test_fast_responses_should_recover_from_backoff(self, controller):
+        controller.on_timeout()
+        for _ in range(50):
+            controller.on_response(0.01)
+        assert controller.max_repetitions == 40
+        assert controller.delay == 0.0
+        assert controller.in_flight_limit == 4
+
+    def test_slow_responses_should_increase_delay(self, controller):
+        controller.on_response(0.9)
+        assert controller.delay > 0
+        assert controller.slow_responses == 1
+
+    def test_too_big_should_reduce_max_repetitions(self, controller):
+        controller.on_too_big()
+        assert controller.max_repetitions == 20
+
+    def test_acquire_should_queue_requests_beyond_limit(self, controller):
+        first = controller.acquire()
+        second = controller.acquire()
+        assert first.called
+        assert not second.called
+        controller.release()
+        assert second.called
+
+
+@pytest.fixture(autouse=True)
+def isolated_controllers():
+    with patch('nav.ipdevpoll.snmp.pacing._controllers', {}):
+        yield
+
+
+class MockAgent(object):
+    def __init__(self, responses, community='public'):
+        self.ip = '192.0.2.1'
+        self.port = 161
+        self.community = community
+        self.responses = list(responses)
+
+    def _get(self, *_args, **_kwargs):
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            return defer.fail(response)
+        return defer.succeed(response)
+
+
+class MockAgentProxy(AgentProxyMixIn, MockAgent):
+    pass
+
+
+def test_agent_timeouts_should_be_reported_to_controller():
+    agent = MockAgentProxy(
+        [TimeoutError()],
+        snmp_parameters=SNMPParameters(timeout=1, max_repetitions=40,
+                                       throttle_delay=0,
+                                       adaptive_pacing=True))
+    df = agent._get(['.1.3.6.1.2.1.1.3.0'])
+    df.addErrback(lambda failure: failure.trap(TimeoutError))
+    assert agent.pacing.timeouts == 1
+    assert agent.get_max_repetitions() == 20
+    assert agent.pacing.in_flight == 0
+
+
+def test_pacing_state_should_be_shared_between_agent_instances():
+    params = SNMPParameters(timeout=1, max_repetitions=40, throttle_delay=0,
+                            adaptive_pacing=True)
+    first = MockAgentProxy([], snmp_parameters=params)
+    second = MockAgentProxy([], snmp_parameters=params)
+    assert first.pacing is second.pacing
+
+
+def test_pacing_state_should_be_shared_between_mib_instances():
+    params = SNMPParameters(timeout=1, max_repetitions=40, throttle_delay=0,
+                            adaptive_pacing=True)
+    first = MockAgentProxy([], snmp_parameters=params)
+    second = MockAgentProxy([], community='public@10',
+                            snmp_parameters=params)
+    assert first.pacing is second.pacing
+
+
+def test_pacing_controller_should_not_reveal_community():
+    agent = MockAgentProxy(
+        [], snmp_parameters=SNMPParameters(timeout=1, max_repetitions=40,
+                                           throttle_delay=0,
+                                           adaptive_pacing=True))
+    assert 'public' not in repr(agent.pacing)
+
+
+def test_agent_without_adaptive_pacing_should_use_static_parameters():
+    agent = MockAgentProxy(
+        [TimeoutError()],
+        snmp_parameters=SNMPParameters(timeout=1, max_repetitions=40,
+                                       throttle_delay=0))
+    assert agent.pacing is None
+    assert agent.get_max_repetitions() == 40
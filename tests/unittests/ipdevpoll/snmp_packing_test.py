@@ -0,0 +1,136 @@
+"""Tests for ipdevpoll's adaptive SNMP GET request packing"""
+from twisted.internet import defer
+from twisted.internet.error import TimeoutError
+import pytest
+
+from nav.ipdevpoll.snmp.packing import RequestPacker, get_packed
+
+
+class FakeAgent(object):
+    """An agent that answers GET requests of up to max_varbinds OIDs, and
+    responds with an empty result (i.e. tooBig) to larger requests
+    """
+    def __init__(self, max_varbinds=10, timeout_oids=(), bad_oids=()):
+        self.max_varbinds = max_varbinds
+        self.timeout_oids = set(timeout_oids)
+        self.bad_oids = set(bad_oids)
+        self.requests = []
+
+    def get(self, oids):
+        self.requests.append(list(oids))
+        if self.timeout_oids.intersection(oids):
+            return defer.fail(TimeoutError())
+        if len(oids) > self.max_varbinds or self.bad_oids.intersection(oids):
+            # tooBig and noSuchName errors both look like empty responses
+            return defer.succeed({})
+        return defer.succeed(dict((oid, oid.upper()) for oid in oids))
+
+
+def _oids(count):
+    return ['.1.2.%d' % i for i in range(count)]
+
+
+@pytest.fixture
+def packer():
+    return RequestPacker('agent', initial_size=5)
+
+
+class TestRequestPacker(object):
+    def test_success_should_grow_size(self, packer):
+        packer.on_success(5)
+        assert packer.size == 10
+
+    def test_partial_success_should_not_grow_size(self, packer):
+        packer.on_success(3)
+        assert packer.size == 5
+
+    def test_empty_response_should_split_without_ceiling(self, packer):
+        packer.on_empty(5)
+        assert packer.size == 2
+        assert packer.ceiling == 100
+
+    def test_too_big_should_set_ceiling(self, packer):
+        packer.on_empty(5)
+        packer.on_too_big(5)
+        assert packer.ceiling == 4
+        for _ in range(5):
+            packer.on_success(packer.size)
+        assert packer.size == 4
+
+    def test_timeout_should_split_without_ceiling(self, packer):
+        packer.on_timeout(5)
+        assert packer.size == 2
+        for _ in range(5):
+            packer.on_success(packer.size)
+        assert packer.size > 5
+
+    def test_size_should_never_drop_below_one(self, packer):
+        for _ in range(5):
+            packer.on_too_big(1)
+        assert packer.size == 1
+        assert packer.ceiling == 1
+
+
+class TestGetPacked(object):
+    def test_should_retrieve_all_oids(self, packer):
+        agent = FakeAgent(max_varbinds=100)
+        result = get_packed(agent, _oids(50), packer).result
+        assert sorted(result) == sorted(_oids(50))
+
+    def test_should_use_fewer_requests_as_size_grows(self, packer):
+        agent = FakeAgent(max_varbinds=100)
+        get_packed(agent, _oids(400), packer)
+        assert len(agent.requests) < 400 / 5
+
+    def test_should_learn_largest_accepted_size(self, packer):
+        agent = FakeAgent(max_varbinds=12)
+        result = get_packed(agent, _oids(200), packer).result
+        assert len(result) == 200
+        assert packer.ceiling <= 12
+        assert all(len(request) <= 12 for request in agent.requests[-5:])
+
+    def test_bad_oid_should_not_lower_ceiling(self, packer):
+        agent = FakeAgent(max_varbinds=100, bad_oids=['.1.2.3'])
+        result = get_packed(agent, _oids(50), packer).result
+        assert sorted(result) == sorted(set(_oids(50)) - {'.1.2.3'})
+        assert packer.ceiling == 100
+
+    def test_should_leave_out_timed_out_oid(self, packer):
+        agent = FakeAgent(timeout_oids=['.1.2.3'])
+        df = get_packed(agent, _oids(10), packer, max_concurrent=2)
+        assert sorted(df.result) == sorted(set(_oids(10)) - {'.1.2.3'})
+
+    def test_should_give_up_on_unresponsive_agent(self, packer):
+        agent = FakeAgent(timeout_oids=_oids(50)[10:])
+        result = get_packed(agent, _oids(50), packer).result
+        assert sorted(result) == sorted(_oids(10))
+        assert len(agent.requests) < 30
+
+    def test_dead_agent_should_fail_with_timeout(self, packer):
+        agent = FakeAgent(timeout_oids=_oids(50))
+        failures = []
+        get_packed(agent, _oids(50), packer).addErrback(failures.append)
+        assert len(failures) == 1
+        assert failures[0].check(TimeoutError)
+
+    def test_timeouts_of_split_requests_should_not_shrink_packer(self,
+                                                                 packer):
+        agent = FakeAgent(timeout_oids=_oids(50))
+        get_packed(agent, _oids(50), packer).addErrback(lambda _: None)
+        assert packer.size == 2
+
+    def test_should_use_concurrent_requests(self, packer):
+        pending = []
+
+        class SlowAgent(object):
+            def get(self, oids):
+                df = defer.Deferred()
+                pending.append((df, oids))
+                return df
+
+        df = get_packed(SlowAgent(), _oids(20), packer, max_concurrent=2)
+        assert len(pending) == 2
+        while pending:
+            request, oids = pending.pop(0)
+            request.callback(dict((oid, 1) for oid in oids))
+        assert len(df.result) == 20
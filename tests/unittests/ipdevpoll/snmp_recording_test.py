@@ -0,0 +1,145 @@
+"""Tests for recording and offline replay of SNMP responses"""
+import gzip
+import json
+
+from twisted.internet import defer
+import pytest
+
+from nav.ipdevpoll import Plugin, shadows
+from nav.ipdevpoll.benchmark.replay import (ReplayTimings, make_netbox,
+                                            replay_plugin, find_regressions)
+from nav.ipdevpoll.snmp.common import recorded
+from nav.ipdevpoll.snmp.recording import (ResponseRecorder, SnmpFixture,
+                                          get_fixture_name)
+
+SYSDESCR = (1, 3, 6, 1, 2, 1, 1, 1, 0)
+SYSOBJECTID = (1, 3, 6, 1, 2, 1, 1, 2, 0)
+IFDESCR = (1, 3, 6, 1, 2, 1, 2, 2, 1, 2)
+IFTYPE = (1, 3, 6, 1, 2, 1, 2, 2, 1, 3)
+
+
+@pytest.fixture
+def fixture():
+    return SnmpFixture({
+        '': [(SYSDESCR, b'Recorded switch'),
+             (SYSOBJECTID, (1, 3, 6, 1, 4, 1, 9, 1, 1)),
+             (IFDESCR + (1,), b'Gi1/1'),
+             (IFDESCR + (2,), b'Gi1/2'),
+             (IFTYPE + (1,), 6)],
+        '10': [(IFDESCR + (1,), b'Vlan10')],
+    })
+
+
+class TestResponseRecorder(object):
+    def test_saved_fixture_should_load_same_varbinds(self, tmpdir):
+        recorder = ResponseRecorder()
+        recorder.record('public', [(SYSDESCR, b'\xffbinary'),
+                                   (SYSOBJECTID, (1, 3, 6, 1, 4, 1, 9)),
+                                   (IFTYPE + (1,), 6),
+                                   (IFTYPE + (2,), None)])
+        filename = str(tmpdir.join('fixture.snmp.json.gz'))
+        recorder.save(filename, sysname='example-sw')
+
+        fixture = SnmpFixture.load(filename)
+        assert fixture.metadata['sysname'] == 'example-sw'
+        assert fixture.get('', SYSDESCR) == b'\xffbinary'
+        assert fixture.get('', SYSOBJECTID) == (1, 3, 6, 1, 4, 1, 9)
+        assert fixture.get('', IFTYPE + (1,)) == 6
+        assert fixture.get('', IFTYPE + (2,)) is None
+
+    def test_should_record_community_instances_separately(self):
+        recorder = ResponseRecorder()
+        recorder.record(b'public', [(IFDESCR + (1,), b'Gi1/1')])
+        recorder.record(b'public@10', [(IFDESCR + (1,), b'Vlan10')])
+        assert set(recorder.instances) == {'', '10'}
+        assert len(recorder) == 2
+
+    def test_should_not_save_community(self, tmpdir):
+        recorder = ResponseRecorder()
+        recorder.record('s3cret@10', [(SYSDESCR, b'switch')])
+        filename = str(tmpdir.join('fixture.snmp.json.gz'))
+        recorder.save(filename)
+        with gzip.open(filename, 'rb') as saved:
+            data = saved.read().decode('utf-8')
+        assert 's3cret' not in data
+        assert list(json.loads(data)['instances']) == ['10']
+
+
+def test_fixture_name_should_be_escaped():
+    assert get_fixture_name('sw.example.org', 'inventory') == (
+        'sw_example_org.inventory.snmp.json.gz')
+
+
+class TestFixtureAgentProxy(object):
+    def test_get_should_return_dict(self, fixture):
+        agent = fixture.make_agent_proxy()
+        result = agent.get(['.1.3.6.1.2.1.1.1.0']).result
+        assert result == {'.1.3.6.1.2.1.1.1.0': b'Recorded switch'}
+
+    def test_walk_should_return_next_varbind(self, fixture):
+        agent = fixture.make_agent_proxy()
+        result = agent.walk('.1.3.6.1.2.1.1.1.0').result
+        assert result == {'.1.3.6.1.2.1.1.2.0': (1, 3, 6, 1, 4, 1, 9, 1, 1)}
+
+    def test_gettable_should_return_subtree(self, fixture):
+        agent = fixture.make_agent_proxy()
+        result = agent.getTable(['.1.3.6.1.2.1.2.2.1.2']).result
+        assert result == {'.1.3.6.1.2.1.2.2.1.2': {
+            '.1.3.6.1.2.1.2.2.1.2.1': b'Gi1/1',
+            '.1.3.6.1.2.1.2.2.1.2.2': b'Gi1/2',
+        }}
+
+    def test_getbulk_should_return_repetitions(self, fixture):
+        agent = fixture.make_agent_proxy()
+        result = agent._getbulk(0, 2, ['.1.3.6.1.2.1.2.2.1.2']).result
+        assert [oid for oid, _ in result] == [IFDESCR + (1,), IFDESCR + (2,)]
+
+    def test_should_answer_from_community_instance(self, fixture):
+        agent = fixture.make_agent_proxy(community='public@10')
+        result = agent.getTable(['.1.3.6.1.2.1.2.2.1.2']).result
+        assert list(result['.1.3.6.1.2.1.2.2.1.2'].values()) == [b'Vlan10']
+
+
+def test_recorded_decorator_should_record_response():
+    class Proxy(object):
+        community = 'public@10'
+        recorder = ResponseRecorder()
+
+        @recorded
+        def _get(self, oids):
+            return defer.succeed([(SYSDESCR, b'switch')])
+
+    proxy = Proxy()
+    proxy._get([SYSDESCR])
+    assert proxy.recorder.instances == {'10': {SYSDESCR: b'switch'}}
+
+
+class SysDescrPlugin(Plugin):
+    @defer.inlineCallbacks
+    def handle(self):
+        result = yield self.agent.get(['.1.3.6.1.2.1.1.1.0'])
+        netbox = self.containers.factory(None, shadows.Netbox)
+        netbox.description = result['.1.3.6.1.2.1.1.1.0']
+
+
+class TestReplay(object):
+    def test_should_replay_plugin_repeatedly(self, fixture):
+        timings = replay_plugin(SysDescrPlugin, fixture,
+                                make_netbox('example-sw'), repeat=3).result
+        assert len(timings.totals) == 3
+        assert timings.requests == 1
+        assert timings.name == 'SysDescrPlugin'
+
+    def test_slower_replay_should_be_regression(self):
+        timings = ReplayTimings('fixture:plugin')
+        timings.handle_times = [0.3, 0.4]
+        timings.prepare_times = [0.0, 0.0]
+        assert find_regressions([timings], {'fixture:plugin': 0.1}) == [
+            ('fixture:plugin', 0.3, 0.1)]
+
+    def test_replay_within_tolerance_should_not_be_regression(self):
+        timings = ReplayTimings('fixture:plugin')
+        timings.handle_times = [0.12]
+        timings.prepare_times = [0.0]
+        assert not find_regressions([timings], {'fixture:plugin': 0.1})
+        assert not find_regressions([timings], {})
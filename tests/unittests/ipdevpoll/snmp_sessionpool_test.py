@@ -0,0 +1,89 @@
+"""Tests for ipdevpoll's SNMP session pool"""
+from mock import Mock, patch
+import pytest
+
+from nav.ipdevpoll.snmp.sessionpool import SessionPool
+
+
+class MockAgentProxy(object):
+    def __init__(self, ip, port, community, snmpVersion, **_kwargs):
+        self.ip = ip
+        self.port = port
+        self.community = community
+        self.snmpVersion = snmpVersion
+        self.open = Mock()
+        self.close = Mock()
+        self.reset = Mock()
+
+
+@pytest.fixture
+def pool():
+    pool = SessionPool(MockAgentProxy, max_sessions=2, idle_timeout=60)
+    pool._start_expiry_loop = Mock()
+    return pool
+
+
+def test_released_session_should_be_reused(pool):
+    agent = pool.borrow('192.0.2.1', 161, 'public', 'v2')
+    pool.release(agent)
+    assert pool.borrow('192.0.2.1', 161, 'public', 'v2') is agent
+    assert agent.open.call_count == 1
+    assert agent.reset.call_count == 1
+    assert not agent.close.called
+
+
+def test_session_that_fails_to_open_should_be_closed(pool):
+    agents = []
+
+    def _factory(*args, **kwargs):
+        agent = MockAgentProxy(*args, **kwargs)
+        agent.open.side_effect = OSError("no more sessions")
+        agents.append(agent)
+        return agent
+
+    pool.factory = _factory
+    with pytest.raises(OSError):
+        pool.borrow('192.0.2.1', 161, 'public', 'v2')
+    assert agents[0].close.called
+    assert pool.created == 0
+
+
+def test_busy_session_should_not_be_shared(pool):
+    first = pool.borrow('192.0.2.1', 161, 'public', 'v2')
+    second = pool.borrow('192.0.2.1', 161, 'public', 'v2')
+    assert first is not second
+
+
+def test_sessions_with_different_credentials_should_not_be_shared(pool):
+    agent = pool.borrow('192.0.2.1', 161, 'public', 'v2')
+    pool.release(agent)
+    assert pool.borrow('192.0.2.1', 161, 'secret', 'v2') is not agent
+
+
+def test_should_close_oldest_idle_session_when_full(pool):
+    first = pool.borrow('192.0.2.1', 161, 'public', 'v2')
+    second = pool.borrow('192.0.2.2', 161, 'public', 'v2')
+    pool.release(first)
+    pool.release(second)
+    pool.borrow('192.0.2.3', 161, 'public', 'v2')
+    assert first.close.called
+    assert not second.close.called
+
+
+def test_unpooled_session_should_be_closed_on_release(pool):
+    pool.borrow('192.0.2.1', 161, 'public', 'v2')
+    pool.borrow('192.0.2.2', 161, 'public', 'v2')
+    unpooled = pool.borrow('192.0.2.3', 161, 'public', 'v2')
+    pool.release(unpooled)
+    assert unpooled.close.called
+
+
+def test_idle_sessions_should_expire(pool):
+    agent = pool.borrow('192.0.2.1', 161, 'public', 'v2')
+    pool.release(agent)
+    pool.expire_idle_sessions()
+    assert not agent.close.called
+    with patch('time.time', return_value=2**40):
+        pool.expire_idle_sessions()
+    assert agent.close.called
+    assert pool.idle_count == 0
@@ -0,0 +1,130 @@
+"""Tests for ipdevpoll's multi-column GETBULK table retriever"""
+from bisect import bisect_right
+
+from twisted.internet import defer
+import pytest
+
+from nav.oids import OID
+from nav.ipdevpoll.snmp.common import AgentProxyMixIn, SNMPParameters
+from nav.ipdevpoll.snmp.tableretriever import MultiColumnTableRetriever
+from nav.mibs.if_mib import IfMib
+
+IFDESCR = '.1.3.6.1.2.1.2.2.1.2'
+IFTYPE = '.1.3.6.1.2.1.2.2.1.3'
+IFSPEED = '.1.3.6.1.2.1.2.2.1.5'
+
+
+class FakeBulkAgent(object):
+    """Serves GETBULK requests from a static, sorted MIB view"""
+    def __init__(self, view, max_varbinds=None, truncate_to=None):
+        self.view = sorted((OID(oid), value) for oid, value in view.items())
+        self.oids = [oid for oid, _value in self.view]
+        self.max_varbinds = max_varbinds
+        self.truncate_to = truncate_to
+        self.requests = []
+
+    def _getbulk(self, nonrepeaters, maxrepetitions, oids):
+        self.requests.append((maxrepetitions, list(oids)))
+        if self.max_varbinds and maxrepetitions * len(oids) > self.max_varbinds:
+            # simulates a tooBig error, as reported by pynetsnmp
+            return defer.succeed([])
+        result = []
+        positions = [bisect_right(self.oids, OID(oid)) for oid in oids]
+        for repetition in range(maxrepetitions):
+            for index, oid in enumerate(oids):
+                pos = positions[index] + repetition
+                if pos < len(self.view):
+                    result.append((tuple(self.view[pos][0]),
+                                   self.view[pos][1]))
+                else:
+                    result.append((tuple(oid), None))  # endOfMibView
+        if self.truncate_to:
+            result = result[:self.truncate_to]
+        return defer.succeed(result)
+
+
+@pytest.fixture
+def iftable_view():
+    view = {}
+    for ifindex in range(1, 49):
+        view['%s.%d' % (IFDESCR, ifindex)] = 'Gi0/%d' % ifindex
+        view['%s.%d' % (IFTYPE, ifindex)] = 6
+        view['%s.%d' % (IFSPEED, ifindex)] = 1000000000
+    view['.1.3.6.1.2.1.2.2.1.6.1'] = 'after the last requested column'
+    return view
+
+
+def _retrieve(agent, oids, **kwargs):
+    df = MultiColumnTableRetriever(agent, oids, **kwargs)()
+    assert df.called
+    return df.result
+
+
+def test_should_retrieve_all_rows_of_all_columns(iftable_view):
+    agent = FakeBulkAgent(iftable_view)
+    result = _retrieve(agent, [IFDESCR, IFTYPE, IFSPEED])
+
+    assert set(result) == {IFDESCR, IFTYPE, IFSPEED}
+    for column in IFDESCR, IFTYPE, IFSPEED:
+        assert len(result[column]) == 48
+    assert result[IFDESCR][IFDESCR + '.12'] == 'Gi0/12'
+
+
+def test_should_walk_columns_in_parallel(iftable_view):
+    agent = FakeBulkAgent(iftable_view)
+    _retrieve(agent, [IFDESCR, IFTYPE, IFSPEED], max_repetitions=10)
+
+    # 48 rows / 10 repetitions, all three columns in each request
+    assert len(agent.requests) == 5
+    assert all(len(oids) == 3 for _, oids in agent.requests)
+
+
+def test_should_limit_columns_per_request(iftable_view):
+    agent = FakeBulkAgent(iftable_view)
+    result = _retrieve(agent, [IFDESCR, IFTYPE, IFSPEED], max_repetitions=50,
+                       max_columns=2)
+
+    assert all(len(oids) <= 2 for _, oids in agent.requests)
+    assert len(result[IFSPEED]) == 48
+
+
+def test_should_shrink_requests_on_empty_response(iftable_view):
+    agent = FakeBulkAgent(iftable_view, max_varbinds=20)
+    result = _retrieve(agent, [IFDESCR, IFTYPE, IFSPEED], max_repetitions=50)
+
+    for column in IFDESCR, IFTYPE, IFSPEED:
+        assert len(result[column]) == 48
+
+
+def test_should_not_finish_columns_left_out_of_truncated_response(
+        iftable_view):
+    agent = FakeBulkAgent(iftable_view, truncate_to=2)
+    result = _retrieve(agent, [IFDESCR, IFTYPE, IFSPEED])
+
+    for column in IFDESCR, IFTYPE, IFSPEED:
+        assert len(result[column]) == 48
+
+
+def test_should_return_empty_result_for_unsupported_column(iftable_view):
+    agent = FakeBulkAgent(iftable_view)
+    unsupported = '.1.3.6.1.2.1.2.2.1.99'
+    result = _retrieve(agent, [IFDESCR, unsupported])
+
+    assert result[unsupported] == {}
+    assert len(result[IFDESCR]) == 48
+
+
+def test_retrieve_columns_should_build_rows_from_parallel_walk(iftable_view):
+    class MockAgentProxy(AgentProxyMixIn, FakeBulkAgent):
+        snmpVersion = 'v2c'
+
+    agent = MockAgentProxy(
+        iftable_view,
+        snmp_parameters=SNMPParameters(timeout=1, max_repetitions=10,
+                                       throttle_delay=0))
+    df = IfMib(agent).retrieve_columns(['ifDescr', 'ifType'])
+    assert df.called
+    result = df.result
+    assert len(result) == 48
+    assert result[OID('.7')]['ifDescr'] == 'Gi0/7'
+    assert result[OID('.7')]['ifType'] == 6
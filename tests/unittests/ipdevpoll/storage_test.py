@@ -1,4 +1,14 @@
-from nav.ipdevpoll.storage import get_shadow_sort_order
+import datetime
+from decimal import Decimal
+
+from IPy import IP
+from mock import Mock, patch
+import pytest
+
+from nav.models import manage
+from nav.ipdevpoll.storage import (get_shadow_sort_order, DefaultManager,
+                                   ContainerRepository, _json_value,
+                                   UNCHANGED, UPDATED)
 from nav.ipdevpoll import shadows
 
 
@@ -8,3 +18,168 @@ from nav.ipdevpoll import shadows
 def test_netboxinfo_should_always_sort_last():
     classes = get_shadow_sort_order()
     assert classes[-1] is shadows.NetboxInfo
+
+
+def test_swportvlan_should_be_bulk_saveable():
+    manager = DefaultManager(shadows.SwPortVlan, ContainerRepository())
+    assert manager.can_bulk_save()
+
+
+def test_shadow_with_custom_save_should_not_be_bulk_saveable():
+    manager = DefaultManager(shadows.Vlan, ContainerRepository())
+    assert not manager.can_bulk_save()
+
+
+def test_save_should_save_objects_one_by_one_when_bulk_save_is_disabled():
+    containers = ContainerRepository()
+    objs = [Mock(), Mock()]
+    containers[shadows.SwPortVlan] = dict(enumerate(objs))
+    manager = DefaultManager(shadows.SwPortVlan, containers)
+    manager.bulk_save = False
+    with patch.object(manager, 'save_in_bulk') as save_in_bulk:
+        manager.save()
+        assert not save_in_bulk.called
+    for obj in objs:
+        obj.save.assert_called_once_with(containers)
+
+
+def test_save_should_use_bulk_save_when_enabled():
+    containers = ContainerRepository()
+    containers[shadows.SwPortVlan] = {1: Mock(), 2: Mock()}
+    manager = DefaultManager(shadows.SwPortVlan, containers)
+    manager.bulk_save = True
+    with patch.object(manager, 'save_in_bulk') as save_in_bulk:
+        manager.save()
+        assert save_in_bulk.called
+
+
+@pytest.mark.parametrize("value,expected", [
+    (datetime.datetime(2020, 1, 2, 3, 4, 5), '2020-01-02T03:04:05'),
+    (datetime.datetime.max, 'infinity'),
+    (Decimal('1.5'), '1.5'),
+    (IP('10.0.0.1'), '10.0.0.1'),
+    (42, 42),
+    (None, None),
+])
+def test_json_value_should_convert_to_serializable_value(value, expected):
+    assert _json_value(value) == expected
+
+
+class TestDirtyFieldTracking(object):
+    @pytest.fixture
+    def existing(self):
+        return manage.Interface(id=1, netbox_id=5, ifindex=1, ifname='Gi0/1',
+                                speed=1000.0, ifconnectorpresent=True,
+                                ifalias='uplink')
+
+    @pytest.fixture
+    def interface(self):
+        netbox = shadows.Netbox(id=5)
+        return shadows.Interface(id=1, netbox=netbox, ifindex=1,
+                                 ifname='Gi0/1', speed=1000,
+                                 ifconnectorpresent=1, ifalias='uplink')
+
+    def test_unchanged_interface_should_have_no_diff(self, existing,
+                                                     interface):
+        assert interface.get_diff_attrs(existing) == []
+
+    def test_changed_interface_should_only_diff_changed_fields(
+            self, existing, interface):
+        interface.ifalias = 'downlink'
+        assert interface.get_diff_attrs(existing) == ['ifalias']
+
+    def test_changed_foreign_key_should_be_diffed(self, existing, interface):
+        interface.netbox = shadows.Netbox(id=6)
+        assert interface.get_diff_attrs(existing) == ['netbox']
+
+    def test_unnormalizable_values_should_be_diffed_as_they_are(
+            self, existing, interface):
+        interface.speed = ''
+        assert interface.get_diff_attrs(existing) == ['speed']
+
+    def test_changed_ip_value_should_be_diffed(self):
+        existing = manage.Prefix(id=1, net_address='10.0.0.0/24')
+        prefix = shadows.Prefix(id=1, net_address=IP('10.0.1.0/24'))
+        assert prefix.get_diff_attrs(existing) == ['net_address']
+
+    def test_unchanged_interface_should_not_be_updated(self, existing,
+                                                       interface):
+        interface.set_existing_model(existing)
+        with patch.object(manage.Interface, 'objects') as objects:
+            assert interface.save(ContainerRepository()) == UNCHANGED
+            assert not objects.filter.called
+
+    def test_changed_interface_should_update_changed_columns_only(
+            self, existing, interface):
+        interface.set_existing_model(existing)
+        interface.ifalias = 'downlink'
+        converted = manage.Interface(id=1, ifalias='downlink')
+        with patch.object(manage.Interface, 'objects') as objects, \
+                patch.object(interface, 'convert_to_model',
+                             return_value=converted):
+            assert interface.save(ContainerRepository()) == UPDATED
+            objects.filter.return_value.update.assert_called_once_with(
+                ifalias='downlink')
+
+    def test_manager_should_count_save_outcomes(self):
+        containers = ContainerRepository()
+        containers[shadows.SwPortVlan] = {
+            1: Mock(save=Mock(return_value=UNCHANGED)),
+            2: Mock(save=Mock(return_value=UNCHANGED)),
+            3: Mock(save=Mock(return_value=UPDATED)),
+            4: Mock(save=Mock(return_value=None)),
+        }
+        manager = DefaultManager(shadows.SwPortVlan, containers)
+        manager.bulk_save = False
+        manager.save()
+        assert manager.save_counts == {UNCHANGED: 2, UPDATED: 1}
+
+
+class TestNaturalKeyPrefetch(object):
+    def _make_info(self, variable):
+        return shadows.NetboxInfo(netbox=shadows.Netbox(id=5), key='poll',
+                                  variable=variable, value='x')
+
+    def test_should_resolve_all_objects_in_one_query(self):
+        objs = [self._make_info('found'), self._make_info('missing')]
+        manager = DefaultManager(shadows.NetboxInfo, ContainerRepository())
+        existing = manage.NetboxInfo(id=10, netbox_id=5, key='poll',
+                                     variable='found', value='y')
+        with patch.object(manage.NetboxInfo, 'objects') as objects:
+            objects.filter.return_value = [existing]
+            missing = manager._prefetch_existing_models_by_lookups(objs)
+            assert objects.filter.call_count == 1
+        assert objs[0].get_existing_model() is existing
+        assert objs[0].id == 10
+        assert missing == {id(objs[1])}
+
+    def test_missing_object_should_not_be_looked_up_again(self):
+        obj = self._make_info('missing')
+        manager = DefaultManager(shadows.NetboxInfo, ContainerRepository())
+        with patch.object(manage.NetboxInfo, 'objects') as objects:
+            objects.filter.return_value = []
+            manager._prefetch_existing_models_by_lookups([obj])
+            obj._cached_missing_model = True
+            assert obj.get_existing_model() is None
+            assert not objects.get.called
+
+    def test_should_leave_ambiguous_objects_to_get_existing_model(self):
+        obj = shadows.GwPortPrefix(gw_ip='10.0.0.1')
+        manager = DefaultManager(shadows.GwPortPrefix, ContainerRepository())
+        duplicates = [manage.GwPortPrefix(gw_ip='10.0.0.1', interface_id=1),
+                      manage.GwPortPrefix(gw_ip='10.0.0.1', interface_id=2)]
+        with patch.object(manage.GwPortPrefix, 'objects') as objects:
+            objects.filter.return_value = duplicates
+            missing = manager._prefetch_existing_models_by_lookups([obj])
+        assert not missing
+        assert not obj._cached_existing_model
+
+    def test_should_leave_unsaved_related_objects_to_get_existing_model(
+            self):
+        obj = shadows.NetboxInfo(netbox=shadows.Netbox(sysname='new'),
+                                 key='poll', variable='x')
+        manager = DefaultManager(shadows.NetboxInfo, ContainerRepository())
+        with patch.object(manage.NetboxInfo, 'objects') as objects:
+            missing = manager._prefetch_existing_models_by_lookups([obj])
+            assert not objects.filter.called
+        assert not missing
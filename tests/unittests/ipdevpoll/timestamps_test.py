@@ -1,10 +1,16 @@
-"""Tests for ipdevpoll's TimestampChecker utility class"""
+"""Tests for ipdevpoll's TimestampChecker and ChangeIndicators classes"""
 from mock import Mock, patch
 
 import pytest
 import pytest_twisted
+from twisted.internet import defer
+from twisted.internet.error import TimeoutError
 
-from nav.ipdevpoll.timestamps import TimestampChecker
+from nav.ipdevpoll import Plugin
+from nav.ipdevpoll.storage import ContainerRepository
+from nav.ipdevpoll.timestamps import TimestampChecker, ChangeIndicators
+from nav.mibs.entity_mib import EntityMib
+from nav.mibs.lldp_mib import LLDPMib
 
 
 @pytest.mark.twisted
@@ -55,3 +61,95 @@ def test_is_changed(loaded, collected, max_deviation, expected, description):
     ts.collected_times = [collected]
     assert ts.is_changed(max_deviation=max_deviation) == expected, description
 
+
+
+class EntityPlugin(Plugin):
+    CHANGE_INDICATORS = ((EntityMib, 'entLastChangeTime'),)
+
+
+class LLDPPlugin(Plugin):
+    CHANGE_INDICATORS = ((LLDPMib, 'lldpStatsRemTablesLastChangeTime'),)
+
+
+SYSUPTIME = '.1.3.6.1.2.1.1.3.0'
+ENTLASTCHANGETIME = '.1.3.6.1.2.1.47.1.4.1.0'
+LLDPREMTABLESLASTCHANGE = '.1.0.8802.1.1.2.1.2.1.0'
+
+
+def _make_indicators(values):
+    agent = Mock()
+    agent.get.return_value = defer.succeed(values)
+    plugins = [EntityPlugin(Mock(), agent, Mock()),
+               LLDPPlugin(Mock(), agent, Mock()),
+               Plugin(Mock(), agent, Mock())]
+    return ChangeIndicators(agent, ContainerRepository(), plugins)
+
+
+class TestChangeIndicators(object):
+    def test_should_ignore_plugins_without_indicators(self):
+        indicators = _make_indicators({})
+        assert len(indicators.plugins) == 2
+
+    def test_should_collect_all_indicators_in_one_request(self):
+        indicators = _make_indicators({})
+        indicators.collect()
+        indicators.agent.get.assert_called_once_with(
+            [SYSUPTIME, ENTLASTCHANGETIME, LLDPREMTABLESLASTCHANGE])
+
+    def test_should_collect_times_in_timestampchecker_format(self):
+        indicators = _make_indicators({SYSUPTIME: 1000,
+                                       ENTLASTCHANGETIME: 10,
+                                       LLDPREMTABLESLASTCHANGE: 20})
+        with patch('time.mktime', return_value=1559904661.0):
+            indicators.collect()
+        assert indicators.collected_times == {
+            'entityplugin': ((1559904661.0, 1000), 10),
+            'lldpplugin': ((1559904661.0, 1000), 20),
+        }
+
+    def test_unchanged_indicators_should_not_be_changed(self):
+        indicators = _make_indicators({SYSUPTIME: 1000,
+                                       ENTLASTCHANGETIME: 10,
+                                       LLDPREMTABLESLASTCHANGE: 20})
+        with patch('time.mktime', return_value=1559904671.0):
+            indicators.collect()
+        indicators.loaded_times = {
+            'entityplugin': [[1559904661.0, 0], 10],
+            'lldpplugin': [[1559904661.0, 0], 15],
+        }
+        entity, lldp = indicators.plugins
+        assert not indicators.is_changed(entity)
+        assert indicators.is_changed(lldp)
+
+    def test_missing_indicator_should_be_interpreted_as_change(self):
+        indicators = _make_indicators({SYSUPTIME: 1000,
+                                       ENTLASTCHANGETIME: 10})
+        with patch('time.mktime', return_value=1559904671.0):
+            indicators.collect()
+        indicators.loaded_times = {
+            'lldpplugin': [[1559904661.0, 0], None],
+        }
+        assert indicators.is_changed(indicators.plugins[1])
+
+    def test_failed_collection_should_be_interpreted_as_change(self):
+        indicators = _make_indicators({})
+        indicators.agent.get.return_value = defer.fail(TimeoutError())
+        indicators.collect()
+        indicators.loaded_times = {
+            'entityplugin': [[1559904661.0, 0], 10],
+        }
+        assert indicators.is_changed(indicators.plugins[0])
+
+    def test_should_store_times_under_indicator_var_name(self):
+        class RenamedPlugin(LLDPPlugin):
+            INDICATOR_VAR_NAME = 'lldp'
+
+        agent = Mock()
+        agent.get.return_value = defer.succeed(
+            {SYSUPTIME: 1000, LLDPREMTABLESLASTCHANGE: 20})
+        indicators = ChangeIndicators(
+            agent, ContainerRepository(),
+            [RenamedPlugin(Mock(), agent, Mock())])
+        with patch('time.mktime', return_value=1559904661.0):
+            indicators.collect()
+        assert list(indicators.collected_times) == ['lldp']
@@ -0,0 +1,127 @@
+import pickle
+import struct
+
+from mock import Mock
+import pytest
+from twisted.internet.address import IPv4Address
+from twisted.test.proto_helpers import StringTransport
+
+from nav.metrics import carbon
+from nav.metrics.carbonclient import CarbonClient, PICKLE
+
+
+def _connect(client):
+    connection = client._factory.buildProtocol(
+        IPv4Address('TCP', '127.0.0.1', 2003))
+    transport = StringTransport()
+    connection.makeConnection(transport)
+    return transport
+
+
+def _metrics(count):
+    return [('nav.test.metric%d' % i, (1600000000.5, i)) for i in range(count)]
+
+
+class TestCarbonClient(object):
+    def test_should_queue_metrics_while_disconnected(self):
+        client = CarbonClient('127.0.0.1', 2003, batch_size=2)
+        client.send(_metrics(3))
+        assert client.queued == 3
+        assert client.sent == 0
+
+    def test_should_write_queued_metrics_on_connect(self):
+        client = CarbonClient('127.0.0.1', 2003)
+        client.send(_metrics(2))
+        transport = _connect(client)
+        assert transport.value() == (b"nav.test.metric0 0 1600000000\n"
+                                     b"nav.test.metric1 1 1600000000\n")
+        assert client.queued == 0
+        assert client.sent == 2
+
+    def test_should_not_write_before_batch_is_full(self):
+        client = CarbonClient('127.0.0.1', 2003, batch_size=3)
+        transport = _connect(client)
+        client.send(_metrics(2))
+        assert transport.value() == b""
+        client.send(_metrics(1))
+        assert client.sent == 3
+
+    def test_flush_should_write_partial_batch(self):
+        client = CarbonClient('127.0.0.1', 2003, batch_size=3)
+        transport = _connect(client)
+        client.send(_metrics(2))
+        client.flush()
+        assert client.sent == 2
+        assert transport.value()
+
+    def test_should_stop_writing_while_paused(self):
+        client = CarbonClient('127.0.0.1', 2003, batch_size=1)
+        transport = _connect(client)
+        transport.producer.pauseProducing()
+        client.send(_metrics(2))
+        assert client.queued == 2
+        transport.producer.resumeProducing()
+        assert client.queued == 0
+
+    def test_should_drop_and_count_metrics_when_queue_is_full(self):
+        client = CarbonClient('127.0.0.1', 2003, max_queue_size=5)
+        client.send(_metrics(4))
+        client.send(_metrics(3))
+        assert client.queued == 5
+        assert client.dropped == 2
+
+    def test_should_queue_metrics_after_connection_loss(self):
+        client = CarbonClient('127.0.0.1', 2003, batch_size=1)
+        _connect(client)
+        client._connection.connectionLost(Mock())
+        assert not client.connected
+        client.send(_metrics(2))
+        assert client.queued == 2
+
+    def test_should_not_count_failed_writes_as_sent(self):
+        client = CarbonClient('127.0.0.1', 2003, batch_size=2)
+        transport = _connect(client)
+        transport.write = Mock(side_effect=IOError("broken pipe"))
+        client.send(_metrics(2))
+        assert client.sent == 0
+        assert client.dropped == 2
+
+    def test_should_keep_metrics_queued_while_disconnecting(self):
+        client = CarbonClient('127.0.0.1', 2003, batch_size=2)
+        transport = _connect(client)
+        transport.loseConnection()
+        client.send(_metrics(2))
+        assert client.sent == 0
+        assert client.queued == 2
+
+    def test_pickle_protocol_should_write_length_prefixed_pickles(self):
+        client = CarbonClient('127.0.0.1', 2004, protocol=PICKLE)
+        client.send(_metrics(2))
+        data = _connect(client).value()
+
+        (length,) = struct.unpack("!L", data[:4])
+        assert len(data) == length + 4
+        assert pickle.loads(data[4:]) == [
+            ('nav.test.metric0', (1600000000, 0.0)),
+            ('nav.test.metric1', (1600000000, 1.0)),
+        ]
+
+    def test_pickle_protocol_should_drop_non_numeric_values(self):
+        client = CarbonClient('127.0.0.1', 2004, protocol=PICKLE)
+        client.send([('nav.test.metric', (1600000000, None))])
+        assert _connect(client).value() == b""
+        assert client.dropped == 1
+
+    def test_unknown_protocol_should_raise(self):
+        with pytest.raises(ValueError):
+            CarbonClient('127.0.0.1', 2003, protocol='carrier-pigeon')
+
+
+def test_send_metrics_should_use_installed_sender():
+    sender = Mock()
+    carbon.set_metrics_sender(sender)
+    try:
+        carbon.send_metrics(_metrics(1))
+    finally:
+        carbon.set_metrics_sender(None)
+    sender.send.assert_called_once_with(_metrics(1))
@@ -0,0 +1,116 @@
+import os
+import socket
+
+from mock import Mock, patch
+import pytest
+
+from nav.metrics import carbon
+from nav.metrics.carbonclient import CarbonClient
+from nav.metrics.spool import MetricSpool
+
+
+def _metrics(count, offset=0):
+    return [('nav.test.metric%d' % i, (1600000000 + i, float(i)))
+            for i in range(offset, offset + count)]
+
+
+@pytest.fixture
+def spool(tmpdir):
+    return MetricSpool(str(tmpdir.join('spool')), replay_rate=10)
+
+
+class TestMetricSpool(object):
+    def test_should_read_back_written_metrics_in_order(self, spool):
+        spool.write(_metrics(3))
+        spool.write(_metrics(2, offset=3))
+        assert spool.read(10) == _metrics(5)
+
+    def test_should_not_read_more_than_max_count(self, spool):
+        spool.write(_metrics(5))
+        assert spool.read(2) == _metrics(2)
+        assert spool.read(10) == _metrics(3, offset=2)
+        assert spool.read(10) == []
+
+    def test_should_remove_segments_when_fully_read(self, spool):
+        spool.write(_metrics(2))
+        spool.read(10)
+        assert os.listdir(spool.directory) == []
+        assert not spool.has_data()
+
+    def test_should_start_new_segments_at_segment_size(self, spool):
+        spool.segment_size = 1
+        spool.write(_metrics(1))
+        spool.write(_metrics(1, offset=1))
+        assert len(os.listdir(spool.directory)) == 2
+        assert spool.read(10) == _metrics(2)
+
+    def test_should_discard_metrics_when_full(self, spool):
+        spool.max_size = 1
+        spool.segment_size = 1
+        assert spool.write(_metrics(1)) == 1
+        assert spool.write(_metrics(1)) == 0
+        assert spool.discarded == 1
+
+    def test_should_replay_segments_left_by_dead_processes(self, spool):
+        spool.write(_metrics(2))
+        spool.read(1)
+        other = MetricSpool(spool.directory)
+        other.pid = spool.pid + 1
+        with patch('nav.metrics.spool._is_running', return_value=False):
+            assert other.read(10) == _metrics(2)
+
+    def test_should_not_replay_segments_claimed_by_live_processes(self,
+                                                                  spool):
+        spool.write(_metrics(2))
+        spool.read(1)
+        other = MetricSpool(spool.directory)
+        other.pid = spool.pid + 1
+        with patch('nav.metrics.spool._is_running', return_value=True):
+            assert other.read(10) == []
+
+
+class TestUdpSpooling(object):
+    def test_should_spool_metrics_on_socket_error(self, spool):
+        sock = Mock(send=Mock(side_effect=socket.error("refused")))
+        with patch('nav.metrics.carbon.get_metric_spool', return_value=spool):
+            assert not carbon._send_packets(sock, _metrics(2), 'localhost',
+                                            2003)
+        assert spool.read(10) == _metrics(2)
+
+    def test_should_replay_at_limited_rate(self, spool):
+        spool.write(_metrics(15))
+        sock = Mock()
+        with patch('nav.metrics.carbon.get_metric_spool', return_value=spool),\
+                patch('nav.metrics.carbon._replay_timestamp', 0):
+            carbon._replay_spooled_metrics(sock, 'localhost', 2003)
+            carbon._replay_spooled_metrics(sock, 'localhost', 2003)
+        assert spool.replayed == 10
+
+
+class TestCarbonClientSpooling(object):
+    def test_should_spool_overflowing_metrics(self, spool):
+        client = CarbonClient('localhost', 2003, max_queue_size=2,
+                              spool=spool)
+        client.send(_metrics(3))
+        assert client.dropped == 0
+        assert spool.read(10) == _metrics(1, offset=2)
+
+    def test_should_spool_queue_on_stop(self, spool):
+        client = CarbonClient('localhost', 2003, spool=spool)
+        client.send(_metrics(3))
+        client.stop()
+        assert spool.read(10) == _metrics(3)
+
+    def test_should_replay_into_queue_when_connected(self, spool):
+        client = CarbonClient('localhost', 2003, flush_interval=1.0,
+                              spool=spool)
+        spool.write(_metrics(15))
+        client._connection = Mock()
+        client.replay()
+        assert client.queued == 10
+
+    def test_should_not_replay_when_disconnected(self, spool):
+        client = CarbonClient('localhost', 2003, spool=spool)
+        spool.write(_metrics(1))
+        client.replay()
+        assert client.queued == 0
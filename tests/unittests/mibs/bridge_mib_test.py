@@ -0,0 +1,116 @@
+from mock import Mock
+
+from twisted.internet import defer
+from twisted.internet.error import TimeoutError
+
+from nav.ipdevpoll.snmp.common import SNMPParameters
+from nav.mibs.bridge_mib import MultiBridgeMib
+
+
+class CommunityRetriever(MultiBridgeMib):
+    """Returns the community of the instance it queries, once the test fires
+    the instance's Deferred
+    """
+    def get_community(self):
+        return self.agent_proxy.deferred.addCallback(
+            lambda _: {self.agent_proxy.community: True})
+
+    def get_all_communities(self):
+        return self._multiquery(self.get_community)
+
+
+def _make_agent(community, **params):
+    agent = Mock(community=community)
+    agent.snmp_parameters = SNMPParameters(
+        timeout=1, max_repetitions=10, throttle_delay=params.get('delay', 0),
+        max_concurrent_instances=params.get('concurrency', 2))
+    agent.deferred = defer.Deferred()
+    return agent
+
+
+def _make_retriever(instance_count, **params):
+    base = _make_agent('public', **params)
+    instances = [(vlan, 'public@%d' % vlan)
+                 for vlan in range(1, instance_count + 1)]
+    retriever = CommunityRetriever(base, instances)
+    agents = {}
+
+    def _get_alternate_agent(community):
+        agents[community] = _make_agent(community, **params)
+        return agents[community]
+
+    retriever._get_alternate_agent = _get_alternate_agent
+    return retriever, agents
+
+
+def _opened(agents):
+    return sorted(community for community, agent in agents.items()
+                  if agent.open.called)
+
+
+class TestMultiquery(object):
+    def test_should_query_no_more_than_max_concurrent_instances(self):
+        retriever, agents = _make_retriever(3, concurrency=2)
+        retriever.get_all_communities()
+        assert _opened(agents) == ['public@1', 'public@2']
+        agents['public@2'].deferred.callback(None)
+        assert _opened(agents) == ['public@1', 'public@2', 'public@3']
+        assert agents['public@2'].close.called
+
+    def test_should_query_one_instance_at_a_time_when_throttled(self):
+        retriever, agents = _make_retriever(3, concurrency=2, delay=1)
+        retriever.get_all_communities()
+        assert _opened(agents) == ['public@1']
+
+    def test_should_merge_results_in_instance_order(self):
+        retriever, agents = _make_retriever(3, concurrency=3)
+        result = []
+        retriever._multiquery(retriever.get_community,
+                              integrator=result.extend)
+        for community in ('public@3', 'public@1', 'public@2'):
+            agents[community].deferred.callback(None)
+        assert [descr for descr, _ in result] == [1, 2, 3]
+
+    def test_should_not_change_the_agent_of_the_original_retriever(self):
+        retriever, agents = _make_retriever(2, concurrency=2)
+        base = retriever.agent_proxy
+        retriever.get_all_communities()
+        assert retriever.agent_proxy is base
+
+    def test_should_ignore_timeouts_from_alternate_instances(self):
+        retriever, agents = _make_retriever(2, concurrency=2)
+        result = retriever.get_all_communities()
+        agents['public@1'].deferred.errback(TimeoutError())
+        agents['public@2'].deferred.callback(None)
+        assert result.result == {'public@2': True}
+
+    def test_should_fail_on_other_errors(self):
+        retriever, agents = _make_retriever(3, concurrency=1)
+        result = retriever.get_all_communities()
+        agents['public@1'].deferred.errback(ValueError("boom"))
+        assert 'public@2' not in agents
+        failures = []
+        result.addErrback(failures.append)
+        assert failures[0].check(ValueError)
+
+
+class AgentProxy(object):
+    def __init__(self, ip, port, community=None, snmpVersion='v2c',
+                 snmp_parameters=None):
+        self.ip = ip
+        self.port = port
+        self.community = community
+        self.snmpVersion = snmpVersion
+        self.snmp_parameters = snmp_parameters
+        self.stats = None
+        self.recorder = None
+        self.pacing = None
+
+
+def test_alternate_agent_should_share_stats():
+    base = AgentProxy('192.0.2.1', 161, community='public')
+    base.stats = Mock()
+    retriever = MultiBridgeMib(base, [(10, 'public@10')])
+    alt_agent = retriever._get_alternate_agent('public@10')
+    assert alt_agent.community == 'public@10'
+    assert alt_agent.stats is base.stats
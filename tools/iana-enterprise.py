@@ -16,7 +16,7 @@
 #
 """
 Retrieves IANAs current list of assigned enterprise numbers, and outputs
-the data NAV wants, as Python code.
+the data NAV wants, as a table for python/nav/enterprise/ids.txt.
 """
 from __future__ import print_function
 import sys
@@ -32,8 +32,8 @@ from nav.enterprise import ids
 IANA_URL = "http://www.iana.org/assignments/enterprise-numbers"
 Enterprise = namedtuple('Enterprise', 'decimal organization contact email')
 
-VENDOR_MAP = {value: constant for constant, value in vars(ids).items()
-              if constant.startswith('VENDOR_ID_')}
+VENDOR_MAP = {value: constant
+              for constant, value in ids.get_vendor_ids().items()}
 _used_names = Counter(VENDOR_MAP)
 
 REPLACE_PATTERN = re.compile(r'[/_-]', re.UNICODE)
@@ -48,15 +48,18 @@ def main():
     print("# As published at {}".format(IANA_URL))
     print("# Generated by {} on {}".format(os.path.basename(sys.argv[0]),
                                            datetime.now()))
-    print("# pylint: skip-file")
     print("#")
+    print("# Each line maps an enterprise number to the name of its "
+          "VENDOR_ID_* constant")
+    print("# in nav.enterprise.ids, without the prefix.")
 
     entmap = {}
     for ent in enterprises:
         var = get_vendor_variable(ent)
         if var:
             entmap[ent] = var
-            print("{} = {}".format(var, ent.decimal))
+            print("{} {}".format(ent.decimal,
+                                 var[len(ids.CONSTANT_PREFIX):]))
 
     # Is this map really necessary? It's huge!
     # print("\n# Name map\n")
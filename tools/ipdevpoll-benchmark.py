@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2020 Uninett AS
+#
+# This file is part of Network Administration Visualized (NAV).
+#
+# NAV is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License version 3 as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.  You should have received a copy of the GNU General Public License
+# along with NAV. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Measures ipdevpoll throughput against a farm of simulated SNMP agents.
+
+Run the agent farm in one process, serving recorded walks on a range of local
+addresses (binding to port 161 requires root privileges, and large farms may
+require a higher limit on open files):
+
+  ipdevpoll-benchmark.py farm --count 1000 --latency 0.01 --loss 0.001 *.walk
+
+Then run a job against the simulated devices in another process, creating the
+devices in the NAV database on the first run:
+
+  ipdevpoll-benchmark.py run --count 1000 --job inventory \\
+      --create --room myroom --organization myorg --profile public
+
+The run command modifies the NAV database, and should only be used against a
+scratch installation.
+
+Plugins can also be replayed offline against SNMP responses recorded using
+ipdevpolld's --record-snmp option, and checked against a baseline of earlier
+replay times:
+
+  ipdevpolld -J inventory -n example-sw --record-snmp fixtures/
+  ipdevpoll-benchmark.py replay --plugin entity --baseline baseline.json \\
+      fixtures/*.inventory.snmp.json.gz
+"""
+from __future__ import print_function
+import argparse
+import json
+import logging
+import sys
+
+from nav.bootstrap import bootstrap_django
+bootstrap_django(__file__)
+
+from twisted.internet import reactor, task
+
+from nav.ipdevpoll.benchmark.agent import (AgentFarm, load_walk,
+                                           simulated_addresses)
+
+DEFAULT_NETWORK = '127.10.0.0'
+
+
+def main():
+    """Main program"""
+    args = parse_args()
+    logging.basicConfig(
+        level=logging.DEBUG if args.debug else logging.INFO,
+        format="%(asctime)s [%(levelname)s %(name)s] %(message)s")
+    args.func(args)
+
+
+def parse_args():
+    """Builds an ArgumentParser and returns parsed program arguments"""
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0],
+        epilog=__doc__.strip().split('\n', 1)[1],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--network", default=DEFAULT_NETWORK,
+                        help="network to allocate simulated agent addresses "
+                             "from (default: %(default)s)")
+    parser.add_argument("--count", type=int, default=100,
+                        help="number of simulated devices "
+                             "(default: %(default)s)")
+    parser.add_argument("--debug", action="store_true",
+                        help="enable debug logging")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    farm = commands.add_parser("farm", help="run a simulated agent farm")
+    farm.add_argument("walks", nargs="+", metavar="WALKFILE",
+                      help="snmpwalk -On output or .snmprec file to serve")
+    farm.add_argument("--port", type=int, default=161,
+                      help="UDP port to listen to (default: %(default)s)")
+    farm.add_argument("--community",
+                      help="only respond to this community")
+    farm.add_argument("--latency", type=float, default=0.0,
+                      help="seconds to delay each response")
+    farm.add_argument("--jitter", type=float, default=0.0,
+                      help="max seconds to randomly vary the latency by")
+    farm.add_argument("--loss", type=float, default=0.0,
+                      help="fraction of requests to drop")
+    farm.add_argument("--max-varbinds", type=int,
+                      help="respond with tooBig to larger requests")
+    farm.set_defaults(func=run_farm)
+
+    run = commands.add_parser("run", help="run a job against simulated "
+                                          "devices and report the results")
+    run.add_argument("--job", required=True,
+                     help="name of the ipdevpoll job to run")
+    run.add_argument("--concurrency", type=int, default=50,
+                     help="max number of concurrent jobs "
+                          "(default: %(default)s)")
+    run.add_argument("--rounds", type=int, default=1,
+                     help="number of times to run the job for each device")
+    run.add_argument("--threadpoolsize", type=int, default=10,
+                     help="database thread pool size (default: %(default)s)")
+    run.add_argument("--json", action="store_true",
+                     help="output the results as JSON")
+    run.add_argument("--create", action="store_true",
+                     help="create missing simulated devices in the database")
+    run.add_argument("--room", help="room of created devices")
+    run.add_argument("--organization", help="organization of created devices")
+    run.add_argument("--category", default="SW",
+                     help="category of created devices (default: %(default)s)")
+    run.add_argument("--profile",
+                     help="name of the SNMP management profile of created "
+                          "devices")
+    run.set_defaults(func=run_jobs)
+
+    replay = commands.add_parser("replay", help="replay plugins against "
+                                                "recorded SNMP fixtures")
+    replay.add_argument("fixtures", nargs="+", metavar="FIXTURE",
+                        help="fixture recorded by ipdevpolld --record-snmp, "
+                             "or an .snmprec file")
+    replay.add_argument("--plugin", action="append", required=True,
+                        dest="plugins", metavar="PLUGIN",
+                        help="name of a configured plugin to replay (may be "
+                             "repeated)")
+    replay.add_argument("--repeat", type=int, default=5,
+                        help="number of replays per plugin and fixture "
+                             "(default: %(default)s)")
+    replay.add_argument("--prepare", action="store_true",
+                        help="also prepare the collected data for saving "
+                             "(requires a database)")
+    replay.add_argument("--baseline", metavar="FILE",
+                        help="fail if any replay is slower than the times "
+                             "stored in this baseline file")
+    replay.add_argument("--tolerance", type=float, default=1.5,
+                        help="how many times slower than the baseline a "
+                             "replay may be (default: %(default)s)")
+    replay.add_argument("--update-baseline", action="store_true",
+                        help="store the replay times in the baseline file")
+    replay.set_defaults(func=run_replays)
+
+    args = parser.parse_args()
+    if args.command == "replay" and args.update_baseline and not args.baseline:
+        parser.error("--update-baseline requires --baseline")
+    if args.command == "run" and args.create and not (
+            args.room and args.organization and args.profile):
+        parser.error("--create requires --room, --organization and --profile")
+    return args
+
+
+def run_farm(args):
+    """Runs a simulated agent farm until interrupted"""
+    walks = [load_walk(filename) for filename in args.walks]
+    farm = AgentFarm(walks, args.network, args.count, port=args.port,
+                     community=(args.community.encode('utf-8')
+                                if args.community else None),
+                     latency=args.latency, jitter=args.jitter, loss=args.loss,
+                     max_varbinds=args.max_varbinds)
+    reactor.callWhenRunning(farm.start)
+    reactor.addSystemEventTrigger("before", "shutdown", farm.log_stats)
+    reactor.run()
+
+
+def run_jobs(args):
+    """Runs a job against the simulated devices and prints the results"""
+    from nav.ipdevpoll import config, plugins
+    from nav.ipdevpoll.benchmark import driver
+
+    jobs = {job.name: job for job in config.get_jobs()}
+    if args.job not in jobs:
+        sys.exit("unknown job %r, configured jobs are: %s" % (
+            args.job, ", ".join(sorted(jobs))))
+    plugins.import_plugins()
+
+    addresses = simulated_addresses(args.network, args.count)
+    if args.create:
+        driver.create_netboxes(addresses, args.room, args.organization,
+                               args.category, args.profile)
+    netbox_ids = driver.get_netbox_ids(addresses)
+    if not netbox_ids:
+        sys.exit("no devices found in %s, use --create to create them" %
+                 args.network)
+
+    def _print_result(result):
+        if args.json:
+            print(json.dumps(result.as_dict(), indent=2, sort_keys=True))
+        else:
+            print(result.report())
+
+    def _benchmark():
+        deferred = driver.run_benchmark(jobs[args.job], netbox_ids,
+                                        concurrency=args.concurrency,
+                                        rounds=args.rounds)
+        deferred.addCallback(_print_result)
+        deferred.addErrback(logging.getLogger(__name__).error)
+        deferred.addBoth(lambda _: reactor.stop())
+
+    reactor.suggestThreadPoolSize(args.threadpoolsize)
+    reactor.callWhenRunning(_benchmark)
+    reactor.run()
+
+
+def run_replays(args):
+    """Replays plugins against fixtures and checks them against a baseline"""
+    import os
+    from nav.ipdevpoll import config, plugins
+    from nav.ipdevpoll.benchmark import replay
+    from nav.ipdevpoll.snmp.recording import (SnmpFixture,
+                                              load_snmprec_fixture)
+
+    plugins.import_plugins()
+    unknown = set(args.plugins).difference(plugins.plugin_registry)
+    if unknown:
+        sys.exit("unknown plugins: %s" % ", ".join(sorted(unknown)))
+
+    results = []
+
+    def _replay_all():
+        for filename in args.fixtures:
+            if filename.endswith('.snmprec'):
+                fixture = load_snmprec_fixture(filename)
+            else:
+                fixture = SnmpFixture.load(filename)
+            sysname = fixture.metadata.get(
+                'sysname', os.path.basename(filename).split('.')[0])
+            netbox = replay.make_netbox(sysname)
+            for plugin in args.plugins:
+                deferred = replay.replay_plugin(
+                    plugins.plugin_registry[plugin], fixture, netbox,
+                    config=config.ipdevpoll_conf, repeat=args.repeat,
+                    prepare=args.prepare,
+                    name="%s:%s" % (os.path.basename(filename), plugin))
+                deferred.addCallback(results.append)
+                yield deferred
+
+    def _report(_):
+        for timing in results:
+            print("{name}: {best:.4f}s best, {median:.4f}s median, "
+                  "{requests} requests".format(name=timing.name,
+                                               **timing.as_dict()))
+        if args.update_baseline:
+            replay.save_baseline(args.baseline, results)
+        elif args.baseline:
+            regressions = replay.find_regressions(
+                results, replay.load_baseline(args.baseline), args.tolerance)
+            for name, seconds, expected in regressions:
+                print("REGRESSION {}: {:.4f}s, baseline {:.4f}s".format(
+                    name, seconds, expected))
+            if regressions:
+                exit_status.append(1)
+
+    exit_status = []
+    deferred = task.cooperate(_replay_all()).whenDone()
+    deferred.addCallback(_report)
+    deferred.addErrback(logging.getLogger(__name__).error)
+    deferred.addErrback(lambda _: exit_status.append(2))
+    deferred.addBoth(lambda _: reactor.stop())
+    reactor.run()
+    sys.exit(exit_status[0] if exit_status else 0)
+
+
+if __name__ == '__main__':
+    main()